@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+
+from nmigen import *
+
+from opcodes import IntRegReg
+
+@dataclass
+class ALUConfig:
+    # Shift one bit per cycle instead of using a barrel shifter, much smaller but slow
+    serial_shifter: bool = False
+    # Register the result, ALU ops take a cycle more but the path into the register file
+    # no longer goes through the whole ALU
+    output_register: bool = False
+
+class ALU(Elaboratable):
+    """Integer ALU for OP/OP_IMM, plus the comparisons for BRANCH.
+
+    ``funct3`` picks the operation like it does in the instruction (``IntRegReg``), ``alt`` is
+    bit 30 of the instruction for SUB and SRA/SRAI, and has to be low for the other immediate
+    ops. ``b`` is rs2 or the immediate.
+
+    One adder does ADD/SUB and the subtraction behind SLT/SLTU, and the same subtraction
+    drives ``lt``/``ltu`` for branches when ``branch`` is set; ``eq`` compares directly. Left
+    and right shifts share one right shifter by reversing the operand and result for SLL.
+
+    Hold ``valid`` with the operands until ``ready``. It's combinational unless the config
+    adds the output register or serial shifter, which take extra cycles. Dropping ``valid``
+    early abandons the operation, as when an interrupt is taken instead. The comparison
+    outputs are always combinational.
+    """
+    def __init__(self, config: ALUConfig = None):
+        if config is None:
+            config = ALUConfig()
+        self.config = config
+
+        #### Operation
+        self.valid = Signal()
+        self.funct3 = Signal(unsigned(3))
+        self.alt = Signal()
+        self.branch = Signal()
+        self.a = Signal(unsigned(32))
+        self.b = Signal(unsigned(32))
+
+        #### Results
+        self.ready = Signal()
+        self.result = Signal(unsigned(32))
+        self.eq = Signal()
+        self.lt = Signal()
+        self.ltu = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        config = self.config
+        a = self.a
+        b = self.b
+        funct3 = self.funct3
+
+        #### Adder/comparator
+        subtract = Signal()
+        m.d.comb += subtract.eq(self.branch | (funct3 == IntRegReg.SLT) | (funct3 == IntRegReg.SLTU) |
+                                ((funct3 == IntRegReg.ADD) & self.alt))
+
+        # a + ~b + 1, the carry out is set when a >= b unsigned
+        sum_ = Signal(unsigned(33))
+        m.d.comb += sum_.eq(a + (b ^ Repl(subtract, 32)) + subtract)
+        m.d.comb += [
+            self.eq.eq(a == b),
+            self.ltu.eq(~sum_[32]),
+            # Signs differ: a is negative. Otherwise the subtraction can't overflow.
+            self.lt.eq(Mux(a[31] ^ b[31], a[31], sum_[31])),
+        ]
+
+        #### Shifter
+        shamt = b[0:5]
+        left = funct3 == IntRegReg.SLL
+        is_shift = Signal()
+        m.d.comb += is_shift.eq(left | (funct3 == IntRegReg.SRx))
+
+        shifted = Signal(unsigned(32))
+        shift_ready = Signal()
+        # Don't start again while the output register still holds this operation's result
+        pending = Signal()
+        if config.serial_shifter:
+            shreg = Signal(unsigned(32))
+            count = Signal(unsigned(5))
+            busy = Signal()
+            arith = Signal()
+            sll = Signal()
+
+            m.d.comb += shifted.eq(shreg)
+            with m.If(busy):
+                with m.If(count == 0):
+                    m.d.comb += shift_ready.eq(1)
+                    m.d.sync += busy.eq(0)
+                with m.Else():
+                    m.d.sync += count.eq(count - 1)
+                    with m.If(sll):
+                        m.d.sync += shreg.eq(shreg << 1)
+                    with m.Else():
+                        m.d.sync += shreg.eq(Cat(shreg[1:], arith & shreg[31]))
+            with m.Elif(self.valid & is_shift & ~pending):
+                m.d.sync += [
+                    busy.eq(1),
+                    shreg.eq(a),
+                    count.eq(shamt),
+                    arith.eq(self.alt),
+                    sll.eq(left),
+                ]
+            with m.If(~self.valid):
+                m.d.sync += busy.eq(0)
+        else:
+            # SLL is a right shift of the reversed operand, reversed back
+            operand = Signal(unsigned(32))
+            right = Signal(unsigned(32))
+            m.d.comb += operand.eq(Mux(left, a[::-1], a))
+            m.d.comb += right.eq(Cat(operand, self.alt & a[31]).as_signed() >> shamt)
+            m.d.comb += shifted.eq(Mux(left, right[::-1], right))
+            m.d.comb += shift_ready.eq(1)
+
+        #### Result
+        result = Signal(unsigned(32))
+        with m.Switch(funct3):
+            with m.Case(IntRegReg.ADD):
+                m.d.comb += result.eq(sum_[:32])
+            with m.Case(IntRegReg.SLT):
+                m.d.comb += result.eq(self.lt)
+            with m.Case(IntRegReg.SLTU):
+                m.d.comb += result.eq(self.ltu)
+            with m.Case(IntRegReg.XOR):
+                m.d.comb += result.eq(a ^ b)
+            with m.Case(IntRegReg.OR):
+                m.d.comb += result.eq(a | b)
+            with m.Case(IntRegReg.AND):
+                m.d.comb += result.eq(a & b)
+            with m.Case(IntRegReg.SLL, IntRegReg.SRx):
+                m.d.comb += result.eq(shifted)
+
+        done = Signal()
+        m.d.comb += done.eq(~is_shift | shift_ready)
+
+        if config.output_register:
+            with m.If(pending):
+                m.d.comb += self.ready.eq(1)
+                m.d.sync += pending.eq(0)
+            with m.Elif(self.valid & done):
+                m.d.sync += pending.eq(1)
+                m.d.sync += self.result.eq(result)
+            with m.If(~self.valid):
+                m.d.sync += pending.eq(0)
+        else:
+            m.d.comb += self.ready.eq(done)
+            m.d.comb += self.result.eq(result)
+
+        return m
@@ -0,0 +1,169 @@
+from nmigen import *
+import nmigen_soc.wishbone as wishbone
+from nmigen_soc.memory import MemoryMap
+
+class BusArbiter(Elaboratable):
+    """Shares one pipelined Wishbone bus between several masters, first one has priority.
+
+    Requests are forwarded in the same cycle they're granted, so an idle bus adds no latency.
+    The owner keeps the bus while it has reads/writes outstanding, but once another master is
+    waiting it's stalled until its responses are back, so a master that keeps CYC high (like
+    a fetch unit streaming reads) can't starve the others. Responses always go to the owner,
+    which is safe because the bus only changes hands with nothing in flight.
+
+    With ``round_robin`` priority rotates instead, the master after the last owner goes first.
+    ``max_outstanding`` is the most requests any one master can have in flight.
+    """
+    def __init__(self, bus: wishbone.Interface, masters: list, max_outstanding: int,
+                 round_robin: bool = False):
+        self.bus = bus
+        self.masters = masters
+        self.max_outstanding = max_outstanding
+        self.round_robin = round_robin
+
+    def elaborate(self, platform):
+        m = Module()
+
+        bus = self.bus
+        masters = self.masters
+        bus_stall = bus.stall if hasattr(bus, "stall") else Const(0)
+
+        owner = Signal(range(len(masters)))
+        outstanding = Signal(range(self.max_outstanding + 1))
+        drained = Signal()  # Nothing in flight once this cycle's response is in
+        grant = Signal(range(len(masters)))
+
+        requests = Cat(master.cyc & master.stb for master in masters)
+        m.d.comb += drained.eq((outstanding == 0) | ((outstanding == 1) & bus.ack))
+
+        # Highest priority requester takes over a drained bus, otherwise the owner keeps it
+        m.d.comb += grant.eq(owner)
+        with m.If(drained):
+            if self.round_robin:
+                with m.Switch(owner):
+                    for last in range(len(masters)):
+                        with m.Case(last):
+                            order = [(last + 1 + i) % len(masters) for i in range(len(masters))]
+                            for i in reversed(order):
+                                with m.If(requests[i]):
+                                    m.d.comb += grant.eq(i)
+            else:
+                for i in reversed(range(len(masters))):
+                    with m.If(requests[i]):
+                        m.d.comb += grant.eq(i)
+
+        # Someone other than the owner wants the bus, stop the owner issuing more
+        contended = Signal()
+        m.d.comb += contended.eq((requests & ~(1 << owner)).any() & ~drained)
+
+        for i, master in enumerate(masters):
+            granted = (grant == i) & ~contended
+            with m.If(granted):
+                m.d.comb += [
+                    bus.adr.eq(master.adr),
+                    bus.dat_w.eq(master.dat_w),
+                    bus.sel.eq(master.sel),
+                    bus.we.eq(master.we),
+                    bus.stb.eq(master.stb),
+                ]
+                for feature in ("cti", "bte"):
+                    if hasattr(bus, feature) and hasattr(master, feature):
+                        m.d.comb += getattr(bus, feature).eq(getattr(master, feature))
+            m.d.comb += [
+                master.dat_r.eq(bus.dat_r),
+                # With nothing outstanding a response can only be for this cycle's request
+                master.ack.eq(bus.ack & Mux(outstanding == 0, grant == i, owner == i)),
+            ]
+            if hasattr(master, "stall"):
+                m.d.comb += master.stall.eq(~granted | bus_stall)
+
+        m.d.comb += bus.cyc.eq(bus.stb | (outstanding != 0))
+
+        issued = Signal()
+        m.d.comb += issued.eq(bus.stb & ~bus_stall)
+        m.d.sync += outstanding.eq(outstanding + issued - bus.ack)
+        with m.If(issued):
+            m.d.sync += owner.eq(grant)
+
+        return m
+
+class BusDecoder(Elaboratable):
+    """Splits one pipelined Wishbone bus between several slaves by address.
+
+    ``windows`` are (base, size, bus) for slaves that each take a naturally aligned,
+    power-of-two sized range of addresses, everything else goes to ``default``. Slaves see
+    the full address, and requests are forwarded in the same cycle. ``memory_map`` is the
+    byte-addressed nmigen-soc ``MemoryMap`` of the windows, by bus name.
+
+    Responses are only ever outstanding from one slave at a time. A request for a different
+    slave is stalled until they're all back, so acknowledgements can't overtake each other,
+    and they still reach the master once the address has moved on to the next request.
+    ``max_outstanding`` is the most requests the master can have in flight.
+    """
+    def __init__(self, bus: wishbone.Interface, default: wishbone.Interface, windows: list,
+                 max_outstanding: int):
+        # nmigen-soc's Decoder wants word addresses and routes responses by the current
+        # address, which breaks once a pipelined master has moved on, so it only lends the map
+        self.memory_map = MemoryMap(addr_width=len(bus.adr), data_width=8)
+        for base, size, slave in windows:
+            if size & (size - 1) or base & (size - 1):
+                raise ValueError(f"Window at {base:#x} of {size:#x} bytes isn't aligned to its size")
+            # Also catches overlapping windows
+            self.memory_map.add_resource(slave.name, size=size, addr=base, alignment=size.bit_length() - 1)
+        self.bus = bus
+        self.default = default
+        self.windows = windows
+        self.max_outstanding = max_outstanding
+
+    def elaborate(self, platform):
+        m = Module()
+
+        bus = self.bus
+        slaves = [self.default] + [slave for _, _, slave in self.windows]
+
+        select = Signal(range(len(slaves)))
+        for i, (base, size, _) in enumerate(self.windows, 1):
+            bits = size.bit_length() - 1
+            with m.If(bus.adr[bits:] == base >> bits):
+                m.d.comb += select.eq(i)
+
+        owner = Signal(range(len(slaves)))
+        outstanding = Signal(range(self.max_outstanding + 1))
+        blocked = Signal()
+        m.d.comb += blocked.eq((outstanding != 0) & (select != owner))
+
+        # With nothing outstanding a response can only be for this cycle's request
+        source = Signal(range(len(slaves)))
+        m.d.comb += source.eq(Mux(outstanding == 0, select, owner))
+        m.d.comb += [
+            bus.ack.eq(Array(slave.ack for slave in slaves)[source]),
+            bus.dat_r.eq(Array(slave.dat_r for slave in slaves)[source]),
+        ]
+
+        stalls = [slave.stall if hasattr(slave, "stall") else Const(0) for slave in slaves]
+        slave_stall = Signal()
+        m.d.comb += slave_stall.eq(Array(stalls)[select])
+        if hasattr(bus, "stall"):
+            m.d.comb += bus.stall.eq(blocked | slave_stall)
+
+        for i, slave in enumerate(slaves):
+            stb = bus.cyc & bus.stb & (select == i) & ~blocked
+            m.d.comb += [
+                slave.adr.eq(bus.adr),
+                slave.dat_w.eq(bus.dat_w),
+                slave.sel.eq(bus.sel),
+                slave.we.eq(bus.we),
+                slave.stb.eq(stb),
+                slave.cyc.eq(stb | ((outstanding != 0) & (owner == i))),
+            ]
+            for feature in ("cti", "bte"):
+                if hasattr(bus, feature) and hasattr(slave, feature):
+                    m.d.comb += getattr(slave, feature).eq(getattr(bus, feature))
+
+        issued = Signal()
+        m.d.comb += issued.eq(bus.cyc & bus.stb & ~blocked & ~slave_stall)
+        m.d.sync += outstanding.eq(outstanding + issued - bus.ack)
+        with m.If(issued):
+            m.d.sync += owner.eq(select)
+
+        return m
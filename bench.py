@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""Build and run the benchmarks in test_fw/bench on SimTop.
+
+    python bench.py --pipelined --icache 4:64:1 --json pipelined.json
+    python bench.py --pipelined --compare pipelined.json dhrystone coremark
+
+Benchmarks are built with test_fw/build.py for the configuration's ISA (RV32I, plus M and C
+if the core has them) and run across a pool of worker processes, like regress.py. Each one
+times its own main loop with rdcycle/rdinstret and crt0.S hands the counts back in
+registers, so start-up and checking don't count. Prints cycles, instructions retired, CPI and
+a score per MHz (DMIPS/MHz for Dhrystone, iterations per second at 1 MHz for the others).
+``--json`` writes the same as a baseline for ``--compare`` against another configuration.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import sim
+from test_fw.build import build
+
+here = os.path.dirname(os.path.abspath(__file__))
+bench_dir = os.path.join(here, "test_fw", "bench")
+
+# Size of RAM in test_fw/bench/link.ld, the stack starts at the top
+RAM_SIZE = 64 * 1024
+
+CFLAGS = ("-O2", "-fno-builtin", "-fno-tree-loop-distribute-patterns")
+
+@dataclass
+class Benchmark:
+    name: str
+    # Default iteration count, small enough for pysim
+    iterations: int
+    score: str = "iter/MHz"
+    # Iterations per unit of score, 1757 for DMIPS
+    scale: float = 1.0
+    cflags: tuple = ()
+
+BENCHMARKS = (
+    # No inlining, as Dhrystone's rules ask
+    Benchmark("dhrystone", 20, "DMIPS/MHz", 1757, ("-fno-inline",)),
+    Benchmark("coremark", 2, "CM/MHz"),
+    Benchmark("memcpy", 2),
+    Benchmark("crc32", 2),
+    Benchmark("sort", 2),
+)
+
+def build_benchmark(benchmark: Benchmark, iterations: int, march: str, build_dir: str) -> str:
+    """Build one benchmark unless its image is up to date, returns the ELF path."""
+    output = os.path.join(build_dir, f"{benchmark.name}-{iterations}")
+    elf = f"{output}.elf"
+    source = os.path.join(bench_dir, f"{benchmark.name}.c")
+    support = [os.path.join(bench_dir, name) for name in ("crt0.S", "lib.c")]
+    inputs = [source, *support, *glob.glob(os.path.join(bench_dir, "*.h")), os.path.join(bench_dir, "link.ld")]
+    if not os.path.exists(elf) or os.path.getmtime(elf) < max(os.path.getmtime(path) for path in inputs):
+        build(source, output, linker_script=os.path.join(bench_dir, "link.ld"), march=march,
+              extra_sources=support, cflags=(*CFLAGS, *benchmark.cflags, f"-DITERATIONS={iterations}"))
+    return elf
+
+#### Worker processes, one simulator each
+
+_simulation = None
+
+def _init_worker(config: dict, engine: str):
+    global _simulation
+    _simulation = sim.Simulation(config, engine)
+
+def _run_benchmark(benchmark: Benchmark, image: str, max_cycles: int) -> dict:
+    return parse_result(benchmark, _simulation.run(image, max_cycles))
+
+def parse_result(benchmark: Benchmark, result: sim.SimResult) -> dict:
+    """The result dict for one run of ``benchmark``, from what crt0.S leaves in registers."""
+    # crt0.S: a0 = errors, a1 = cycles, a2 = instret, a3 = iterations of the timed loop
+    errors, cycles, instret, iterations = result.regs[10:14]
+    passed = result.halted and errors == 0
+    return {
+        "name": benchmark.name,
+        "passed": passed,
+        "timeout": not result.halted,
+        "iterations": iterations,
+        "cycles": cycles,
+        "instret": instret,
+        "cpi": round(cycles / instret, 3) if instret else 0.0,
+        "score": round(iterations * 1e6 / cycles / benchmark.scale, 4) if passed and cycles else 0.0,
+        "score_unit": benchmark.score,
+        "total_cycles": result.cycles,
+    }
+
+def isa(config: dict) -> str:
+    """-march for a core configuration."""
+    return "rv32i" + ("m" if config.get("muldiv") else "") + ("c" if config.get("compressed") else "")
+
+def run_suite(config: dict, engine: str = "pysim", names: list = (), iterations: int = None, jobs: int = None,
+              max_cycles: int = 10_000_000, build_dir: str = os.path.join(here, "build", "bench")) -> list:
+    """Build and run the benchmarks called ``names`` (all of them by default) on SimTop with
+    ``config``, returns a result dict per benchmark."""
+    benchmarks = [b for b in BENCHMARKS if not names or b.name in names]
+    if not benchmarks:
+        raise ValueError(f"no such benchmark, there are {', '.join(b.name for b in BENCHMARKS)}")
+
+    config = dict(config)
+    # pysim can't compile a Memory that big, it gets the paged model instead
+    if engine == "pysim":
+        config["paged"] = True
+    if not config.get("paged"):
+        config["memory_depth"] = max(config.get("memory_depth", 0), RAM_SIZE // 4)
+
+    march = isa(config)
+    build_dir = os.path.join(build_dir, march)
+    os.makedirs(build_dir, exist_ok=True)
+    jobs = jobs or os.cpu_count()
+    with ThreadPoolExecutor(jobs) as pool:
+        images = list(pool.map(lambda b: build_benchmark(b, iterations or b.iterations, march, build_dir),
+                               benchmarks))
+
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(config, engine)) as pool:
+        futures = [pool.submit(_run_benchmark, b, image, max_cycles) for b, image in zip(benchmarks, images)]
+        return [future.result() for future in futures]
+
+def compare(results: list, baseline: dict):
+    """Print each benchmark's score against the baseline's, higher is better."""
+    before = {r["name"]: r for r in baseline["benchmarks"]}
+    print(f"\nagainst {baseline['config']}")
+    print(f"{'benchmark':<12} {'baseline':>12} {'score':>12} {'change':>8}")
+    for r in results:
+        old = before.get(r["name"])
+        if old is None or not old["score"] or not r["score"]:
+            continue
+        change = 100 * (r["score"] / old["score"] - 1)
+        print(f"{r['name']:<12} {old['score']:>12.4f} {r['score']:>12.4f} {change:>+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help="benchmark names (default: all of them)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", choices=("pysim", "cxxsim"), default="pysim")
+    parser.add_argument("--max-cycles", type=int, default=10_000_000)
+    parser.add_argument("--iterations", type=int, help="override every benchmark's iteration count")
+    parser.add_argument("--build-dir", default=os.path.join(here, "build", "bench"))
+    parser.add_argument("--json", help="write results to this file, as a baseline")
+    parser.add_argument("--compare", metavar="JSON", help="compare scores with a baseline from --json")
+    sim.add_config_args(parser)
+    args = parser.parse_args()
+
+    config = sim.config_from_args(args)
+    try:
+        results = run_suite(config, args.engine, args.benchmarks, args.iterations, args.jobs, args.max_cycles,
+                            args.build_dir)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    print(f"{'benchmark':<12} {'result':<8} {'iter':>6} {'cycles':>12} {'instret':>12} {'CPI':>6} {'score':>12}")
+    for r in results:
+        status = "pass" if r["passed"] else "timeout" if r["timeout"] else "FAIL"
+        print(f"{r['name']:<12} {status:<8} {r['iterations']:>6} {r['cycles']:>12} {r['instret']:>12} "
+              f"{r['cpi']:>6.2f} {r['score']:>12.4f} {r['score_unit']}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "config": sim.config_to_json(config),
+                "engine": args.engine,
+                "march": isa(config),
+                "benchmarks": results,
+            }, f, indent=2)
+
+    sys.exit(0 if all(r["passed"] for r in results) else 1)
+
+if __name__ == "__main__":
+    main()
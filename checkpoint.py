@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Architectural checkpoints, to fast-forward a program on the ISS and carry on in the RTL.
+
+    python checkpoint.py test_fw/test.elf --muldiv --at main -o main.ckpt
+    python sim.py test_fw/test.elf --pipelined --muldiv iterative --checkpoint main.ckpt
+    python sim.py test_fw/test.elf --pipelined --fast-forward 1000000
+
+A ``Checkpoint`` is what a program can see of the machine: pc, x1-x31, the writable machine
+CSRs, instret and memory. ``fast_forward`` runs an image on the ``ISS`` up to an instruction
+count or a PC and takes one, quickly, and ``sim.Simulation.run`` restores one into
+``SimTop`` as its reset state instead of loading an image, then simulates cycle by cycle
+from there. The cycles and instructions it reports are those after the checkpoint.
+
+Only architectural state is carried over. Caches, the predictor and the prefetch queue start
+cold, the CLINT from reset, and cycle/time carry on from instret as they read on the ISS.
+Checkpoint files are gzipped JSON.
+"""
+import argparse
+import gzip
+import json
+import sys
+from dataclasses import dataclass, field
+
+from image import PagedMemory, load_symbols
+from iss import ISS
+
+@dataclass
+class Checkpoint:
+    pc: int
+    # x0-x31
+    regs: list
+    # Writable machine CSRs by address, the trap CSRs and mscratch
+    csrs: dict
+    instret: int
+    memory: PagedMemory = field(repr=False)
+
+    def save(self, path: str):
+        state = {
+            "pc": self.pc,
+            "regs": self.regs,
+            "csrs": {f"{address:#05x}": value for address, value in self.csrs.items()},
+            "instret": self.instret,
+            "page_bits": self.memory.page_bits,
+            "pages": {str(number): page.hex() for number, page in sorted(self.memory.pages.items())},
+        }
+        with gzip.open(path, "wt") as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint":
+        with gzip.open(path, "rt") as f:
+            state = json.load(f)
+        memory = PagedMemory(state["page_bits"])
+        memory.pages.update((int(number), bytearray.fromhex(page)) for number, page in state["pages"].items())
+        return cls(state["pc"], state["regs"], {int(address, 16): value for address, value in state["csrs"].items()},
+                   state["instret"], memory)
+
+def capture(iss: ISS) -> Checkpoint:
+    """The ISS's state as it is now."""
+    memory = PagedMemory(iss.memory.page_bits)
+    memory.copy_from(iss.memory)
+    return Checkpoint(iss.pc, list(iss.regs), dict(iss.csrs), iss.instret, memory)
+
+def restore(iss: ISS, checkpoint: Checkpoint):
+    """Put the ISS in the checkpoint's state, to run on from it or check the RTL in lockstep."""
+    iss.memory.copy_from(checkpoint.memory)
+    iss.flush()
+    iss.reset()
+    iss.regs[:] = checkpoint.regs
+    iss.pc = checkpoint.pc
+    iss.csrs.update(checkpoint.csrs)
+    iss.instret = checkpoint.instret
+
+def core_state(cpu) -> list:
+    """(signal, getter) for each register of an ``RV32ICore`` a checkpoint sets, the getter
+    picking its value out of a ``Checkpoint``. Setting their reset values is how
+    ``sim.Simulation`` restores one."""
+    state = [(cpu.pc, lambda c: c.pc)]
+    for i, reg in enumerate(cpu.regfile.registers()):
+        state.append((reg, lambda c, i=i: c.regs[i]))
+
+    traps = cpu.csr.traps
+    for address, csr in traps.csrs():
+        if address in traps.masks:
+            state.append((csr, lambda c, address=address: c.csrs[address]))
+    state.append((cpu.csr.mscratch.sig, lambda c: c.csrs[0x340]))
+
+    counters = cpu.counters
+    for counter in (counters.cycle, counters.time, counters.instret):
+        state.append((counter, lambda c: c.instret))
+    return state
+
+def resolve(image: str, where: str) -> int:
+    """A PC given as a number or as a symbol of the image."""
+    try:
+        return int(where, 0)
+    except ValueError:
+        pass
+    for address, _, name in load_symbols(image):
+        if name == where:
+            return address
+    raise ValueError(f"{image} has no symbol {where}")
+
+def fast_forward(image: str, muldiv: bool = False, instructions: int = None, pc: int = None) -> Checkpoint:
+    """Run ``image`` on the ISS until ``instructions`` have retired or it gets to ``pc``,
+    whichever comes first, and checkpoint it there."""
+    iss = ISS(muldiv=muldiv)
+    iss.load(image)
+    if pc is not None:
+        # A run doesn't stop at the breakpoint it starts on
+        if iss.pc == pc:
+            return capture(iss)
+        iss.breakpoints.add(pc)
+    stop = iss.run(instructions)
+    if stop == "halted":
+        raise ValueError(f"{image} finished after {iss.instret} instructions, before the checkpoint")
+    return capture(iss)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="flat binary or ELF file, loaded at address 0")
+    parser.add_argument("--muldiv", action="store_true", help="with RV32M")
+    parser.add_argument("--instructions", type=int, help="checkpoint after this many instructions")
+    parser.add_argument("--at", metavar="PC", help="checkpoint when execution gets here, an address or symbol")
+    parser.add_argument("-o", "--output", required=True, help="checkpoint file to write")
+    args = parser.parse_args()
+    if args.instructions is None and args.at is None:
+        parser.error("give --instructions, --at or both")
+
+    try:
+        pc = resolve(args.image, args.at) if args.at is not None else None
+        checkpoint = fast_forward(args.image, args.muldiv, args.instructions, pc)
+    except ValueError as e:
+        sys.exit(str(e))
+    checkpoint.save(args.output)
+    print(f"checkpoint at pc {checkpoint.pc:#010x} after {checkpoint.instret} instructions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from nmigen import *
+import nmigen_soc.wishbone as wishbone
+
+from counters import TimeCounter
+
+# Where the core maps it, and the register offsets of SiFive's CLINT (single hart)
+CLINT_BASE = 0x0200_0000
+CLINT_SIZE = 0x1_0000
+MSIP = 0x0000
+MTIMECMP = 0x4000
+MTIME = 0xBFF8
+
+class CLINT(Elaboratable):
+    """Core-local interruptor: msip, mtimecmp and mtime for one hart.
+
+    ``bus`` is a pipelined Wishbone slave with byte lanes that never stalls and answers the
+    cycle after each request, like ``SimulationMemory``. Only the low 16 address bits are
+    decoded, at the offsets SiFive's CLINT uses. Unmapped offsets read as zero.
+
+    mtime is the ``TimeCounter`` behind the ``time`` CSR, so both always agree, and writing it
+    loads the counter. ``mtip`` is registered from mtime >= mtimecmp, it follows a write to
+    mtimecmp a cycle later. mtimecmp resets to all ones so the timer is quiet until it's set.
+    ``msip`` is bit 0 of the msip register.
+    """
+    def __init__(self, time: TimeCounter):
+        self.time = time
+        self.bus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"},
+                                      name="clint")
+
+        #### Interrupt lines
+        self.msip = Signal()
+        self.mtip = Signal()
+
+        self.mtimecmp = Signal(unsigned(64), reset=2**64 - 1)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        bus = self.bus
+        time = self.time
+        mtime = time.cnt
+        mtimecmp = self.mtimecmp
+
+        m.d.comb += bus.stall.eq(0)
+
+        offset = Signal(unsigned(16))
+        request = Signal()
+        m.d.comb += offset.eq(Cat(Const(0, 2), bus.adr[2:16]))
+        m.d.comb += request.eq(bus.cyc & bus.stb)
+
+        def merge(old):
+            # ``old`` with the written byte lanes replaced
+            return Cat(Mux(bus.sel[i], bus.dat_w[8 * i:8 * i + 8], old[8 * i:8 * i + 8]) for i in range(4))
+
+        #### Read, registered like a synchronous RAM
+        m.d.sync += bus.ack.eq(request)
+        with m.If(request & ~bus.we):
+            with m.Switch(offset):
+                with m.Case(MSIP):
+                    m.d.sync += bus.dat_r.eq(self.msip)
+                with m.Case(MTIMECMP):
+                    m.d.sync += bus.dat_r.eq(mtimecmp[:32])
+                with m.Case(MTIMECMP + 4):
+                    m.d.sync += bus.dat_r.eq(mtimecmp[32:])
+                with m.Case(MTIME):
+                    m.d.sync += bus.dat_r.eq(mtime[:32])
+                with m.Case(MTIME + 4):
+                    m.d.sync += bus.dat_r.eq(mtime[32:])
+                with m.Default():
+                    m.d.sync += bus.dat_r.eq(0)
+
+        #### Write
+        with m.If(request & bus.we):
+            with m.Switch(offset):
+                with m.Case(MSIP):
+                    with m.If(bus.sel[0]):
+                        m.d.sync += self.msip.eq(bus.dat_w[0])
+                with m.Case(MTIMECMP):
+                    m.d.sync += mtimecmp[:32].eq(merge(mtimecmp[:32]))
+                with m.Case(MTIMECMP + 4):
+                    m.d.sync += mtimecmp[32:].eq(merge(mtimecmp[32:]))
+                with m.Case(MTIME):
+                    m.d.comb += time.load.eq(1)
+                    m.d.comb += time.value.eq(Cat(merge(mtime[:32]), mtime[32:]))
+                with m.Case(MTIME + 4):
+                    m.d.comb += time.load.eq(1)
+                    m.d.comb += time.value.eq(Cat(mtime[:32], merge(mtime[32:])))
+
+        m.d.sync += self.mtip.eq(mtime >= mtimecmp)
+
+        return m
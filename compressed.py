@@ -0,0 +1,175 @@
+from nmigen import *
+
+from opcodes import Opcodes, IntImmediate, IntRegReg, BranchCondition, LSWidth
+
+#### 32-bit instruction formats, from already-sliced fields
+
+def _opcode(opcode: Opcodes) -> Const:
+    return Const((opcode.value << 2) | 0b11, 7)
+
+def _r_type(opcode, funct3, funct7, rd, rs1, rs2):
+    return Cat(_opcode(opcode), rd, Const(funct3, 3), rs1, rs2, Const(funct7, 7))
+
+def _i_type(opcode, funct3, rd, rs1, imm):
+    return Cat(_opcode(opcode), rd, Const(funct3, 3), rs1, imm[0:12])
+
+def _s_type(opcode, funct3, rs1, rs2, imm):
+    return Cat(_opcode(opcode), imm[0:5], Const(funct3, 3), rs1, rs2, imm[5:12])
+
+def _b_type(funct3, rs1, rs2, imm):
+    return Cat(_opcode(Opcodes.BRANCH), imm[11], imm[1:5], Const(funct3, 3), rs1, rs2, imm[5:11], imm[12])
+
+def _u_type(opcode, rd, imm):
+    return Cat(_opcode(opcode), rd, imm[12:32])
+
+def _j_type(rd, imm):
+    return Cat(_opcode(Opcodes.JAL), rd, imm[12:20], imm[11], imm[1:11], imm[20])
+
+def _sext(value: Value, width: int) -> Value:
+    return Cat(value, Repl(value[-1], width - len(value)))
+
+class CompressedExpander(Elaboratable):
+    """Expands an RV32C instruction into the 32-bit instruction it stands for.
+
+    ``instr`` holds the instruction at the bottom, a full 32-bit instruction passes straight
+    through to ``out``. ``compressed`` is set for a 16-bit one. Reserved encodings and the
+    floating-point loads/stores come out as all zeros, which is an illegal instruction.
+    """
+    def __init__(self):
+        self.instr = Signal(unsigned(32))
+        self.out = Signal(unsigned(32))
+        self.compressed = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        c = self.instr[0:16]
+        out = self.out
+
+        m.d.comb += self.compressed.eq(c[0:2] != 0b11)
+
+        # Register fields, the 3-bit ones are x8-x15
+        rd = c[7:12]
+        rs2 = c[2:7]
+        rd_ = Cat(c[2:5], Const(0b01, 2))      # rd'/rs2' in bits 4:2
+        rs1_ = Cat(c[7:10], Const(0b01, 2))    # rs1'/rd' in bits 9:7
+        x0 = Const(0, 5)
+        ra = Const(1, 5)
+        sp = Const(2, 5)
+
+        # Immediates, named after the instructions that use them
+        imm6 = _sext(Cat(c[2:7], c[12]), 12)
+        addi4spn = Cat(Const(0, 2), c[6], c[5], c[11:13], c[7:11], Const(0, 2))
+        lw = Cat(Const(0, 2), c[6], c[10:13], c[5], Const(0, 5))
+        addi16sp = _sext(Cat(Const(0, 4), c[6], c[2], c[5], c[3:5], c[12]), 12)
+        lui = Cat(Const(0, 12), _sext(Cat(c[2:7], c[12]), 20))
+        j = _sext(Cat(Const(0, 1), c[3:6], c[11], c[2], c[7], c[6], c[9:11], c[8], c[12]), 21)
+        b = _sext(Cat(Const(0, 1), c[3:5], c[10:12], c[2], c[5:7], c[12]), 13)
+        lwsp = Cat(Const(0, 2), c[4:7], c[12], c[2:4], Const(0, 4))
+        swsp = Cat(Const(0, 2), c[9:13], c[7:9], Const(0, 4))
+        shamt = Cat(c[2:7], Const(0, 7))
+
+        funct3 = c[13:16]
+        with m.If(~self.compressed):
+            m.d.comb += out.eq(self.instr)
+
+        # Quadrant 0
+        with m.Elif(c[0:2] == 0b00):
+            with m.Switch(funct3):
+                with m.Case(0b000):
+                    # C.ADDI4SPN, a zero immediate is reserved
+                    with m.If(c[5:13] != 0):
+                        m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.ADDI.value, rd_, sp, addi4spn))
+                with m.Case(0b010):
+                    m.d.comb += out.eq(_i_type(Opcodes.LOAD, LSWidth.W.value, rd_, rs1_, lw))
+                with m.Case(0b110):
+                    m.d.comb += out.eq(_s_type(Opcodes.STORE, LSWidth.W.value, rs1_, rd_, lw))
+
+        # Quadrant 1
+        with m.Elif(c[0:2] == 0b01):
+            with m.Switch(funct3):
+                with m.Case(0b000):
+                    # C.ADDI, C.NOP
+                    m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.ADDI.value, rd, rd, imm6))
+                with m.Case(0b001):
+                    # C.JAL
+                    m.d.comb += out.eq(_j_type(ra, j))
+                with m.Case(0b010):
+                    # C.LI
+                    m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.ADDI.value, rd, x0, imm6))
+                with m.Case(0b011):
+                    # C.ADDI16SP or C.LUI, a zero immediate is reserved for both
+                    with m.If((c[12] != 0) | (c[2:7] != 0)):
+                        with m.If(rd == 2):
+                            m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.ADDI.value, sp, sp, addi16sp))
+                        with m.Else():
+                            m.d.comb += out.eq(_u_type(Opcodes.LUI, rd, lui))
+                with m.Case(0b100):
+                    with m.Switch(c[10:12]):
+                        # C.SRLI/C.SRAI, shamt[5] has to be clear on RV32
+                        with m.Case(0b00):
+                            with m.If(~c[12]):
+                                m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.SRxI.value,
+                                                           rs1_, rs1_, shamt))
+                        with m.Case(0b01):
+                            with m.If(~c[12]):
+                                m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.SRxI.value,
+                                                           rs1_, rs1_, shamt | (1 << 10)))
+                        with m.Case(0b10):
+                            m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.ANDI.value, rs1_, rs1_, imm6))
+                        with m.Case(0b11):
+                            # C.SUB/C.XOR/C.OR/C.AND, the c[12] forms are RV64 only
+                            with m.If(~c[12]):
+                                with m.Switch(c[5:7]):
+                                    with m.Case(0b00):
+                                        m.d.comb += out.eq(_r_type(Opcodes.OP, IntRegReg.ADD.value, 0b0100000,
+                                                                   rs1_, rs1_, rd_))
+                                    with m.Case(0b01):
+                                        m.d.comb += out.eq(_r_type(Opcodes.OP, IntRegReg.XOR.value, 0, rs1_, rs1_, rd_))
+                                    with m.Case(0b10):
+                                        m.d.comb += out.eq(_r_type(Opcodes.OP, IntRegReg.OR.value, 0, rs1_, rs1_, rd_))
+                                    with m.Case(0b11):
+                                        m.d.comb += out.eq(_r_type(Opcodes.OP, IntRegReg.AND.value, 0, rs1_, rs1_, rd_))
+                with m.Case(0b101):
+                    # C.J
+                    m.d.comb += out.eq(_j_type(x0, j))
+                with m.Case(0b110):
+                    m.d.comb += out.eq(_b_type(BranchCondition.BEQ.value, rs1_, x0, b))
+                with m.Case(0b111):
+                    m.d.comb += out.eq(_b_type(BranchCondition.BNE.value, rs1_, x0, b))
+
+        # Quadrant 2
+        with m.Else():
+            with m.Switch(funct3):
+                with m.Case(0b000):
+                    # C.SLLI
+                    with m.If(~c[12]):
+                        m.d.comb += out.eq(_i_type(Opcodes.OP_IMM, IntImmediate.SLLI.value, rd, rd, shamt))
+                with m.Case(0b010):
+                    # C.LWSP, rd=x0 is reserved
+                    with m.If(rd != 0):
+                        m.d.comb += out.eq(_i_type(Opcodes.LOAD, LSWidth.W.value, rd, sp, lwsp))
+                with m.Case(0b100):
+                    with m.If(~c[12]):
+                        with m.If(rs2 == 0):
+                            # C.JR, rs1=x0 is reserved
+                            with m.If(rd != 0):
+                                m.d.comb += out.eq(_i_type(Opcodes.JALR, 0, x0, rd, Const(0, 12)))
+                        with m.Else():
+                            # C.MV
+                            m.d.comb += out.eq(_r_type(Opcodes.OP, IntRegReg.ADD.value, 0, rd, x0, rs2))
+                    with m.Else():
+                        with m.If(rs2 == 0):
+                            with m.If(rd == 0):
+                                # C.EBREAK
+                                m.d.comb += out.eq(_i_type(Opcodes.SYSTEM, 0, x0, x0, Const(1, 12)))
+                            with m.Else():
+                                # C.JALR
+                                m.d.comb += out.eq(_i_type(Opcodes.JALR, 0, ra, rd, Const(0, 12)))
+                        with m.Else():
+                            # C.ADD
+                            m.d.comb += out.eq(_r_type(Opcodes.OP, IntRegReg.ADD.value, 0, rd, rd, rs2))
+                with m.Case(0b110):
+                    m.d.comb += out.eq(_s_type(Opcodes.STORE, LSWidth.W.value, sp, rs2, swsp))
+
+        return m
@@ -1,68 +1,287 @@
 from nmigen import *
 from nmigen.hdl.rec import Layout, Record
 from enum import Enum
+from dataclasses import replace
 
 
-from opcodes import Opcodes
+from opcodes import Opcodes, IntImmediate, IntRegReg, BranchCondition, LSWidth, SystemFunct, MULDIV
 from instruction_decoder import InstructionDecoder
-from regfile import RegisterFile
+from regfile import RegisterFile, RegFileConfig
+from pipeline import RV32IPipeline
+from icache import ICache, ICacheConfig
+from prefetch import PrefetchBuffer
+from realign import RealignBuffer
+from dcache import DCache, DCacheConfig
+from store_buffer import StoreBuffer
+from predictor import BranchPredictor, PredictorConfig
+from counters import PerfCounters, CounterConfig
+from csr import CSRTable, MISA_M, MISA_C
+from lsu import LoadStoreUnit
+from alu import ALU, ALUConfig
+from muldiv import MulDiv, MulDivConfig
+from arbiter import BusArbiter, BusDecoder
+from traps import Cause, MRET, WFI
+from clint import CLINT, CLINT_BASE, CLINT_SIZE
+from tracing import TracePort
+from image import load_words, PagedMemory
 import nmigen_soc.wishbone as wishbone
 from nmigen_soc.memory import *
-
-# TODO replace this with a proper wishbone bus
-class IntImmediate(Enum):
-    # Integer opperations on immediates, as defined by funct3 field
-    ADDI  = 0b000
-    SLTI  = 0b010
-    SLTIU = 0b011
-    XORI  = 0b100
-    ORI   = 0b110
-    ANDI  = 0b111
-
-    SLLI  = 0b001
-    SRxI  = 0b101
-
-class IntRegReg(Enum):
-    # Integer register-register operations, as defined by funct3 field
-    ADD  = 0b000 # Also SUB
-    SLL  = 0b001
-    SLT  = 0b010
-    SLTU = 0b011
-    XOR  = 0b100
-    SRx  = 0b101 # SRL/SRA
-    OR   = 0b110
-    AND  = 0b111
-
-class BranchCondition(Enum):
-    # Different BRANCH conditions, as defined by funct3 field
-    BEQ  = 0b000
-    BNE  = 0b001
-    BLT  = 0b100
-    BGE  = 0b101
-    BLTU = 0b110
-    BGEU = 0b111
-
-class LSWidth(Enum):
-    B = 0b00
-    H = 0b01
-    W = 0b10
+try:
+    from nmigen.sim import Passive, Settle, Tick
+except ImportError:
+    from nmigen.back.pysim import Passive, Settle, Tick
 
 class RV32ICore(Elaboratable):
-    """Basic RV32-I core."""
-    def __init__(self, mem_bus: wishbone.Interface):
-
-        self.decoder = InstructionDecoder()
+    """Basic RV32-I core.
+
+    By default this is a small multi-cycle FSM core. Passing ``pipelined=True`` instead builds
+    the 3-stage pipeline in ``pipeline.py``, trading area for close to 1 IPC.
+
+    Giving an ``ICacheConfig`` puts an instruction cache in front of the fetch port, and a
+    non-zero ``prefetch`` depth adds a sequential prefetch queue in front of that.
+    A ``PredictorConfig`` adds branch prediction to the pipelined core. The pipelined core
+    runs on predecoded control words, with ``predecode`` they're stored in the instruction
+    cache or prefetch queue (whichever is closest to the core) instead of being made at fetch.
+
+    Integer ops and branch comparisons go through an ``ALU``, ``ALUConfig`` trades its speed
+    for area or Fmax. ``RegFileConfig`` can put the register file in RAM. A ``MulDivConfig``
+    adds the RV32M multiply/divide instructions, and ``compressed`` the RV32C ones, through a
+    ``RealignBuffer`` in front of the rest of the fetch path.
+
+    Likewise a ``DCacheConfig`` puts a write-back data cache behind the load/store unit, and a
+    non-zero ``store_buffer`` depth adds a coalescing store buffer between the two.
+
+    CSR instructions go to a ``CSRTable`` of the machine-mode CSRs. ``counters`` picks the
+    events behind its mhpmcounters, cycle/time/instret are always there.
+
+    Illegal instructions, misaligned jump targets and loads/stores, ECALL and EBREAK trap to
+    mtvec through the CSR file's ``TrapUnit``, with mtval zero for illegal instructions.
+    ``meip``, ``msip`` and ``mtip`` are interrupt inputs. With ``clint`` the last two come from
+    a ``CLINT`` instead, mapped at ``CLINT_BASE`` in front of the store buffer and data cache
+    so its registers are never cached. Interrupts replace the instruction about to execute,
+    abandoning a multi-cycle ALU or multiply/divide op, so only a fetch or load already on the
+    bus delays them. ``trap`` and ``interrupt`` pulse as each is taken.
+
+    ``trace`` adds a ``TracePort``, its ``TRACE_LAYOUT`` record on ``self.trace`` describes
+    each retired instruction for simulation. Without it there's no trace logic at all.
+
+    Instruction fetch and the ``LoadStoreUnit`` are separate masters (``ibus``/``dbus``),
+    shared on ``mem_bus`` by a ``BusArbiter`` that favours data accesses, or takes turns with
+    ``round_robin``. ``mem_bus`` needs 8-bit granularity for the byte lanes. With ``harvard``
+    there's no arbiter and ``mem_bus`` is None, ``ibus`` and ``dbus`` are the core's bus
+    ports, so fetch and data accesses can both go out in the same cycle.
+    """
+    def __init__(self, mem_bus: wishbone.Interface, pipelined: bool = False,
+                 icache: ICacheConfig = None, prefetch: int = 0, predictor: PredictorConfig = None,
+                 counters: CounterConfig = None, dcache: DCacheConfig = None, store_buffer: int = 0,
+                 alu: ALUConfig = None, regfile: RegFileConfig = None, predecode: bool = False,
+                 muldiv: MulDivConfig = None, compressed: bool = False, trace: bool = False,
+                 clint: bool = False, harvard: bool = False, round_robin: bool = False):
+        if harvard != (mem_bus is None):
+            raise ValueError("Harvard cores take no memory bus, and the others need one")
+
+        # The pipeline runs on predecoded instructions instead
+        self.decoder = InstructionDecoder() if not pipelined else None
+        self.regfile = RegisterFile(regfile)
+        self.alu = ALU(alu)
+        self.muldiv = MulDiv(muldiv) if muldiv is not None else None
+        extensions = (MISA_M if muldiv is not None else 0) | (MISA_C if compressed else 0)
+        self.csr = CSRTable(counters=PerfCounters(counters), extensions=extensions)
+        self.counters = self.csr.counters
         self.mem = mem_bus
+        self.pipelined = pipelined
+
+        # Cache refills can use bursts if the memory bus has them
+        features = {"stall"} | {feature for feature in ("cti", "bte") if hasattr(mem_bus, feature)}
+        self.ibus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features=features,
+                                       name="ibus")
+        self.dbus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features=features,
+                                       name="dbus")
+        if dcache is not None:
+            self.dcache = DCache(self.dbus, dcache)
+        else:
+            self.dcache = None
+
+        if store_buffer:
+            self.store_buffer = StoreBuffer(self.dcache.bus if self.dcache else self.dbus, store_buffer)
+        else:
+            self.store_buffer = None
+
+        if self.store_buffer is not None:
+            lsu_bus = self.store_buffer.bus
+        else:
+            lsu_bus = self.dcache.bus if self.dcache else self.dbus
+
+        if clint:
+            self.clint = CLINT(self.counters.time_counter)
+            self.lsu_bus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"},
+                                              name="lsu")
+            self.lsu_decoder = BusDecoder(self.lsu_bus, lsu_bus, [(CLINT_BASE, CLINT_SIZE, self.clint.bus)],
+                                          LoadStoreUnit.max_outstanding)
+            lsu_bus = self.lsu_bus
+        else:
+            self.clint = None
+        self.lsu = LoadStoreUnit(lsu_bus)
+
+        # Only the FSM core decodes raw instructions. Cached words don't line up with RV32C
+        # instructions, those are predecoded by the pipeline after realignment.
+        predecode = predecode and pipelined and not compressed
+
+        if icache is not None:
+            if predecode and not prefetch:
+                icache = replace(icache, predecode=True)
+            self.icache = ICache(self.ibus, icache)
+        else:
+            self.icache = None
+
+        if prefetch:
+            self.prefetch = PrefetchBuffer(self.icache.bus if self.icache else self.ibus, prefetch, predecode)
+        else:
+            self.prefetch = None
+
+        if compressed:
+            fetch_mem = self.prefetch.bus if self.prefetch else self.icache.bus if self.icache else self.ibus
+            self.realign = RealignBuffer(fetch_mem)
+        else:
+            self.realign = None
+
+        if harvard:
+            self.arbiter = None
+        else:
+            # Whatever is directly on each bus, the cores' own fetch has one read out at a time
+            fetch_master = self.icache or self.prefetch or self.realign
+            data_master = self.dcache or self.store_buffer or self.lsu
+            max_outstanding = max(fetch_master.max_outstanding if fetch_master else 1, data_master.max_outstanding)
+            self.arbiter = BusArbiter(mem_bus, [self.dbus, self.ibus], max_outstanding, round_robin)
+
+        # The FSM core never has anything in flight to predict for
+        if predictor is not None and pipelined:
+            self.predictor = BranchPredictor(predictor)
+        else:
+            self.predictor = None
+
+        self.tracer = TracePort() if trace else None
+        self.trace = self.tracer.out if trace else None
+
+        # Where the next instruction is fetched from, execution starts at its reset value. In
+        # the pipeline it runs ahead of the instruction in execute.
+        self.pc = Signal(unsigned(32), name="pc")
+
+        #### Interrupt lines
+        self.meip = Signal()
+        # Only without a CLINT
+        self.msip = Signal()
+        self.mtip = Signal()
+
+        # Pulsed when FENCE.I executes
+        self.fence_i = Signal()
+        # Pulsed when ECALL/EBREAK execute
+        self.ecall = Signal()
+        self.ebreak = Signal()
+        # Pulsed for every retired instruction
+        self.retire = Signal()
+        # Pulsed when a trap is taken, and when that's for an interrupt
+        self.trap = Signal()
+        self.interrupt = Signal()
 
     def elaborate(self, platform):
         m = Module()
-        m.submodules.decoder = self.decoder
-        m.submodules.regfile = RegisterFile()
 
-        regfile = m.submodules.regfile
+        m.submodules.csr = csr = self.csr
+        counters = self.counters
+        m.d.comb += counters.retire.eq(self.retire)
+
+        trap = csr.traps
+        if self.clint is not None:
+            m.submodules.clint = self.clint
+            m.submodules.lsu_decoder = self.lsu_decoder
+            m.d.comb += trap.msip.eq(self.clint.msip)
+            m.d.comb += trap.mtip.eq(self.clint.mtip)
+        else:
+            m.d.comb += trap.msip.eq(self.msip)
+            m.d.comb += trap.mtip.eq(self.mtip)
+        m.d.comb += [
+            trap.meip.eq(self.meip),
+            self.trap.eq(trap.exception | trap.interrupt),
+            self.interrupt.eq(trap.interrupt),
+            # They still trap, SimTop just stops there
+            self.ecall.eq(trap.exception & (trap.cause == Cause.ECALL_M)),
+            self.ebreak.eq(trap.exception & (trap.cause == Cause.BREAKPOINT)),
+        ]
+
+        if self.arbiter is not None:
+            m.submodules.arbiter = self.arbiter
+        m.submodules.lsu = lsu = self.lsu
+
+        if self.dcache is not None:
+            m.submodules.dcache = self.dcache
+            m.d.comb += [
+                self.dcache.clean.eq(lsu.clean),
+                lsu.dirty.eq(self.dcache.dirty),
+                counters.dcache_miss.eq(self.dcache.miss),
+                counters.dcache_writeback.eq(self.dcache.writeback),
+            ]
+
+        if self.store_buffer is not None:
+            m.submodules.store_buffer = self.store_buffer
+            m.d.comb += lsu.buffered.eq(self.store_buffer.busy)
+
+        predecoded = None
+        if self.icache is not None:
+            m.submodules.icache = self.icache
+            m.d.comb += self.icache.invalidate.eq(self.fence_i)
+            m.d.comb += counters.icache_miss.eq(self.icache.miss)
+            fetch_bus = self.icache.bus
+            predecoded = self.icache.predecoded
+        else:
+            fetch_bus = self.ibus
+
+        if self.prefetch is not None:
+            m.submodules.prefetch = self.prefetch
+            m.d.comb += self.prefetch.invalidate.eq(self.fence_i)
+            fetch_bus = self.prefetch.bus
+            predecoded = self.prefetch.predecoded
+
+        compressed = None
+        if self.realign is not None:
+            m.submodules.realign = self.realign
+            m.d.comb += self.realign.invalidate.eq(self.fence_i)
+            fetch_bus = self.realign.bus
+            compressed = self.realign.compressed
+
+        if self.pipelined:
+            m.submodules.pipeline = pipeline = RV32IPipeline(fetch_bus, self.regfile, self.alu, csr, lsu,
+                                                             self.predictor, predecoded, self.muldiv,
+                                                             compressed, self.tracer, self.pc)
+            m.d.comb += self.fence_i.eq(pipeline.fence_i)
+            m.d.comb += self.retire.eq(pipeline.retire)
+            return m
 
-        pc = Signal(unsigned(32))
+        m.submodules.decoder = self.decoder
+        m.submodules.regfile = self.regfile
+        m.submodules.alu = alu = self.alu
+
+        regfile = self.regfile
+
+        is_muldiv = Signal()
+        if self.muldiv is not None:
+            m.submodules.muldiv = muldiv = self.muldiv
+            m.d.comb += is_muldiv.eq((self.decoder.opcode == Opcodes.OP) & (self.decoder.funct7 == MULDIV))
+            m.d.comb += [
+                muldiv.funct3.eq(self.decoder.funct3),
+                muldiv.a.eq(regfile.rdata1),
+                muldiv.b.eq(regfile.rdata2),
+            ]
+
+        pc = self.pc
         instr = Signal(unsigned(32)) # Internal reg to hold instrunction data
+        # Address of the instruction after this one, PC + 2 after a compressed one
+        next_pc = Signal(unsigned(32))
+        if self.realign is not None:
+            instr_compressed = Signal()
+            m.d.comb += next_pc.eq(pc + Mux(instr_compressed, 2, 4))
+        else:
+            m.d.comb += next_pc.eq(pc + 4)
 
         decoder_ports = self.decoder.ports()
         funct3 = decoder_ports[2]
@@ -73,265 +292,495 @@ class RV32ICore(Elaboratable):
 
         m.d.comb += self.decoder.instr.eq(instr)
 
+        # Both source registers of the instruction in DECODE are always read, synchronous
+        # reads need the addresses a cycle early, as the instruction comes off the bus
+        read_instr = Signal(unsigned(32))
+        m.d.comb += read_instr.eq(instr)
+        m.d.comb += regfile.raddr1.eq(read_instr[15:20])
+        m.d.comb += regfile.raddr2.eq(read_instr[20:25])
+
         m.d.sync += regfile.wen.eq(0)
 
         # Default memory bus to inactive
-        m.d.sync += self.mem.stb.eq(0)
-        m.d.sync += self.mem.cyc.eq(0)
-
-        # Load/store variables
-        load_dest = Signal(unsigned(5))
-        load_unsigned = Signal()
-        ls_width = Signal(LSWidth)
+        m.d.sync += fetch_bus.stb.eq(0)
+        m.d.sync += fetch_bus.cyc.eq(0)
+
+        # OP/OP_IMM and BRANCH operands
+        is_op = self.decoder.opcode == Opcodes.OP
+        is_branch = self.decoder.opcode == Opcodes.BRANCH
+        m.d.comb += [
+            alu.a.eq(regfile.rdata1),
+            alu.b.eq(Mux(is_op | is_branch, regfile.rdata2, imm)),
+            alu.funct3.eq(funct3),
+            # SUB/SRA, or SRAI
+            alu.alt.eq(Mux(is_op, self.decoder.funct7[5], immu[10] & (funct3 == IntImmediate.SRxI))),
+            alu.branch.eq(is_branch),
+        ]
+
+        # Loads/stores, the address is ready in DECODE
+        m.d.comb += [
+            lsu.store.eq(self.decoder.opcode == Opcodes.STORE),
+            lsu.funct3.eq(funct3),
+            lsu.addr.eq(regfile.rdata1 + imm),
+            lsu.wdata.eq(regfile.rdata2),
+        ]
+
+        # Pipelined slaves take a request on every cycle STB is high and STALL is low,
+        # so only hold STB until the fetch has been accepted
+        stall = fetch_bus.stall if hasattr(fetch_bus, "stall") else Const(0)
+        fetch_sent = Signal()
+
+        m.d.comb += [
+            csr.funct3.eq(funct3),
+            csr.addr.eq(immu[0:12]),
+            csr.rs1.eq(regfile.rdata1),
+            csr.uimm.eq(src),
+        ]
+
+        #### Traps
+        # Jumps and taken branches go here
+        branch_condition = Signal()
+        with m.Switch(funct3):
+            with m.Case(BranchCondition.BEQ):
+                m.d.comb += branch_condition.eq(alu.eq)
+            with m.Case(BranchCondition.BNE):
+                m.d.comb += branch_condition.eq(~alu.eq)
+            with m.Case(BranchCondition.BLT):
+                m.d.comb += branch_condition.eq(alu.lt)
+            with m.Case(BranchCondition.BGE):
+                m.d.comb += branch_condition.eq(~alu.lt)
+            with m.Case(BranchCondition.BLTU):
+                m.d.comb += branch_condition.eq(alu.ltu)
+            with m.Case(BranchCondition.BGEU):
+                m.d.comb += branch_condition.eq(~alu.ltu)
+
+        target = Signal(unsigned(32))
+        with m.If(self.decoder.opcode == Opcodes.JALR):
+            m.d.comb += target.eq((regfile.rdata1 + imm) & ~1)
+        with m.Else():
+            m.d.comb += target.eq(pc + imm)
+        # Without RV32C instructions have to be 4-byte aligned
+        target_misaligned = target[1] if self.realign is None else Const(0)
+
+        # Synchronous exceptions of the instruction in DECODE, raised before it does anything
+        exception = Signal()
+        cause = Signal(Cause)
+        tval = Signal(unsigned(32))
+        illegal = Signal()
+        funct7 = instr[25:32]
+        with m.Switch(self.decoder.opcode):
+            with m.Case(Opcodes.LUI, Opcodes.AUIPC):
+                pass
+            with m.Case(Opcodes.OP_IMM):
+                # Shifts by more than 31, or SRAI's funct7 on anything else, are reserved
+                with m.If(funct3 == IntImmediate.SLLI):
+                    m.d.comb += illegal.eq(funct7 != 0)
+                with m.Elif(funct3 == IntImmediate.SRxI):
+                    m.d.comb += illegal.eq((funct7 != 0) & (funct7 != 0b0100000))
+            with m.Case(Opcodes.OP):
+                # Only ADD/SUB and SRL/SRA have an alternate form
+                alt = (funct3 == IntRegReg.ADD) | (funct3 == IntRegReg.SRx)
+                standard = (funct7 == 0) | ((funct7 == 0b0100000) & alt)
+                if self.muldiv is not None:
+                    standard = standard | is_muldiv
+                m.d.comb += illegal.eq(~standard)
+            with m.Case(Opcodes.JAL):
+                m.d.comb += exception.eq(target_misaligned)
+            with m.Case(Opcodes.JALR):
+                m.d.comb += exception.eq(target_misaligned)
+                m.d.comb += illegal.eq(funct3 != 0)
+            with m.Case(Opcodes.BRANCH):
+                m.d.comb += exception.eq(branch_condition & target_misaligned)
+                # funct3 2 and 3 are reserved
+                m.d.comb += illegal.eq(funct3[1:] == 0b01)
+            with m.Case(Opcodes.LOAD):
+                m.d.comb += exception.eq(lsu.misaligned)
+                # Only LB/LH/LW and LBU/LHU
+                m.d.comb += illegal.eq((funct3 == 0b011) | (funct3[1:] == 0b11))
+            with m.Case(Opcodes.STORE):
+                m.d.comb += exception.eq(lsu.misaligned)
+                # Only SB/SH/SW
+                m.d.comb += illegal.eq(funct3[2] | (funct3[0:2] == 0b11))
+            with m.Case(Opcodes.MISC_MEM):
+                m.d.comb += illegal.eq(funct3[1:] != 0)
+            with m.Case(Opcodes.SYSTEM):
+                with m.If(funct3 == SystemFunct.PRIV):
+                    with m.Switch(immu[0:12]):
+                        with m.Case(0, 1):
+                            m.d.comb += exception.eq(1)
+                        with m.Case(MRET, WFI):
+                            pass
+                        with m.Default():
+                            m.d.comb += illegal.eq(1)
+                with m.Else():
+                    m.d.comb += illegal.eq((funct3 == 0b100) | csr.illegal)
+            with m.Default():
+                m.d.comb += illegal.eq(1)
+
+        with m.Switch(self.decoder.opcode):
+            with m.Case(Opcodes.JAL, Opcodes.JALR, Opcodes.BRANCH):
+                m.d.comb += cause.eq(Cause.INSN_MISALIGNED)
+                m.d.comb += tval.eq(target)
+            with m.Case(Opcodes.LOAD):
+                m.d.comb += cause.eq(Cause.LOAD_MISALIGNED)
+                m.d.comb += tval.eq(lsu.addr)
+            with m.Case(Opcodes.STORE):
+                m.d.comb += cause.eq(Cause.STORE_MISALIGNED)
+                m.d.comb += tval.eq(lsu.addr)
+            with m.Case(Opcodes.SYSTEM):
+                m.d.comb += cause.eq(Mux(immu[0], Cause.BREAKPOINT, Cause.ECALL_M))
+                m.d.comb += tval.eq(Mux(immu[0], pc, 0))
+        with m.If(illegal | (instr[0:2] != 0b11)):
+            m.d.comb += exception.eq(1)
+            m.d.comb += cause.eq(Cause.ILLEGAL_INSN)
+            m.d.comb += tval.eq(0)
+
+        # Interrupts are taken in place of the instruction in DECODE, or of a load that hasn't
+        # gone out yet. Only a fetch or load already on the bus holds them up.
+        take_interrupt = Signal()
+        m.d.comb += [
+            trap.cause.eq(cause),
+            trap.tval.eq(tval),
+            trap.epc.eq(pc),
+            trap.interrupt.eq(take_interrupt),
+        ]
 
         with m.FSM():
             with m.State("READ_PC"):
+                m.d.comb += counters.fetch_stall.eq(1)
+
                 # Issue memory read to PC
-                # TODO there may be some issues with this naive WB implementation,
-                #      specifically around slave ACK response, too tired atm to deal with it though
-                m.d.sync += self.mem.cyc.eq(1)  # Valid bus cycle - begin wishbone bus operation
-                m.d.sync += self.mem.stb.eq(1)  # Start data transfer cycle
-                m.d.sync += self.mem.we.eq(0)   # Read data
-                m.d.sync += self.mem.adr.eq(pc)
-                # TODO do I need to set sel? what should granularity of bus be?
-
-                with m.If(self.mem.ack):
+                m.d.sync += fetch_bus.cyc.eq(1)  # Valid bus cycle - begin wishbone bus operation
+                m.d.sync += fetch_bus.we.eq(0)   # Read data
+                m.d.sync += fetch_bus.adr.eq(pc)
+                m.d.sync += fetch_bus.sel.eq(~0)
+
+                with m.If(fetch_bus.stb & ~stall):
+                    m.d.sync += fetch_sent.eq(1)
+                with m.Elif(~fetch_sent):
+                    m.d.sync += fetch_bus.stb.eq(1)  # Start data transfer cycle
+
+                with m.If(fetch_bus.ack):
                     # De-assert bus
-                    m.d.sync += self.mem.cyc.eq(0)
-                    m.d.sync += self.mem.stb.eq(0)
-                    m.d.sync += instr.eq(self.mem.dat_r)
+                    m.d.sync += fetch_bus.cyc.eq(0)
+                    m.d.sync += fetch_bus.stb.eq(0)
+                    m.d.sync += fetch_sent.eq(0)
+                    m.d.sync += instr.eq(fetch_bus.dat_r)
+                    if self.realign is not None:
+                        m.d.sync += instr_compressed.eq(self.realign.compressed)
+                    if regfile.sync_read:
+                        m.d.comb += read_instr.eq(fetch_bus.dat_r)
                     m.next = "DECODE"
 
             with m.State("DECODE"):
-                # TODO likely integer ops should be deferred and split into a seperate ALU,
-                # Where instead of doing everything here, I load all the values into the ALU
-                # and pull from the results.
-
-                # TODO should I pull the src1/src2/dest assignments out to all the time?
-                with m.Switch(self.decoder.opcode):
-                    with m.Case(Opcodes.OP_IMM):
-                        m.next = "READ_PC"
-
-                        m.d.comb += regfile.raddr1.eq(src)
-                        m.d.comb += regfile.waddr.eq(dest)
-                        m.d.sync += regfile.wen.eq(1)
-
-                        with m.Switch(funct3):
-                            with m.Case(IntImmediate.ADDI):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 + imm)
-
-                            with m.Case(IntImmediate.SLTI):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 < imm)
-
-                            with m.Case(IntImmediate.SLTIU):
-                                # TODO evaluate if this casts correctly and does what I want
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1.as_unsigned() < immu)
-
-                            with m.Case(IntImmediate.ANDI):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 & immu)
-
-                            with m.Case(IntImmediate.ORI):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 | immu)
-
-                            with m.Case(IntImmediate.XORI):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 ^ immu)
-
-                            with m.Case(IntImmediate.SLLI):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1.as_unsigned() << immu[0:4])
-
-                            with m.Case(IntImmediate.SRxI):
-                                with m.If(immu[10]):
-                                    # SRAI
-                                    m.d.sync += regfile.wdata.eq(regfile.rdata1.as_unsigned() >> immu[0:4])
-
-                                with m.Else():
-                                    # SRLI
-                                    m.d.sync += regfile.wdata.eq(regfile.rdata1 >> immu[0:4])
-
-                    with m.Case(Opcodes.LUI):
-                        m.d.comb += regfile.waddr.eq(dest)
-                        m.d.sync += regfile.wdata.eq(immu)
-                        m.d.sync += regfile.wen.eq(1)
-
-                    with m.Case(Opcodes.AUIPC):
-                        m.d.comb += regfile.waddr.eq(dest)
-                        m.d.sync += regfile.wdata.eq(pc + immu)
-
-                    with m.Case(Opcodes.OP):
-                        m.next = "READ_PC"
-
-                        m.d.comb += regfile.raddr1.eq(self.decoder.src1)
-                        m.d.comb += regfile.raddr2.eq(self.decoder.src2)
-                        m.d.comb += regfile.waddr.eq(self.decoder.dest)
-                        m.d.sync += regfile.wen.eq(1)
-
-                        with m.Switch(self.decoder.funct7):
-                            with m.Case(IntRegReg.ADD):
-                                with m.If(self.decoder.funct7[5]):
-                                    # SUB
-                                    m.d.sync += regfile.wdata.eq(regfile.rdata1 - regfile.rdata2)
-                                with m.Else():
-                                    # ADD
-                                    m.d.sync += regfile.wdata.eq(regfile.rdata1 + regfile.rdata2)
-                            with m.Case(IntRegReg.SLL):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 << regfile.rdata2[0:4])
-                            with m.Case(IntRegReg.SLT):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 < regfile.rdata2)
-                            with m.Case(IntRegReg.SLTU):
-                                rdata1 = regfile.rdata1.as_unsigned()
-                                rdata2 = regfile.rdata2.as_unsigned()
-                                m.d.sync += regfile.wdata.eq(rdata1 < rdata2)
-                            with m.Case(IntRegReg.XOR):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 ^ regfile.rdata2)
-                            with m.Case(IntRegReg.SRx):
-                                with m.If(self.decoder.funct7[5]):
-                                    # SRA
-                                    m.d.sync += regfile.wdata.eq(regfile.rdata1 << regfile.rdata2[0:4])
+                m.d.comb += take_interrupt.eq(trap.pending)
+
+                with m.If(take_interrupt | exception):
+                    # The instruction is executed again after MRET, if it wasn't the cause
+                    m.d.comb += trap.exception.eq(~take_interrupt)
+                    m.d.sync += pc.eq(trap.vector)
+                    m.next = "READ_PC"
+
+                with m.Else():
+                    m.d.comb += self.retire.eq(1)
+
+                    # Everything but control transfers falls through to the next instruction
+                    m.next = "READ_PC"
+                    m.d.sync += pc.eq(next_pc)
+
+                    # TODO should I pull the src1/src2/dest assignments out to all the time?
+                    with m.Switch(self.decoder.opcode):
+                        with m.Case(Opcodes.OP_IMM, Opcodes.OP):
+                            ready = Signal()
+                            result = Signal(unsigned(32))
+                            m.d.comb += alu.valid.eq(~is_muldiv)
+                            m.d.comb += ready.eq(alu.ready)
+                            m.d.comb += result.eq(alu.result)
+                            if self.muldiv is not None:
+                                m.d.comb += muldiv.valid.eq(is_muldiv)
+                                m.d.comb += counters.muldiv.eq(is_muldiv & muldiv.ready)
+                                m.d.comb += counters.muldiv_stall.eq(is_muldiv & ~muldiv.ready)
+                                with m.If(is_muldiv):
+                                    m.d.comb += ready.eq(muldiv.ready)
+                                    m.d.comb += result.eq(muldiv.result)
+
+                            with m.If(ready):
+                                m.d.sync += regfile.waddr.eq(dest)
+                                m.d.sync += regfile.wdata.eq(result)
+                                m.d.sync += regfile.wen.eq(1)
+                            with m.Else():
+                                # Multi-cycle ALU or multiply/divide op, keep the operands coming
+                                m.d.comb += self.retire.eq(0)
+                                m.d.sync += pc.eq(pc)
+                                m.next = "DECODE"
+
+                        with m.Case(Opcodes.LUI):
+                            m.d.sync += regfile.waddr.eq(dest)
+                            m.d.sync += regfile.wdata.eq(immu)
+                            m.d.sync += regfile.wen.eq(1)
+
+                        with m.Case(Opcodes.AUIPC):
+                            m.d.sync += regfile.waddr.eq(dest)
+                            m.d.sync += regfile.wdata.eq(pc + immu)
+                            m.d.sync += regfile.wen.eq(1)
+
+                        with m.Case(Opcodes.JAL, Opcodes.JALR):
+                            m.d.sync += regfile.waddr.eq(self.decoder.dest)
+                            m.d.sync += regfile.wdata.eq(next_pc)
+                            m.d.sync += regfile.wen.eq(1)
+                            m.d.sync += pc.eq(target)
+
+                        with m.Case(Opcodes.BRANCH):
+                            with m.If(branch_condition):
+                                m.d.sync += pc.eq(target)
+
+                            m.d.comb += counters.branch.eq(1)
+                            m.d.comb += counters.branch_taken.eq(branch_condition)
+
+                        with m.Case(Opcodes.LOAD):
+                            m.d.comb += lsu.valid.eq(1)
+
+                            with m.If(lsu.done):
+                                # Only from a combinational slave
+                                m.d.sync += regfile.waddr.eq(dest)
+                                m.d.sync += regfile.wdata.eq(lsu.load_data)
+                                m.d.sync += regfile.wen.eq(1)
+                            with m.Else():
+                                # PC moves on once the load retires
+                                m.d.comb += self.retire.eq(0)
+                                m.d.sync += pc.eq(pc)
+                                m.next = "LOAD"
+
+                        with m.Case(Opcodes.STORE):
+                            m.d.comb += lsu.valid.eq(1)
+
+                            # Done once the bus takes it, wait here if it's stalling
+                            with m.If(~lsu.done):
+                                m.d.comb += self.retire.eq(0)
+                                m.d.comb += counters.store_stall.eq(1)
+                                m.d.sync += pc.eq(pc)
+                                m.next = "DECODE"
+
+                        with m.Case(Opcodes.MISC_MEM):
+                            with m.If(self.decoder.funct3 == 0):
+                                # FENCE, accesses are in order but wait for stores to land
+                                with m.If(lsu.busy):
+                                    m.d.comb += self.retire.eq(0)
+                                    m.d.sync += pc.eq(pc)
+                                    m.next = "DECODE"
+                            with m.Else():
+                                # FENCE.I, stores have to reach memory before the next fetch
+                                m.d.comb += lsu.clean.eq(1)
+                                with m.If(lsu.busy | lsu.dirty):
+                                    m.d.comb += self.retire.eq(0)
+                                    m.d.sync += pc.eq(pc)
+                                    m.next = "DECODE"
                                 with m.Else():
-                                    # SRL
-                                    m.d.sync += regfile.wdata.eq(regfile.rdata1.as_unsigned() << regfile.rdata2[0:4])
-                            with m.Case(IntRegReg.OR):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 | regfile.rdata2)
-                            with m.Case(IntRegReg.AND):
-                                m.d.sync += regfile.wdata.eq(regfile.rdata1 & regfile.rdata2)
-
-                    # TODO raise misalign exception
-                    with m.Case(Opcodes.JAL):
-                        m.d.comb += regfile.waddr.eq(self.decoder.dest)
-                        m.d.sync += regfile.wdata.eq(pc + 4)
-                        m.d.sync += regfile.wen.eq(1)
-                        m.d.sync += pc.eq(pc + self.decoder.imm)
-
-                    # TODO raise misalign exception
-                    with m.Case(Opcodes.JALR):
-                        m.d.comb += regfile.waddr.eq(self.decoder.dest)
-                        m.d.comb += regfile.raddr1.eq(self.decoder.src1)
-                        m.d.sync += regfile.wdata.eq(pc + 4)
-                        m.d.sync += regfile.wen.eq(1)
-                        m.d.sync += pc.eq(regfile.rdata1 + self.decoder.imm)
-
-                    # TODO misalign exception
-                    with m.Case(Opcodes.BRANCH):
-                        m.d.comb += regfile.raddr1.eq(self.decoder.src1)
-                        m.d.comb += regfile.raddr2.eq(self.decoder.src2)
-                        branch_condition = Signal()
-
-                        with m.Switch(self.decoder.funct3):
-                            with m.Case(BranchCondition.BEQ):
-                                m.d.comb += branch_condition.eq(regfile.rdata1 == regfile.rdata2)
-                            with m.Case(BranchCondition.BNE):
-                                m.d.comb += branch_condition.eq(regfile.rdata1 != regfile.rdata2)
-                            with m.Case(BranchCondition.BLT):
-                                m.d.comb += branch_condition.eq(regfile.rdata1 < regfile.rdata2)
-                            with m.Case(BranchCondition.BGE):
-                                m.d.comb += branch_condition.eq(regfile.rdata1 >= regfile.rdata2)
-                            with m.Case(BranchCondition.BLTU):
-                                m.d.comb += branch_condition.eq(regfile.rdata1.as_unsigned() < regfile.rdata2.as_unsigned())
-                            with m.Case(BranchCondition.BGEU):
-                                m.d.comb += branch_condition.eq(regfile.rdata1.as_unsigned() >= regfile.rdata2.as_unsigned())
-
-                        with m.If(branch_condition):
-                            m.d.sync += pc.eq(pc + self.decoder.imm)
-
-                    #with m.Case(Opcodes.LOAD):
-                    #    m.d.comb += regfile.raddr1.eq(self.decoder.src1)
-                    #    m.d.sync += load_dest.eq(self.decoder.dest)
-
-                    #    with m.If(~self.mem.o_ready):
-                    #        m.next = "LOAD"
-                    #        m.d.sync += self.mem.rw.eq(0)
-                    #        m.d.sync += self.mem.addr.eq(regfile.rdata1 + self.decoder.imm)
-                    #        m.d.sync += self.mem.i_valid.eq(1)
-                    #        m.d.sync += ls_width.eq(self.decoder.funct3[0:1])
-                    #        m.d.sync += load_unsigned.eq(self.decoder.funct3[2])
-
-                    #with m.Case(Opcodes.STORE):
-                    #    m.d.comb += regfile.raddr1.eq(self.decoder.src1)
-                    #    m.d.comb += regfile.raddr2.eq(self.decoder.base)
-
-                    #    with m.If(~self.mem.o_ready):
-                    #        m.next = "STORE"
-                    #        m.d.sync += self.mem.rw.eq(1)
-                    #        m.d.sync += self.mem.addr.eq(regfile.rdata2 + self.decoder.imm)
-                    #        m.d.sync += self.mem.data.eq(regfile.rdata1)
-                    #        m.d.sync += self.mem.i_valid.eq(1)
-                    #        m.d.sync += ls_width.eq(self.decoder.funct3[0:1])
-
-                    with m.Case(Opcodes.MISC_MEM):
-                        with m.If(self.decoder.funct3 == 0):
-                            # TODO impl NOP
-                            pass
-                        with m.Else():
-                            # TODO raise invalid instruction
-                            pass
-
-                    with m.Case(Opcodes.SYSTEM):
-                        # TODO need to impl privileged stuff before I can do this
-                        # Do I????
-                        pass
-
-                    # TODO raise invalid instruction
-                    with m.Default():
-                        pass
-
-
-            #with m.State("LOAD"):
-            #    # TODO convert to wishbone properly
-            #    m.d.comb += regfile.waddr.eq(load_dest)
-            #    m.d.sync += regfile.wdata.eq(self.mem.dat_r)
-
-            #    with m.If(self.mem.ack):
-            #        m.d.sync += regfile.wen.eq(1)
-            #        m.next = "READ_PC"
-
-            with m.State("STORE"):
-                # TODO this shouldn't be necessary, just temp until memory is handled properly
-                m.next = "READ_PC"
+                                    # The next fetch hasn't been issued yet
+                                    m.d.comb += self.fence_i.eq(1)
+
+                        with m.Case(Opcodes.SYSTEM):
+                            with m.If(funct3 == SystemFunct.PRIV):
+                                # MRET, WFI is a NOP
+                                with m.If(immu[0:12] == MRET):
+                                    m.d.comb += trap.mret.eq(1)
+                                    m.d.sync += pc.eq(trap.mepc)
+                            with m.Else():
+                                m.d.comb += csr.valid.eq(1)
+                                m.d.sync += regfile.waddr.eq(dest)
+                                m.d.sync += regfile.wdata.eq(csr.rdata)
+                                m.d.sync += regfile.wen.eq(1)
+
+
+            with m.State("LOAD"):
+                m.d.comb += take_interrupt.eq(trap.pending & ~lsu.loading)
+                m.d.comb += lsu.valid.eq(~take_interrupt)
+                m.d.comb += counters.load_stall.eq(1)
+
+                with m.If(take_interrupt):
+                    m.d.sync += pc.eq(trap.vector)
+                    m.next = "READ_PC"
+                with m.Elif(lsu.done):
+                    m.d.comb += self.retire.eq(1)
+                    m.d.sync += regfile.waddr.eq(dest)
+                    m.d.sync += regfile.wdata.eq(lsu.load_data)
+                    m.d.sync += regfile.wen.eq(1)
+                    m.d.sync += pc.eq(next_pc)
+                    m.next = "READ_PC"
+
+        if self.tracer is not None:
+            m.submodules.trace = tracer = self.tracer
+            m.d.comb += [
+                tracer.retire.eq(self.retire),
+                tracer.pc.eq(pc),
+                tracer.insn.eq(instr),
+                tracer.mem_valid.eq(lsu.valid),
+                tracer.mem_store.eq(lsu.store),
+                tracer.mem_addr.eq(lsu.addr),
+                tracer.mem_sel.eq(lsu.sel),
+                # Register writes land the cycle after DECODE/LOAD
+                tracer.rd_wen.eq(regfile.wen),
+                tracer.rd_addr.eq(regfile.waddr),
+                tracer.rd_wdata.eq(regfile.wdata),
+            ]
 
         return m
 
-# TODO care about endianness in core
 class SimulationMemory(Elaboratable):
-    def __init__(self, mem_file: str, bus: wishbone.Interface):
-
-        # Open memory file
-        data = open(mem_file, "rb").read()
+    """Word-addressed RAM on a pipelined Wishbone slave, holding the program image.
+
+    By default this is an nMigen ``Memory`` of ``depth`` words, which works with every
+    simulator and in generated RTL. ``paged=True`` instead serves the whole 32-bit address
+    space from a sparse ``PagedMemory`` in Python (``process``, added to the simulator by
+    ``sim.Simulation``), so large images and address maps cost nothing up front. That only
+    works in nMigen's Python simulator.
+
+    Giving a ``data_bus`` makes it dual-ported, like a true dual-port block RAM, with the
+    same contents on both buses and each serving a request every cycle. A write from one
+    port is visible to the other the cycle after, writes to the same word in the same cycle
+    from both are undefined.
+
+    Each request is acked ``latency`` cycles after it's accepted, still taking a new one every
+    cycle, to stand in for slower memory such as SDRAM or SPI flash behind a cache.
+    """
+    def __init__(self, mem_file: str, bus: wishbone.Interface, depth: int = 0x1000, paged: bool = False,
+                 data_bus: wishbone.Interface = None, latency: int = 1):
+        if latency < 1:
+            raise ValueError("Memory latency is at least a cycle")
 
         self.bus = bus
-
-        self.memory = Memory(width=32, depth=0x1000, init=data)
-        self.r_port = self.memory.read_port()
-
+        self.data_bus = data_bus
+        self.buses = [bus] if data_bus is None else [bus, data_bus]
+        self.depth = depth
+        self.paged = paged
+        self.latency = latency
+
+        if paged:
+            self.pages = PagedMemory()
+        else:
+            self.memory = Memory(width=32, depth=depth)
+            self.ports = [(self.memory.read_port(), self.memory.write_port(granularity=8)) for _ in self.buses]
+
+        if mem_file is not None:
+            self.load(mem_file)
+
+    def load(self, mem_file: str):
+        """Replace the initial contents with a program image (flat binary or ELF).
+
+        This also works after elaboration, the simulator picks it up on its next reset.
+        """
+        if self.paged:
+            self.pages.load(mem_file)
+        else:
+            self.memory.init = load_words(mem_file, self.depth)
+
+    def restore(self, memory: PagedMemory):
+        """Like ``load``, with the contents of ``memory`` instead of an image."""
+        if self.paged:
+            self.pages.copy_from(memory)
+        else:
+            self.memory.init = [memory.read(4 * i) for i in range(self.depth)]
+
+    def process(self):
+        """Simulator process serving the buses from ``pages``, with the same timing as the RTL.
+
+        Add it with ``add_process``, it has to see the buses before the first clock edge.
+        """
+        yield Passive()
+
+        # Responses on their way back, oldest first, one slot per cycle of latency
+        responses = [[None] * self.latency for _ in self.buses]
+        while True:
+            for bus, pending in zip(self.buses, responses):
+                response = pending.pop(0)
+                yield bus.ack.eq(response is not None)
+                if response is not None:
+                    yield bus.dat_r.eq(response)
+            yield Settle()
+
+            for bus, pending in zip(self.buses, responses):
+                response = None
+                if (yield bus.cyc) and (yield bus.stb):
+                    adr = (yield bus.adr) & ~3
+                    if (yield bus.we):
+                        self.pages.write(adr, (yield bus.dat_w), (yield bus.sel))
+                        response = 0
+                    else:
+                        response = self.pages.read(adr)
+                pending.append(response)
+            yield Tick()
 
     def elaborate(self, platform):
         m = Module()
 
-        # TODO what are submodules again?
-        #      do they just have to be defined to elaborate properly?
-        m.submodules.r_port = self.r_port
-
-        # Wait an extra cycle after getting address for memory latency
-        cyc_latch = Signal(1)
-        m.d.sync += cyc_latch.eq(self.bus.cyc)
-        # The AND here is needed to respond immediately to CYC deassertion
-        m.d.sync += self.bus.ack.eq(cyc_latch & self.bus.cyc)
-
-        # Operate on words
-        m.d.comb += self.r_port.addr.eq(self.bus.adr >> 2)
-
-        # Write data out to bus
-        m.d.sync += self.bus.dat_w.eq(self.r_port.data)
+        for bus in self.buses:
+            if hasattr(bus, "stall"):
+                m.d.comb += bus.stall.eq(0)
+
+        if self.paged:
+            # Everything else is driven by ``process``
+            return m
+
+        for i, (bus, (r_port, w_port)) in enumerate(zip(self.buses, self.ports)):
+            m.submodules[f"r_port{i}"] = r_port
+            m.submodules[f"w_port{i}"] = w_port
+
+            # Pipelined slave: never stall, and ACK every accepted strobe on the next cycle,
+            # which is when the synchronous read port has the data, or after ``latency``
+            ack = Signal(name=f"ack{i}")
+            m.d.sync += ack.eq(bus.cyc & bus.stb)
+
+            # Operate on words
+            m.d.comb += [
+                r_port.addr.eq(bus.adr >> 2),
+                w_port.addr.eq(bus.adr >> 2),
+                w_port.data.eq(bus.dat_w),
+            ]
+            with m.If(bus.cyc & bus.stb & bus.we):
+                m.d.comb += w_port.en.eq(bus.sel)
+
+            # Read data out to bus
+            dat_r = r_port.data
+            for stage in range(self.latency - 1):
+                ack_next = Signal(name=f"ack{i}_{stage}")
+                dat_next = Signal(32, name=f"dat_r{i}_{stage}")
+                m.d.sync += ack_next.eq(ack)
+                m.d.sync += dat_next.eq(dat_r)
+                ack, dat_r = ack_next, dat_next
+            m.d.comb += bus.ack.eq(ack)
+            m.d.comb += bus.dat_r.eq(dat_r)
 
         return m
 
 class SimTop(Elaboratable):
-    def __init__(self):
-        master_wb = wishbone.Interface(addr_width=32, data_width=32)
-        memory_wb = wishbone.Interface(addr_width=32, data_width=32)
-        master_wb.connect(memory_wb)
-
-        self.cpu = RV32ICore(master_wb)
-        self.memory = SimulationMemory("test.bin", memory_wb)
+    def __init__(self, mem_file: str = "test.bin", pipelined: bool = False, icache: ICacheConfig = None,
+                 prefetch: int = 0, predictor: PredictorConfig = None, counters: CounterConfig = None,
+                 memory_depth: int = 0x1000, paged: bool = False, dcache: DCacheConfig = None,
+                 store_buffer: int = 0, alu: ALUConfig = None, regfile: RegFileConfig = None,
+                 predecode: bool = False, muldiv: MulDivConfig = None, compressed: bool = False,
+                 trace: bool = False, clint: bool = False, harvard: bool = False, round_robin: bool = False,
+                 memory_latency: int = 1):
+        self.harvard = harvard
+        self.master_wb = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"})
+        self.memory_wb = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"})
+        # Second memory port, for the data bus of a Harvard core
+        self.data_wb = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"}) \
+            if harvard else None
+
+        self.cpu = RV32ICore(None if harvard else self.master_wb, pipelined=pipelined, icache=icache,
+                             prefetch=prefetch, predictor=predictor, counters=counters, dcache=dcache,
+                             store_buffer=store_buffer, alu=alu, regfile=regfile, predecode=predecode,
+                             muldiv=muldiv, compressed=compressed, trace=trace, clint=clint, harvard=harvard,
+                             round_robin=round_robin)
+        self.memory = SimulationMemory(mem_file, self.memory_wb, memory_depth, paged, self.data_wb, memory_latency)
+
+        # Simulation stops here (ECALL/EBREAK)
+        self.halt = Signal()
+        # External interrupt, for the simulator to drive
+        self.meip = Signal()
+
+    def ports(self) -> tuple:
+        return (self.halt, self.cpu.retire, self.meip)
 
     def elaborate(self, platform):
         m = Module()
@@ -339,6 +788,14 @@ class SimTop(Elaboratable):
         m.submodules.cpu = self.cpu
         m.submodules.memory = self.memory
 
+        if self.harvard:
+            m.d.comb += self.cpu.ibus.connect(self.memory_wb)
+            m.d.comb += self.cpu.dbus.connect(self.data_wb)
+        else:
+            m.d.comb += self.master_wb.connect(self.memory_wb)
+        m.d.comb += self.halt.eq(self.cpu.ecall | self.cpu.ebreak)
+        m.d.comb += self.cpu.meip.eq(self.meip)
+
         return m
 
 if __name__ == "__main__":
@@ -346,4 +803,4 @@ if __name__ == "__main__":
     #top = RV32ICore(wishbone.Interface(addr_width=32, data_width=32))
     top = SimTop()
 
-    main(top)
+    main(top, ports=top.ports())
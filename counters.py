@@ -1,37 +1,198 @@
+from dataclasses import dataclass
+from enum import Enum
+
 from nmigen import *
 
 class CycleCounter(Elaboratable):
     # Simple clock cycle counter
     def __init__(self):
         self.cnt = Signal(unsigned(64))
+        self.inhibit = Signal()
+        # Load ``value`` instead of counting, for CSR writes
+        self.load = Signal()
+        self.value = Signal(unsigned(64))
 
     def ports(self) -> tuple:
-        return (self.cnt)
+        return (self.cnt,)
 
     def elaborate(self, platform):
         m = Module()
 
         # Update count
-        m.d.sync += self.cnt.eq(self.cnt + 1)
+        with m.If(self.load):
+            m.d.sync += self.cnt.eq(self.value)
+        with m.Elif(~self.inhibit):
+            m.d.sync += self.cnt.eq(self.cnt + 1)
 
         return m
 
 class TimeCounter(Elaboratable):
-    def __init__(self):
+    # Wall-clock counter, ticks once every ``divider`` clock cycles. Without a divider it
+    # ticks every microsecond if the platform knows its clock frequency, otherwise every cycle.
+    def __init__(self, divider: int = 0):
+        self.divider = divider
         self.overflow = Signal(unsigned(32))
         self.cnt = Signal(unsigned(64))
+        # Load ``value`` instead of counting, for mtime writes
+        self.load = Signal()
+        self.value = Signal(unsigned(64))
 
     def ports(self) -> tuple:
-        return (self.cnt)
+        return (self.cnt,)
 
     def elaborate(self, platform):
         m = Module()
 
-        # TODO figure out how to extract clock frequency
-        with m.If(self.overflow < 8_000_000):
+        divider = self.divider
+        if not divider:
+            clk_frequency = getattr(platform, "default_clk_frequency", None)
+            divider = max(int(clk_frequency // 1_000_000), 1) if clk_frequency else 1
+
+        with m.If(self.overflow < divider - 1):
             m.d.sync += self.overflow.eq(self.overflow + 1)
         with m.Else():
             m.d.sync += self.overflow.eq(0)
             m.d.sync += self.cnt.eq(self.cnt + 1)
 
+        with m.If(self.load):
+            m.d.sync += self.cnt.eq(self.value)
+
+        return m
+
+class HPMEvent(Enum):
+    # Events a mhpmcounter can count, the value is what its mhpmevent CSR reads back
+    FETCH_STALL = 1     # Cycles the core waits on instruction fetch
+    BRANCH = 2          # Conditional branches retired
+    BRANCH_TAKEN = 3    # ... and taken
+    MISPREDICT = 4      # Control transfers fetch went the wrong way on
+    LOAD_STALL = 5      # Cycles the core waits on a load
+    STORE_STALL = 6     # Cycles the core waits on a store
+    ICACHE_MISS = 7
+    DCACHE_MISS = 8
+    DCACHE_WRITEBACK = 9 # Dirty lines written back to memory
+    MULDIV = 10         # RV32M multiplies/divides retired
+    MULDIV_STALL = 11   # Cycles the core waits on the multiply/divide unit
+
+@dataclass
+class CounterConfig:
+    # Event counted by each of mhpmcounter3, mhpmcounter4, ... in order, up to 29
+    events: tuple = ()
+    # Clock cycles per tick of ``time``, see TimeCounter
+    time_divider: int = 0
+
+class PerfCounters(Elaboratable):
+    """Performance counters, and their CSRs.
+
+    ``cycle``, ``time`` and ``instret`` are always there, ``config.events`` adds a
+    ``mhpmcounter`` for each event. The core pulses ``retire`` and the event inputs (one per
+    ``HPMEvent``, named in lower case) for every cycle they happen.
+
+    ``csrs`` lists the machine counters (``mcycle``, ``mhpmcounter3``...), their user
+    read-only shadows (``cycle``, ``hpmcounter3``...), the ``h`` upper halves,
+    ``mcountinhibit`` and ``mhpmevent3``... for the CSR file to decode. Counters above the
+    configured ones read as zero, as do their events. The CSR file forwards writes on
+    ``we``/``waddr``/``wdata``, a write takes priority over counting in the same cycle.
+    """
+    def __init__(self, config: CounterConfig = None):
+        if config is None:
+            config = CounterConfig()
+        if len(config.events) > 29:
+            raise ValueError(f"Only 29 mhpmcounters exist, {len(config.events)} events were given")
+        self.config = config
+
+        self.cycle_counter = CycleCounter()
+        self.time_counter = TimeCounter(config.time_divider)
+
+        #### Counters
+        self.cycle = self.cycle_counter.cnt
+        self.time = self.time_counter.cnt
+        self.instret = Signal(unsigned(64))
+        self.hpm = [Signal(unsigned(64), name=f"mhpmcounter{i + 3}") for i in range(len(config.events))]
+        # mcountinhibit, bit 0 is cycle, 2 is instret and 3 onwards the mhpmcounters
+        self.inhibit = Signal(unsigned(32))
+
+        #### Events
+        self.retire = Signal()
+        for event in HPMEvent:
+            setattr(self, event.name.lower(), Signal(name=event.name.lower()))
+
+        #### CSR writes
+        self.we = Signal()
+        self.waddr = Signal(unsigned(12))
+        self.wdata = Signal(unsigned(32))
+
+    def event(self, event: HPMEvent) -> Signal:
+        return getattr(self, event.name.lower())
+
+    def named(self) -> list:
+        """(name, counter) for every counter, for reading them from a simulation."""
+        counters = [("cycle", self.cycle), ("time", self.time), ("instret", self.instret)]
+        for event, counter in zip(self.config.events, self.hpm):
+            counters.append((event.name.lower(), counter))
+        return counters
+
+    def csrs(self) -> list:
+        """(address, value) for every counter CSR with something behind it."""
+        csrs = []
+        def counter(user, machine, value):
+            csrs.append((user, value[:32]))
+            csrs.append((user + 0x80, value[32:]))
+            if machine is not None:
+                csrs.append((machine, value[:32]))
+                csrs.append((machine + 0x80, value[32:]))
+
+        counter(0xC00, 0xB00, self.cycle)
+        counter(0xC01, None, self.time)     # mtime is memory mapped, not a CSR
+        counter(0xC02, 0xB02, self.instret)
+        for i, (event, value) in enumerate(zip(self.config.events, self.hpm)):
+            counter(0xC03 + i, 0xB03 + i, value)
+            csrs.append((0x323 + i, Const(event.value, 32)))
+        csrs.append((0x320, self.inhibit))
+
+        return csrs
+
+    def implemented(self, addr: Value) -> Value:
+        """Whether ``addr`` is a counter CSR, including the unconfigured ones that read as zero."""
+        block = addr[5:]
+        index = addr[:5]
+        return (((block == 0xC00 >> 5) | (block == 0xC80 >> 5)) |
+                (((block == 0xB00 >> 5) | (block == 0xB80 >> 5)) & (index != 1)) |
+                ((block == 0x320 >> 5) & ((index == 0) | (index >= 3))))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.cycle = self.cycle_counter
+        m.submodules.time = self.time_counter
+
+        def written(index):
+            # (low, high) write strobes for machine counter ``index``
+            return (self.we & (self.waddr == 0xB00 + index),
+                    self.we & (self.waddr == 0xB80 + index))
+
+        def count(counter, index, event):
+            low, high = written(index)
+            with m.If(low):
+                m.d.sync += counter[:32].eq(self.wdata)
+            with m.Elif(high):
+                m.d.sync += counter[32:].eq(self.wdata)
+            with m.Elif(event & ~self.inhibit[index]):
+                m.d.sync += counter.eq(counter + 1)
+
+        low, high = written(0)
+        cycle = self.cycle_counter
+        m.d.comb += [
+            cycle.inhibit.eq(self.inhibit[0]),
+            cycle.load.eq(low | high),
+            cycle.value.eq(Mux(low, Cat(self.wdata, self.cycle[32:]), Cat(self.cycle[:32], self.wdata))),
+        ]
+
+        count(self.instret, 2, self.retire)
+        for i, (event, counter) in enumerate(zip(self.config.events, self.hpm)):
+            count(counter, i + 3, self.event(event))
+
+        # Only the bits of counters that exist can be inhibited
+        inhibit_mask = 0b101 | (((1 << len(self.hpm)) - 1) << 3)
+        with m.If(self.we & (self.waddr == 0x320)):
+            m.d.sync += self.inhibit.eq(self.wdata & inhibit_mask)
+
         return m
@@ -1,22 +1,20 @@
 from nmigen import *
 from dataclasses import dataclass
-from enum import enum
+from enum import Enum
+from functools import reduce
+from operator import or_
 
-@dataclass
-class MachineConfig:
-    vendor_id: int
-    arch_id: int
-    impid: int
-    hartid: int
+from counters import PerfCounters
+from traps import TrapUnit
 
 @dataclass
-class MachineCounters:
-    cycle: Signal
-    instret: Signal
-    time: Signal
+class MachineConfig:
+    vendor_id: int = 0
+    arch_id: int = 0
+    impid: int = 0
+    hartid: int = 0
 
-@enum
-class Priv:
+class Priv(Enum):
     # Machine-level
     MRO = 1
     MRW = 2
@@ -33,43 +31,133 @@ class Priv:
 # I only need to support M-level CSRs, everything else is not necessary
 
 class CSR:
-    def __init__(self, address: int, priv: Priv = Priv.MRW, sig: Signal = None):
+    # ``mask`` picks the bits CSR instructions can write, the rest keep their (reset) value
+    def __init__(self, address: int, priv: Priv = Priv.MRW, sig: Value = None, mask: int = 0xFFFF_FFFF,
+                 reset: int = 0):
         if sig is None:
-            self.sig = Signal(32)
+            self.sig = Signal(32, reset=reset, name=f"csr_{address:03x}")
         else:
             self.sig = sig
         self.address = address
         self.privilege = priv
+        self.mask = mask
 
+    @property
+    def writable(self) -> bool:
+        return self.privilege in (Priv.MRW, Priv.SRW, Priv.HRW, Priv.URW) and isinstance(self.sig, Signal)
+
+# misa, RV32 with I and the extensions the core was built with
+MISA_MXL_32 = 1 << 30
+MISA_I = 1 << 8
+MISA_M = 1 << 12
+MISA_C = 1 << 2
 
-# Really the way to go here is to make an extra CSR class or something which hides stuff
 class CSRTable(Elaboratable):
-    def __init__(self, machine_config: MachineConfig, machine_counters: MachineCounters):
+    """Machine-mode CSR file, with CSRRW/CSRRS/CSRRC and their immediate forms.
+
+    Execute presents the instruction's ``funct3``, CSR ``addr``, ``rs1`` value and ``uimm``
+    (the rs1 field) and gets the old value back on ``rdata`` in the same cycle. Pulse
+    ``valid`` when the instruction commits to do the write. Every CSR address, including the
+    counters from ``PerfCounters``, is compared at once and the matching value ORed out, so
+    reads don't go through a priority chain however many CSRs there are.
+
+    ``illegal`` flags an access to a CSR that doesn't exist, or a write to a read-only one.
+    ``extensions`` are the ``misa`` bits of the extensions besides I.
+
+    The trap CSRs (mstatus, mie, mtvec, mepc, mcause, mtval, mip) belong to the ``TrapUnit``
+    on ``traps``, which the core drives for trap entry and MRET.
+    """
+    def __init__(self, machine_config: MachineConfig = None, counters: PerfCounters = None,
+                 extensions: int = 0):
+        if machine_config is None:
+            machine_config = MachineConfig()
+        if counters is None:
+            counters = PerfCounters()
+        self.counters = counters
+        self.traps = TrapUnit(compressed=bool(extensions & MISA_C))
+
+        #### Access from execute
+        self.valid = Signal()
+        self.funct3 = Signal(unsigned(3))
+        self.addr = Signal(unsigned(12))
+        self.rs1 = Signal(unsigned(32))
+        self.uimm = Signal(unsigned(5))
+        self.rdata = Signal(unsigned(32))
+        self.illegal = Signal()
+
         #### Machine CSRs
         # Machine Information Registers
-        self.mvendorid  = CSR(0xF11, Priv.MRO, Const(machine_config.vendor_id))
-        self.marchid    = CSR(0xF12, Priv.MRO, Const(machine_config.arch_id))
-        self.impid      = CSR(0xF13, Priv.MRO, Const(machine_config.impid))
-        self.mhartid    = CSR(0xF14, Priv.MRO, Const(machine_config.hartid))
+        self.mvendorid  = CSR(0xF11, Priv.MRO, Const(machine_config.vendor_id, 32))
+        self.marchid    = CSR(0xF12, Priv.MRO, Const(machine_config.arch_id, 32))
+        self.impid      = CSR(0xF13, Priv.MRO, Const(machine_config.impid, 32))
+        self.mhartid    = CSR(0xF14, Priv.MRO, Const(machine_config.hartid, 32))
 
         # Machine Trap Setup
-        self.mstatus    = CSR(0x300)
-        self.misa       = CSR(0x301)
-        self.medeleg    = CSR(0x302)
-        self.mideleg    = CSR(0x303)
-        self.mie        = CSR(0x304)
-        self.mtvec      = CSR(0x305)
+        # Writes are ignored, the ISA is fixed
+        self.misa       = CSR(0x301, Priv.MRW, Const(MISA_MXL_32 | MISA_I | extensions, 32))
 
         # Machine Trap Handling
         self.mscratch   = CSR(0x340)
-        self.mepc       = CSR(0x341)
-        self.mcause     = CSR(0x342)
-        self.mtval      = CSR(0x343)
-        self.mip        = CSR(0x344)
 
-        # Machine Counter/Timers
-        self.mcycle     = CSR(0xB00, machine_counters.cycle)
-        self.minstret   = CSR(0xB02, machine_counters.instret)
+        # The rest of Machine Trap Setup/Handling is in TrapUnit, Machine Counter/Timers and
+        # Counter Setup are in PerfCounters
+
+    def table(self) -> list:
+        return [
+            self.mvendorid, self.marchid, self.impid, self.mhartid,
+            self.misa, self.mscratch,
+        ]
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.counters = counters = self.counters
+        m.submodules.traps = traps = self.traps
+
+        #### Read
+        entries = [(csr.address, csr.sig) for csr in self.table()] + traps.csrs() + counters.csrs()
+        terms = []
+        matches = {}
+        for address, value in entries:
+            match = matches[address] = Signal(name=f"match_{address:03x}")
+            m.d.comb += match.eq(self.addr == address)
+            terms.append(Mux(match, value, 0))
+
+        hit = Signal()
+        m.d.comb += self.rdata.eq(reduce(or_, terms))
+        m.d.comb += hit.eq(Cat(*matches.values()).any() | counters.implemented(self.addr))
+
+        #### Write
+        operand = Signal(unsigned(32))
+        writes = Signal()
+        new = Signal(unsigned(32))
+
+        m.d.comb += operand.eq(Mux(self.funct3[2], self.uimm, self.rs1))
+        # CSRRS/CSRRC with x0 or a zero immediate only read
+        m.d.comb += writes.eq((self.funct3[0:2] == 0b01) | (self.uimm != 0))
+        with m.Switch(self.funct3[0:2]):
+            with m.Case(0b01):
+                m.d.comb += new.eq(operand)
+            with m.Case(0b10):
+                m.d.comb += new.eq(self.rdata | operand)
+            with m.Case(0b11):
+                m.d.comb += new.eq(self.rdata & ~operand)
+
+        # The top two address bits are 0b11 for read-only CSRs
+        m.d.comb += self.illegal.eq(~hit | (writes & (self.addr[10:12] == 0b11)))
+
+        commit = Signal()
+        m.d.comb += commit.eq(self.valid & writes & ~self.illegal)
+
+        for csr in self.table():
+            if csr.writable:
+                with m.If(commit & matches[csr.address]):
+                    m.d.sync += csr.sig.eq((new & csr.mask) | (csr.sig & (~csr.mask & 0xFFFF_FFFF)))
+
+        for unit in (counters, traps):
+            m.d.comb += [
+                unit.we.eq(commit),
+                unit.waddr.eq(self.addr),
+                unit.wdata.eq(new),
+            ]
 
-        # Machine Counter Setup
-        self.mcountinhibit  = CSR(0x320)
+        return m
@@ -0,0 +1,311 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from nmigen import *
+from nmigen.utils import log2_int
+import nmigen_soc.wishbone as wishbone
+from nmigen_soc.wishbone import CycleType, BurstTypeExt
+
+@dataclass
+class DCacheConfig:
+    line_words: int = 4 # 32-bit words per line
+    sets: int = 64
+    ways: int = 1
+
+class DCache(Elaboratable):
+    """Write-back, write-allocate data cache between the load/store unit and the memory bus.
+
+    ``bus`` is a pipelined Wishbone slave with byte lanes, ``mem`` is the master side. Load
+    hits are acknowledged the cycle after the request, store hits too but they stall the next
+    request for that cycle while the line is written. A miss writes the victim line back with
+    an incrementing burst if it's dirty, then refills the line with another before answering.
+
+    Hold ``clean`` (FENCE.I) to write every dirty line back, ``dirty`` drops once memory is
+    up to date. Lines stay valid, so loads keep hitting afterwards.
+    """
+    def __init__(self, mem_bus: wishbone.Interface, config: Optional[DCacheConfig] = None):
+        if config is None:
+            config = DCacheConfig()
+        self.config = config
+        # Accesses on ``mem`` at once, a line's write-back or refill
+        self.max_outstanding = config.line_words
+
+        self.offset_bits = log2_int(config.line_words)
+        self.index_bits = log2_int(config.sets)
+        self.tag_bits = 32 - 2 - self.offset_bits - self.index_bits
+
+        #### Buses
+        self.mem = mem_bus
+        self.bus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"},
+                                      name="dcache")
+
+        #### Control
+        self.clean = Signal()
+        self.dirty = Signal()
+
+        #### Statistics
+        self.hits = Signal(unsigned(32))
+        self.misses = Signal(unsigned(32))
+        self.writebacks = Signal(unsigned(32))
+        self.miss = Signal()        # Pulsed for every miss
+        self.writeback = Signal()   # Pulsed for every dirty line written back
+
+    def elaborate(self, platform):
+        m = Module()
+
+        config = self.config
+        ob = self.offset_bits
+        ib = self.index_bits
+
+        def index(adr):
+            return adr[2 + ob:2 + ob + ib]
+
+        def tag(adr):
+            return adr[2 + ob + ib:]
+
+        def word(offset, set_index):
+            # Data memory address of a word in a line
+            return Cat(offset[:ob], set_index) if ob else set_index
+
+        #### Storage
+        data_ports = []
+        tag_ports = []
+        for way in range(config.ways):
+            data = Memory(width=32, depth=config.sets * config.line_words)
+            tags = Memory(width=self.tag_bits, depth=config.sets)
+            ports = (data.read_port(), data.write_port(granularity=8), tags.read_port(), tags.write_port())
+            for i, port in enumerate(ports):
+                m.submodules[f"way{way}_port{i}"] = port
+            data_ports.append(ports[0:2])
+            tag_ports.append(ports[2:4])
+
+        # Valid and dirty bits are kept in flops, so replacement and cleaning can look at a
+        # whole set without a memory read
+        valid = Array(Signal(config.ways, name=f"valid{i}") for i in range(config.sets))
+        dirty = Array(Signal(config.ways, name=f"dirty{i}") for i in range(config.sets))
+        m.d.comb += self.dirty.eq(Cat(*dirty).any())
+
+        #### Lookup
+        stall = Signal()
+        lookup = Signal()
+        m.d.comb += lookup.eq(self.bus.cyc & self.bus.stb & ~stall)
+        m.d.comb += self.bus.stall.eq(stall)
+
+        for (rdata, _), (rtag, _) in zip(data_ports, tag_ports):
+            m.d.comb += rdata.addr.eq(self.bus.adr[2:2 + ob + ib])
+            m.d.comb += rtag.addr.eq(index(self.bus.adr))
+
+        req_valid = Signal()
+        req_adr = Signal(unsigned(32))
+        req_we = Signal()
+        req_sel = Signal(4)
+        req_data = Signal(unsigned(32))
+        m.d.sync += req_valid.eq(lookup)
+        with m.If(lookup):
+            m.d.sync += [
+                req_adr.eq(self.bus.adr),
+                req_we.eq(self.bus.we),
+                req_sel.eq(self.bus.sel),
+                req_data.eq(self.bus.dat_w),
+            ]
+
+        req_set_valid = valid[index(req_adr)]
+        hit_ways = Signal(config.ways)
+        hit = Signal()
+        hit_data = Signal(unsigned(32))
+        for way, ((rdata, _), (rtag, _)) in enumerate(zip(data_ports, tag_ports)):
+            m.d.comb += hit_ways[way].eq(req_set_valid[way] & (rtag.data == tag(req_adr)))
+            with m.If(hit_ways[way]):
+                m.d.comb += hit_data.eq(rdata.data)
+        m.d.comb += hit.eq(hit_ways.any())
+
+        #### Replacement, first invalid way, otherwise round-robin
+        victim = Signal(range(config.ways))
+        victim_next = Signal(range(config.ways))
+        round_robin = Signal(range(config.ways))
+        m.d.comb += victim_next.eq(round_robin)
+        for way in reversed(range(config.ways)):
+            with m.If(~req_set_valid[way]):
+                m.d.comb += victim_next.eq(way)
+        # One-hot, valid and dirty bits are read and updated a whole set at a time
+        victim_mask = Signal(config.ways)
+        victim_next_mask = Signal(config.ways)
+        m.d.comb += victim_mask.eq(Const(1, config.ways) << victim)
+        m.d.comb += victim_next_mask.eq(Const(1, config.ways) << victim_next)
+
+        #### Write-back and refill
+        miss_adr = Signal(unsigned(32))
+        miss_data = Signal(unsigned(32))
+        evict_tag = Signal(self.tag_bits)
+        cleaning = Signal()     # The write-back is for ``clean``, not a miss
+        clean_set = Signal(range(config.sets))
+        issued = Signal(range(config.line_words + 1))
+        received = Signal(range(config.line_words))
+        last_ack = Signal()
+        m.d.comb += last_ack.eq(self.mem.ack & (received == config.line_words - 1))
+
+        # Refilling the requested word of a store miss merges in the store
+        refill_data = Signal(unsigned(32))
+        is_req_word = Signal()
+        m.d.comb += is_req_word.eq(received == (miss_adr[2:2 + ob] if ob else 0))
+        m.d.comb += refill_data.eq(self.mem.dat_r)
+        with m.If(req_we & is_req_word):
+            for lane in range(4):
+                with m.If(req_sel[lane]):
+                    m.d.comb += refill_data.word_select(lane, 8).eq(req_data.word_select(lane, 8))
+
+        for way, ((_, wdata), (_, wtag)) in enumerate(zip(data_ports, tag_ports)):
+            m.d.comb += [
+                wtag.addr.eq(index(miss_adr)),
+                wtag.data.eq(tag(miss_adr)),
+            ]
+
+        victim_data = Signal(unsigned(32))
+        for way, (rdata, _) in enumerate(data_ports):
+            with m.If(victim == way):
+                m.d.comb += victim_data.eq(rdata.data)
+
+        def start_refill():
+            m.d.sync += issued.eq(0)
+            m.d.sync += received.eq(0)
+            m.next = "REFILL"
+
+        def start_writeback(set_index, way, line_tag):
+            # The read ports have to be on the first word one cycle ahead of the burst
+            for rdata, _ in data_ports:
+                m.d.comb += rdata.addr.eq(word(Const(0, max(ob, 1)), set_index))
+            m.d.sync += victim.eq(way)
+            m.d.sync += evict_tag.eq(line_tag)
+            m.d.sync += issued.eq(0)
+            m.d.sync += received.eq(0)
+            m.next = "WRITEBACK"
+
+        mem_stall = self.mem.stall if hasattr(self.mem, "stall") else Const(0)
+
+        def burst(we, line_tag):
+            # The whole line as a linear incrementing burst, in pipelined mode a new beat goes
+            # out every cycle the slave doesn't stall
+            m.d.comb += self.mem.cyc.eq(1)
+            m.d.comb += self.mem.stb.eq(issued != config.line_words)
+            m.d.comb += self.mem.we.eq(we)
+            m.d.comb += self.mem.sel.eq(~0)
+            m.d.comb += self.mem.adr.eq(Cat(Const(0, 2), issued[:ob], index(miss_adr), line_tag))
+            if hasattr(self.mem, "cti"):
+                with m.If(issued == config.line_words - 1):
+                    m.d.comb += self.mem.cti.eq(CycleType.END_OF_BURST)
+                with m.Else():
+                    m.d.comb += self.mem.cti.eq(CycleType.INCR_BURST)
+            if hasattr(self.mem, "bte"):
+                m.d.comb += self.mem.bte.eq(BurstTypeExt.LINEAR)
+
+            with m.If(self.mem.stb & ~mem_stall):
+                m.d.sync += issued.eq(issued + 1)
+            with m.If(self.mem.ack):
+                m.d.sync += received.eq(received + 1)
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(req_valid):
+                    with m.If(hit):
+                        m.d.comb += self.bus.ack.eq(1)
+                        m.d.comb += self.bus.dat_r.eq(hit_data)
+                        m.d.sync += self.hits.eq(self.hits + 1)
+                        with m.If(req_we):
+                            # Hold the next lookup off while the data port is written
+                            m.d.comb += stall.eq(1)
+                            for way, (rdata, wdata) in enumerate(data_ports):
+                                m.d.comb += wdata.addr.eq(req_adr[2:2 + ob + ib])
+                                m.d.comb += wdata.data.eq(req_data)
+                                m.d.comb += wdata.en.eq(Mux(hit_ways[way], req_sel, 0))
+                            m.d.sync += dirty[index(req_adr)].eq(dirty[index(req_adr)] | hit_ways)
+                    with m.Else():
+                        m.d.comb += stall.eq(1)
+                        m.d.comb += self.miss.eq(1)
+                        m.d.sync += self.misses.eq(self.misses + 1)
+                        m.d.sync += miss_adr.eq(req_adr)
+                        m.d.sync += cleaning.eq(0)
+                        m.d.sync += victim.eq(victim_next)
+                        with m.If((req_set_valid & dirty[index(req_adr)] & victim_next_mask).any()):
+                            victim_tag = Signal(self.tag_bits)
+                            for way, (rtag, _) in enumerate(tag_ports):
+                                with m.If(victim_next == way):
+                                    m.d.comb += victim_tag.eq(rtag.data)
+                            start_writeback(index(req_adr), victim_next, victim_tag)
+                        with m.Else():
+                            start_refill()
+                with m.Elif(self.clean & self.dirty):
+                    m.d.comb += stall.eq(1)
+                    m.d.sync += clean_set.eq(0)
+                    m.next = "CLEAN"
+
+            with m.State("CLEAN"):
+                # Read the tags of ``clean_set``
+                m.d.comb += stall.eq(1)
+                for rtag, _ in tag_ports:
+                    m.d.comb += rtag.addr.eq(clean_set)
+                m.next = "CLEAN_CHECK"
+
+            with m.State("CLEAN_CHECK"):
+                m.d.comb += stall.eq(1)
+                set_dirty = dirty[clean_set]
+                with m.If(set_dirty.any()):
+                    for way in reversed(range(config.ways)):
+                        with m.If(set_dirty[way]):
+                            m.d.sync += miss_adr.eq(Cat(Const(0, 2 + ob), clean_set))
+                            m.d.sync += cleaning.eq(1)
+                            start_writeback(clean_set, way, tag_ports[way][0].data)
+                with m.Elif(clean_set == config.sets - 1):
+                    m.next = "IDLE"
+                with m.Else():
+                    m.d.sync += clean_set.eq(clean_set + 1)
+                    m.next = "CLEAN"
+
+            with m.State("WRITEBACK"):
+                m.d.comb += stall.eq(1)
+                burst(1, evict_tag)
+                m.d.comb += self.mem.dat_w.eq(victim_data)
+
+                # Keep the read ports one word ahead of the burst
+                next_issued = Mux(self.mem.stb & ~mem_stall, issued + 1, issued)
+                for rdata, _ in data_ports:
+                    m.d.comb += rdata.addr.eq(word(next_issued, index(miss_adr)))
+
+                with m.If(last_ack):
+                    m.d.comb += self.writeback.eq(1)
+                    m.d.sync += self.writebacks.eq(self.writebacks + 1)
+                    m.d.sync += dirty[index(miss_adr)].eq(dirty[index(miss_adr)] & ~victim_mask)
+                    with m.If(cleaning):
+                        # Look at the same set again for more dirty ways
+                        m.next = "CLEAN"
+                    with m.Else():
+                        start_refill()
+
+            with m.State("REFILL"):
+                m.d.comb += stall.eq(1)
+                burst(0, tag(miss_adr))
+
+                for way, (_, wdata) in enumerate(data_ports):
+                    m.d.comb += wdata.addr.eq(word(received, index(miss_adr)))
+                    m.d.comb += wdata.data.eq(refill_data)
+                with m.If(self.mem.ack):
+                    for way, (_, wdata) in enumerate(data_ports):
+                        m.d.comb += wdata.en.eq(Mux(victim == way, 0b1111, 0))
+                    with m.If(is_req_word):
+                        m.d.sync += miss_data.eq(self.mem.dat_r)
+
+                with m.If(last_ack):
+                    for way, (_, wtag) in enumerate(tag_ports):
+                        m.d.comb += wtag.en.eq(victim == way)
+                    m.d.sync += valid[index(miss_adr)].eq(valid[index(miss_adr)] | victim_mask)
+                    m.d.sync += dirty[index(miss_adr)].eq((dirty[index(miss_adr)] & ~victim_mask) |
+                                                          Mux(req_we, victim_mask, 0))
+                    m.d.sync += round_robin.eq(Mux(round_robin == config.ways - 1, 0, round_robin + 1))
+                    m.next = "RESPOND"
+
+            with m.State("RESPOND"):
+                # Answer the request, the next lookup can already go in
+                m.d.comb += self.bus.ack.eq(1)
+                m.d.comb += self.bus.dat_r.eq(miss_data)
+                m.next = "IDLE"
+
+        return m
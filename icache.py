@@ -0,0 +1,245 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from nmigen import *
+from nmigen.utils import log2_int
+from nmigen.hdl.rec import Record
+import nmigen_soc.wishbone as wishbone
+from nmigen_soc.wishbone import CycleType, BurstTypeExt
+
+from predecode import Predecoder, PREDECODE_LAYOUT
+
+@dataclass
+class ICacheConfig:
+    line_words: int = 4 # 32-bit words per line
+    sets: int = 64
+    ways: int = 1
+    # Also store each word's predecoded control word, see ``predecode.py``
+    predecode: bool = False
+
+class ICache(Elaboratable):
+    """Read-only instruction cache between the fetch port and the memory bus.
+
+    ``bus`` is a pipelined Wishbone slave for the core's fetch logic, ``mem`` is the master
+    side. Hits are acknowledged the cycle after the request, misses stall the fetch port while
+    the whole line is refilled with an incrementing burst. Assert ``invalidate`` (FENCE.I)
+    for one cycle to drop every line, including one being refilled: it still answers the
+    fetch that missed but isn't kept.
+
+    With ``config.predecode`` every word is predecoded as the line is refilled and the
+    control word is kept next to it, ``predecoded`` is valid along with ``bus.ack``.
+    """
+    def __init__(self, mem_bus: wishbone.Interface, config: Optional[ICacheConfig] = None):
+        if config is None:
+            config = ICacheConfig()
+        self.config = config
+        # Reads on ``mem`` at once, a line's refill
+        self.max_outstanding = config.line_words
+
+        self.offset_bits = log2_int(config.line_words)
+        self.index_bits = log2_int(config.sets)
+        self.tag_bits = 32 - 2 - self.offset_bits - self.index_bits
+
+        #### Buses
+        self.mem = mem_bus
+        self.bus = wishbone.Interface(addr_width=32, data_width=32, features={"stall"}, name="icache")
+
+        #### Control
+        self.invalidate = Signal()
+        if config.predecode:
+            self.predecoded = Record(PREDECODE_LAYOUT)
+        else:
+            self.predecoded = None
+
+        #### Statistics
+        self.hits = Signal(unsigned(32))
+        self.misses = Signal(unsigned(32))
+        self.miss = Signal()    # Pulsed for every miss
+
+    def elaborate(self, platform):
+        m = Module()
+
+        config = self.config
+        ob = self.offset_bits
+        ib = self.index_bits
+
+        def index(adr):
+            return adr[2 + ob:2 + ob + ib]
+
+        def tag(adr):
+            return adr[2 + ob + ib:]
+
+        #### Storage
+        data_ports = []
+        tag_ports = []
+        predecoded_ports = []
+        for way in range(config.ways):
+            data = Memory(width=32, depth=config.sets * config.line_words)
+            tags = Memory(width=self.tag_bits, depth=config.sets)
+            ports = (data.read_port(), data.write_port(), tags.read_port(), tags.write_port())
+            if config.predecode:
+                predecoded = Memory(width=len(self.predecoded), depth=config.sets * config.line_words)
+                ports += (predecoded.read_port(), predecoded.write_port())
+            for i, port in enumerate(ports):
+                m.submodules[f"way{way}_port{i}"] = port
+            data_ports.append(ports[0:2])
+            tag_ports.append(ports[2:4])
+            predecoded_ports.append(ports[4:6])
+
+        # Valid bits are kept in flops so FENCE.I can clear them all at once
+        valid = Array(Signal(config.ways, name=f"valid{i}") for i in range(config.sets))
+
+        #### Lookup
+        stall = Signal()
+        lookup = Signal()
+        m.d.comb += lookup.eq(self.bus.cyc & self.bus.stb & ~stall)
+        m.d.comb += self.bus.stall.eq(stall)
+
+        for (rdata, _), (rtag, _) in zip(data_ports, tag_ports):
+            m.d.comb += rdata.addr.eq(self.bus.adr[2:2 + ob + ib])
+            m.d.comb += rtag.addr.eq(index(self.bus.adr))
+        if config.predecode:
+            for rpredecoded, _ in predecoded_ports:
+                m.d.comb += rpredecoded.addr.eq(self.bus.adr[2:2 + ob + ib])
+
+        req_valid = Signal()
+        req_adr = Signal(unsigned(32))
+        m.d.sync += req_valid.eq(lookup)
+        with m.If(lookup):
+            m.d.sync += req_adr.eq(self.bus.adr)
+
+        req_set_valid = valid[index(req_adr)]
+        hit_ways = Signal(config.ways)
+        hit = Signal()
+        hit_data = Signal(unsigned(32))
+        for way, ((rdata, _), (rtag, _)) in enumerate(zip(data_ports, tag_ports)):
+            m.d.comb += hit_ways[way].eq(req_set_valid[way] & (rtag.data == tag(req_adr)))
+            with m.If(hit_ways[way]):
+                m.d.comb += hit_data.eq(rdata.data)
+        m.d.comb += hit.eq(hit_ways.any())
+
+        if config.predecode:
+            hit_predecoded = Signal(len(self.predecoded))
+            for way, (rpredecoded, _) in enumerate(predecoded_ports):
+                with m.If(hit_ways[way]):
+                    m.d.comb += hit_predecoded.eq(rpredecoded.data)
+
+        #### Replacement, first invalid way, otherwise round-robin
+        victim = Signal(range(config.ways))
+        victim_next = Signal(range(config.ways))
+        round_robin = Signal(range(config.ways))
+        m.d.comb += victim_next.eq(round_robin)
+        for way in reversed(range(config.ways)):
+            with m.If(~req_set_valid[way]):
+                m.d.comb += victim_next.eq(way)
+        # One-hot, valid bits are updated a whole set at a time
+        victim_mask = Signal(config.ways)
+        m.d.comb += victim_mask.eq(Const(1, config.ways) << victim)
+
+        #### Refill
+        miss_adr = Signal(unsigned(32))
+        miss_data = Signal(unsigned(32))
+        issued = Signal(range(config.line_words + 1))
+        received = Signal(range(config.line_words))
+        last_ack = Signal()
+        m.d.comb += last_ack.eq(self.mem.ack & (received == config.line_words - 1))
+        # FENCE.I during a refill, the line may hold words from before the stores it waited for
+        refill_stale = Signal()
+
+        for way, ((_, wdata), (_, wtag)) in enumerate(zip(data_ports, tag_ports)):
+            m.d.comb += [
+                wdata.addr.eq(Cat(received, index(miss_adr)) if ob else index(miss_adr)),
+                wdata.data.eq(self.mem.dat_r),
+                wtag.addr.eq(index(miss_adr)),
+                wtag.data.eq(tag(miss_adr)),
+            ]
+
+        # Words are predecoded on their way in from memory
+        if config.predecode:
+            miss_predecoded = Signal(len(self.predecoded))
+            m.submodules.predecoder = predecoder = Predecoder()
+            m.d.comb += predecoder.instr.eq(self.mem.dat_r)
+            for way, (_, wpredecoded) in enumerate(predecoded_ports):
+                m.d.comb += [
+                    wpredecoded.addr.eq(Cat(received, index(miss_adr)) if ob else index(miss_adr)),
+                    wpredecoded.data.eq(predecoder.out),
+                ]
+
+        mem_stall = self.mem.stall if hasattr(self.mem, "stall") else Const(0)
+
+        with m.FSM():
+            with m.State("IDLE"):
+                with m.If(req_valid):
+                    with m.If(hit):
+                        m.d.comb += self.bus.ack.eq(1)
+                        m.d.comb += self.bus.dat_r.eq(hit_data)
+                        if config.predecode:
+                            m.d.comb += self.predecoded.eq(hit_predecoded)
+                        m.d.sync += self.hits.eq(self.hits + 1)
+                    with m.Else():
+                        m.d.comb += stall.eq(1)
+                        m.d.comb += self.miss.eq(1)
+                        m.d.sync += self.misses.eq(self.misses + 1)
+                        m.d.sync += miss_adr.eq(req_adr)
+                        m.d.sync += victim.eq(victim_next)
+                        m.d.sync += issued.eq(0)
+                        m.d.sync += received.eq(0)
+                        m.d.sync += refill_stale.eq(0)
+                        m.next = "REFILL"
+
+            with m.State("REFILL"):
+                m.d.comb += stall.eq(1)
+
+                # Issue the whole line as a linear incrementing burst, in pipelined mode
+                # a new beat goes out every cycle the slave doesn't stall
+                m.d.comb += self.mem.cyc.eq(1)
+                m.d.comb += self.mem.stb.eq(issued != config.line_words)
+                m.d.comb += self.mem.we.eq(0)
+                m.d.comb += self.mem.sel.eq(~0)
+                m.d.comb += self.mem.adr.eq(Cat(Const(0, 2), issued[:ob], index(miss_adr), tag(miss_adr)))
+                if hasattr(self.mem, "cti"):
+                    with m.If(issued == config.line_words - 1):
+                        m.d.comb += self.mem.cti.eq(CycleType.END_OF_BURST)
+                    with m.Else():
+                        m.d.comb += self.mem.cti.eq(CycleType.INCR_BURST)
+                if hasattr(self.mem, "bte"):
+                    m.d.comb += self.mem.bte.eq(BurstTypeExt.LINEAR)
+
+                with m.If(self.mem.stb & ~mem_stall):
+                    m.d.sync += issued.eq(issued + 1)
+
+                with m.If(self.mem.ack):
+                    m.d.sync += received.eq(received + 1)
+                    for way, (_, wdata) in enumerate(data_ports):
+                        m.d.comb += wdata.en.eq(victim == way)
+                    if config.predecode:
+                        for way, (_, wpredecoded) in enumerate(predecoded_ports):
+                            m.d.comb += wpredecoded.en.eq(victim == way)
+                    with m.If(received == (miss_adr[2:2 + ob] if ob else 0)):
+                        m.d.sync += miss_data.eq(self.mem.dat_r)
+                        if config.predecode:
+                            m.d.sync += miss_predecoded.eq(predecoder.out)
+
+                with m.If(last_ack):
+                    for way, (_, (_, wtag)) in enumerate(zip(data_ports, tag_ports)):
+                        m.d.comb += wtag.en.eq(victim == way)
+                    with m.If(~refill_stale):
+                        m.d.sync += valid[index(miss_adr)].eq(valid[index(miss_adr)] | victim_mask)
+                    m.d.sync += round_robin.eq(Mux(round_robin == config.ways - 1, 0, round_robin + 1))
+                    m.next = "RESPOND"
+
+            with m.State("RESPOND"):
+                # Return the requested word, the fetch port can already issue the next lookup
+                m.d.comb += self.bus.ack.eq(1)
+                m.d.comb += self.bus.dat_r.eq(miss_data)
+                if config.predecode:
+                    m.d.comb += self.predecoded.eq(miss_predecoded)
+                m.next = "IDLE"
+
+        # Wins over a refill's valid bit in the same cycle, and keeps the one in flight invalid
+        with m.If(self.invalidate):
+            for set_valid in valid:
+                m.d.sync += set_valid.eq(0)
+            m.d.sync += refill_stale.eq(1)
+
+        return m
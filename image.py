@@ -0,0 +1,169 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+ELF_MAGIC = b"\x7fELF"
+PT_LOAD = 1
+SHT_SYMTAB = 2
+STT_NOTYPE = 0
+STT_FUNC = 2
+
+def load_segments(path: str) -> list:
+    """Read a program image as a list of (address, data, size) segments.
+
+    ELF files are loaded by their PT_LOAD program headers, anything else is treated as a flat
+    binary starting at address 0. ``data`` is a read-only view straight into the mmapped file,
+    ``size`` can be larger than it, the rest of the segment (.bss) is zero.
+    """
+    if os.path.getsize(path) == 0:
+        return []
+
+    with open(path, "rb") as f:
+        # The views below keep the mapping alive, it goes away with the last of them
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    if data[:4] != ELF_MAGIC:
+        return [(0, data, len(data))]
+
+    # Only 32-bit little-endian images make sense for this core
+    if data[4] != 1 or data[5] != 1:
+        raise ValueError(f"{path} is not a 32-bit little-endian ELF file")
+
+    phoff, = struct.unpack_from("<I", data, 28)
+    phentsize, phnum = struct.unpack_from("<HH", data, 42)
+
+    segments = []
+    for i in range(phnum):
+        p_type, p_offset, _, p_paddr, p_filesz, p_memsz, _, _ = \
+            struct.unpack_from("<IIIIIIII", data, phoff + i * phentsize)
+        if p_type != PT_LOAD or p_memsz == 0:
+            continue
+        segments.append((p_paddr, data[p_offset:p_offset + p_filesz], p_memsz))
+
+    return segments
+
+def load_symbols(path: str) -> list:
+    """Code symbols of an ELF file as a sorted list of (address, size, name).
+
+    Functions, and untyped labels for hand-written assembly, which have no size. Flat binaries
+    have no symbols. Undefined and absolute symbols are left out.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != ELF_MAGIC:
+        return []
+    if data[4] != 1 or data[5] != 1:
+        raise ValueError(f"{path} is not a 32-bit little-endian ELF file")
+
+    shoff, = struct.unpack_from("<I", data, 32)
+    shentsize, shnum = struct.unpack_from("<HH", data, 46)
+    sections = [struct.unpack_from("<IIIIIIIIII", data, shoff + i * shentsize) for i in range(shnum)]
+
+    symbols = set()
+    for _, sh_type, _, _, sh_offset, sh_size, sh_link, _, _, sh_entsize in sections:
+        if sh_type != SHT_SYMTAB:
+            continue
+        strtab = sections[sh_link][4]
+        for offset in range(sh_offset, sh_offset + sh_size, sh_entsize or 16):
+            st_name, st_value, st_size, st_info, _, st_shndx = struct.unpack_from("<IIIBBH", data, offset)
+            if st_info & 0xf not in (STT_NOTYPE, STT_FUNC) or not 0 < st_shndx < 0xff00 or st_name == 0:
+                continue
+            end = data.index(b"\0", strtab + st_name)
+            name = data[strtab + st_name:end].decode(errors="replace")
+            # Skip section/mapping symbols and compiler-local labels
+            if name.startswith(("$", ".L")):
+                continue
+            symbols.add((st_value, st_size, name))
+
+    return sorted(symbols)
+
+def image_size(path: str) -> int:
+    """Bytes of memory from address 0 needed to hold the image."""
+    return max((address + size for address, _, size in load_segments(path)), default=0)
+
+def word_view(data) -> memoryview:
+    """``data`` as little-endian 32-bit words, without copying it if the host allows."""
+    view = memoryview(data).cast("B")
+    if len(view) % 4:
+        view = memoryview(bytes(view) + bytes(-len(view) % 4))
+    if sys.byteorder != "little":
+        words = array("I")
+        words.frombytes(view)
+        words.byteswap()
+        return memoryview(words)
+    return view.cast("I")
+
+def load_words(path: str, depth: int = None) -> list:
+    """Flatten a program image into ``depth`` little-endian 32-bit words from address 0.
+
+    Without a ``depth`` the image decides it.
+    """
+    segments = load_segments(path)
+    if depth is None:
+        depth = (max((address + size for address, _, size in segments), default=0) + 3) // 4
+
+    image = bytearray(depth * 4)
+    for address, data, size in segments:
+        if address + size > len(image):
+            raise ValueError(f"{path} doesn't fit in {depth * 4} bytes of memory "
+                             f"(segment at {address:#x} is {size} bytes)")
+        image[address:address + len(data)] = data
+
+    return word_view(image).tolist()
+
+class PagedMemory:
+    """Sparse 32-bit address space, backed by pages allocated the first time they're written.
+
+    Reads from pages that were never written return zero, so a multi-megabyte address space
+    only costs memory for what a program actually touches.
+    """
+    def __init__(self, page_bits: int = 12):
+        self.page_bits = page_bits
+        self.page_size = 1 << page_bits
+        self.pages = {}
+
+    def _page(self, address: int) -> bytearray:
+        number = address >> self.page_bits
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = bytearray(self.page_size)
+        return page
+
+    def clear(self):
+        self.pages.clear()
+
+    def copy_from(self, other: "PagedMemory"):
+        """Replace the contents with a copy of ``other``'s, which has the same page size."""
+        if other.page_bits != self.page_bits:
+            raise ValueError(f"Can't copy {other.page_size} byte pages into {self.page_size} byte ones")
+        self.clear()
+        self.pages.update((number, bytearray(page)) for number, page in other.pages.items())
+
+    def load(self, path: str):
+        """Replace the contents with a program image (flat binary or ELF)."""
+        self.clear()
+        for address, data, _ in load_segments(path):
+            # .bss needs nothing, untouched pages already read as zero
+            offset = 0
+            while offset < len(data):
+                page_offset = (address + offset) & (self.page_size - 1)
+                chunk = min(len(data) - offset, self.page_size - page_offset)
+                self._page(address + offset)[page_offset:page_offset + chunk] = data[offset:offset + chunk]
+                offset += chunk
+
+    def read(self, address: int) -> int:
+        """Aligned little-endian word at ``address``."""
+        page = self.pages.get(address >> self.page_bits)
+        if page is None:
+            return 0
+        return struct.unpack_from("<I", page, address & (self.page_size - 4))[0]
+
+    def write(self, address: int, data: int, sel: int = 0b1111):
+        """Write the bytes of ``data`` picked by ``sel`` to the word at ``address``."""
+        page = self._page(address)
+        offset = address & (self.page_size - 4)
+        for lane in range(4):
+            if sel & (1 << lane):
+                page[offset + lane] = (data >> (8 * lane)) & 0xff
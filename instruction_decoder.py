@@ -24,55 +24,56 @@ class InstructionDecoder(Elaboratable):
     def elaborate(self, platform):
         m = Module()
 
-        m.d.comb += self.opcode.eq(self.instr[0:6])
+        # Bits [0:2] are always 0b11 for 32-bit instructions
+        m.d.comb += self.opcode.eq(self.instr[2:7])
         # Default immediate to 0 whenever we can
         m.d.comb += self.imm.eq(0)
         m.d.comb += self.immu.eq(0)
-        m.d.comb += self.dest.eq(self.instr[7:11]) # TODO will likely move back into the switch
+        m.d.comb += self.dest.eq(self.instr[7:12]) # TODO will likely move back into the switch
 
         with m.Switch(self.opcode):
             # I-Type Instructions
-            with m.Case(Opcodes.OP_IMM, Opcodes.JALR, Opcodes.LOAD, Opcodes.MISC_MEM):
-                # TODO does this sign-extend?
-                m.d.comb += self.imm.eq(self.instr[20:31].as_signed())
-                m.d.comb += self.immu.eq(self.instr[20:31])
+            with m.Case(Opcodes.OP_IMM, Opcodes.JALR, Opcodes.LOAD, Opcodes.MISC_MEM, Opcodes.SYSTEM):
+                m.d.comb += self.imm.eq(Cat(self.instr[20:32], Repl(self.instr[31], 20)))
+                m.d.comb += self.immu.eq(self.instr[20:32])
 
-                m.d.comb += self.funct3.eq(self.instr[12:14])
-                m.d.comb += self.src1.eq(self.instr[15:19])
+                m.d.comb += self.funct3.eq(self.instr[12:15])
+                m.d.comb += self.src1.eq(self.instr[15:20])
 
             # U-Type Instructions
             with m.Case(Opcodes.LUI, Opcodes.AUIPC):
-                m.d.comb += self.imm[12:31].eq(self.instr[12:31].as_signed())
-                m.d.comb += self.immu[12:31].eq(self.instr[12:31])
+                m.d.comb += self.imm[12:32].eq(self.instr[12:32])
+                m.d.comb += self.immu[12:32].eq(self.instr[12:32])
 
             # R-Type Instructions
             with m.Case(Opcodes.OP):
-                m.d.comb += self.funct3.eq(self.instr[12:14])
-                m.d.comb += self.funct7.eq(self.instr[25:31])
-                m.d.comb += self.src1.eq(self.instr[15:19])
-                m.d.comb += self.src2.eq(self.instr[20:24])
+                m.d.comb += self.funct3.eq(self.instr[12:15])
+                m.d.comb += self.funct7.eq(self.instr[25:32])
+                m.d.comb += self.src1.eq(self.instr[15:20])
+                m.d.comb += self.src2.eq(self.instr[20:25])
 
             # J-Type Instructions
             with m.Case(Opcodes.JAL):
-                imm = Cat(Const(0, shape=1), self.instr[21:30], self.instr[20], self.instr[12:19], self.instr[31])
-                m.d.comb += self.imm.eq(imm.as_signed())
+                imm = Cat(Const(0, shape=1), self.instr[21:31], self.instr[20], self.instr[12:20], self.instr[31])
+                m.d.comb += self.imm.eq(Cat(imm, Repl(self.instr[31], 11)))
                 m.d.comb += self.immu.eq(imm.as_unsigned())
 
             # B-Type Instructions
             with m.Case(Opcodes.BRANCH):
-                imm = Cat(Const(0, shape=1), self.instr[8:11], self.instr[25:30], self.instr[7], self.instr[31])
-                m.d.comb += self.imm.eq(imm.as_signed())
+                imm = Cat(Const(0, shape=1), self.instr[8:12], self.instr[25:31], self.instr[7], self.instr[31])
+                m.d.comb += self.imm.eq(Cat(imm, Repl(self.instr[31], 19)))
                 m.d.comb += self.immu.eq(imm.as_unsigned())
-                m.d.comb += self.funct3.eq(self.instr[12:14])
-                m.d.comb += self.src1.eq(self.instr[15:19])
-                m.d.comb += self.src2.eq(self.instr[20:24])
+                m.d.comb += self.funct3.eq(self.instr[12:15])
+                m.d.comb += self.src1.eq(self.instr[15:20])
+                m.d.comb += self.src2.eq(self.instr[20:25])
 
             # S-Type Instructions
             with m.Case(Opcodes.STORE):
-                m.d.comb += self.funct3.eq(self.instr[12:14])
-                m.d.comb += self.base.eq(self.instr[15:19])
-                m.d.comb += self.src1.eq(self.instr[20:24])
-                m.d.comb += self.imm.eq(Cat(self.instr[7:11], self.instr[25:31]).as_signed())
-                m.d.comb += self.immu.eq(Cat(self.instr[7:11], self.instr[25:31]).as_unsigned())
+                m.d.comb += self.funct3.eq(self.instr[12:15])
+                m.d.comb += self.base.eq(self.instr[15:20])
+                m.d.comb += self.src1.eq(self.instr[15:20])
+                m.d.comb += self.src2.eq(self.instr[20:25])
+                m.d.comb += self.imm.eq(Cat(self.instr[7:12], self.instr[25:32], Repl(self.instr[31], 20)))
+                m.d.comb += self.immu.eq(Cat(self.instr[7:12], self.instr[25:32]).as_unsigned())
 
         return m
@@ -0,0 +1,654 @@
+#!/usr/bin/env python
+"""Instruction-set simulator for RV32I(M), to run firmware fast and to check the RTL against.
+
+    python iss.py test_fw/test.elf --muldiv
+    python iss.py test_fw/test.elf --lockstep run.trace
+    python sim.py test_fw/test.elf --pipelined --lockstep
+
+``ISS`` models the core as software sees it: the registers, pc, the machine-mode CSRs and
+traps of ``CSRTable``/``TrapUnit``, and memory in a ``PagedMemory``. It decodes with the
+same ``Opcodes`` and funct enums as the RTL. Code runs from a cache of basic blocks, each
+decoded once into a Python function and then called every time control reaches it, which
+is good for millions of instructions a second in CPython. FENCE.I, or a store near cached
+code, drops the cache.
+
+There's no timing: cycle, time and instret all count retired instructions, and there are no
+interrupts or CLINT. ECALL and EBREAK stop a run, like they stop ``SimTop``.
+
+``Lockstep`` steps an ISS alongside the RTL's retired-instruction trace, either as a trace
+consumer of ``sim.Simulation`` or from a trace file, and keeps the first instruction where
+the two disagree. What the ISS can't know, counter CSRs, mip, CLINT loads and interrupts,
+it takes from the RTL.
+"""
+import argparse
+import struct
+import sys
+import time
+
+from opcodes import Opcodes, IntImmediate, IntRegReg, BranchCondition, SystemFunct, MulDivFunct, MULDIV
+from traps import Cause, Interrupt, INTERRUPT_PRIORITY, MSTATUS_MIE, MSTATUS_MPIE, MSTATUS_MPP, \
+    MIP_MSIP, MIP_MTIP, MIP_MEIP, MTVEC_VECTORED, MRET, WFI
+from csr import MISA_MXL_32, MISA_I, MISA_M
+from clint import CLINT_BASE, CLINT_SIZE
+from image import PagedMemory
+from tracing import TraceEntry, read_trace
+
+M32 = 0xFFFF_FFFF
+SIGN = 0x8000_0000
+
+# Longest basic block, so one that never branches still comes back to the run loop
+MAX_BLOCK = 64
+
+# Stores into a 2**CODE_LINE_BITS byte line holding decoded code flush the block cache. Small
+# images keep data next to code, so this is finer than a page.
+CODE_LINE_BITS = 6
+
+class _Trap(Exception):
+    """Synchronous exception from the instruction at ``pc``, the ``index``th of its block."""
+    def __init__(self, cause: Cause, tval: int, pc: int, index: int):
+        self.cause = cause
+        self.tval = tval
+        self.pc = pc
+        self.index = index
+
+#### Decoding
+
+def _sext(value: int, bits: int) -> int:
+    sign = 1 << (bits - 1)
+    return (value ^ sign) - sign
+
+def _imm_i(insn: int) -> int:
+    return _sext(insn >> 20, 12)
+
+def _imm_s(insn: int) -> int:
+    return _sext(((insn >> 25) << 5) | ((insn >> 7) & 0x1f), 12)
+
+def _imm_b(insn: int) -> int:
+    return _sext((((insn >> 31) & 1) << 12) | (((insn >> 7) & 1) << 11) | (((insn >> 25) & 0x3f) << 5) |
+                 (((insn >> 8) & 0xf) << 1), 13)
+
+def _imm_u(insn: int) -> int:
+    return insn & 0xFFFF_F000
+
+def _imm_j(insn: int) -> int:
+    return _sext((((insn >> 31) & 1) << 20) | (((insn >> 12) & 0xff) << 12) | (((insn >> 20) & 1) << 11) |
+                 (((insn >> 21) & 0x3ff) << 1), 21)
+
+def _opcode(insn: int) -> Opcodes:
+    """The instruction's major opcode, or None if it isn't a 32-bit one this core knows."""
+    if insn & 0b11 != 0b11:
+        return None
+    try:
+        return Opcodes((insn >> 2) & 0x1f)
+    except ValueError:
+        return None
+
+# LOAD/STORE funct3: (bytes, load helper)
+_LOADS = {0b000: (1, "lb"), 0b001: (2, "lh"), 0b010: (4, "lw"), 0b100: (1, "lbu"), 0b101: (2, "lhu")}
+_STORES = {0b000: (1, "sb"), 0b001: (2, "sh"), 0b010: (4, "sw")}
+
+_BRANCHES = {
+    BranchCondition.BEQ:  "{a} == {b}",
+    BranchCondition.BNE:  "{a} != {b}",
+    BranchCondition.BLT:  "({a} ^ 0x80000000) < ({b} ^ 0x80000000)",
+    BranchCondition.BGE:  "({a} ^ 0x80000000) >= ({b} ^ 0x80000000)",
+    BranchCondition.BLTU: "{a} < {b}",
+    BranchCondition.BGEU: "{a} >= {b}",
+}
+
+# Expressions for OP and OP-IMM, ``b`` is rs2 or the immediate
+_ALU = {
+    IntRegReg.ADD:  "({a} + {b}) & 0xFFFFFFFF",
+    IntRegReg.SLL:  "({a} << ({b} & 31)) & 0xFFFFFFFF",
+    IntRegReg.SLT:  "int(({a} ^ 0x80000000) < ({b} ^ 0x80000000))",
+    IntRegReg.SLTU: "int({a} < {b})",
+    IntRegReg.XOR:  "{a} ^ {b}",
+    IntRegReg.SRx:  "{a} >> ({b} & 31)",
+    IntRegReg.OR:   "{a} | {b}",
+    IntRegReg.AND:  "{a} & {b}",
+}
+_SUB = "({a} - {b}) & 0xFFFFFFFF"
+_SRA = "(({a} ^ 0x80000000) - 0x80000000 >> ({b} & 31)) & 0xFFFFFFFF"
+
+_MULDIV = {
+    MulDivFunct.MUL:    "({a} * {b}) & 0xFFFFFFFF",
+    MulDivFunct.MULH:   "((({a} ^ 0x80000000) - 0x80000000) * (({b} ^ 0x80000000) - 0x80000000) >> 32) & 0xFFFFFFFF",
+    MulDivFunct.MULHSU: "((({a} ^ 0x80000000) - 0x80000000) * {b} >> 32) & 0xFFFFFFFF",
+    MulDivFunct.MULHU:  "({a} * {b}) >> 32",
+    MulDivFunct.DIV:    "div({a}, {b})",
+    MulDivFunct.DIVU:   "({a} // {b}) if {b} else 0xFFFFFFFF",
+    MulDivFunct.REM:    "rem({a}, {b})",
+    MulDivFunct.REMU:   "({a} % {b}) if {b} else {a}",
+}
+
+def _div(a: int, b: int) -> int:
+    if b == 0:
+        return M32
+    a, b = _sext(a, 32), _sext(b, 32)
+    # Rounds towards zero, and the overflow case wraps back to -2**31
+    quotient = abs(a) // abs(b)
+    return (-quotient if (a < 0) != (b < 0) else quotient) & M32
+
+def _rem(a: int, b: int) -> int:
+    if b == 0:
+        return a
+    a, b = _sext(a, 32), _sext(b, 32)
+    remainder = abs(a) % abs(b)
+    return (-remainder if a < 0 else remainder) & M32
+
+def _is_counter(address: int) -> bool:
+    """Whether a CSR address is one of ``PerfCounters``', like ``PerfCounters.implemented``."""
+    block, index = address >> 5, address & 0x1f
+    return (block in (0xC00 >> 5, 0xC80 >> 5) or (block in (0xB00 >> 5, 0xB80 >> 5) and index != 1) or
+            (block == 0x320 >> 5 and (index == 0 or index >= 3)))
+
+class ISS:
+    """Functional model of the core: ``load`` an image, then ``run`` it or ``step`` through it.
+
+    ``muldiv`` adds RV32M. ``regs`` (x0 to x31), ``pc``, ``csrs`` (the trap CSRs and mscratch,
+    by address), ``instret`` and ``memory`` are the architectural state, and can be changed
+    between runs. ``breakpoints`` are PCs ``run`` stops in front of.
+    """
+    def __init__(self, muldiv: bool = False):
+        self.muldiv = muldiv
+        self.misa = MISA_MXL_32 | MISA_I | (MISA_M if muldiv else 0)
+        self.memory = PagedMemory()
+        self.regs = [0] * 32
+        self.pc = 0
+        self.instret = 0
+        self.csrs = {}
+        self.halted = False
+        self.breakpoints = set()
+
+        # pc -> (block function, instructions in it), for runs and for single steps
+        self._blocks = {}
+        self._steps = {}
+        self._code_lines = set()
+        self._helpers = self._memory_helpers()
+        self.reset()
+
+    def reset(self):
+        """Back to the state out of reset, memory is left as it is."""
+        self.regs[:] = [0] * 32
+        self.pc = 0
+        self.instret = 0
+        self.halted = False
+        self.csrs = {
+            0x300: MSTATUS_MPP,     # mstatus
+            0x304: 0,               # mie
+            0x305: 0,               # mtvec
+            0x340: 0,               # mscratch
+            0x341: 0,               # mepc
+            0x342: 0,               # mcause
+            0x343: 0,               # mtval
+        }
+
+    def load(self, path: str):
+        """Load a program image (flat binary or ELF) and reset."""
+        self.memory.load(path)
+        self.flush()
+        self.reset()
+
+    def flush(self):
+        """Forget every decoded block, after code has been changed."""
+        self._blocks.clear()
+        self._steps.clear()
+        self._code_lines.clear()
+
+    #### Memory
+
+    def _memory_helpers(self) -> dict:
+        # Loads and stores for the generated code, straight on the pages for speed
+        pages = self.memory.pages
+        page = self.memory._page
+        bits = self.memory.page_bits
+        mask = self.memory.page_size - 1
+        code_lines = self._code_lines
+        unpack_from = struct.unpack_from
+        pack_into = struct.pack_into
+        flush = self.flush
+
+        def lw(address):
+            data = pages.get(address >> bits)
+            return unpack_from("<I", data, address & mask)[0] if data is not None else 0
+
+        def lhu(address):
+            data = pages.get(address >> bits)
+            return unpack_from("<H", data, address & mask)[0] if data is not None else 0
+
+        def lh(address):
+            return ((lhu(address) ^ 0x8000) - 0x8000) & M32
+
+        def lbu(address):
+            data = pages.get(address >> bits)
+            return data[address & mask] if data is not None else 0
+
+        def lb(address):
+            return ((lbu(address) ^ 0x80) - 0x80) & M32
+
+        def store(fmt, value_mask):
+            def write(address, value):
+                pack_into(fmt, page(address), address & mask, value & value_mask)
+                if address >> CODE_LINE_BITS in code_lines:
+                    flush()
+            return write
+
+        return {"lw": lw, "lh": lh, "lhu": lhu, "lb": lb, "lbu": lbu,
+                "sw": store("<I", M32), "sh": store("<H", 0xffff), "sb": store("<B", 0xff)}
+
+    def fetch(self, pc: int) -> int:
+        return self._helpers["lw"](pc)
+
+    #### Translation
+
+    def _translate(self, pc: int, insn: int, index: int) -> tuple:
+        """Python statements for one instruction, and whether it ends its block."""
+        illegal = [f"raise _Trap(Cause.ILLEGAL_INSN, 0, {pc:#x}, {index})"], True
+
+        def trap(cause, tval):
+            return f"raise _Trap(Cause.{cause.name}, {tval}, {pc:#x}, {index})"
+
+        opcode = _opcode(insn)
+        rd = (insn >> 7) & 0x1f
+        funct3 = (insn >> 12) & 0b111
+        rs1 = (insn >> 15) & 0x1f
+        rs2 = (insn >> 20) & 0x1f
+        funct7 = insn >> 25
+        a, b = f"r[{rs1}]", f"r[{rs2}]"
+        next_pc = (pc + 4) & M32
+
+        def write(value):
+            return [f"r[{rd}] = {value}"] if rd else []
+
+        if opcode == Opcodes.LUI:
+            return write(f"{_imm_u(insn):#x}"), False
+
+        if opcode == Opcodes.AUIPC:
+            return write(f"{(pc + _imm_u(insn)) & M32:#x}"), False
+
+        if opcode == Opcodes.JAL:
+            target = (pc + _imm_j(insn)) & M32
+            if target & 0b10:
+                return [trap(Cause.INSN_MISALIGNED, f"{target:#x}")], True
+            return write(f"{next_pc:#x}") + [f"return {target:#x}"], True
+
+        if opcode == Opcodes.JALR:
+            if funct3 != 0:
+                return illegal
+            return [
+                f"t = ({a} + {_imm_i(insn)}) & 0xFFFFFFFE",
+                f"if t & 2: {trap(Cause.INSN_MISALIGNED, 't')}",
+                *write(f"{next_pc:#x}"),
+                "return t",
+            ], True
+
+        if opcode == Opcodes.BRANCH:
+            try:
+                condition = _BRANCHES[BranchCondition(funct3)].format(a=a, b=b)
+            except ValueError:
+                return illegal
+            target = (pc + _imm_b(insn)) & M32
+            taken = trap(Cause.INSN_MISALIGNED, f"{target:#x}") if target & 0b10 else f"return {target:#x}"
+            return [f"if {condition}: {taken}", f"return {next_pc:#x}"], True
+
+        if opcode == Opcodes.LOAD:
+            if funct3 not in _LOADS:
+                return illegal
+            size, helper = _LOADS[funct3]
+            lines = [f"t = ({a} + {_imm_i(insn)}) & 0xFFFFFFFF"]
+            if size > 1:
+                lines.append(f"if t & {size - 1}: {trap(Cause.LOAD_MISALIGNED, 't')}")
+            lines.append(f"r[{rd}] = {helper}(t)" if rd else f"{helper}(t)")
+            return lines, False
+
+        if opcode == Opcodes.STORE:
+            if funct3 not in _STORES:
+                return illegal
+            size, helper = _STORES[funct3]
+            lines = [f"t = ({a} + {_imm_s(insn)}) & 0xFFFFFFFF"]
+            if size > 1:
+                lines.append(f"if t & {size - 1}: {trap(Cause.STORE_MISALIGNED, 't')}")
+            lines.append(f"{helper}(t, {b})")
+            return lines, False
+
+        if opcode == Opcodes.OP_IMM:
+            op = IntImmediate(funct3)
+            imm = _imm_i(insn)
+            if op == IntImmediate.SLLI:
+                if funct7 != 0:
+                    return illegal
+                return write(_ALU[IntRegReg.SLL].format(a=a, b=rs2)), False
+            if op == IntImmediate.SRxI:
+                if funct7 not in (0, 0x20):
+                    return illegal
+                return write((_SRA if funct7 else _ALU[IntRegReg.SRx]).format(a=a, b=rs2)), False
+            return write(_ALU[IntRegReg(funct3)].format(a=a, b=f"{imm & M32:#x}")), False
+
+        if opcode == Opcodes.OP:
+            if funct7 == MULDIV and self.muldiv:
+                return write(_MULDIV[MulDivFunct(funct3)].format(a=a, b=b)), False
+            op = IntRegReg(funct3)
+            if funct7 == 0:
+                return write(_ALU[op].format(a=a, b=b)), False
+            if funct7 == 0x20 and op in (IntRegReg.ADD, IntRegReg.SRx):
+                return write((_SUB if op == IntRegReg.ADD else _SRA).format(a=a, b=b)), False
+            return illegal
+
+        if opcode == Opcodes.MISC_MEM:
+            if funct3 == 0b000:
+                # FENCE, memory is always in order here
+                return [], False
+            if funct3 == 0b001:
+                return ["iss.flush()", f"return {next_pc:#x}"], True
+            return illegal
+
+        if opcode == Opcodes.SYSTEM:
+            return [f"return iss._system({pc:#x}, {insn:#x}, {index})"], True
+
+        return illegal
+
+    def _compile(self, pc: int, limit: int = MAX_BLOCK) -> tuple:
+        """Decode the block at ``pc``, of at most ``limit`` instructions, into a function
+        returning the next pc. Blocks end at control transfers, SYSTEM instructions,
+        and breakpoints."""
+        lines = []
+        address = pc
+        length = 0
+        ends = False
+        while not ends and length < limit:
+            body, ends = self._translate(address, self.fetch(address), length)
+            lines += body
+            length += 1
+            address = (address + 4) & M32
+            if address in self.breakpoints:
+                break
+        if not ends:
+            lines.append(f"return {address:#x}")
+
+        source = "def make(r, iss, div, rem, lw, lh, lhu, lb, lbu, sw, sh, sb):\n    def block():\n"
+        source += "".join(f"        {line}\n" for line in lines)
+        source += "    return block\n"
+        namespace = {"_Trap": _Trap, "Cause": Cause}
+        exec(compile(source, f"<block {pc:#010x}>", "exec"), namespace)
+        block = namespace["make"](self.regs, self, _div, _rem, **self._helpers), length
+
+        (self._blocks if limit == MAX_BLOCK else self._steps)[pc] = block
+        self._code_lines.update(range(pc >> CODE_LINE_BITS, ((address - 1) >> CODE_LINE_BITS) + 1))
+        return block
+
+    #### SYSTEM instructions and traps
+
+    def _csr_read(self, address: int, instret: int) -> int:
+        """A CSR's value, or None if there's no such CSR."""
+        if address in self.csrs:
+            return self.csrs[address]
+        if address in (0xF11, 0xF12, 0xF13, 0xF14):
+            return 0
+        if address == 0x301:
+            return self.misa
+        if address == 0x344:
+            return 0
+        if _is_counter(address):
+            # cycle/time/instret and their machine-mode versions, the rest read as zero
+            if address & 0x1f in (0, 1, 2) and address >> 8 in (0xB, 0xC):
+                return instret >> 32 if address & 0x80 else instret & M32
+            return 0
+        return None
+
+    def _csr_write(self, address: int, value: int):
+        masks = {
+            0x300: MSTATUS_MIE | MSTATUS_MPIE,
+            0x304: MIP_MSIP | MIP_MTIP | MIP_MEIP,
+            0x305: ~0b10 & M32,
+            0x340: M32,
+            0x341: ~0b11 & M32,
+            0x342: M32,
+            0x343: M32,
+        }
+        mask = masks.get(address)
+        # Writes to counters and read-only values are dropped
+        if mask is not None:
+            self.csrs[address] = (value & mask) | (self.csrs[address] & ~mask & M32)
+
+    def _system(self, pc: int, insn: int, index: int) -> int:
+        rd = (insn >> 7) & 0x1f
+        funct3 = (insn >> 12) & 0b111
+        rs1 = (insn >> 15) & 0x1f
+        address = insn >> 20
+
+        if funct3 == SystemFunct.PRIV.value:
+            if address == 0:
+                raise _Trap(Cause.ECALL_M, 0, pc, index)
+            if address == 1:
+                raise _Trap(Cause.BREAKPOINT, pc, pc, index)
+            if address == MRET:
+                mstatus = self.csrs[0x300]
+                mie = MSTATUS_MIE if mstatus & MSTATUS_MPIE else 0
+                self.csrs[0x300] = (mstatus & ~MSTATUS_MIE) | mie | MSTATUS_MPIE
+                return self.csrs[0x341]
+            if address == WFI:
+                return (pc + 4) & M32
+            raise _Trap(Cause.ILLEGAL_INSN, 0, pc, index)
+
+        try:
+            op = SystemFunct(funct3)
+        except ValueError:
+            raise _Trap(Cause.ILLEGAL_INSN, 0, pc, index)
+
+        old = self._csr_read(address, self.instret + index)
+        # CSRRS/CSRRC with x0 or a zero immediate only read, read-only CSRs have 0b11 on top
+        writes = op in (SystemFunct.CSRRW, SystemFunct.CSRRWI) or rs1 != 0
+        if old is None or (writes and address >> 10 == 0b11):
+            raise _Trap(Cause.ILLEGAL_INSN, 0, pc, index)
+
+        operand = rs1 if funct3 & 0b100 else self.regs[rs1]
+        if writes:
+            if op in (SystemFunct.CSRRW, SystemFunct.CSRRWI):
+                self._csr_write(address, operand)
+            elif op in (SystemFunct.CSRRS, SystemFunct.CSRRSI):
+                self._csr_write(address, old | operand)
+            else:
+                self._csr_write(address, old & ~operand & M32)
+        if rd:
+            self.regs[rd] = old
+        return (pc + 4) & M32
+
+    def _enter_trap(self, cause: int, tval: int, epc: int):
+        mstatus = self.csrs[0x300]
+        mpie = MSTATUS_MPIE if mstatus & MSTATUS_MIE else 0
+        self.csrs[0x300] = (mstatus & ~(MSTATUS_MIE | MSTATUS_MPIE)) | mpie
+        self.csrs[0x341] = epc
+        self.csrs[0x342] = cause
+        self.csrs[0x343] = tval
+
+        mtvec = self.csrs[0x305]
+        base = mtvec & ~0b11
+        if cause & SIGN and mtvec & 0b11 == MTVEC_VECTORED:
+            self.pc = (base + 4 * (cause & ~SIGN)) & M32
+        else:
+            self.pc = base
+
+    def _take(self, trap: _Trap):
+        # ECALL/EBREAK end the run where they are, like in SimTop
+        if trap.cause in (Cause.ECALL_M, Cause.BREAKPOINT):
+            self.pc = trap.pc
+            self.halted = True
+        else:
+            self._enter_trap(trap.cause.value, trap.tval, trap.pc)
+
+    def interrupt(self, code: Interrupt):
+        """Take an interrupt in front of the next instruction, whether it's enabled or not."""
+        self._enter_trap(SIGN | code.value, 0, self.pc)
+
+    #### Running
+
+    def run(self, max_instructions: int = None) -> str:
+        """Run until ECALL/EBREAK ("halted"), a breakpoint ("breakpoint") or until
+        ``max_instructions`` more have retired ("limit"). A run started on a breakpoint
+        doesn't stop there straight away."""
+        blocks = self._blocks
+        breakpoints = self.breakpoints
+        limit = self.instret + max_instructions if max_instructions is not None else None
+        pc = self.pc
+        first = True
+        while not self.halted:
+            if pc in breakpoints and not first:
+                self.pc = pc
+                return "breakpoint"
+            first = False
+
+            block, length = blocks.get(pc) or self._compile(pc)
+            if limit is not None and self.instret + length > limit:
+                if self.instret >= limit:
+                    self.pc = pc
+                    return "limit"
+                block, length = self._steps.get(pc) or self._compile(pc, 1)
+
+            try:
+                pc = block()
+                self.instret += length
+            except _Trap as trap:
+                self.instret += trap.index
+                self._take(trap)
+                pc = self.pc
+        return "halted"
+
+    def step(self) -> TraceEntry:
+        """Run up to and including the next instruction to retire, through any traps before it,
+        and describe it like the RTL's trace. None once halted."""
+        while not self.halted:
+            pc = self.pc
+            insn = self.fetch(pc)
+            opcode = _opcode(insn)
+            rd = (insn >> 7) & 0x1f
+            mem_addr = rmask = wmask = 0
+            if opcode in (Opcodes.LOAD, Opcodes.STORE):
+                imm = _imm_i(insn) if opcode == Opcodes.LOAD else _imm_s(insn)
+                mem_addr = (self.regs[(insn >> 15) & 0x1f] + imm) & M32
+                size = 1 << ((insn >> 12) & 0b11)
+                sel = ((1 << size) - 1) << (mem_addr & 0b11)
+                if opcode == Opcodes.LOAD:
+                    rmask = sel & 0xf
+                else:
+                    wmask = sel & 0xf
+            writes_rd = opcode not in (Opcodes.STORE, Opcodes.BRANCH, Opcodes.MISC_MEM) and rd != 0
+
+            block, _ = self._steps.get(pc) or self._compile(pc, 1)
+            try:
+                self.pc = block()
+            except _Trap as trap:
+                self._take(trap)
+                continue
+            self.instret += 1
+            rd = rd if writes_rd else 0
+            return TraceEntry(pc, insn, rd, self.regs[rd] if rd else 0, mem_addr, rmask, wmask, 0, ())
+        return None
+
+#### Checking the RTL
+
+class Lockstep:
+    """Checks the RTL's retired instructions against an ``ISS``, as a trace consumer.
+
+    ``divergence`` is set at the first instruction they disagree on, to (index, RTL entry,
+    ISS entry) with the ISS's None if it had already halted, and nothing after it is checked.
+    Register values the ISS can't predict (counter CSRs, mip, loads from the CLINT) are
+    copied from the RTL. If the RTL jumps to a handler while the ISS has interrupts enabled, the
+    ISS takes the same interrupt.
+    """
+    def __init__(self, iss: ISS):
+        self.iss = iss
+        self.checked = 0
+        self.divergence = None
+
+    def _unpredictable(self, entry: TraceEntry) -> bool:
+        opcode = _opcode(entry.insn)
+        if opcode == Opcodes.SYSTEM and (entry.insn >> 12) & 0b111:
+            # mip's pending bits come from the CLINT and meip, which the ISS doesn't model
+            return _is_counter(entry.insn >> 20) or entry.insn >> 20 == 0x344
+        if opcode == Opcodes.LOAD:
+            return CLINT_BASE <= entry.mem_addr < CLINT_BASE + CLINT_SIZE
+        return False
+
+    def _interrupt(self, pc: int) -> Interrupt:
+        # The interrupt the RTL took to get to ``pc``, if the ISS could have taken one
+        iss = self.iss
+        if not iss.csrs[0x300] & MSTATUS_MIE:
+            return None
+        mtvec = iss.csrs[0x305]
+        base = mtvec & ~0b11
+        enabled = [irq for irq in INTERRUPT_PRIORITY if iss.csrs[0x304] & (1 << irq.value)]
+        if mtvec & 0b11 == MTVEC_VECTORED:
+            return next((irq for irq in enabled if pc == base + 4 * irq.value), None)
+        # Direct mode doesn't say which, the highest priority enabled one is the best guess
+        return enabled[0] if enabled and pc == base else None
+
+    def add(self, entry: TraceEntry):
+        if self.divergence is not None:
+            return
+        iss = self.iss
+        if entry.pc != iss.pc and not iss.halted:
+            irq = self._interrupt(entry.pc)
+            if irq is not None:
+                iss.interrupt(irq)
+
+        expected = iss.step()
+        if expected is not None and self._unpredictable(entry) and entry.rd_addr == expected.rd_addr != 0:
+            iss.regs[expected.rd_addr] = expected.rd_wdata = entry.rd_wdata
+
+        fields = ("pc", "insn", "rd_addr", "rd_wdata", "mem_addr", "mem_rmask", "mem_wmask")
+        if expected is None or any(getattr(entry, f) != getattr(expected, f) for f in fields):
+            self.divergence = (self.checked, entry, expected)
+        else:
+            self.checked += 1
+
+    def report(self) -> str:
+        if self.divergence is None:
+            return f"lockstep: {self.checked} instructions match"
+        index, rtl, iss = self.divergence
+
+        def describe(entry):
+            if entry is None:
+                return "halted"
+            text = f"pc {entry.pc:#010x} insn {entry.insn:#010x}"
+            if entry.rd_addr:
+                text += f" x{entry.rd_addr} = {entry.rd_wdata:#010x}"
+            if entry.mem_rmask or entry.mem_wmask:
+                kind = "load" if entry.mem_rmask else "store"
+                text += f" {kind} {entry.mem_addr:#010x} mask {entry.mem_rmask | entry.mem_wmask:04b}"
+            return text
+
+        return (f"lockstep: diverged at retired instruction {index}\n"
+                f"  rtl {describe(rtl)}\n"
+                f"  iss {describe(iss)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="flat binary or ELF file, loaded at address 0")
+    parser.add_argument("--muldiv", action="store_true", help="with RV32M")
+    parser.add_argument("--max-instructions", type=int, help="stop after this many instructions")
+    parser.add_argument("--lockstep", metavar="TRACE", help="check a trace file from sim.py --trace against the ISS")
+    args = parser.parse_args()
+
+    iss = ISS(muldiv=args.muldiv)
+    iss.load(args.image)
+
+    if args.lockstep:
+        lockstep = Lockstep(iss)
+        for entry in read_trace(args.lockstep):
+            lockstep.add(entry)
+            if lockstep.divergence is not None:
+                break
+        print(lockstep.report())
+        sys.exit(0 if lockstep.divergence is None else 1)
+
+    start = time.perf_counter()
+    stop = iss.run(args.max_instructions)
+    seconds = time.perf_counter() - start
+
+    print(f"iss: {stop} after {iss.instret} instructions at pc {iss.pc:#010x} in {seconds:.2f}s "
+          f"({iss.instret / seconds / 1e6 if seconds else 0:.1f} MIPS)")
+    for i in range(0, 32, 4):
+        print("  " + "  ".join(f"x{r:<2} {iss.regs[r]:08x}" for r in range(i, i + 4)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Measure worst-case interrupt latency on SimTop.
+
+    python latency.py --pipelined --icache 4:64:1 --muldiv iterative
+    python latency.py --runs 8 --interrupts 64 --json latency.json
+
+Builds test_fw/irq/latency.S for the configuration's ISA and runs it across a pool of worker
+processes, each with its own seed. While mstatus.MIE is set, the simulator raises meip at a
+random cycle of the workload and counts the clock edges until the core enters the handler,
+then drops it again. 0 means the core took it the cycle it came in. Prints the minimum, mean
+and worst latency, a histogram, and which instructions the worst interrupts had to wait for.
+
+Timer and software interrupts from the CLINT take one cycle more, mtip and msip are
+registered.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import sim
+from bench import isa
+from image import load_symbols
+from test_fw.build import build
+from tracing import Profile
+
+here = os.path.dirname(os.path.abspath(__file__))
+irq_dir = os.path.join(here, "test_fw", "irq")
+
+# test_fw/bench/link.ld, 64K of RAM
+LINKER_SCRIPT = os.path.join(here, "test_fw", "bench", "link.ld")
+RAM_SIZE = 64 * 1024
+
+# Cycles of workload between an interrupt and the next
+MIN_GAP = 4
+MAX_GAP = 64
+
+def build_workload(interrupts: int, march: str, build_dir: str) -> str:
+    """Build latency.S unless its image is up to date, returns the ELF path."""
+    source = os.path.join(irq_dir, "latency.S")
+    output = os.path.join(build_dir, f"latency-{interrupts}")
+    elf = f"{output}.elf"
+    if not os.path.exists(elf) or os.path.getmtime(elf) < max(map(os.path.getmtime, (source, LINKER_SCRIPT))):
+        build(source, output, linker_script=LINKER_SCRIPT, march=march, cflags=(f"-DINTERRUPTS={interrupts}",))
+    return elf
+
+#### Worker processes, one simulator each
+
+_simulation = None
+# Set by _run_workload for the driver, which restarts with every run
+_driver = {}
+
+def _drive_meip():
+    top = _simulation.top
+    cpu = top.cpu
+    traps = cpu.csr.traps
+    rng = _driver["rng"]
+    samples = _driver["samples"]
+    max_cycles = _driver["max_cycles"]
+    cycles = 0
+
+    def tick():
+        # True once the workload is over. pysim 0.2 can't reset a process still waiting on
+        # the clock, so this one has to stop with it.
+        nonlocal cycles
+        yield
+        cycles += 1
+        return cycles >= max_cycles or (yield top.halt)
+
+    # Like any sync process, this reads what the design had up to the clock edge it just
+    # woke on, and its writes show up after it
+    while True:
+        for _ in range(rng.randrange(MIN_GAP, MAX_GAP)):
+            if (yield from tick()):
+                return
+        # MIE is clear from the cycle after a trap
+        while not (yield traps.mstatus[3]) or (yield cpu.trap):
+            if (yield from tick()):
+                return
+
+        yield top.meip.eq(1)
+        latency = 0
+        while True:
+            if (yield from tick()):
+                return
+            if (yield cpu.interrupt):
+                break
+            latency += 1
+        samples.append((latency, (yield traps.epc)))
+        yield top.meip.eq(0)
+
+def _init_worker(config: dict, engine: str):
+    global _simulation
+    _simulation = sim.Simulation(config, engine)
+    _simulation.sim.add_sync_process(_drive_meip)
+
+def _run_workload(image: str, seed: int, max_cycles: int) -> dict:
+    _driver.update(rng=random.Random(seed), samples=[], max_cycles=max_cycles)
+    result = _simulation.run(image, max_cycles)
+    # latency.S: a0 = errors, a1 = interrupts taken, a2 = loop iterations
+    errors, interrupts, iterations = result.regs[10:13]
+    samples = _driver["samples"]
+    return {
+        "seed": seed,
+        "passed": result.halted and errors == 0 and interrupts == len(samples),
+        "timeout": not result.halted,
+        "errors": errors,
+        "iterations": iterations,
+        "cycles": result.cycles,
+        "samples": samples,
+    }
+
+def run_latency(config: dict, engine: str = "pysim", runs: int = None, interrupts: int = 32, seed: int = 0,
+                jobs: int = None, max_cycles: int = 1_000_000,
+                build_dir: str = os.path.join(here, "build", "irq")) -> tuple:
+    """Build and run the latency workload ``runs`` times on SimTop with ``config``, taking
+    ``interrupts`` each. Returns the ELF path and a result dict per run."""
+    config = dict(config)
+    if engine == "pysim":
+        config["paged"] = True
+    if not config.get("paged"):
+        config["memory_depth"] = max(config.get("memory_depth", 0), RAM_SIZE // 4)
+
+    march = isa(config)
+    build_dir = os.path.join(build_dir, march)
+    os.makedirs(build_dir, exist_ok=True)
+    image = build_workload(interrupts, march, build_dir)
+
+    jobs = jobs or os.cpu_count()
+    runs = runs or jobs
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(config, engine)) as pool:
+        futures = [pool.submit(_run_workload, image, seed + i, max_cycles) for i in range(runs)]
+        return image, [future.result() for future in futures]
+
+def summarize(results: list) -> dict:
+    """Latency statistics over every run's samples."""
+    samples = [sample for r in results for sample in r["samples"]]
+    latencies = [latency for latency, _ in samples]
+    if not latencies:
+        return {"interrupts": 0}
+    worst = max(latencies)
+    return {
+        "interrupts": len(latencies),
+        "min": min(latencies),
+        "mean": round(sum(latencies) / len(latencies), 3),
+        "max": worst,
+        "histogram": dict(sorted(Counter(latencies).items())),
+        # Where the core was when the worst ones came in
+        "worst_pcs": sorted({pc for latency, pc in samples if latency == worst}),
+    }
+
+def report(summary: dict, symbols: list = ()) -> str:
+    """The printed form of ``summarize``'s statistics, worst cases symbolised with ``symbols``."""
+    if not summary["interrupts"]:
+        return "0 interrupts"
+    lines = [f"{summary['interrupts']} interrupts, latency min {summary['min']} mean {summary['mean']:.2f} "
+             f"max {summary['max']} cycles",
+             f"{'cycles':>6} {'count':>8}"]
+    for latency, count in summary["histogram"].items():
+        lines.append(f"{latency:>6} {count:>8}")
+    profile = Profile(symbols)
+    for pc in summary["worst_pcs"]:
+        symbol = profile.symbolize(pc)
+        where = f" ({symbol[0]}+{symbol[1]:#x})" if symbol else ""
+        lines.append(f"worst case at {pc:#010x}{where}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", choices=("pysim", "cxxsim"), default="pysim")
+    parser.add_argument("--runs", type=int, help="workload runs, each with its own seed (default: one per job)")
+    parser.add_argument("--interrupts", type=int, default=32, help="interrupts per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-cycles", type=int, default=1_000_000)
+    parser.add_argument("--build-dir", default=os.path.join(here, "build", "irq"))
+    parser.add_argument("--json", help="write results to this file")
+    sim.add_config_args(parser)
+    args = parser.parse_args()
+
+    config = sim.config_from_args(args)
+    image, results = run_latency(config, args.engine, args.runs, args.interrupts, args.seed, args.jobs,
+                                 args.max_cycles, args.build_dir)
+    summary = summarize(results)
+
+    for r in results:
+        if not r["passed"]:
+            status = "timeout" if r["timeout"] else f"FAIL (a0 = {r['errors']})"
+            print(f"seed {r['seed']}: {status}")
+
+    print(report(summary, load_symbols(image)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "config": sim.config_to_json(config),
+                "engine": args.engine,
+                "march": isa(config),
+                "summary": summary,
+                "runs": results,
+            }, f, indent=2)
+
+    sys.exit(0 if results and all(r["passed"] for r in results) else 1)
+
+if __name__ == "__main__":
+    main()
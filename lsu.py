@@ -0,0 +1,145 @@
+from nmigen import *
+import nmigen_soc.wishbone as wishbone
+
+from opcodes import LSWidth
+
+class LoadStoreUnit(Elaboratable):
+    """Loads and stores on a pipelined Wishbone master, with byte lanes.
+
+    The core computes ``addr`` (rs1 + imm) in the same cycle it decodes the instruction and
+    holds ``valid`` with ``store``, ``funct3`` and ``wdata`` (rs2) until ``done``. The request
+    goes out on the bus that cycle. B/H/W accesses drive ``sel`` for their byte lanes, and
+    loads are shifted down and sign or zero extended onto ``load_data``.
+
+    A store is ``done`` as soon as the bus accepts it, its ACK is collected in the background.
+    Stores can keep going back to back like that, and the bus keeps them in order. A load
+    waits for anything outstanding to be acknowledged, then is ``done`` when its own data is
+    back. ``busy`` is high while anything is outstanding, for FENCE.
+
+    The core drives ``buffered`` while a store buffer behind the LSU still holds stores (which
+    counts as ``busy`` too) and ``dirty`` while a write-back data cache holds data memory
+    hasn't seen. FENCE.I raises ``clean`` to have the cache write it back, and waits until
+    the LSU is neither busy nor dirty.
+
+    ``misaligned`` flags a request that doesn't fit in its word, the core raises an exception
+    for it instead of asserting ``valid``. ``loading`` is high once a load has gone out and
+    until its data is back, after which it can't be abandoned for an interrupt.
+    """
+    # Accesses on ``bus`` at once, stores waiting for their ACK
+    max_outstanding = 7
+
+    def __init__(self, bus: wishbone.Interface):
+        self.bus = bus
+
+        #### Request
+        self.valid = Signal()
+        self.store = Signal()
+        self.funct3 = Signal(unsigned(3))
+        self.addr = Signal(unsigned(32))
+        self.wdata = Signal(unsigned(32))
+
+        #### Response
+        self.done = Signal()
+        self.load_data = Signal(unsigned(32))
+        self.misaligned = Signal()
+        self.loading = Signal()
+        self.busy = Signal()
+        # Byte lanes of the request, as driven on ``sel``
+        self.sel = Signal(4)
+
+        #### Memory ordering
+        self.buffered = Signal()
+        self.dirty = Signal()
+        self.clean = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        bus = self.bus
+        stall = bus.stall if hasattr(bus, "stall") else Const(0)
+
+        width = Signal(LSWidth)
+        offset = self.addr[0:2]
+        m.d.comb += width.eq(self.funct3[0:2])
+
+        #### Byte lanes
+        sel = self.sel
+        wdata = Signal(unsigned(32))
+        with m.Switch(width):
+            with m.Case(LSWidth.B):
+                m.d.comb += sel.eq(0b0001 << offset)
+                m.d.comb += wdata.eq(Repl(self.wdata[0:8], 4))
+            with m.Case(LSWidth.H):
+                m.d.comb += sel.eq(0b0011 << Cat(Const(0, 1), offset[1]))
+                m.d.comb += wdata.eq(Repl(self.wdata[0:16], 2))
+                m.d.comb += self.misaligned.eq(offset[0])
+            with m.Default():
+                m.d.comb += sel.eq(0b1111)
+                m.d.comb += wdata.eq(self.wdata)
+                m.d.comb += self.misaligned.eq(offset != 0)
+
+        #### Bus
+        # Stores waiting for their ACK
+        stores = Signal(range(self.max_outstanding + 1))
+        load_pending = Signal()
+        load_offset = Signal(2)
+        load_funct3 = Signal(unsigned(3))
+
+        # Loads have to wait for older stores so their ACK can be told apart, and there's
+        # only room to count so many stores
+        can_issue = Signal()
+        m.d.comb += can_issue.eq(~load_pending & Mux(self.store, stores != self.max_outstanding,
+                                                     (stores == 0) | ((stores == 1) & bus.ack)))
+
+        issue = Signal()
+        accepted = Signal()
+        m.d.comb += [
+            issue.eq(self.valid & can_issue),
+            accepted.eq(issue & ~stall),
+            bus.cyc.eq(issue | load_pending | (stores != 0)),
+            bus.stb.eq(issue),
+            bus.we.eq(self.store),
+            bus.adr.eq(Cat(Const(0, 2), self.addr[2:])),
+            bus.sel.eq(sel),
+            bus.dat_w.eq(wdata),
+        ]
+
+        store_ack = Signal()
+        load_ack = Signal()
+        m.d.comb += store_ack.eq(bus.ack & (stores != 0))
+        m.d.comb += load_ack.eq(bus.ack & ((load_pending & (stores == 0)) |
+                                           (accepted & ~self.store & ~load_pending & (stores == 0))))
+
+        m.d.sync += stores.eq(stores + (accepted & self.store) - store_ack)
+
+        with m.If(accepted & ~self.store & ~load_ack):
+            m.d.sync += load_pending.eq(1)
+            m.d.sync += load_offset.eq(offset)
+            m.d.sync += load_funct3.eq(self.funct3)
+        with m.Elif(load_ack):
+            m.d.sync += load_pending.eq(0)
+
+        m.d.comb += self.done.eq(Mux(self.store, accepted, load_ack))
+        m.d.comb += self.busy.eq(load_pending | (stores != 0) | self.buffered)
+        m.d.comb += self.loading.eq(load_pending)
+
+        #### Load data
+        # Data comes back the same cycle only from a combinational slave
+        data_offset = Mux(load_pending, load_offset, offset)
+        data_funct3 = Mux(load_pending, load_funct3, self.funct3)
+        shifted = Signal(unsigned(32))
+        m.d.comb += shifted.eq(bus.dat_r >> Cat(Const(0, 3), data_offset))
+
+        with m.Switch(data_funct3):
+            with m.Case(0b000):     # LB
+                m.d.comb += self.load_data.eq(Cat(shifted[0:8], Repl(shifted[7], 24)))
+            with m.Case(0b001):     # LH
+                m.d.comb += self.load_data.eq(Cat(shifted[0:16], Repl(shifted[15], 16)))
+            with m.Case(0b100):     # LBU
+                m.d.comb += self.load_data.eq(shifted[0:8])
+            with m.Case(0b101):     # LHU
+                m.d.comb += self.load_data.eq(shifted[0:16])
+            with m.Default():       # LW
+                m.d.comb += self.load_data.eq(shifted)
+
+        return m
@@ -0,0 +1,241 @@
+from dataclasses import dataclass
+from enum import Enum
+
+from nmigen import *
+
+from opcodes import MulDivFunct
+
+class Multiplier(Enum):
+    SINGLE_CYCLE = "single"     # One combinational 33x33 multiply, for DSP blocks
+    PIPELINED = "pipelined"     # The same multiply with registered operands and product
+    ITERATIVE = "iterative"     # Shift-and-add, a bit of the multiplier per cycle
+
+@dataclass
+class MulDivConfig:
+    multiplier: Multiplier = Multiplier.SINGLE_CYCLE
+    # Quotient bits per divider step, 2 or 4 (two restoring steps per cycle)
+    divider_radix: int = 2
+    # Skip the dividend's leading zeros, and the multiplier's once they're all used up
+    early_terminate: bool = True
+
+class MulDiv(Elaboratable):
+    """RV32M multiply/divide unit.
+
+    ``funct3`` picks the operation like it does in the instruction (``MulDivFunct``), ``a`` and
+    ``b`` are rs1 and rs2. Hold ``valid`` with the operands until ``ready``.
+
+    Multiplies take a cycle with ``Multiplier.SINGLE_CYCLE``, three with
+    ``Multiplier.PIPELINED`` and up to 34 with ``Multiplier.ITERATIVE``. Divides are restoring
+    on the operands' magnitudes, 1 or 2 quotient bits per cycle. With ``early_terminate`` the
+    leading zeros of the dividend are skipped, so small dividends finish in a few cycles. A
+    zero divisor finishes straight away. Dropping ``valid`` early abandons the operation, so
+    an interrupt doesn't have to wait for a divide.
+    """
+    def __init__(self, config: MulDivConfig = None):
+        if config is None:
+            config = MulDivConfig()
+        if config.divider_radix not in (2, 4):
+            raise ValueError(f"Divider radix has to be 2 or 4, not {config.divider_radix}")
+        self.config = config
+
+        #### Operation
+        self.valid = Signal()
+        self.funct3 = Signal(unsigned(3))
+        self.a = Signal(unsigned(32))
+        self.b = Signal(unsigned(32))
+
+        #### Results
+        self.ready = Signal()
+        self.result = Signal(unsigned(32))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        config = self.config
+        a = self.a
+        b = self.b
+        funct3 = self.funct3
+
+        is_div = funct3[2]
+        # MULH/MULHSU take rs1 as signed, MULH also rs2. DIV/REM take both.
+        a_signed = Signal()
+        b_signed = Signal()
+        m.d.comb += a_signed.eq(Mux(is_div, ~funct3[0], (funct3 == MulDivFunct.MULH) | (funct3 == MulDivFunct.MULHSU)))
+        m.d.comb += b_signed.eq(Mux(is_div, ~funct3[0], funct3 == MulDivFunct.MULH))
+
+        a_neg = Signal()
+        b_neg = Signal()
+        a_mag = Signal(unsigned(32))
+        b_mag = Signal(unsigned(32))
+        m.d.comb += [
+            a_neg.eq(a_signed & a[31]),
+            b_neg.eq(b_signed & b[31]),
+            a_mag.eq(Mux(a_neg, -a, a)),
+            b_mag.eq(Mux(b_neg, -b, b)),
+        ]
+
+        #### Multiplier
+        high = funct3 != MulDivFunct.MUL
+        product = Signal(unsigned(64))
+        mul_ready = Signal()
+        mul_start = Signal()
+        m.d.comb += mul_start.eq(self.valid & ~is_div)
+
+        def signed_product(x, y, x_signed, y_signed):
+            return Cat(x, x_signed & x[31]).as_signed() * Cat(y, y_signed & y[31]).as_signed()
+
+        if config.multiplier == Multiplier.SINGLE_CYCLE:
+            m.d.comb += product.eq(signed_product(a, b, a_signed, b_signed))
+            m.d.comb += mul_ready.eq(1)
+
+        elif config.multiplier == Multiplier.PIPELINED:
+            # Operands, then product, registered
+            stage = Signal(range(3))
+            op_a = Signal(unsigned(32))
+            op_b = Signal(unsigned(32))
+            op_a_signed = Signal()
+            op_b_signed = Signal()
+            with m.Switch(stage):
+                with m.Case(0):
+                    with m.If(mul_start):
+                        m.d.sync += [
+                            op_a.eq(a),
+                            op_b.eq(b),
+                            op_a_signed.eq(a_signed),
+                            op_b_signed.eq(b_signed),
+                            stage.eq(1),
+                        ]
+                with m.Case(1):
+                    m.d.sync += product.eq(signed_product(op_a, op_b, op_a_signed, op_b_signed))
+                    m.d.sync += stage.eq(2)
+                with m.Case(2):
+                    m.d.comb += mul_ready.eq(1)
+                    m.d.sync += stage.eq(0)
+            with m.If(~self.valid):
+                m.d.sync += stage.eq(0)
+
+        else:
+            # Adds the shifted multiplicand for each set multiplier bit, on the magnitudes.
+            # It's done once there are no set bits left.
+            busy = Signal()
+            done = Signal()
+            acc = Signal(unsigned(64))
+            multiplicand = Signal(unsigned(64))
+            multiplier = Signal(unsigned(32))
+            count = Signal(range(33))
+            negate = Signal()
+
+            m.d.comb += product.eq(Mux(negate, -acc, acc))
+            with m.If(done):
+                m.d.comb += mul_ready.eq(1)
+                m.d.sync += done.eq(0)
+            with m.Elif(busy):
+                with m.If(multiplier[0]):
+                    m.d.sync += acc.eq(acc + multiplicand)
+                m.d.sync += [
+                    multiplicand.eq(multiplicand << 1),
+                    multiplier.eq(multiplier >> 1),
+                    count.eq(count - 1),
+                ]
+                last = count == 1
+                if config.early_terminate:
+                    last = last | (multiplier[1:] == 0)
+                with m.If(last):
+                    m.d.sync += busy.eq(0)
+                    m.d.sync += done.eq(1)
+            with m.Elif(mul_start):
+                m.d.sync += [
+                    busy.eq(1),
+                    acc.eq(0),
+                    multiplicand.eq(a_mag),
+                    multiplier.eq(b_mag),
+                    count.eq(32),
+                    negate.eq(a_neg ^ b_neg),
+                ]
+            with m.If(~self.valid):
+                m.d.sync += busy.eq(0)
+                m.d.sync += done.eq(0)
+
+        mul_result = Mux(high, product[32:64], product[0:32])
+
+        #### Divider
+        bits = 2 if config.divider_radix == 4 else 1
+
+        div_busy = Signal()
+        div_done = Signal()
+        rem = Signal(unsigned(32))
+        quo = Signal(unsigned(32))      # Dividend bits still to go in at the top, quotient at the bottom
+        divisor = Signal(unsigned(32))
+        steps = Signal(range(32 // bits + 1))
+        neg_quo = Signal()
+        neg_rem = Signal()
+
+        # Skip whole steps of leading zeros of the dividend, they'd only shift in zero bits
+        skip = Signal(range(33))
+        if config.early_terminate:
+            for i in range(32):
+                with m.If(a_mag[i]):
+                    m.d.comb += skip.eq((31 - i) // bits * bits)
+            with m.If(a_mag == 0):
+                m.d.comb += skip.eq(32)
+
+        def step(rem, quo):
+            shifted = Cat(quo[31], rem)
+            diff = Signal(unsigned(33))
+            m.d.comb += diff.eq(shifted - divisor)
+            fits = Signal()
+            m.d.comb += fits.eq(~diff[32])
+            new_rem = Signal(unsigned(32))
+            new_quo = Signal(unsigned(32))
+            m.d.comb += new_rem.eq(Mux(fits, diff[0:32], shifted[0:32]))
+            m.d.comb += new_quo.eq(Cat(fits, quo[0:31]))
+            return new_rem, new_quo
+
+        next_rem, next_quo = rem, quo
+        for _ in range(bits):
+            next_rem, next_quo = step(next_rem, next_quo)
+
+        div_start = Signal()
+        div_ready = Signal()
+        div_result = Signal(unsigned(32))
+        m.d.comb += div_start.eq(self.valid & is_div & ~div_busy & ~div_done)
+        is_rem = funct3[1]
+
+        with m.If(div_done):
+            m.d.comb += div_ready.eq(1)
+            m.d.comb += div_result.eq(Mux(is_rem, Mux(neg_rem, -rem, rem), Mux(neg_quo, -quo, quo)))
+            m.d.sync += div_done.eq(0)
+        with m.Elif(div_busy):
+            m.d.sync += rem.eq(next_rem)
+            m.d.sync += quo.eq(next_quo)
+            m.d.sync += steps.eq(steps - 1)
+            with m.If(steps == 1):
+                m.d.sync += div_busy.eq(0)
+                m.d.sync += div_done.eq(1)
+        with m.Elif(div_start):
+            with m.If(b == 0):
+                # Defined results for a zero divisor, everything ones and the dividend
+                m.d.comb += div_ready.eq(1)
+                m.d.comb += div_result.eq(Mux(is_rem, a, ~0))
+            with m.Else():
+                m.d.sync += [
+                    rem.eq(0),
+                    quo.eq(a_mag << skip),
+                    divisor.eq(b_mag),
+                    neg_quo.eq(a_neg ^ b_neg),
+                    neg_rem.eq(a_neg),
+                ]
+                with m.If(skip == 32):
+                    m.d.sync += div_done.eq(1)
+                with m.Else():
+                    m.d.sync += steps.eq((32 - skip) >> (bits - 1))
+                    m.d.sync += div_busy.eq(1)
+        with m.If(~self.valid):
+            m.d.sync += div_busy.eq(0)
+            m.d.sync += div_done.eq(0)
+
+        #### Result
+        m.d.comb += self.ready.eq(Mux(is_div, div_ready, mul_ready))
+        m.d.comb += self.result.eq(Mux(is_div, div_result, mul_result))
+
+        return m
@@ -38,3 +38,64 @@ class Opcodes(Enum):
     # reserved
     CUSTOM_3 = 0b11110
     # >80b?
+
+class IntImmediate(Enum):
+    # Integer opperations on immediates, as defined by funct3 field
+    ADDI  = 0b000
+    SLTI  = 0b010
+    SLTIU = 0b011
+    XORI  = 0b100
+    ORI   = 0b110
+    ANDI  = 0b111
+
+    SLLI  = 0b001
+    SRxI  = 0b101
+
+class IntRegReg(Enum):
+    # Integer register-register operations, as defined by funct3 field
+    ADD  = 0b000 # Also SUB
+    SLL  = 0b001
+    SLT  = 0b010
+    SLTU = 0b011
+    XOR  = 0b100
+    SRx  = 0b101 # SRL/SRA
+    OR   = 0b110
+    AND  = 0b111
+
+class BranchCondition(Enum):
+    # Different BRANCH conditions, as defined by funct3 field
+    BEQ  = 0b000
+    BNE  = 0b001
+    BLT  = 0b100
+    BGE  = 0b101
+    BLTU = 0b110
+    BGEU = 0b111
+
+class LSWidth(Enum):
+    B = 0b00
+    H = 0b01
+    W = 0b10
+
+class SystemFunct(Enum):
+    # SYSTEM instructions, as defined by funct3 field
+    PRIV   = 0b000 # ECALL/EBREAK/MRET/WFI
+    CSRRW  = 0b001
+    CSRRS  = 0b010
+    CSRRC  = 0b011
+    CSRRWI = 0b101
+    CSRRSI = 0b110
+    CSRRCI = 0b111
+
+class MulDivFunct(Enum):
+    # RV32M operations, OP with funct7 MULDIV, as defined by funct3 field
+    MUL    = 0b000
+    MULH   = 0b001
+    MULHSU = 0b010
+    MULHU  = 0b011
+    DIV    = 0b100
+    DIVU   = 0b101
+    REM    = 0b110
+    REMU   = 0b111
+
+# funct7 of the RV32M instructions
+MULDIV = 0b0000001
@@ -0,0 +1,498 @@
+from nmigen import *
+from nmigen.hdl.rec import Record
+
+from opcodes import BranchCondition
+from predecode import Predecoder, PREDECODE_LAYOUT
+from regfile import RegisterFile
+from alu import ALU
+from muldiv import MulDiv
+from csr import CSRTable
+from lsu import LoadStoreUnit
+from predictor import BranchPredictor
+from tracing import TracePort
+from traps import Cause, MRET, WFI
+import nmigen_soc.wishbone as wishbone
+
+class RV32IPipeline(Elaboratable):
+    """3-stage (fetch, execute, writeback) RV32-I pipeline.
+
+    Fetch keeps a pipelined Wishbone read going every cycle. Without a ``predictor`` it always
+    fetches PC + 4, otherwise the predictor picks the next PC as each instruction comes off
+    the bus. JAL/JALR/BRANCH resolve in execute and flush whatever fetch has in flight if the
+    prediction was wrong. Writeback results are forwarded into execute, so back-to-back
+    dependent instructions don't stall.
+
+    Instructions travel down the pipeline as ``PREDECODE_LAYOUT`` control words rather than
+    raw instructions, execute doesn't decode anything. If the fetch port has them stored
+    already (an instruction cache or prefetch queue with predecode), pass its ``predecoded``
+    record, otherwise a ``Predecoder`` sits on the fetched data.
+
+    With RV32C the fetch port is a ``RealignBuffer``, pass its ``compressed`` flag to step the
+    PC by 2 past compressed instructions.
+
+    A ``tracer`` gets every instruction as it leaves execute, and its register write from
+    writeback. The raw instruction is only carried down the pipeline for it.
+
+    Integer ops and branch comparisons use ``alu``, execute stalls if it takes more than a
+    cycle. Results are registered into writeback anyway, so the ALU's own output register
+    only costs a stall here. RV32M instructions go to ``muldiv`` the same way, if there is one.
+
+    CSR instructions access ``csr`` in execute, in a single cycle, and the pipeline drives the
+    fetch/branch events of its performance counters.
+
+    Loads and stores issue to ``lsu`` from execute, which stalls until the LSU is done with
+    them: a store once the bus accepts it, a load once its data is back.
+
+    Traps are taken from execute through ``csr.traps``, flushing fetch like a mispredict. An
+    exception replaces the instruction that raised it. A pending interrupt replaces whatever
+    instruction is in execute, even part way through a stall, unless it's a load already on
+    the bus.
+    """
+    def __init__(self, mem_bus: wishbone.Interface, regfile: RegisterFile, alu: ALU, csr: CSRTable,
+                 lsu: LoadStoreUnit, predictor: BranchPredictor = None, predecoded: Record = None,
+                 muldiv: MulDiv = None, compressed: Value = None, tracer: TracePort = None,
+                 pc: Signal = None):
+        self.mem = mem_bus
+        self.predecoded = predecoded
+        self.muldiv = muldiv
+        self.rvc = compressed is not None
+        self.compressed = compressed if compressed is not None else Const(0)
+        self.regfile = regfile
+        self.alu = alu
+        self.csr = csr
+        self.lsu = lsu
+        self.predictor = predictor
+        self.tracer = tracer
+        # Fetch address register, the core's if it has one, fetching starts at its reset value
+        self.pc = pc if pc is not None else Signal(unsigned(32), name="fetch_pc")
+
+        # Pulsed when FENCE.I executes
+        self.fence_i = Signal()
+        # Pulsed for every retired instruction
+        self.retire = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.regfile = self.regfile
+        m.submodules.alu = alu = self.alu
+
+        regfile = self.regfile
+        csr = self.csr
+        lsu = self.lsu
+        counters = csr.counters
+        trap = csr.traps
+
+        #### Fetch state
+        fetch_pc = self.pc                  # Address of the next read to issue
+        pending = Signal()                  # A read is outstanding on the bus
+        pending_pc = Signal(unsigned(32))
+        pending_kill = Signal()             # Outstanding read was made stale by a redirect
+        # A read the slave stalled stays on the bus unchanged until it's accepted, even if a
+        # redirect makes it stale in the meantime
+        hold = Signal()
+        hold_pc = Signal(unsigned(32))
+        hold_kill = Signal()
+
+        # Skid buffer, catches a fetch that returns while execute is stalled
+        skid_valid = Signal()
+        skid_pc = Signal(unsigned(32))
+        skid_compressed = Signal()
+        skid_ctrl = Record(PREDECODE_LAYOUT)
+        skid_pred_taken = Signal()
+        skid_pred_target = Signal(unsigned(32))
+        skid_pred_snapshot = Signal(len(self.predictor.snapshot) if self.predictor is not None else 0)
+        skid_insn = Signal(unsigned(32))
+
+        #### Execute stage registers
+        ex_valid = Signal()
+        ex_pc = Signal(unsigned(32))
+        ex_compressed = Signal()
+        ex_ctrl = Record(PREDECODE_LAYOUT)
+        ex_pred_taken = Signal()
+        ex_pred_target = Signal(unsigned(32))
+        ex_pred_snapshot = Signal.like(skid_pred_snapshot)
+        ex_insn = Signal(unsigned(32))
+        # Held high by multi-cycle operations
+        ex_stall = Signal()
+        # The instruction in execute is replaced by a trap
+        ex_trap = Signal()
+
+        #### Writeback stage registers
+        wb_valid = Signal()
+        wb_rd = Signal(unsigned(5))
+        wb_data = Signal(unsigned(32))
+
+        # Control transfer resolved in execute
+        redirect = Signal()
+        redirect_pc = Signal(unsigned(32))
+
+        #### Fetch
+        stall = self.mem.stall if hasattr(self.mem, "stall") else Const(0)
+
+        fetch_done = Signal()   # Outstanding read completes this cycle
+        fetch_new = Signal()    # ... and it should enter the pipeline
+        ex_accept = Signal()    # Execute registers load this cycle
+        skid_next = Signal()    # Skid buffer will be full next cycle
+        issue = Signal()
+
+        m.d.comb += [
+            fetch_done.eq(pending & self.mem.ack),
+            fetch_new.eq(fetch_done & ~pending_kill & ~redirect),
+            ex_accept.eq(~ex_valid | ~ex_stall),
+            skid_next.eq(Mux(ex_accept, skid_valid & fetch_new, skid_valid | fetch_new)),
+        ]
+
+        # Only issue a read once the previous one has returned, and only when there is
+        # somewhere to put the response. A held read already had both.
+        m.d.comb += issue.eq(~hold & (~pending | fetch_done) & ~skid_next & ~redirect)
+
+        # Predict the instruction coming off the bus. As only one read is ever outstanding,
+        # nothing younger has been fetched yet and a predicted-taken branch costs no bubble.
+        pred_taken = Signal()
+        pred_target = Signal(unsigned(32))
+        pred_snapshot = Signal.like(skid_pred_snapshot)
+        if self.predictor is not None:
+            m.submodules.predictor = predictor = self.predictor
+            m.d.comb += [
+                predictor.valid.eq(fetch_new),
+                predictor.pc.eq(pending_pc),
+                predictor.instr.eq(self.mem.dat_r),
+                predictor.compressed.eq(self.compressed),
+                pred_taken.eq(fetch_new & predictor.taken),
+                pred_target.eq(predictor.target),
+                pred_snapshot.eq(predictor.snapshot),
+            ]
+
+        # Control word of the instruction coming off the bus
+        if self.predecoded is not None:
+            fetch_ctrl = self.predecoded
+        else:
+            m.submodules.predecoder = predecoder = Predecoder()
+            m.d.comb += predecoder.instr.eq(self.mem.dat_r)
+            fetch_ctrl = predecoder.out
+
+        next_pc = Signal(unsigned(32))
+        # fetch_pc assumes the outstanding read is a 32-bit instruction
+        m.d.comb += next_pc.eq(Mux(pred_taken, pred_target,
+                                   Mux(fetch_new & self.compressed, pending_pc + 2, fetch_pc)))
+
+        m.d.comb += [
+            self.mem.adr.eq(Mux(hold, hold_pc, next_pc)),
+            self.mem.we.eq(0),
+            self.mem.sel.eq(~0),
+            self.mem.stb.eq(issue | hold),
+            self.mem.cyc.eq(issue | hold | pending),
+        ]
+
+        with m.If(self.mem.stb & stall):
+            m.d.sync += hold.eq(1)
+            m.d.sync += hold_pc.eq(self.mem.adr)
+            m.d.sync += hold_kill.eq((hold & hold_kill) | redirect)
+        with m.Else():
+            m.d.sync += hold.eq(0)
+
+        # While holding, nothing is outstanding: the held read was issued as the one before
+        # it returned
+        with m.If(self.mem.stb & ~stall):
+            m.d.sync += pending.eq(1)
+            m.d.sync += pending_pc.eq(self.mem.adr)
+            m.d.sync += pending_kill.eq(hold & (hold_kill | redirect))
+        with m.Elif(fetch_done):
+            m.d.sync += pending.eq(0)
+
+        with m.If(issue & ~stall):
+            m.d.sync += fetch_pc.eq(next_pc + 4)
+        with m.Elif(hold & ~stall & ~hold_kill):
+            m.d.sync += fetch_pc.eq(hold_pc + 4)
+        with m.Elif(~hold):
+            m.d.sync += fetch_pc.eq(next_pc)
+
+        with m.If(redirect):
+            m.d.sync += fetch_pc.eq(redirect_pc)
+            with m.If(pending & ~fetch_done):
+                m.d.sync += pending_kill.eq(1)
+
+        #### Fetch -> execute
+        with m.If(redirect):
+            m.d.sync += ex_valid.eq(0)
+            m.d.sync += skid_valid.eq(0)
+        with m.Elif(ex_accept):
+            with m.If(skid_valid):
+                m.d.sync += ex_valid.eq(1)
+                m.d.sync += ex_pc.eq(skid_pc)
+                m.d.sync += ex_compressed.eq(skid_compressed)
+                m.d.sync += ex_ctrl.eq(skid_ctrl)
+                m.d.sync += ex_pred_taken.eq(skid_pred_taken)
+                m.d.sync += ex_pred_target.eq(skid_pred_target)
+                m.d.sync += ex_pred_snapshot.eq(skid_pred_snapshot)
+                if self.tracer is not None:
+                    m.d.sync += ex_insn.eq(skid_insn)
+            with m.Elif(fetch_new):
+                m.d.sync += ex_valid.eq(1)
+                m.d.sync += ex_pc.eq(pending_pc)
+                m.d.sync += ex_compressed.eq(self.compressed)
+                m.d.sync += ex_ctrl.eq(fetch_ctrl)
+                m.d.sync += ex_pred_taken.eq(pred_taken)
+                m.d.sync += ex_pred_target.eq(pred_target)
+                m.d.sync += ex_pred_snapshot.eq(pred_snapshot)
+                if self.tracer is not None:
+                    m.d.sync += ex_insn.eq(self.mem.dat_r)
+            with m.Else():
+                m.d.sync += ex_valid.eq(0)
+
+        m.d.sync += skid_valid.eq(skid_next & ~redirect)
+        with m.If(fetch_new & (skid_valid | ~ex_accept)):
+            m.d.sync += skid_pc.eq(pending_pc)
+            m.d.sync += skid_compressed.eq(self.compressed)
+            m.d.sync += skid_ctrl.eq(fetch_ctrl)
+            m.d.sync += skid_pred_taken.eq(pred_taken)
+            m.d.sync += skid_pred_target.eq(pred_target)
+            m.d.sync += skid_pred_snapshot.eq(pred_snapshot)
+            if self.tracer is not None:
+                m.d.sync += skid_insn.eq(self.mem.dat_r)
+
+        #### Execute
+        ctrl = ex_ctrl
+
+        # Both source fields are always read. Synchronous reads need the addresses a cycle
+        # early, from the instruction execute is about to take.
+        if regfile.sync_read:
+            read_ctrl = Record(PREDECODE_LAYOUT)
+            with m.If(ex_accept & skid_valid):
+                m.d.comb += read_ctrl.eq(skid_ctrl)
+            with m.Elif(ex_accept & fetch_new):
+                m.d.comb += read_ctrl.eq(fetch_ctrl)
+            with m.Else():
+                m.d.comb += read_ctrl.eq(ex_ctrl)
+        else:
+            read_ctrl = ex_ctrl
+        m.d.comb += regfile.raddr1.eq(read_ctrl.rs1)
+        m.d.comb += regfile.raddr2.eq(read_ctrl.rs2)
+
+        # Forward from writeback, the register file only sees the write at the end of this cycle
+        rs1 = Signal(unsigned(32))
+        rs2 = Signal(unsigned(32))
+        m.d.comb += rs1.eq(Mux(wb_valid & (wb_rd == ctrl.rs1), wb_data, regfile.rdata1))
+        m.d.comb += rs2.eq(Mux(wb_valid & (wb_rd == ctrl.rs2), wb_data, regfile.rdata2))
+
+        imm = ctrl.imm
+        # Address of the instruction after this one
+        ex_next_pc = Signal(unsigned(32))
+        m.d.comb += ex_next_pc.eq(ex_pc + Mux(ex_compressed, 2, 4))
+        m.d.comb += [
+            alu.valid.eq(ex_valid & ~ex_trap & ctrl.alu),
+            alu.a.eq(rs1),
+            alu.b.eq(Mux(ctrl.alu_imm, imm, rs2)),
+            alu.funct3.eq(ctrl.funct3),
+            alu.alt.eq(ctrl.alt),
+            alu.branch.eq(ctrl.branch),
+        ]
+
+        # Only one of the instruction class bits is ever set
+        result = Signal(unsigned(32))
+        taken = Signal()
+        target = Signal(unsigned(32))
+
+        with m.If(ctrl.alu):
+            m.d.comb += result.eq(alu.result)
+
+        muldiv_busy = Signal()
+        if self.muldiv is not None:
+            m.submodules.muldiv = muldiv = self.muldiv
+            m.d.comb += [
+                muldiv.valid.eq(ex_valid & ~ex_trap & ctrl.muldiv),
+                muldiv.funct3.eq(ctrl.funct3),
+                muldiv.a.eq(rs1),
+                muldiv.b.eq(rs2),
+                muldiv_busy.eq(ctrl.muldiv & ~muldiv.ready),
+            ]
+            with m.If(ctrl.muldiv):
+                m.d.comb += result.eq(muldiv.result)
+
+        with m.If(ctrl.lui):
+            m.d.comb += result.eq(imm)
+
+        with m.If(ctrl.auipc):
+            m.d.comb += result.eq(ex_pc + imm)
+
+        with m.If(ctrl.jal):
+            m.d.comb += result.eq(ex_next_pc)
+            m.d.comb += taken.eq(1)
+            m.d.comb += target.eq(ex_pc + imm)
+
+        with m.If(ctrl.jalr):
+            m.d.comb += result.eq(ex_next_pc)
+            m.d.comb += taken.eq(1)
+            m.d.comb += target.eq((rs1 + imm) & ~1)
+
+        with m.If(ctrl.branch):
+            m.d.comb += target.eq(ex_pc + imm)
+            with m.Switch(ctrl.funct3):
+                with m.Case(BranchCondition.BEQ):
+                    m.d.comb += taken.eq(alu.eq)
+                with m.Case(BranchCondition.BNE):
+                    m.d.comb += taken.eq(~alu.eq)
+                with m.Case(BranchCondition.BLT):
+                    m.d.comb += taken.eq(alu.lt)
+                with m.Case(BranchCondition.BGE):
+                    m.d.comb += taken.eq(~alu.lt)
+                with m.Case(BranchCondition.BLTU):
+                    m.d.comb += taken.eq(alu.ltu)
+                with m.Case(BranchCondition.BGEU):
+                    m.d.comb += taken.eq(~alu.ltu)
+
+        with m.If(ctrl.load):
+            m.d.comb += result.eq(lsu.load_data)
+
+        # FENCE waits for stores to land, accesses are otherwise in order
+        with m.If(ctrl.fence_i):
+            # FENCE.I, refetch everything behind it once stores have reached memory
+            m.d.comb += lsu.clean.eq(ex_valid)
+            m.d.comb += self.fence_i.eq(self.retire)
+            m.d.comb += taken.eq(1)
+            m.d.comb += target.eq(ex_next_pc)
+
+        # MRET, WFI is a NOP. ECALL/EBREAK are exceptions.
+        is_mret = Signal()
+        m.d.comb += is_mret.eq(ctrl.priv & (imm[0:12] == MRET))
+        with m.If(is_mret):
+            m.d.comb += trap.mret.eq(self.retire)
+            m.d.comb += taken.eq(1)
+            m.d.comb += target.eq(trap.mepc)
+
+        with m.If(ctrl.csr):
+            m.d.comb += csr.valid.eq(self.retire)
+            m.d.comb += result.eq(csr.rdata)
+
+        #### Traps
+        # Synchronous exceptions, raised before the instruction does anything
+        exception = Signal()
+        cause = Signal(Cause)
+        tval = Signal(unsigned(32))
+        is_mem = Signal()
+        m.d.comb += is_mem.eq(ctrl.load | ctrl.store)
+
+        illegal = Signal()
+        legal_priv = (imm[0:12] == 0) | (imm[0:12] == 1) | (imm[0:12] == MRET) | (imm[0:12] == WFI)
+        m.d.comb += illegal.eq(ctrl.illegal | (ctrl.csr & csr.illegal) | (ctrl.priv & ~legal_priv) |
+                               (ctrl.muldiv if self.muldiv is None else 0))
+        # Without RV32C instructions have to be 4-byte aligned
+        target_misaligned = Signal()
+        if self.rvc:
+            m.d.comb += target_misaligned.eq(0)
+        else:
+            m.d.comb += target_misaligned.eq((ctrl.jal | ctrl.jalr | ctrl.branch) & taken & target[1])
+
+        with m.If(illegal):
+            m.d.comb += exception.eq(1)
+            m.d.comb += cause.eq(Cause.ILLEGAL_INSN)
+        with m.Elif(ctrl.priv & (imm[0:12] == 0)):
+            m.d.comb += exception.eq(1)
+            m.d.comb += cause.eq(Cause.ECALL_M)
+        with m.Elif(ctrl.priv & (imm[0:12] == 1)):
+            m.d.comb += exception.eq(1)
+            m.d.comb += cause.eq(Cause.BREAKPOINT)
+            m.d.comb += tval.eq(ex_pc)
+        with m.Elif(target_misaligned):
+            m.d.comb += exception.eq(1)
+            m.d.comb += cause.eq(Cause.INSN_MISALIGNED)
+            m.d.comb += tval.eq(target)
+        with m.Elif(is_mem & lsu.misaligned):
+            m.d.comb += exception.eq(1)
+            m.d.comb += cause.eq(Mux(ctrl.store, Cause.STORE_MISALIGNED, Cause.LOAD_MISALIGNED))
+            m.d.comb += tval.eq(lsu.addr)
+
+        # A load can't be called back once it's on the bus
+        take_interrupt = Signal()
+        m.d.comb += take_interrupt.eq(ex_valid & trap.pending & ~lsu.loading)
+        m.d.comb += ex_trap.eq(ex_valid & (take_interrupt | exception))
+        m.d.comb += [
+            trap.interrupt.eq(take_interrupt),
+            trap.exception.eq(ex_trap & ~take_interrupt),
+            trap.cause.eq(cause),
+            trap.tval.eq(tval),
+            trap.epc.eq(ex_pc),
+        ]
+
+        #### Load/store
+        m.d.comb += [
+            lsu.valid.eq(ex_valid & ~ex_trap & is_mem),
+            lsu.store.eq(ctrl.store),
+            lsu.funct3.eq(ctrl.funct3),
+            lsu.addr.eq(rs1 + imm),
+            lsu.wdata.eq(rs2),
+        ]
+        m.d.comb += ex_stall.eq(ex_valid & ~ex_trap &
+                                ((ctrl.alu & ~alu.ready) | muldiv_busy | (is_mem & ~lsu.done) |
+                                 (ctrl.fence & lsu.busy) | (ctrl.fence_i & (lsu.busy | lsu.dirty))))
+
+        # Fetch went down the wrong path if the predicted next PC doesn't match
+        mispredict = Signal()
+        m.d.comb += mispredict.eq(Mux(taken, ~ex_pred_taken | (ex_pred_target != target), ex_pred_taken))
+        m.d.comb += redirect.eq((ex_valid & ~ex_stall & mispredict) | ex_trap)
+        m.d.comb += redirect_pc.eq(Mux(ex_trap, trap.vector, Mux(taken, target, ex_next_pc)))
+
+        if self.predictor is not None:
+            m.d.comb += [
+                predictor.update.eq(self.retire & (ctrl.jal | ctrl.jalr | ctrl.branch)),
+                predictor.update_pc.eq(ex_pc),
+                predictor.update_branch.eq(ctrl.branch),
+                predictor.update_indirect.eq(ctrl.jalr),
+                predictor.update_taken.eq(taken),
+                predictor.update_target.eq(target),
+                predictor.update_mispredict.eq(mispredict),
+                predictor.restore.eq(redirect),
+                predictor.restore_snapshot.eq(ex_pred_snapshot),
+                predictor.restore_replaced.eq(ex_trap),
+            ]
+
+        m.d.comb += self.retire.eq(ex_valid & ~ex_stall & ~ex_trap)
+
+        m.d.comb += [
+            csr.funct3.eq(ctrl.funct3),
+            csr.addr.eq(imm[0:12]),
+            csr.rs1.eq(rs1),
+            csr.uimm.eq(ctrl.rs1),
+        ]
+
+        #### Performance counters
+        is_branch = Signal()
+        m.d.comb += is_branch.eq(self.retire & ctrl.branch)
+        m.d.comb += [
+            # Execute is empty, whether fetch is slow or refilling after a redirect
+            counters.fetch_stall.eq(~ex_valid),
+            counters.branch.eq(is_branch),
+            counters.branch_taken.eq(is_branch & taken),
+            counters.mispredict.eq(redirect),
+            counters.load_stall.eq(ex_valid & ex_stall & ctrl.load),
+            counters.store_stall.eq(ex_valid & ex_stall & ctrl.store),
+            counters.muldiv.eq(self.retire & ctrl.muldiv),
+            counters.muldiv_stall.eq(ex_valid & ex_stall & ctrl.muldiv),
+        ]
+
+        #### Writeback
+        m.d.sync += wb_valid.eq(self.retire & ctrl.rd_valid)
+        m.d.sync += wb_rd.eq(ctrl.rd)
+        m.d.sync += wb_data.eq(result)
+
+        m.d.comb += regfile.waddr.eq(wb_rd)
+        m.d.comb += regfile.wdata.eq(wb_data)
+        m.d.comb += regfile.wen.eq(wb_valid)
+
+        #### Trace
+        if self.tracer is not None:
+            m.submodules.trace = tracer = self.tracer
+            m.d.comb += [
+                tracer.retire.eq(self.retire),
+                tracer.pc.eq(ex_pc),
+                tracer.insn.eq(ex_insn),
+                tracer.mem_valid.eq(is_mem),
+                tracer.mem_store.eq(ctrl.store),
+                tracer.mem_addr.eq(lsu.addr),
+                tracer.mem_sel.eq(lsu.sel),
+                tracer.rd_wen.eq(wb_valid),
+                tracer.rd_addr.eq(wb_rd),
+                tracer.rd_wdata.eq(wb_data),
+            ]
+
+        return m
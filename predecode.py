@@ -0,0 +1,157 @@
+from nmigen import *
+from nmigen.hdl.rec import Layout, Record
+
+from opcodes import Opcodes, IntImmediate, IntRegReg, SystemFunct, MULDIV
+
+# Control word an instruction is predecoded into, everything execute needs without looking
+# at the raw instruction again
+PREDECODE_LAYOUT = Layout([
+    # Instruction class, one-hot
+    ("alu",         1),     # OP/OP_IMM
+    ("muldiv",      1),     # RV32M, OP with funct7 MULDIV
+    ("lui",         1),
+    ("auipc",       1),
+    ("jal",         1),
+    ("jalr",        1),
+    ("branch",      1),
+    ("load",        1),
+    ("store",       1),
+    ("fence",       1),
+    ("fence_i",     1),
+    ("csr",         1),     # CSRRW/CSRRS/CSRRC and the immediate forms
+    ("priv",        1),     # ECALL/EBREAK/MRET/WFI
+    ("illegal",     1),     # None of the above
+
+    # funct3 of the instruction, so ALU or multiply/divide op, branch condition, load/store
+    # width or CSR op
+    ("funct3",      3),
+    ("alt",         1),     # SUB/SRA/SRAI, as ALU.alt
+    ("alu_imm",     1),     # ALU operand b is the immediate, not rs2
+    # Immediate of whichever format, sign-extended. The CSR address is its low 12 bits.
+    ("imm",         32),
+
+    ("rs1",         5),     # Also the CSR immediate
+    ("rs2",         5),
+    ("rd",          5),
+    ("rs1_valid",   1),
+    ("rs2_valid",   1),
+    ("rd_valid",    1),     # Writes a register other than x0
+])
+
+class Predecoder(Elaboratable):
+    """Turns a raw instruction into a ``PREDECODE_LAYOUT`` control word.
+
+    Purely combinational, it's meant to sit where instructions are fetched or stored (the
+    instruction cache refill, the prefetch queue) so its output can be registered along with
+    the instruction and execute only has ready-made control bits to look at.
+    """
+    def __init__(self):
+        self.instr = Signal(unsigned(32))
+        self.out = Record(PREDECODE_LAYOUT)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        instr = self.instr
+        out = self.out
+
+        opcode = Signal(Opcodes)
+        funct3 = instr[12:15]
+        funct7 = instr[25:32]
+        m.d.comb += opcode.eq(instr[2:7])
+
+        imm_i = Cat(instr[20:32], Repl(instr[31], 20))
+        imm_s = Cat(instr[7:12], instr[25:32], Repl(instr[31], 20))
+        imm_b = Cat(Const(0, 1), instr[8:12], instr[25:31], instr[7], Repl(instr[31], 20))
+        imm_u = Cat(Const(0, 12), instr[12:32])
+        imm_j = Cat(Const(0, 1), instr[21:31], instr[20], instr[12:20], Repl(instr[31], 12))
+
+        writes = Signal()
+        m.d.comb += [
+            out.funct3.eq(funct3),
+            out.rs1.eq(instr[15:20]),
+            out.rs2.eq(instr[20:25]),
+            out.rd.eq(instr[7:12]),
+            out.rd_valid.eq(writes & (instr[7:12] != 0)),
+        ]
+
+        # Only 32-bit instructions
+        with m.If(instr[0:2] != 0b11):
+            m.d.comb += out.illegal.eq(1)
+        with m.Else():
+            with m.Switch(opcode):
+                with m.Case(Opcodes.OP_IMM):
+                    # Shifts by more than 31, or SRAI's funct7 on anything else, are reserved
+                    bad_shift = Mux(funct3 == IntImmediate.SRxI, (funct7 != 0) & (funct7 != 0b0100000),
+                                    (funct3 == IntImmediate.SLLI) & (funct7 != 0))
+                    m.d.comb += [
+                        out.alu.eq(~bad_shift),
+                        out.illegal.eq(bad_shift),
+                        out.alu_imm.eq(1),
+                        out.alt.eq(instr[30] & (funct3 == IntImmediate.SRxI)),
+                        out.imm.eq(imm_i),
+                        out.rs1_valid.eq(1),
+                        writes.eq(~bad_shift),
+                    ]
+                with m.Case(Opcodes.OP):
+                    # Only ADD/SUB and SRL/SRA have an alternate form
+                    alu = (funct7 == 0) | ((funct7 == 0b0100000) &
+                                           ((funct3 == IntRegReg.ADD) | (funct3 == IntRegReg.SRx)))
+                    m.d.comb += [
+                        out.alu.eq(alu),
+                        out.muldiv.eq(funct7 == MULDIV),
+                        out.illegal.eq(~alu & (funct7 != MULDIV)),
+                        out.alt.eq(instr[30]),
+                        out.rs1_valid.eq(1),
+                        out.rs2_valid.eq(1),
+                        writes.eq(1),
+                    ]
+                with m.Case(Opcodes.LUI):
+                    m.d.comb += [out.lui.eq(1), out.imm.eq(imm_u), writes.eq(1)]
+                with m.Case(Opcodes.AUIPC):
+                    m.d.comb += [out.auipc.eq(1), out.imm.eq(imm_u), writes.eq(1)]
+                with m.Case(Opcodes.JAL):
+                    m.d.comb += [out.jal.eq(1), out.imm.eq(imm_j), writes.eq(1)]
+                with m.Case(Opcodes.JALR):
+                    with m.If(funct3 == 0):
+                        m.d.comb += [out.jalr.eq(1), out.imm.eq(imm_i), out.rs1_valid.eq(1), writes.eq(1)]
+                    with m.Else():
+                        m.d.comb += out.illegal.eq(1)
+                with m.Case(Opcodes.BRANCH):
+                    # funct3 2 and 3 are reserved
+                    with m.If(funct3[1:] != 0b01):
+                        m.d.comb += [out.branch.eq(1), out.imm.eq(imm_b), out.rs1_valid.eq(1),
+                                     out.rs2_valid.eq(1)]
+                    with m.Else():
+                        m.d.comb += out.illegal.eq(1)
+                with m.Case(Opcodes.LOAD):
+                    # LB/LH/LW and LBU/LHU
+                    with m.If((funct3 != 0b011) & (funct3[1:] != 0b11)):
+                        m.d.comb += [out.load.eq(1), out.imm.eq(imm_i), out.rs1_valid.eq(1), writes.eq(1)]
+                    with m.Else():
+                        m.d.comb += out.illegal.eq(1)
+                with m.Case(Opcodes.STORE):
+                    # SB/SH/SW
+                    with m.If(~funct3[2] & (funct3[0:2] != 0b11)):
+                        m.d.comb += [out.store.eq(1), out.imm.eq(imm_s), out.rs1_valid.eq(1),
+                                     out.rs2_valid.eq(1)]
+                    with m.Else():
+                        m.d.comb += out.illegal.eq(1)
+                with m.Case(Opcodes.MISC_MEM):
+                    m.d.comb += [
+                        out.fence.eq(funct3 == 0),
+                        out.fence_i.eq(funct3 == 1),
+                        out.illegal.eq(funct3[1:] != 0),
+                    ]
+                with m.Case(Opcodes.SYSTEM):
+                    m.d.comb += out.imm.eq(imm_i)
+                    with m.If(funct3 == SystemFunct.PRIV):
+                        m.d.comb += out.priv.eq(1)
+                    with m.Elif(funct3 == 0b100):
+                        m.d.comb += out.illegal.eq(1)
+                    with m.Else():
+                        m.d.comb += [out.csr.eq(1), out.rs1_valid.eq(~funct3[2]), writes.eq(1)]
+                with m.Default():
+                    m.d.comb += out.illegal.eq(1)
+
+        return m
@@ -0,0 +1,189 @@
+from dataclasses import dataclass
+
+from nmigen import *
+from nmigen.utils import log2_int
+
+from opcodes import Opcodes
+from instruction_decoder import InstructionDecoder
+
+@dataclass
+class PredictorConfig:
+    # All zero is a purely static backward-taken/forward-not-taken predictor
+    bht_entries: int = 0    # 2-bit counters for conditional branches
+    btb_entries: int = 0    # Target cache for JALR
+    ras_depth: int = 0      # Return address stack
+
+class BranchPredictor(Elaboratable):
+    """Next-PC predictor for the pipelined core's fetch stage.
+
+    Predictions are made from the fetched word as it comes off the bus, using its own
+    ``InstructionDecoder`` for the B/J immediates:
+
+    - JAL is always taken.
+    - BRANCH uses the 2-bit counter from the BHT if it has seen that branch, and
+      backward-taken/forward-not-taken otherwise.
+    - JALR that looks like a return (rd=x0, rs1=x1/x5) pops the RAS, any other JALR uses the BTB.
+      JAL/JALR with rd=x1/x5 push the address after them on the RAS, PC + 2 if ``compressed``.
+
+    Execute reports every resolved JAL/JALR/BRANCH on the ``update_*`` port, which trains the
+    tables and counts ``mispredicts``. ``lookups`` counts control transfers seen by fetch.
+
+    The RAS is updated speculatively, so ``snapshot`` is its pointer and top entry as they are
+    after each prediction, and whether it pushed or popped. It travels down the pipeline with
+    the instruction, and when execute redirects fetch it's put back with ``restore``, undoing
+    whatever the wrong path did. If the instruction itself was replaced by a trap
+    (``restore_replaced``) its own push or pop is undone too, as it will run again. Entries
+    below the top that the wrong path overwrote stay lost.
+    """
+    def __init__(self, config: PredictorConfig):
+        self.config = config
+
+        self.decoder = InstructionDecoder()
+
+        #### Prediction, for the instruction arriving from the bus
+        self.valid = Signal()
+        self.pc = Signal(unsigned(32))
+        self.instr = Signal(unsigned(32))
+        self.compressed = Signal()          # ``instr`` was expanded from RV32C
+        self.taken = Signal()
+        self.target = Signal(unsigned(32))
+        if config.ras_depth:
+            self.snapshot = Signal(len(Signal(range(config.ras_depth))) + 32 + 2)
+        else:
+            self.snapshot = Signal(0)
+
+        #### Resolution, from execute
+        self.update = Signal()
+        self.update_pc = Signal(unsigned(32))
+        self.update_branch = Signal()       # Conditional branch
+        self.update_indirect = Signal()     # JALR
+        self.update_taken = Signal()
+        self.update_target = Signal(unsigned(32))
+        self.update_mispredict = Signal()
+        # Fetch is redirected, go back to the RAS state of the instruction in execute
+        self.restore = Signal()
+        self.restore_snapshot = Signal(len(self.snapshot))
+        self.restore_replaced = Signal()
+
+        #### Statistics
+        self.lookups = Signal(unsigned(32))
+        self.mispredicts = Signal(unsigned(32))
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.decoder = decoder = self.decoder
+
+        config = self.config
+
+        m.d.comb += decoder.instr.eq(self.instr)
+
+        def is_link(reg):
+            return (reg == 1) | (reg == 5)
+
+        # Static prediction
+        with m.Switch(decoder.opcode):
+            with m.Case(Opcodes.JAL):
+                m.d.comb += self.taken.eq(1)
+                m.d.comb += self.target.eq(self.pc + decoder.imm)
+            with m.Case(Opcodes.BRANCH):
+                m.d.comb += self.taken.eq(decoder.imm[31])
+                m.d.comb += self.target.eq(self.pc + decoder.imm)
+
+        with m.If(self.valid & ((decoder.opcode == Opcodes.JAL) |
+                                (decoder.opcode == Opcodes.JALR) |
+                                (decoder.opcode == Opcodes.BRANCH))):
+            m.d.sync += self.lookups.eq(self.lookups + 1)
+
+        with m.If(self.update & self.update_mispredict):
+            m.d.sync += self.mispredicts.eq(self.mispredicts + 1)
+
+        #### Branch history table
+        if config.bht_entries:
+            bits = log2_int(config.bht_entries)
+            counters = Array(Signal(2, name=f"bht{i}") for i in range(config.bht_entries))
+            seen = Array(Signal(name=f"bht_seen{i}") for i in range(config.bht_entries))
+
+            lookup_index = self.pc[2:2 + bits]
+            with m.If((decoder.opcode == Opcodes.BRANCH) & seen[lookup_index]):
+                m.d.comb += self.taken.eq(counters[lookup_index][1])
+
+            update_index = self.update_pc[2:2 + bits]
+            counter = counters[update_index]
+            with m.If(self.update & self.update_branch):
+                m.d.sync += seen[update_index].eq(1)
+                with m.If(~seen[update_index]):
+                    # Start out weakly biased towards what just happened
+                    m.d.sync += counter.eq(Mux(self.update_taken, 0b10, 0b01))
+                with m.Elif(self.update_taken & (counter != 0b11)):
+                    m.d.sync += counter.eq(counter + 1)
+                with m.Elif(~self.update_taken & (counter != 0b00)):
+                    m.d.sync += counter.eq(counter - 1)
+
+        #### Branch target buffer
+        if config.btb_entries:
+            bits = log2_int(config.btb_entries)
+            tags = Array(Signal(30 - bits, name=f"btb_tag{i}") for i in range(config.btb_entries))
+            targets = Array(Signal(32, name=f"btb_target{i}") for i in range(config.btb_entries))
+            valid = Array(Signal(name=f"btb_valid{i}") for i in range(config.btb_entries))
+
+            lookup_index = self.pc[2:2 + bits]
+            with m.If((decoder.opcode == Opcodes.JALR) & valid[lookup_index] &
+                      (tags[lookup_index] == self.pc[2 + bits:])):
+                m.d.comb += self.taken.eq(1)
+                m.d.comb += self.target.eq(targets[lookup_index])
+
+            update_index = self.update_pc[2:2 + bits]
+            with m.If(self.update & self.update_indirect):
+                m.d.sync += valid[update_index].eq(1)
+                m.d.sync += tags[update_index].eq(self.update_pc[2 + bits:])
+                m.d.sync += targets[update_index].eq(self.update_target)
+
+        #### Return address stack
+        if config.ras_depth:
+            stack = Array(Signal(32, name=f"ras{i}") for i in range(config.ras_depth))
+            # Points at the next free entry, wraps around and overwrites the oldest on overflow
+            ptr = Signal(range(config.ras_depth))
+            top = Signal(range(config.ras_depth))
+            m.d.comb += top.eq(Mux(ptr == 0, config.ras_depth - 1, ptr - 1))
+
+            is_call = ((decoder.opcode == Opcodes.JAL) | (decoder.opcode == Opcodes.JALR)) & is_link(decoder.dest)
+            is_return = (decoder.opcode == Opcodes.JALR) & (decoder.dest == 0) & is_link(decoder.src1)
+
+            with m.If(is_return):
+                m.d.comb += self.taken.eq(1)
+                m.d.comb += self.target.eq(stack[top])
+
+            # Pointer and top entry once this instruction has pushed or popped
+            after_ptr = Signal.like(ptr)
+            after_top = Signal(32)
+            with m.If(is_call):
+                m.d.comb += after_ptr.eq(Mux(ptr == config.ras_depth - 1, 0, ptr + 1))
+                m.d.comb += after_top.eq(self.pc + Mux(self.compressed, 2, 4))
+            with m.Elif(is_return):
+                m.d.comb += after_ptr.eq(top)
+                m.d.comb += after_top.eq(stack[Mux(top == 0, config.ras_depth - 1, top - 1)])
+            with m.Else():
+                m.d.comb += after_ptr.eq(ptr)
+                m.d.comb += after_top.eq(stack[top])
+            m.d.comb += self.snapshot.eq(Cat(after_ptr, after_top, is_call, is_return))
+
+            restore_ptr = self.restore_snapshot[:len(ptr)]
+            restore_top = self.restore_snapshot[len(ptr):len(ptr) + 32]
+            restore_call = self.restore_snapshot[-2]
+            restore_return = self.restore_snapshot[-1]
+            with m.If(self.restore):
+                m.d.sync += stack[Mux(restore_ptr == 0, config.ras_depth - 1, restore_ptr - 1)].eq(restore_top)
+                with m.If(self.restore_replaced & restore_call):
+                    m.d.sync += ptr.eq(Mux(restore_ptr == 0, config.ras_depth - 1, restore_ptr - 1))
+                with m.Elif(self.restore_replaced & restore_return):
+                    # The popped entry is still there, pops don't write
+                    m.d.sync += ptr.eq(Mux(restore_ptr == config.ras_depth - 1, 0, restore_ptr + 1))
+                with m.Else():
+                    m.d.sync += ptr.eq(restore_ptr)
+            with m.Elif(self.valid & is_call):
+                m.d.sync += stack[ptr].eq(after_top)
+                m.d.sync += ptr.eq(after_ptr)
+            with m.Elif(self.valid & is_return):
+                m.d.sync += ptr.eq(after_ptr)
+
+        return m
@@ -0,0 +1,187 @@
+from nmigen import *
+from nmigen.hdl.rec import Record
+import nmigen_soc.wishbone as wishbone
+
+from predecode import Predecoder, PREDECODE_LAYOUT
+
+class PrefetchBuffer(Elaboratable):
+    """Sequential instruction prefetch queue.
+
+    ``bus`` is a pipelined Wishbone slave for the core's fetch logic, ``mem`` is the master
+    side. The buffer speculates that fetches are sequential and keeps up to ``depth`` reads
+    at PC + 4, PC + 8, ... queued or in flight, so the bus keeps working while the core
+    decodes and executes. A fetch from any other address (a JAL/JALR/taken branch) flushes
+    the queue and restarts prefetching from there, sending the new address out in the same
+    cycle as the fetch. Assert ``invalidate`` (FENCE.I) for one cycle to have the next fetch
+    restart the stream too, whatever its address.
+
+    A fetch the queue can serve is acked the next cycle, like a single-cycle memory would, so
+    the buffer only speeds things up when reads take longer than that: a memory with wait
+    states or latency, or an instruction cache refilling.
+
+    ``useful`` counts prefetched words handed to the core, ``discarded`` counts words that
+    were fetched or in flight when the queue was flushed.
+
+    With ``predecode`` words are predecoded as they come off the bus and queued with their
+    control word, ``predecoded`` is valid along with ``bus.ack``.
+    """
+    def __init__(self, mem_bus: wishbone.Interface, depth: int = 4, predecode: bool = False):
+        self.depth = depth
+        # Reads on ``mem`` at once: a queue's worth of live ones behind as many a flush made stale
+        self.max_outstanding = 2 * depth
+
+        #### Buses
+        self.mem = mem_bus
+        self.bus = wishbone.Interface(addr_width=32, data_width=32, features={"stall"}, name="prefetch")
+        if predecode:
+            self.predecoded = Record(PREDECODE_LAYOUT)
+        else:
+            self.predecoded = None
+
+        #### Control
+        self.invalidate = Signal()
+
+        #### Statistics
+        self.useful = Signal(unsigned(32))
+        self.discarded = Signal(unsigned(32))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        depth = self.depth
+
+        def wrap(ptr):
+            return Mux(ptr == depth - 1, 0, ptr + 1)
+
+        #### Queue
+        queue = Array(Signal(unsigned(32), name=f"queue{i}") for i in range(depth))
+        rd_ptr = Signal(range(depth))
+        wr_ptr = Signal(range(depth))
+        count = Signal(range(depth + 1))
+        head_pc = Signal(unsigned(32))      # Address of the word at rd_ptr
+
+        #### Memory side
+        issue_pc = Signal(unsigned(32))
+        # Reads still on the bus, ``kill`` of them (the oldest) belong to a flushed stream
+        inflight = Signal(range(2 * depth + 1))
+        kill = Signal(range(2 * depth + 1))
+
+        #### Fetch side
+        # The core's request waiting for its word, always for the word at head_pc: anything
+        # else restarts the stream from that address as it's accepted
+        req_valid = Signal()
+        next_head = Signal(unsigned(32))    # head_pc after this cycle's pop/bypass
+        stall = Signal()
+        accept = Signal()
+        restart = Signal()
+        arrive = Signal()   # A live prefetch comes off the bus this cycle
+        pop = Signal()      # Request served from the queue
+        bypass = Signal()   # Request served straight off the bus, the queue is empty
+        push = Signal()
+        # The queue and reads in flight may be older than the last FENCE.I
+        flushed = Signal()
+
+        m.d.comb += [
+            arrive.eq(self.mem.ack & (kill == 0)),
+            pop.eq(req_valid & (count != 0)),
+            bypass.eq(req_valid & (count == 0) & arrive),
+            push.eq(arrive & ~bypass & ~restart),
+            next_head.eq(Mux(pop | bypass, head_pc + 4, head_pc)),
+            stall.eq(req_valid & ~pop & ~bypass),
+            accept.eq(self.bus.cyc & self.bus.stb & ~stall),
+            # Decided as the request is accepted rather than once it's registered, so a
+            # redirect goes out to memory in the same cycle as it would without the buffer
+            restart.eq(accept & ((self.bus.adr != next_head) | flushed | self.invalidate)),
+            self.bus.stall.eq(stall),
+            self.bus.ack.eq(pop | bypass),
+            self.bus.dat_r.eq(Mux(pop, queue[rd_ptr], self.mem.dat_r)),
+        ]
+
+        with m.If(accept):
+            m.d.sync += req_valid.eq(1)
+        with m.Elif(pop | bypass):
+            m.d.sync += req_valid.eq(0)
+
+        #### Prefetch reads
+        mem_stall = self.mem.stall if hasattr(self.mem, "stall") else Const(0)
+        # A read the slave stalled stays on the bus unchanged until it's accepted, even if a
+        # restart makes it stale in the meantime
+        hold = Signal()
+        hold_adr = Signal(unsigned(32))
+        hold_kill = Signal()
+        room = Signal()
+        issue = Signal()
+        live = Signal(range(2 * depth + 2))
+        m.d.comb += live.eq(inflight - kill + (hold & ~hold_kill))
+        # A word leaving this cycle frees its slot straight away, and a restart empties the
+        # queue and starts fetching the new stream in the same cycle. Stale reads still
+        # count towards the bus limit, so a slow slave can't pile them up.
+        m.d.comb += room.eq(restart | (count + live < depth + pop + bypass))
+        m.d.comb += issue.eq(~hold & room & (inflight < self.max_outstanding))
+
+        m.d.comb += [
+            self.mem.adr.eq(Mux(hold, hold_adr, Mux(restart, self.bus.adr, issue_pc))),
+            self.mem.we.eq(0),
+            self.mem.sel.eq(~0),
+            self.mem.stb.eq(issue | hold),
+            self.mem.cyc.eq(issue | hold | (inflight != 0)),
+        ]
+
+        with m.If(self.mem.stb & mem_stall):
+            m.d.sync += hold.eq(1)
+            m.d.sync += hold_adr.eq(self.mem.adr)
+            m.d.sync += hold_kill.eq(hold & (hold_kill | restart))
+        with m.Else():
+            m.d.sync += hold.eq(0)
+
+        accepted = Signal()
+        stale = Signal()    # The read accepted this cycle belongs to a flushed stream
+        m.d.comb += accepted.eq(self.mem.stb & ~mem_stall)
+        m.d.comb += stale.eq(accepted & hold & (hold_kill | restart))
+        m.d.sync += inflight.eq(inflight + accepted - self.mem.ack)
+        # The address moves on as a read goes out, whether or not it's held
+        with m.If(issue):
+            m.d.sync += issue_pc.eq(self.mem.adr + 4)
+
+        m.d.sync += kill.eq(kill - (self.mem.ack & (kill != 0)) + stale)
+
+        with m.If(push):
+            m.d.sync += queue[wr_ptr].eq(self.mem.dat_r)
+            m.d.sync += wr_ptr.eq(wrap(wr_ptr))
+
+        if self.predecoded is not None:
+            m.submodules.predecoder = predecoder = Predecoder()
+            predecoded = Array(Signal(len(self.predecoded), name=f"predecoded{i}") for i in range(depth))
+            incoming = Signal(len(self.predecoded))
+            m.d.comb += predecoder.instr.eq(self.mem.dat_r)
+            m.d.comb += incoming.eq(predecoder.out)
+            m.d.comb += self.predecoded.eq(Mux(pop, predecoded[rd_ptr], incoming))
+            with m.If(push):
+                m.d.sync += predecoded[wr_ptr].eq(incoming)
+
+        with m.If(pop):
+            m.d.sync += rd_ptr.eq(wrap(rd_ptr))
+
+        with m.If(pop | bypass):
+            m.d.sync += head_pc.eq(head_pc + 4)
+            m.d.sync += self.useful.eq(self.useful + 1)
+
+        m.d.sync += count.eq(count + push - pop)
+
+        #### Flush on a non-sequential fetch, or the first one after FENCE.I
+        m.d.sync += flushed.eq(Mux(restart, 0, flushed | self.invalidate))
+
+        with m.If(restart):
+            m.d.sync += [
+                head_pc.eq(self.bus.adr),
+                issue_pc.eq(Mux(issue, self.bus.adr + 4, self.bus.adr)),
+                rd_ptr.eq(0),
+                wr_ptr.eq(0),
+                count.eq(0),
+                # Everything still outstanding after this cycle is stale, apart from a read
+                # of the new stream that went out in it
+                kill.eq(inflight - self.mem.ack + stale),
+                self.discarded.eq(self.discarded + count - pop + live - bypass),
+            ]
+
+        return m
@@ -0,0 +1,148 @@
+from nmigen import *
+import nmigen_soc.wishbone as wishbone
+
+from compressed import CompressedExpander
+
+class RealignBuffer(Elaboratable):
+    """Fetch port for RV32C, instructions at any halfword address out of word reads.
+
+    ``bus`` is a pipelined Wishbone slave for the core's fetch logic, taking halfword-aligned
+    instruction addresses. It answers with the instruction at that address, expanded to 32
+    bits if it was compressed, and ``compressed`` set along with ``bus.ack`` so the core can
+    step its PC by 2. ``mem`` is the master side and only ever sees aligned word reads.
+
+    The last word read is kept, so a compressed instruction and whatever follows it in the
+    same word cost one read between them. A 32-bit instruction straddling two words takes the
+    second read once the first half is in. A read needed for a new request goes out in the
+    cycle the request is accepted, so aligned code sees the same latency as without the
+    buffer. Assert ``invalidate`` (FENCE.I) to have the next request read its word again.
+    """
+    # Reads on ``mem`` at once
+    max_outstanding = 1
+
+    def __init__(self, mem_bus: wishbone.Interface):
+        #### Buses
+        self.mem = mem_bus
+        self.bus = wishbone.Interface(addr_width=32, data_width=32, features={"stall"}, name="realign")
+
+        #### Fetch side, along with ``bus.ack``
+        self.compressed = Signal()
+
+        #### Control
+        self.invalidate = Signal()
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.expander = expander = CompressedExpander()
+
+        bus = self.bus
+        mem_stall = self.mem.stall if hasattr(self.mem, "stall") else Const(0)
+
+        #### Kept word
+        buf_valid = Signal()
+        buf_word = Signal(30)
+        buf_data = Signal(unsigned(32))
+
+        #### Memory side, one read at a time
+        mem_pending = Signal()
+        mem_word = Signal(30)
+        mem_done = Signal()
+        m.d.comb += mem_done.eq(mem_pending & self.mem.ack)
+
+        #### Request in progress
+        req_valid = Signal()
+        req_adr = Signal(unsigned(32))
+        hi_requested = Signal()     # The second word of a straddling instruction has been read
+
+        req_word = req_adr[2:]
+        hi_word = Signal(30)
+        m.d.comb += hi_word.eq(req_word + 1)
+
+        # First half, from the kept word or the read coming back for it
+        lo_ack = Signal()
+        lo_avail = Signal()
+        lo_data = Signal(unsigned(32))
+        lo_half = Signal(unsigned(16))
+        m.d.comb += [
+            lo_ack.eq(mem_done & (mem_word == req_word)),
+            lo_avail.eq((buf_valid & (buf_word == req_word)) | lo_ack),
+            lo_data.eq(Mux(lo_ack, self.mem.dat_r, buf_data)),
+            lo_half.eq(Mux(req_adr[1], lo_data[16:32], lo_data[0:16])),
+        ]
+
+        straddle = Signal()
+        hi_ack = Signal()
+        m.d.comb += straddle.eq(req_adr[1] & (lo_half[0:2] == 0b11))
+        m.d.comb += hi_ack.eq(mem_done & hi_requested)
+
+        #### Responses
+        with m.If(req_valid & lo_avail):
+            with m.If(~straddle):
+                m.d.comb += bus.ack.eq(1)
+                m.d.comb += expander.instr.eq(Cat(lo_half, lo_data[16:32]))
+            with m.Elif(hi_ack):
+                m.d.comb += bus.ack.eq(1)
+                m.d.comb += expander.instr.eq(Cat(lo_half, self.mem.dat_r[0:16]))
+        m.d.comb += bus.dat_r.eq(expander.out)
+        m.d.comb += self.compressed.eq(expander.compressed)
+
+        #### New requests
+        # A request in progress may still be using the kept word, so an invalidate only makes
+        # new requests read it again
+        flush = Signal()
+
+        # The kept word as of next cycle, when the new request is looked at
+        next_valid = Signal()
+        next_word = Signal(30)
+        m.d.comb += next_valid.eq((buf_valid | mem_done) & ~self.invalidate & ~flush)
+        m.d.comb += next_word.eq(Mux(mem_done, mem_word, buf_word))
+
+        request = Signal()
+        lo_needed = Signal()
+        m.d.comb += request.eq(bus.cyc & bus.stb & (~req_valid | bus.ack))
+        m.d.comb += lo_needed.eq(~(next_valid & (next_word == bus.adr[2:])))
+        m.d.comb += bus.stall.eq(~request | (lo_needed & mem_stall))
+
+        accept = Signal()
+        m.d.comb += accept.eq(request & ~bus.stall)
+        with m.If(accept):
+            m.d.sync += req_valid.eq(1)
+            m.d.sync += req_adr.eq(bus.adr)
+            m.d.sync += hi_requested.eq(0)
+        with m.Elif(bus.ack):
+            m.d.sync += req_valid.eq(0)
+
+        with m.If(self.invalidate):
+            m.d.sync += flush.eq(1)
+        with m.Elif(accept):
+            m.d.sync += flush.eq(0)
+
+        #### Reads
+        issue_lo = Signal()
+        issue_hi = Signal()
+        m.d.comb += issue_lo.eq(request & lo_needed)
+        m.d.comb += issue_hi.eq(req_valid & lo_avail & straddle & ~hi_requested & (~mem_pending | self.mem.ack))
+
+        m.d.comb += [
+            self.mem.adr.eq(Cat(Const(0, 2), Mux(issue_hi, hi_word, bus.adr[2:]))),
+            self.mem.we.eq(0),
+            self.mem.sel.eq(~0),
+            self.mem.stb.eq(issue_lo | issue_hi),
+            self.mem.cyc.eq(self.mem.stb | mem_pending),
+        ]
+
+        with m.If(self.mem.stb & ~mem_stall):
+            m.d.sync += mem_pending.eq(1)
+            m.d.sync += mem_word.eq(self.mem.adr[2:])
+            with m.If(issue_hi):
+                m.d.sync += hi_requested.eq(1)
+        with m.Elif(self.mem.ack):
+            m.d.sync += mem_pending.eq(0)
+
+        # Every word read is kept
+        with m.If(mem_done):
+            m.d.sync += buf_valid.eq(1)
+            m.d.sync += buf_word.eq(mem_word)
+            m.d.sync += buf_data.eq(self.mem.dat_r)
+
+        return m
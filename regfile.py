@@ -1,8 +1,35 @@
+from dataclasses import dataclass
+
 from nmigen import *
 
+@dataclass
+class RegFileConfig:
+    # Keep the registers in a Memory (LUTRAM/block RAM) instead of flip-flops
+    memory: bool = False
+    # Registered read ports, for block RAM. The core has to put the read addresses up a cycle
+    # before it uses the data.
+    sync_read: bool = False
+
 class RegisterFile(Elaboratable):
-    def __init__(self):
-        self.regs = Array([Signal(32) for _ in range(32)])
+    """x0-x31 with two read ports and one write port.
+
+    By default the registers are flip-flops read through muxes. With ``config.memory`` they
+    are an nMigen ``Memory`` instead, which maps onto distributed RAM with asynchronous reads,
+    or block RAM with ``sync_read``. Writes to x0 are dropped, so it always reads zero.
+
+    With ``sync_read`` the data comes out the cycle after the address goes in, and already
+    includes a write made to that register in the same cycle as the address.
+    """
+    def __init__(self, config: RegFileConfig = None):
+        if config is None:
+            config = RegFileConfig()
+        self.config = config
+        self.sync_read = config.memory and config.sync_read
+
+        if config.memory:
+            self.mem = Memory(width=32, depth=32)
+        else:
+            self.regs = Array([Signal(32) for _ in range(32)])
 
         self.wen = Signal()
         self.waddr = Signal(unsigned(5))
@@ -12,20 +39,53 @@ class RegisterFile(Elaboratable):
         self.rdata1 = Signal(unsigned(32))
         self.rdata2 = Signal(unsigned(32))
 
+    def registers(self) -> list:
+        """x0-x31, for reading them from a simulation."""
+        if self.config.memory:
+            return [self.mem[i] for i in range(32)]
+        return list(self.regs)
+
     def elaborate(self, platform):
         m = Module()
 
-        with m.If(self.wen):
-            m.d.sync += self.regs[self.waddr].eq(self.wdata)
+        if not self.config.memory:
+            with m.If(self.wen & (self.waddr != 0)):
+                m.d.sync += self.regs[self.waddr].eq(self.wdata)
+
+            with m.If(self.raddr1 == 0):
+                m.d.comb += self.rdata1.eq(0)
+            with m.Else():
+                m.d.comb += self.rdata1.eq(self.regs[self.raddr1])
+
+            with m.If(self.raddr2 == 0):
+                m.d.comb += self.rdata2.eq(0)
+            with m.Else():
+                m.d.comb += self.rdata2.eq(self.regs[self.raddr2])
+
+            return m
 
-        with m.If(self.raddr1 == 0):
-            m.d.comb += self.rdata1.eq(0)
-        with m.Else():
-            m.d.comb += self.rdata1.eq(self.regs[self.raddr1])
+        m.submodules.wport = wport = self.mem.write_port()
+        m.d.comb += [
+            wport.addr.eq(self.waddr),
+            wport.data.eq(self.wdata),
+            wport.en.eq(self.wen & (self.waddr != 0)),
+        ]
 
-        with m.If(self.raddr2 == 0):
-            m.d.comb += self.rdata2.eq(0)
-        with m.Else():
-            m.d.comb += self.rdata2.eq(self.regs[self.raddr2])
+        for raddr, rdata in ((self.raddr1, self.rdata1), (self.raddr2, self.rdata2)):
+            if not self.sync_read:
+                rport = self.mem.read_port(domain="comb")
+                m.d.comb += rport.addr.eq(raddr)
+                m.d.comb += rdata.eq(rport.data)
+            else:
+                # Bypass a write to the same register in the cycle the address went in,
+                # instead of relying on how the RAM handles read-during-write
+                rport = self.mem.read_port(transparent=False)
+                bypass = Signal()
+                bypass_data = Signal(unsigned(32))
+                m.d.comb += rport.addr.eq(raddr)
+                m.d.sync += bypass.eq(wport.en & (self.waddr == raddr))
+                m.d.sync += bypass_data.eq(self.wdata)
+                m.d.comb += rdata.eq(Mux(bypass, bypass_data, rport.data))
+            m.submodules += rport
 
         return m
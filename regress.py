@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Build and run the rv32ui riscv-tests on SimTop.
+
+    python regress.py -j 8 --json results.json --pipelined
+
+Tests are built with test_fw/build.py against the bare environment in test_fw/env, then
+simulated across a pool of worker processes. Each worker elaborates the design once and
+reuses it for every test it runs. Prints a pass/fail table with cycles and instructions
+retired per test, and optionally writes the same as JSON.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import sim
+from test_fw.build import build
+
+here = os.path.dirname(os.path.abspath(__file__))
+riscv_tests = os.path.join(here, "riscv-tests")
+env = os.path.join(here, "test_fw", "env")
+
+def build_test(source: str, build_dir: str) -> str:
+    """Build one test unless its binary is up to date, returns the .bin path."""
+    output = os.path.join(build_dir, os.path.splitext(os.path.basename(source))[0])
+    binary = f"{output}.bin"
+    if not os.path.exists(binary) or os.path.getmtime(binary) < os.path.getmtime(source):
+        build(source, output, linker_script=os.path.join(env, "link.ld"),
+              include_dirs=(env, os.path.join(riscv_tests, "isa", "macros", "scalar")))
+    return binary
+
+#### Worker processes, one simulator each
+
+_simulation = None
+
+def _init_worker(config: dict, engine: str):
+    global _simulation
+    _simulation = sim.Simulation(config, engine)
+
+def _run_test(name: str, binary: str, max_cycles: int) -> dict:
+    result = _simulation.run(binary, max_cycles)
+    gp, a0 = result.regs[3], result.regs[10]
+    return {
+        "name": name,
+        "passed": result.halted and a0 == 0 and gp == 1,
+        # riscv-tests report the failing TEST_CASE number as gp = (n << 1) | 1
+        "failed_case": gp >> 1 if result.halted and a0 != 0 else None,
+        "timeout": not result.halted,
+        "cycles": result.cycles,
+        "instret": result.instret,
+        "cpi": round(result.cpi, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tests", nargs="*", help="test names (default: all of rv32ui)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", choices=("pysim", "cxxsim"), default="pysim")
+    parser.add_argument("--max-cycles", type=int, default=100_000)
+    parser.add_argument("--build-dir", default=os.path.join(here, "build", "riscv-tests"))
+    parser.add_argument("--json", help="write results to this file")
+    sim.add_config_args(parser)
+    args = parser.parse_args()
+
+    sources = sorted(glob.glob(os.path.join(riscv_tests, "isa", "rv32ui", "*.S")))
+    if not sources:
+        sys.exit(f"no tests found, is the riscv-tests submodule checked out? ({riscv_tests})")
+    if args.tests:
+        sources = [s for s in sources if os.path.splitext(os.path.basename(s))[0] in args.tests]
+
+    os.makedirs(args.build_dir, exist_ok=True)
+    with ThreadPoolExecutor(args.jobs) as pool:
+        binaries = list(pool.map(lambda s: build_test(s, args.build_dir), sources))
+    names = [os.path.splitext(os.path.basename(s))[0] for s in sources]
+
+    config = sim.config_from_args(args)
+    with ProcessPoolExecutor(args.jobs, initializer=_init_worker, initargs=(config, args.engine)) as pool:
+        futures = [pool.submit(_run_test, name, binary, args.max_cycles) for name, binary in zip(names, binaries)]
+        results = [future.result() for future in futures]
+
+    print(f"{'test':<12} {'result':<10} {'cycles':>10} {'instret':>10} {'CPI':>6}")
+    for r in results:
+        if r["passed"]:
+            status = "pass"
+        elif r["timeout"]:
+            status = "timeout"
+        else:
+            status = f"FAIL #{r['failed_case']}"
+        print(f"{r['name']:<12} {status:<10} {r['cycles']:>10} {r['instret']:>10} {r['cpi']:>6.2f}")
+
+    passed = sum(r["passed"] for r in results)
+    print(f"{passed}/{len(results)} passed")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "config": sim.config_to_json(config),
+                "engine": args.engine,
+                "passed": passed,
+                "total": len(results),
+                "tests": results,
+            }, f, indent=2)
+
+    sys.exit(0 if passed == len(results) else 1)
+
+if __name__ == "__main__":
+    main()
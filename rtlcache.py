@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""Content-addressed on-disk cache for generated RTL and compiled simulators.
+
+Entries are keyed on a hash of the design sources (every local module ``core.py`` pulls in,
+plus the installed nMigen/Amaranth and nmigen-soc versions), the kind of artifact and its parameters, so editing the design or
+changing the configuration never returns a stale netlist.
+
+    python rtlcache.py generate -t v --pipelined top.v
+    python rtlcache.py stats
+    python rtlcache.py clear
+
+The cache lives in ``$RUNT_CACHE_DIR`` (default ``~/.cache/runt``). Once it grows past its size
+cap the least recently used entries are evicted.
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict, is_dataclass
+from importlib import metadata
+from typing import Callable, Optional
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_DIR = os.environ.get("RUNT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "runt"))
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+#### Keys
+
+def _local_imports(path: str) -> set:
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+
+    return {name for name in names if os.path.exists(os.path.join(here, f"{name}.py"))}
+
+def design_sources(root: str = "core") -> list:
+    """Paths of ``root`` and every local module it imports, directly or not."""
+    seen = set()
+    pending = [root]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        pending.extend(_local_imports(os.path.join(here, f"{name}.py")))
+
+    return sorted(os.path.join(here, f"{name}.py") for name in seen)
+
+# Distributions the generated RTL depends on, ``nmigen`` may be Amaranth's compatibility shim
+TOOLCHAIN = ("amaranth", "nmigen", "nmigen-soc")
+
+def toolchain_versions() -> dict:
+    """Installed version of each of ``TOOLCHAIN``, None if it isn't installed."""
+    versions = {}
+    for name in TOOLCHAIN:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+def source_hash(root: str = "core") -> str:
+    h = hashlib.sha256()
+    for name, version in toolchain_versions().items():
+        h.update(f"{name} {version}\n".encode())
+    for path in design_sources(root):
+        with open(path, "rb") as f:
+            h.update(os.path.basename(path).encode() + b"\0" + f.read() + b"\0")
+
+    return h.hexdigest()
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _plain(value):
+    if is_dataclass(value):
+        return {"type": type(value).__name__, **asdict(value)}
+    return repr(value)
+
+#### Cache
+
+class RTLCache:
+    """On-disk cache of generated artifacts, one directory per entry.
+
+    ``get`` returns the entry directory for ``kind`` and ``params``, calling ``build`` with a
+    scratch directory to fill on a miss. ``hits`` and ``misses`` count lookups made through
+    this instance.
+    """
+    def __init__(self, directory: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._sources = None
+
+    def key(self, kind: str, params: dict) -> str:
+        if self._sources is None:
+            self._sources = source_hash()
+        blob = json.dumps({"sources": self._sources, "kind": kind, "params": params},
+                          sort_keys=True, default=_plain)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def lookup(self, kind: str, params: dict) -> Optional[str]:
+        path = os.path.join(self.directory, self.key(kind, params))
+        if os.path.isdir(path):
+            return path
+        return None
+
+    def get(self, kind: str, params: dict, build: Callable[[str], None], verbose: bool = False) -> str:
+        key = self.key(kind, params)
+        path = os.path.join(self.directory, key)
+
+        if os.path.isdir(path):
+            self.hits += 1
+            # Directory mtime tracks last use for eviction
+            os.utime(path)
+            if verbose:
+                print(f"rtlcache: hit {kind} {key[:12]}", file=sys.stderr)
+            return path
+
+        self.misses += 1
+        if verbose:
+            print(f"rtlcache: miss {kind} {key[:12]}", file=sys.stderr)
+
+        os.makedirs(self.directory, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix=f".{key[:12]}.", dir=self.directory)
+        try:
+            build(scratch)
+            with open(os.path.join(scratch, "entry.json"), "w") as f:
+                json.dump({"kind": kind, "params": params, "created": time.time()}, f,
+                          sort_keys=True, default=_plain, indent=2)
+            try:
+                os.rename(scratch, path)
+            except OSError:
+                # Another process built the same entry first, keep theirs
+                if not os.path.isdir(path):
+                    raise
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        self.evict(keep=key)
+        return path
+
+    def entries(self) -> list:
+        """(key, size in bytes, last use) for every entry, least recently used first."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = 0
+            for root, _, files in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            entries.append((key, size, os.path.getmtime(path)))
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep: str = None):
+        """Drop least recently used entries until the cache fits in ``max_bytes``."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for key, _, _ in self.entries():
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    def report(self) -> str:
+        entries = self.entries()
+        size = sum(size for _, size, _ in entries)
+        return (f"{self.hits} hits, {self.misses} misses, {len(entries)} entries, "
+                f"{size / 2**20:.1f}/{self.max_bytes / 2**20:.0f} MiB in {self.directory}")
+
+#### Generated RTL
+
+def generate(config: dict = None, fmt: str = "il", mem_file: str = None, cache: RTLCache = None,
+             verbose: bool = False, core: bool = False) -> str:
+    """RTLIL (``il``) or Verilog (``v``) for ``SimTop`` with ``config``, from the cache if possible.
+
+    With ``core`` it's just ``RV32ICore`` instead, for synthesis, its memory bus (or a Harvard
+    core's two) and status outputs as the ports. ``config`` are then its keyword arguments,
+    and there's no image.
+    """
+    if cache is None:
+        cache = RTLCache()
+    config = config or {}
+
+    params = {"config": config, "image": file_hash(mem_file) if mem_file else None}
+
+    def build(directory):
+        from nmigen.back import rtlil, verilog
+
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 100_000))
+        if core:
+            import nmigen_soc.wishbone as wishbone
+            from core import RV32ICore
+
+            if config.get("harvard"):
+                top = RV32ICore(None, **config)
+                buses = [top.ibus, top.dbus]
+            else:
+                bus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"})
+                top = RV32ICore(bus, **config)
+                buses = [bus]
+            ports = [*(port for bus in buses for port in bus.fields.values()),
+                     top.meip, top.msip, top.mtip, top.retire, top.ecall, top.ebreak]
+        else:
+            from core import SimTop
+
+            top = SimTop(mem_file, **config)
+            ports = top.ports()
+        convert = {"il": rtlil.convert, "v": verilog.convert}[fmt]
+        with open(os.path.join(directory, f"top.{fmt}"), "w") as f:
+            f.write(convert(top, name="top", ports=ports))
+
+    path = cache.get(f"rtl-core-{fmt}" if core else f"rtl-{fmt}", params, build, verbose)
+    with open(os.path.join(path, f"top.{fmt}")) as f:
+        return f.read()
+
+if __name__ == "__main__":
+    import sim
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache-dir", default=DEFAULT_DIR)
+    parser.add_argument("--max-mb", type=int, default=DEFAULT_MAX_BYTES // 2**20, help="size cap")
+    actions = parser.add_subparsers(dest="action", required=True)
+
+    p_generate = actions.add_parser("generate", help="write RTLIL/Verilog for SimTop")
+    p_generate.add_argument("-t", "--type", dest="fmt", choices=("il", "v"), default="il")
+    p_generate.add_argument("--image", help="program image to initialise memory with")
+    p_generate.add_argument("output", nargs="?", help="output file (default: stdout)")
+    sim.add_config_args(p_generate)
+
+    actions.add_parser("stats", help="show cache size")
+    actions.add_parser("clear", help="remove every entry")
+
+    args = parser.parse_args()
+    cache = RTLCache(args.cache_dir, args.max_mb * 2**20)
+
+    if args.action == "generate":
+        text = generate(sim.config_from_args(args), args.fmt, args.image, cache, verbose=True)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text)
+        else:
+            sys.stdout.write(text)
+    elif args.action == "clear":
+        cache.clear()
+
+    print(cache.report(), file=sys.stderr)
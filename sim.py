@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+"""Run a program on SimTop until ECALL/EBREAK or a cycle limit.
+
+    python sim.py test_fw/test.elf --engine cxxsim --max-cycles 1000000 --pipelined
+    python sim.py test_fw/test.elf --pipelined --trace run.trace --profile
+    python sim.py test_fw/test.elf --pipelined --muldiv iterative --lockstep
+    python sim.py test_fw/test.elf --pipelined --fast-forward-to main
+
+Engines:
+    pysim       nMigen's Python simulator, always available but slow
+    cxxsim      nMigen's compiled C++ simulator, if the installed nMigen has it
+    verilator   Verilog from Yosys, compiled with a local Verilator install
+
+If the requested engine can't be used, this falls back to pysim.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, asdict, is_dataclass
+from enum import Enum
+
+from core import SimTop
+from icache import ICacheConfig
+from dcache import DCacheConfig
+from alu import ALUConfig
+from muldiv import MulDivConfig, Multiplier
+from regfile import RegFileConfig
+from predictor import PredictorConfig
+from counters import CounterConfig, HPMEvent
+from tracing import STALL_EVENTS, TraceEntry, TraceWriter, Profile
+from image import load_symbols
+from iss import ISS, Lockstep
+from checkpoint import Checkpoint, core_state, restore, resolve, fast_forward
+from rtlcache import RTLCache, generate, file_hash
+
+ENGINES = ("pysim", "cxxsim", "verilator")
+
+@dataclass
+class SimResult:
+    engine: str
+    cycles: int
+    instret: int
+    halted: bool    # Stopped on ECALL/EBREAK rather than the cycle limit
+    seconds: float
+    regs: list = None   # x0-x31 at the end of the run, if the engine can read them
+    counters: dict = None   # Performance counters by name, likewise
+
+    @property
+    def cycles_per_second(self) -> float:
+        return self.cycles / self.seconds if self.seconds else 0.0
+
+    @property
+    def cpi(self) -> float:
+        return self.cycles / self.instret if self.instret else 0.0
+
+#### Core configuration from the command line
+
+def add_config_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--pipelined", action="store_true", help="use the 3-stage pipelined core")
+    parser.add_argument("--icache", metavar="WORDS:SETS:WAYS", help="add an instruction cache, e.g. 4:64:1")
+    parser.add_argument("--prefetch", metavar="DEPTH", type=int, default=0, help="add a prefetch buffer")
+    parser.add_argument("--predecode", action="store_true",
+                        help="store predecoded instructions in the icache/prefetch queue (pipelined core)")
+    parser.add_argument("--dcache", metavar="WORDS:SETS:WAYS", help="add a write-back data cache, e.g. 4:64:1")
+    parser.add_argument("--store-buffer", metavar="DEPTH", type=int, default=0, help="add a store buffer")
+    parser.add_argument("--serial-shifter", action="store_true", help="shift one bit per cycle, for area")
+    parser.add_argument("--alu-register", action="store_true", help="register the ALU output, for Fmax")
+    parser.add_argument("--muldiv", choices=[kind.value for kind in Multiplier],
+                        help="add RV32M with this kind of multiplier")
+    parser.add_argument("--divider-radix", type=int, choices=(2, 4), default=2)
+    parser.add_argument("--compressed", action="store_true", help="add RV32C")
+    parser.add_argument("--clint", action="store_true", help="add a CLINT (mtime/mtimecmp/msip) to the core")
+    parser.add_argument("--harvard", action="store_true",
+                        help="separate instruction and data buses, to a dual-ported memory")
+    parser.add_argument("--round-robin", action="store_true",
+                        help="share the memory bus round-robin instead of favouring data accesses")
+    parser.add_argument("--regfile", choices=("flops", "lutram", "bram"), default="flops",
+                        help="register file in flip-flops, or RAM with asynchronous/synchronous reads")
+    parser.add_argument("--predictor", metavar="BHT:BTB:RAS",
+                        help="add a branch predictor (pipelined only), 0:0:0 is static BTFN")
+    parser.add_argument("--hpm", metavar="EVENT,...",
+                        help="events for mhpmcounter3 onwards: " + ", ".join(e.name.lower() for e in HPMEvent))
+    parser.add_argument("--memory-depth", metavar="WORDS", type=lambda x: int(x, 0), default=0x1000,
+                        help="words of simulation memory")
+    parser.add_argument("--memory-latency", metavar="CYCLES", type=int, default=1,
+                        help="cycles from a memory request to its response")
+    parser.add_argument("--paged", action="store_true",
+                        help="sparse memory covering the whole address space (Python engines only)")
+
+def config_from_args(args: argparse.Namespace) -> dict:
+    """SimTop keyword arguments (other than the image) selected by ``add_config_args``."""
+    config = {"pipelined": args.pipelined, "prefetch": args.prefetch, "memory_depth": args.memory_depth,
+              "paged": args.paged, "store_buffer": args.store_buffer, "predecode": args.predecode,
+              "compressed": args.compressed, "clint": args.clint, "harvard": args.harvard,
+              "round_robin": args.round_robin, "memory_latency": args.memory_latency}
+    if args.icache:
+        line_words, sets, ways = (int(x) for x in args.icache.split(":"))
+        config["icache"] = ICacheConfig(line_words=line_words, sets=sets, ways=ways)
+    if args.serial_shifter or args.alu_register:
+        config["alu"] = ALUConfig(serial_shifter=args.serial_shifter, output_register=args.alu_register)
+    if args.muldiv:
+        config["muldiv"] = MulDivConfig(multiplier=Multiplier(args.muldiv), divider_radix=args.divider_radix)
+    if args.regfile != "flops":
+        config["regfile"] = RegFileConfig(memory=True, sync_read=args.regfile == "bram")
+    if args.dcache:
+        line_words, sets, ways = (int(x) for x in args.dcache.split(":"))
+        config["dcache"] = DCacheConfig(line_words=line_words, sets=sets, ways=ways)
+    if args.predictor:
+        bht, btb, ras = (int(x) for x in args.predictor.split(":"))
+        config["predictor"] = PredictorConfig(bht_entries=bht, btb_entries=btb, ras_depth=ras)
+    if args.hpm:
+        config["counters"] = CounterConfig(events=tuple(HPMEvent[name.upper()] for name in args.hpm.split(",")))
+    return config
+
+def config_to_json(config: dict) -> dict:
+    """Plain-data form of a SimTop configuration, for reports."""
+    def plain(value):
+        if is_dataclass(value):
+            return plain(asdict(value))
+        if isinstance(value, dict):
+            return {key: plain(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [plain(item) for item in value]
+        if isinstance(value, Enum):
+            return value.name.lower()
+        return value
+
+    return plain(config)
+
+#### Engines
+
+class Simulation:
+    """One elaborated SimTop configuration on an nMigen engine, reusable across images.
+
+    The design is elaborated and compiled once. Each ``run`` swaps in a new memory image
+    and resets the simulator, which is much cheaper than building a new one.
+
+    A run can start from a ``Checkpoint`` instead of an image, in pysim, which takes the
+    reset values of the core's registers at each reset.
+    """
+    def __init__(self, config: dict = None, engine: str = "pysim"):
+        try:
+            from nmigen.sim import Simulator
+        except ImportError:
+            from nmigen.back.pysim import Simulator
+
+        # pysim compiles each fragment to deeply nested Python
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 100_000))
+
+        self.top = SimTop(None, **(config or {}))
+
+        self.sim = None
+        if engine != "pysim":
+            try:
+                self.sim = Simulator(self.top, engine=engine)
+            except (TypeError, ValueError, ImportError) as e:
+                print(f"{engine} isn't available ({e}), falling back to pysim", file=sys.stderr)
+                engine = "pysim"
+        if self.sim is None:
+            self.sim = Simulator(self.top)
+        self.engine = engine
+
+        self.sim.add_clock(1e-6)
+        # Reset values a checkpoint replaces, for runs that start from an image again
+        self._core_state = core_state(self.top.cpu)
+        self._resets = [signal.reset for signal, _ in self._core_state]
+        self._max_cycles = 0
+        self._state = {}
+        self._trace = ()
+        self.sim.add_sync_process(self._process)
+        if self.top.memory.paged:
+            self.sim.add_process(self.top.memory.process)
+
+    def _trace_sampler(self):
+        # Called every cycle, hands a TraceEntry to each consumer as an instruction shows up
+        # on the trace port. The cycles and stalls since the one before are put down to it.
+        trace = self.top.cpu.trace
+        events = [self.top.cpu.counters.event(event) for event in STALL_EVENTS]
+        consumers = self._trace
+        cycles = 0
+        stalls = [0] * len(events)
+
+        def sample():
+            nonlocal cycles, stalls
+            if (yield trace.valid):
+                entry = TraceEntry((yield trace.pc), (yield trace.insn), (yield trace.rd_addr),
+                                   (yield trace.rd_wdata), (yield trace.mem_addr), (yield trace.mem_rmask),
+                                   (yield trace.mem_wmask), cycles, tuple(stalls))
+                for consumer in consumers:
+                    consumer.add(entry)
+                cycles = 0
+                stalls = [0] * len(events)
+            cycles += 1
+            for i, event in enumerate(events):
+                stalls[i] += yield event
+
+        return sample
+
+    def _process(self):
+        top = self.top
+        state = self._state
+        # Nothing extra to read each cycle unless someone wants the trace
+        sample = self._trace_sampler() if self._trace else None
+        while state["cycles"] < self._max_cycles:
+            yield
+            state["cycles"] += 1
+            state["instret"] += yield top.cpu.retire
+            if sample:
+                yield from sample()
+            if (yield top.halt):
+                state["halted"] = True
+                break
+
+        # Let writebacks still in the pipeline land before reading the registers. The trace of
+        # the last instruction comes out in the first cycle, anything after it isn't traced.
+        for i in range(2):
+            yield
+            if sample and i == 0:
+                yield from sample()
+        regs = []
+        for reg in top.cpu.regfile.registers():
+            regs.append((yield reg))
+        state["regs"] = regs
+
+        counters = {}
+        for name, counter in top.cpu.counters.named():
+            counters[name] = yield counter
+        state["counters"] = counters
+
+    def run(self, mem_file: str, max_cycles: int = 1_000_000, vcd: str = None, trace: list = (),
+            checkpoint: Checkpoint = None) -> SimResult:
+        """Run an image from reset, or from ``checkpoint`` (``mem_file`` is ignored then).
+
+        ``trace`` takes consumers of ``TraceEntry``s (``TraceWriter``, ``Profile``, anything with
+        an ``add`` method), which need a configuration with ``trace``.
+        """
+        if trace and self.top.cpu.trace is None:
+            raise ValueError("Tracing needs a configuration with trace=True")
+        if checkpoint is not None:
+            if self.engine != "pysim":
+                raise ValueError("Checkpoints can only be restored in pysim")
+            self.top.memory.restore(checkpoint.memory)
+            for signal, value in self._core_state:
+                signal.reset = value(checkpoint)
+        else:
+            self.top.memory.load(mem_file)
+            for (signal, _), reset in zip(self._core_state, self._resets):
+                signal.reset = reset
+        self._max_cycles = max_cycles
+        self._trace = tuple(trace)
+        self._state.update(cycles=0, instret=0, halted=False, regs=None, counters=None)
+        self.sim.reset()
+
+        start = time.perf_counter()
+        if vcd:
+            with self.sim.write_vcd(vcd):
+                self.sim.run()
+        else:
+            self.sim.run()
+        seconds = time.perf_counter() - start
+
+        state = self._state
+        return SimResult(self.engine, state["cycles"], state["instret"], state["halted"], seconds,
+                         state["regs"], state["counters"])
+
+VERILATOR_MAIN = r"""
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include "Vtop.h"
+#include "verilated.h"
+
+int main(int argc, char **argv) {
+    Verilated::commandArgs(argc, argv);
+    Vtop top;
+    unsigned long max_cycles = strtoul(argv[1], nullptr, 0);
+
+    top.rst = 1;
+    top.clk = 0; top.eval();
+    top.clk = 1; top.eval();
+    top.rst = 0;
+
+    auto start = std::chrono::steady_clock::now();
+    unsigned long cycles = 0, instret = 0;
+    bool halted = false;
+    while (cycles < max_cycles) {
+        top.clk = 0; top.eval();
+        top.clk = 1; top.eval();
+        cycles++;
+        instret += top.retire;
+        if (top.halt) {
+            halted = true;
+            break;
+        }
+    }
+    std::chrono::duration<double> seconds = std::chrono::steady_clock::now() - start;
+
+    printf("%lu %lu %d %f\n", cycles, instret, halted, seconds.count());
+    return 0;
+}
+"""
+
+def _run_verilator(mem_file: str, config: dict, max_cycles: int) -> SimResult:
+    # The image is baked into the netlist, so builds are cached per configuration and image
+    cache = RTLCache()
+
+    def build(directory):
+        with open(os.path.join(directory, "top.v"), "w") as f:
+            f.write(generate(config, "v", mem_file, cache))
+        with open(os.path.join(directory, "main.cpp"), "w") as f:
+            f.write(VERILATOR_MAIN)
+
+        subprocess.run(["verilator", "--cc", "--exe", "--build", "-O3", "-Wno-fatal",
+                        "--top-module", "top", "top.v", "main.cpp", "-o", "Vtop"],
+                       cwd=directory, check=True, stdout=subprocess.DEVNULL)
+
+    build_dir = cache.get("verilator", {"config": config, "image": file_hash(mem_file)}, build,
+                          verbose=True)
+
+    out = subprocess.run([os.path.join(build_dir, "obj_dir", "Vtop"), str(max_cycles)],
+                         check=True, capture_output=True, text=True).stdout
+    cycles, instret, halted, seconds = out.split()
+    return SimResult("verilator", int(cycles), int(instret), bool(int(halted)), float(seconds))
+
+def run(mem_file: str, config: dict = None, engine: str = "pysim", max_cycles: int = 1_000_000,
+        vcd: str = None, trace: list = (), checkpoint: Checkpoint = None) -> SimResult:
+    if trace:
+        config = dict(config or {}, trace=True)
+
+    if engine == "verilator":
+        if (config or {}).get("paged"):
+            print("paged memory only works in Python engines, falling back to pysim", file=sys.stderr)
+        elif trace:
+            print("tracing only works in nMigen engines, falling back to pysim", file=sys.stderr)
+        elif checkpoint is not None:
+            print("checkpoints only work in pysim, falling back to it", file=sys.stderr)
+        elif shutil.which("verilator") and shutil.which("yosys"):
+            return _run_verilator(mem_file, config or {}, max_cycles)
+        else:
+            print("verilator/yosys not found, falling back to pysim", file=sys.stderr)
+        engine = "pysim"
+
+    if checkpoint is not None and engine != "pysim":
+        print("checkpoints only work in pysim, falling back to it", file=sys.stderr)
+        engine = "pysim"
+
+    return Simulation(config, engine).run(mem_file, max_cycles, vcd, trace, checkpoint)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", help="flat binary or ELF file, loaded at address 0")
+    parser.add_argument("--engine", choices=ENGINES, default="pysim")
+    parser.add_argument("--max-cycles", type=int, default=1_000_000)
+    parser.add_argument("--vcd", help="write a VCD trace (nMigen engines only)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write retired instructions to a compressed trace file, see tracing.py")
+    parser.add_argument("--profile", action="store_true",
+                        help="print a PC histogram, per-function cycles and stalls at the end")
+    parser.add_argument("--lockstep", action="store_true",
+                        help="check every retired instruction against the ISS, see iss.py")
+    parser.add_argument("--checkpoint", metavar="FILE", help="start from a checkpoint, see checkpoint.py")
+    parser.add_argument("--fast-forward", metavar="INSTRUCTIONS", type=int,
+                        help="run this many instructions on the ISS first, then carry on in the RTL")
+    parser.add_argument("--fast-forward-to", metavar="PC",
+                        help="likewise, up to an address or symbol")
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    checkpoint = None
+    if args.checkpoint or args.fast_forward is not None or args.fast_forward_to:
+        if args.compressed:
+            parser.error("the ISS doesn't do RV32C")
+    if args.checkpoint:
+        checkpoint = Checkpoint.load(args.checkpoint)
+    elif args.fast_forward is not None or args.fast_forward_to:
+        try:
+            pc = resolve(args.image, args.fast_forward_to) if args.fast_forward_to else None
+            checkpoint = fast_forward(args.image, args.muldiv is not None, args.fast_forward, pc)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"iss: fast-forwarded {checkpoint.instret} instructions to pc {checkpoint.pc:#010x}")
+
+    consumers = []
+    if args.trace:
+        consumers.append(TraceWriter(args.trace))
+    if args.profile:
+        profile = Profile(load_symbols(args.image))
+        consumers.append(profile)
+    if args.lockstep:
+        if args.compressed:
+            parser.error("the ISS doesn't do RV32C")
+        iss = ISS(muldiv=args.muldiv is not None)
+        if checkpoint is not None:
+            restore(iss, checkpoint)
+        else:
+            iss.load(args.image)
+        lockstep = Lockstep(iss)
+        consumers.append(lockstep)
+
+    result = run(args.image, config_from_args(args), args.engine, args.max_cycles, args.vcd, consumers,
+                 checkpoint)
+    if args.trace:
+        consumers[0].close()
+
+    stop = "halted" if result.halted else "hit cycle limit"
+    print(f"{result.engine}: {stop} after {result.cycles} cycles, {result.instret} instructions "
+          f"(CPI {result.cpi:.2f}) in {result.seconds:.2f}s ({result.cycles_per_second:,.0f} cycles/s)")
+    for name, value in (result.counters or {}).items():
+        print(f"  {name:<14} {value:>12}")
+    if args.profile:
+        print()
+        print(profile.report())
+    if args.lockstep:
+        print(lockstep.report())
+        sys.exit(0 if lockstep.divergence is None else 1)
@@ -0,0 +1,184 @@
+from nmigen import *
+import nmigen_soc.wishbone as wishbone
+
+class StoreBuffer(Elaboratable):
+    """Coalescing store buffer between the load/store unit and the data cache or memory.
+
+    ``bus`` is a pipelined Wishbone slave with byte lanes, ``mem`` is the master side. Stores
+    are acknowledged the cycle after they're accepted and drained to ``mem`` in order, one at
+    a time, whenever it isn't busy with a load. A store to a word that already has an entry
+    waiting is merged into it instead of taking a new one.
+
+    Loads go ahead of buffered stores to other words. A load the newest entry for its word
+    fully covers is answered from the buffer the next cycle, one that only partly overlaps
+    waits for that word to drain first. ``busy`` is high while anything is buffered or in
+    flight, for FENCE.
+
+    ``forwarded`` counts loads answered from the buffer, ``coalesced`` counts stores merged
+    into an existing entry.
+    """
+    # Accesses on ``mem`` at once
+    max_outstanding = 1
+
+    def __init__(self, mem_bus: wishbone.Interface, depth: int = 4):
+        self.depth = depth
+
+        #### Buses
+        self.mem = mem_bus
+        self.bus = wishbone.Interface(addr_width=32, data_width=32, granularity=8, features={"stall"},
+                                      name="store_buffer")
+
+        #### Control
+        self.busy = Signal()
+
+        #### Statistics
+        self.forwarded = Signal(unsigned(32))
+        self.coalesced = Signal(unsigned(32))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        depth = self.depth
+        bus = self.bus
+
+        def wrap(ptr):
+            return Mux(ptr == depth - 1, 0, ptr + 1)
+
+        #### Entries, a queue in drain order
+        valid = Signal(depth)
+        adr = Array(Signal(30, name=f"adr{i}") for i in range(depth))
+        data = Array(Signal(unsigned(32), name=f"data{i}") for i in range(depth))
+        sel = Array(Signal(4, name=f"sel{i}") for i in range(depth))
+        rd_ptr = Signal(range(depth))
+        wr_ptr = Signal(range(depth))
+
+        #### Memory side, one access at a time
+        mem_stall = self.mem.stall if hasattr(self.mem, "stall") else Const(0)
+        mem_pending = Signal()
+        mem_load = Signal()         # The outstanding access is a load for ``bus``
+        mem_free = Signal()
+        m.d.comb += mem_free.eq(~mem_pending | self.mem.ack)
+
+        # The head entry can't take more stores once its drain has been issued
+        head_locked = Signal()
+        drain = Signal()
+
+        #### Request
+        request = Signal()
+        word = Signal(30)
+        # Nothing else is taken while a load is on its way through
+        m.d.comb += request.eq(bus.cyc & bus.stb & ~(mem_pending & mem_load))
+        m.d.comb += word.eq(bus.adr[2:])
+
+        matches = Signal(depth)     # Entries for the requested word
+        open_match = Signal(depth)  # ... that can still be merged into
+        for i in range(depth):
+            m.d.comb += matches[i].eq(valid[i] & (adr[i] == word))
+            locked = Const(i) == rd_ptr
+            m.d.comb += open_match[i].eq(matches[i] & ~(locked & head_locked))
+
+        # There's at most one open entry per word, it's newer than a locked one
+        newest = Signal(range(depth))
+        m.d.comb += newest.eq(rd_ptr)
+        for i in range(depth):
+            with m.If(open_match[i]):
+                m.d.comb += newest.eq(i)
+
+        full = Signal()
+        m.d.comb += full.eq(valid.all())
+
+        accept = Signal()
+        coalesce = Signal()
+        forward = Signal()
+        load_through = Signal()
+
+        with m.If(bus.we):
+            m.d.comb += coalesce.eq(open_match.any())
+            m.d.comb += accept.eq(request & (coalesce | ~full))
+        with m.Elif(matches.any()):
+            # All the bytes it wants have to come from the same entry
+            m.d.comb += forward.eq((bus.sel & ~sel[newest]) == 0)
+            m.d.comb += accept.eq(request & forward)
+        with m.Else():
+            m.d.comb += load_through.eq(request & mem_free)
+            m.d.comb += accept.eq(load_through & ~mem_stall)
+
+        m.d.comb += bus.stall.eq(~accept)
+
+        with m.If(accept & bus.we):
+            with m.If(coalesce):
+                for lane in range(4):
+                    with m.If(bus.sel[lane]):
+                        m.d.sync += data[newest].word_select(lane, 8).eq(bus.dat_w.word_select(lane, 8))
+                m.d.sync += sel[newest].eq(sel[newest] | bus.sel)
+                m.d.sync += self.coalesced.eq(self.coalesced + 1)
+            with m.Else():
+                m.d.sync += [
+                    adr[wr_ptr].eq(word),
+                    data[wr_ptr].eq(bus.dat_w),
+                    sel[wr_ptr].eq(bus.sel),
+                    wr_ptr.eq(wrap(wr_ptr)),
+                ]
+
+        #### Responses
+        # Stores and forwarded loads are answered from here the next cycle
+        local_ack = Signal()
+        local_data = Signal(unsigned(32))
+        m.d.sync += local_ack.eq(accept & (bus.we | forward))
+        with m.If(accept & forward):
+            m.d.sync += local_data.eq(data[newest])
+            m.d.sync += self.forwarded.eq(self.forwarded + 1)
+
+        load_ack = Signal()
+        m.d.comb += load_ack.eq(mem_pending & mem_load & self.mem.ack)
+        m.d.comb += [
+            bus.ack.eq(local_ack | load_ack),
+            bus.dat_r.eq(Mux(local_ack, local_data, self.mem.dat_r)),
+        ]
+
+        #### Drain
+        drained = Signal()
+        m.d.comb += drained.eq(mem_pending & ~mem_load & self.mem.ack)
+        m.d.comb += drain.eq(valid.bit_select(rd_ptr, 1) & ~mem_pending & ~load_through)
+
+        with m.If(load_through):
+            m.d.comb += [
+                self.mem.adr.eq(bus.adr),
+                self.mem.sel.eq(bus.sel),
+                self.mem.we.eq(0),
+            ]
+        with m.Else():
+            m.d.comb += [
+                self.mem.adr.eq(Cat(Const(0, 2), adr[rd_ptr])),
+                self.mem.sel.eq(sel[rd_ptr]),
+                self.mem.dat_w.eq(data[rd_ptr]),
+                self.mem.we.eq(1),
+            ]
+        m.d.comb += [
+            self.mem.stb.eq(load_through | drain),
+            self.mem.cyc.eq(self.mem.stb | mem_pending),
+        ]
+
+        issued = Signal()
+        m.d.comb += issued.eq(self.mem.stb & ~mem_stall)
+        with m.If(issued):
+            m.d.sync += mem_pending.eq(1)
+            m.d.sync += mem_load.eq(load_through)
+        with m.Elif(self.mem.ack):
+            m.d.sync += mem_pending.eq(0)
+
+        # Merging into the head is off from when its drain goes out until it's popped
+        m.d.comb += head_locked.eq(drain | (mem_pending & ~mem_load))
+        with m.If(drained):
+            m.d.sync += rd_ptr.eq(wrap(rd_ptr))
+
+        # Entries are pushed at wr_ptr and popped at rd_ptr, possibly in the same cycle
+        push = Signal(depth)
+        pop = Signal(depth)
+        m.d.comb += push.eq(Mux(accept & bus.we & ~coalesce, 1 << wr_ptr, 0))
+        m.d.comb += pop.eq(Mux(drained, 1 << rd_ptr, 0))
+        m.d.sync += valid.eq((valid & ~pop) | push)
+
+        m.d.comb += self.busy.eq(valid.any() | mem_pending)
+
+        return m
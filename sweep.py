@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""Synthesize RV32ICore across a matrix of configurations and tabulate area against speed.
+
+    python sweep.py --pipeline fsm pipelined --regfile flops bram --icache none 4:64:1 --ext i imc
+    python sweep.py --pipeline pipelined --icache 4:64:1 --prefetch 0 2 --dcache none 4:64:1 4:32:2
+    python sweep.py --pipeline pipelined --target xilinx --bench --json sweep.json
+
+Every combination of the options is elaborated (RTLIL through rtlcache.py) and synthesized by
+a local Yosys, generically and/or for Xilinx 7-series, in a pool of worker processes. Results
+are cached like generated RTL, keyed on the synthesis script and Yosys version too, so only
+new configurations cost a synthesis run.
+
+For each it reports cells, flip-flops, LUTs, block RAMs (in 36Kb tiles), DSPs and the longest
+combinational path (``ltp -noff``, in gates or LUT/carry levels). A configuration that fails
+to elaborate, synthesize or pass the benchmarks is listed with its error, the rest of the
+sweep carries on, and the exit status is non-zero. Without Yosys every configuration is
+still elaborated, to check it builds. The Xilinx Fmax is a rough
+estimate from that path with fixed per-level and clocking delays, there's no placement.
+``--bench`` also runs the benchmark suite (bench.py) on each configuration for its CPI and
+DMIPS/MHz, then DMIPS per 1000 LUTs at the estimated Fmax ranks performance per area.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import sim
+from dcache import DCacheConfig
+from icache import ICacheConfig
+from muldiv import MulDivConfig
+from regfile import RegFileConfig
+from rtlcache import RTLCache, generate
+
+SCRIPTS = {
+    "generic": "synth -flatten -top top",
+    "xilinx": "synth_xilinx -flatten -top top -family xc7",
+}
+
+STAT_SCRIPT = """read_ilang top.il
+{synth}
+tee -q -o stat.json stat -json
+tee -q -o ltp.txt ltp -noff
+"""
+
+# Rough 7-series -1 delays (ns): clock-to-out plus setup, and a LUT (or carry) level with its
+# routing. Real paths vary a lot with placement, this is only good for comparing configurations.
+XILINX_CLOCKING_NS = 0.6
+XILINX_LEVEL_NS = 0.6
+
+#### Configurations
+
+REGFILES = {
+    "flops": None,
+    "lutram": RegFileConfig(memory=True),
+    "bram": RegFileConfig(memory=True, sync_read=True),
+}
+
+EXTENSIONS = {
+    "i": {},
+    "im": {"muldiv": MulDivConfig()},
+    "ic": {"compressed": True},
+    "imc": {"muldiv": MulDivConfig(), "compressed": True},
+}
+
+def _geometry(value: str) -> dict:
+    line_words, sets, ways = (int(x) for x in value.split(":"))
+    return {"line_words": line_words, "sets": sets, "ways": ways}
+
+def configurations(args: argparse.Namespace) -> list:
+    """(name, RV32ICore keyword arguments) for every combination of the options."""
+    points = []
+    for pipeline, regfile, icache, prefetch, dcache, ext in itertools.product(
+            args.pipeline, args.regfile, args.icache, args.prefetch, args.dcache, args.ext):
+        config = {"pipelined": pipeline == "pipelined", **EXTENSIONS[ext]}
+        if REGFILES[regfile] is not None:
+            config["regfile"] = REGFILES[regfile]
+        name = [pipeline, regfile]
+        if icache != "none":
+            config["icache"] = ICacheConfig(**_geometry(icache))
+            name.append(f"ic{icache.replace(':', 'x')}")
+        if prefetch:
+            config["prefetch"] = prefetch
+            name.append(f"pf{prefetch}")
+        if dcache != "none":
+            config["dcache"] = DCacheConfig(**_geometry(dcache))
+            name.append(f"dc{dcache.replace(':', 'x')}")
+        name.append(ext)
+        points.append(("-".join(name), config))
+    return points
+
+#### Synthesis
+
+def _cell_counts(cells: dict, target: str) -> dict:
+    def count(*prefixes):
+        return sum(n for cell, n in cells.items() if cell.startswith(prefixes))
+
+    if target == "xilinx":
+        return {
+            "ffs": count("FD"),
+            "luts": count("LUT"),
+            "lutram": count("RAM32", "RAM64", "RAM128", "RAM256"),
+            "carry": count("CARRY"),
+            "bram": count("RAMB36") + count("RAMB18") / 2,
+            "dsp": count("DSP48"),
+        }
+    return {
+        "ffs": count("$_DFF", "$_SDFF", "$_ALDFF", "$_DLATCH"),
+        "luts": 0,
+        "lutram": 0,
+        "carry": 0,
+        "bram": 0,
+        "dsp": 0,
+    }
+
+@lru_cache(maxsize=None)
+def yosys_version() -> str:
+    """``yosys -V``, part of the cache key: a new Yosys can map the same design differently."""
+    return subprocess.run(["yosys", "-V"], capture_output=True, text=True, check=True).stdout.strip()
+
+def synthesize(config: dict, target: str, cache_dir: str) -> dict:
+    """Area and logic depth of RV32ICore with ``config`` for ``target``, from the cache if possible."""
+    cache = RTLCache(cache_dir)
+    script = STAT_SCRIPT.format(synth=SCRIPTS[target])
+
+    def build(directory):
+        with open(os.path.join(directory, "top.il"), "w") as f:
+            f.write(generate(config, "il", cache=cache, core=True))
+        with open(os.path.join(directory, "synth.ys"), "w") as f:
+            f.write(script)
+        if subprocess.run(["yosys", "-q", "-l", "yosys.log", "-s", "synth.ys"], cwd=directory,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode:
+            # The failed entry is thrown away with its log, keep the reason
+            with open(os.path.join(directory, "yosys.log")) as f:
+                lines = [line.strip() for line in f if line.strip()]
+            raise RuntimeError(f"yosys failed: {lines[-1] if lines else 'no log'}")
+        # The netlist is the bulk of the entry and nothing reads it again
+        os.remove(os.path.join(directory, "top.il"))
+
+    path = cache.get(f"synth-{target}", {"config": config, "script": script, "yosys": yosys_version()}, build)
+
+    with open(os.path.join(path, "stat.json")) as f:
+        stat = json.load(f)
+    with open(os.path.join(path, "ltp.txt")) as f:
+        ltp = f.read()
+    return parse_synthesis(stat, ltp, target)
+
+def parse_synthesis(stat: dict, ltp: str, target: str) -> dict:
+    """Results from Yosys's ``stat -json`` and ``ltp -noff`` output."""
+    design = stat.get("design") or next(iter(stat["modules"].values()))
+    match = re.search(r"length=(\d+)", ltp)
+    depth = int(match.group(1)) if match else None
+
+    result = {"cells": design["num_cells"], "depth": depth,
+              **_cell_counts(design.get("num_cells_by_type", {}), target)}
+    if target == "xilinx" and depth:
+        result["fmax_mhz"] = round(1000 / (XILINX_CLOCKING_NS + depth * XILINX_LEVEL_NS), 1)
+    return result
+
+def elaborate(config: dict, cache_dir: str) -> dict:
+    """Just generate the RTLIL, when there's no Yosys to synthesize it."""
+    generate(config, "il", cache=RTLCache(cache_dir), core=True)
+    return {}
+
+def _error(e: Exception) -> str:
+    return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+def _sweep_point(config: dict, target: str, cache_dir: str) -> dict:
+    # Runs in a worker, a failure is a result like any other
+    try:
+        if target is None:
+            return elaborate(config, cache_dir)
+        return synthesize(config, target, cache_dir)
+    except Exception as e:
+        return {"error": _error(e)}
+
+#### Benchmarks
+
+def benchmark(config: dict, args: argparse.Namespace) -> dict:
+    """CPI over the whole benchmark suite, and Dhrystone's DMIPS/MHz."""
+    import bench
+
+    try:
+        results = bench.run_suite(config, args.engine, iterations=args.iterations, jobs=args.jobs)
+    except Exception as e:
+        return {"passed": False, "error": _error(e)}
+    cycles = sum(r["cycles"] for r in results)
+    instret = sum(r["instret"] for r in results)
+    dhrystone = next((r for r in results if r["name"] == "dhrystone"), None)
+    return {
+        "passed": all(r["passed"] for r in results),
+        "cpi": round(cycles / instret, 3) if instret else None,
+        "dmips_mhz": dhrystone["score"] if dhrystone and dhrystone["passed"] else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", nargs="+", choices=("fsm", "pipelined"), default=["fsm", "pipelined"])
+    parser.add_argument("--regfile", nargs="+", choices=tuple(REGFILES), default=["flops"])
+    parser.add_argument("--icache", nargs="+", metavar="WORDS:SETS:WAYS", default=["none"],
+                        help="instruction cache geometries, 'none' for no cache")
+    parser.add_argument("--prefetch", nargs="+", metavar="DEPTH", type=int, default=[0],
+                        help="prefetch queue depths, 0 for no queue")
+    parser.add_argument("--dcache", nargs="+", metavar="WORDS:SETS:WAYS", default=["none"],
+                        help="data cache geometries, 'none' for no cache")
+    parser.add_argument("--ext", nargs="+", choices=tuple(EXTENSIONS), default=["i"],
+                        help="ISA extensions, M through a single-cycle multiplier")
+    parser.add_argument("--target", nargs="+", choices=tuple(SCRIPTS), default=list(SCRIPTS))
+    parser.add_argument("--bench", action="store_true", help="also run the benchmark suite on each configuration")
+    parser.add_argument("--engine", choices=("pysim", "cxxsim"), default="pysim")
+    parser.add_argument("--iterations", type=int, help="benchmark iteration count override")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-dir", default=RTLCache().directory)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    points = configurations(args)
+    targets = args.target
+    if not shutil.which("yosys"):
+        print("yosys not found, skipping synthesis", file=sys.stderr)
+        targets = []
+
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures = {(name, target): pool.submit(_sweep_point, config, target, args.cache_dir)
+                   for name, config in points for target in targets or [None]}
+        synth = {key: future.result() for key, future in futures.items()}
+
+    results = []
+    for name, config in points:
+        errors = [synth[name, target]["error"] for target in targets or [None] if "error" in synth[name, target]]
+        results.append({
+            "name": name,
+            "config": sim.config_to_json(config),
+            "synth": {target: synth[name, target] for target in targets},
+            # Not worth benchmarking what doesn't build
+            "bench": benchmark(config, args) if args.bench and not errors else None,
+            "error": errors[0] if errors else None,
+        })
+
+    print(f"{'configuration':<36} {'target':<8} {'cells':>7} {'FFs':>6} {'LUTs':>6} {'BRAM':>5} {'DSP':>4} "
+          f"{'depth':>5} {'Fmax':>6} {'CPI':>6} {'DMIPS/MHz':>9} {'DMIPS/kLUT':>10}")
+    for r in results:
+        b = r["bench"] or {}
+        for target in targets or [None]:
+            s = r["synth"].get(target, {})
+            if s.get("error"):
+                print(f"{r['name']:<36} {target:<8} FAILED {s['error']}")
+                continue
+            if target is None and r["error"]:
+                print(f"{r['name']:<36} {'-':<8} FAILED {r['error']}")
+                continue
+            fmax = s.get("fmax_mhz")
+            per_klut = None
+            if fmax and s.get("luts") and b.get("dmips_mhz"):
+                per_klut = b["dmips_mhz"] * fmax / (s["luts"] / 1000)
+
+            def col(value, width, fmt=""):
+                return f"{'-' if value is None else format(value, fmt):>{width}}"
+
+            print(f"{r['name']:<36} {target or '-':<8} {col(s.get('cells'), 7)} {col(s.get('ffs'), 6)} "
+                  f"{col(s.get('luts') if target == 'xilinx' else None, 6)} "
+                  f"{col(s.get('bram') if target == 'xilinx' else None, 5, 'g')} "
+                  f"{col(s.get('dsp') if target == 'xilinx' else None, 4)} {col(s.get('depth'), 5)} "
+                  f"{col(fmax, 6, '.1f')} {col(b.get('cpi'), 6, '.2f')} {col(b.get('dmips_mhz'), 9, '.3f')} "
+                  f"{col(per_klut, 10, '.1f')}")
+        if b.get("error"):
+            print(f"{r['name']:<36} {'bench':<8} FAILED {b['error']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"targets": targets, "results": results}, f, indent=2)
+
+    failed = [r["name"] for r in results if r["error"] or (r["bench"] and not r["bench"]["passed"])]
+    if failed:
+        print(f"{len(failed)} of {len(results)} configurations failed", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#ifndef BENCH_H
+#define BENCH_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+/* bench.py passes -DITERATIONS, small enough for the Python simulator by default */
+#ifndef ITERATIONS
+#define ITERATIONS 1
+#endif
+
+/* Timed region, bench_stop records what it took for crt0.S to hand back */
+extern uint32_t bench_cycles, bench_instret, bench_iterations;
+
+static inline uint32_t read_cycle(void)
+{
+    uint32_t value;
+    __asm__ volatile ("rdcycle %0" : "=r"(value));
+    return value;
+}
+
+static inline uint32_t read_instret(void)
+{
+    uint32_t value;
+    __asm__ volatile ("rdinstret %0" : "=r"(value));
+    return value;
+}
+
+void bench_start(void);
+void bench_stop(uint32_t iterations);
+
+/* There's no libc, lib.c has what the benchmarks and GCC need */
+void *memcpy(void *dest, const void *src, size_t n);
+void *memset(void *dest, int c, size_t n);
+int memcmp(const void *a, const void *b, size_t n);
+char *strcpy(char *dest, const char *src);
+int strcmp(const char *a, const char *b);
+
+/* Same sequence on every run, for inputs */
+static inline uint32_t bench_random(uint32_t *state)
+{
+    *state = *state * 1664525u + 1013904223u;
+    return *state;
+}
+
+#endif
@@ -0,0 +1,394 @@
+/*
+ * CoreMark-style workload: linked-list search/reverse/mergesort, small-matrix arithmetic
+ * and a number-parsing state machine, with results folded into a CRC-16 as CoreMark does.
+ *
+ * The algorithms follow CoreMark's, but this isn't the EEMBC code and its scores can't be
+ * compared with published CoreMark results, only between configurations of this core. Every
+ * iteration starts from the same data, so each has to come out with EXPECTED_CRC.
+ */
+#include "bench.h"
+
+#define EXPECTED_CRC 0x098d
+
+#define SEED 0x3415
+
+/* CRC-16, polynomial 0xA001, the one CoreMark uses */
+
+static uint16_t crcu8(uint8_t data, uint16_t crc)
+{
+    for (int i = 0; i < 8; i++) {
+        uint8_t carry = (data ^ crc) & 1;
+        data >>= 1;
+        crc >>= 1;
+        if (carry)
+            crc ^= 0xa001;
+    }
+    return crc;
+}
+
+static uint16_t crcu16(uint16_t data, uint16_t crc)
+{
+    crc = crcu8((uint8_t)data, crc);
+    return crcu8((uint8_t)(data >> 8), crc);
+}
+
+static uint16_t crcu32(uint32_t data, uint16_t crc)
+{
+    crc = crcu16((uint16_t)data, crc);
+    return crcu16((uint16_t)(data >> 16), crc);
+}
+
+/* Linked list */
+
+#define LIST_ITEMS 32
+
+typedef struct list_item {
+    struct list_item *next;
+    int16_t data;
+    int16_t idx;
+} list_item;
+
+static list_item items[LIST_ITEMS];
+
+typedef int (*list_cmp)(const list_item *a, const list_item *b);
+
+static int cmp_data(const list_item *a, const list_item *b)
+{
+    if (a->data != b->data)
+        return a->data - b->data;
+    return a->idx - b->idx;
+}
+
+static int cmp_idx(const list_item *a, const list_item *b)
+{
+    return a->idx - b->idx;
+}
+
+static list_item *list_init(uint16_t seed)
+{
+    uint32_t state = seed;
+    for (int i = 0; i < LIST_ITEMS; i++) {
+        items[i].next = i + 1 < LIST_ITEMS ? &items[i + 1] : 0;
+        items[i].data = (int16_t)(bench_random(&state) >> 20);
+        items[i].idx = (int16_t)i;
+    }
+    return &items[0];
+}
+
+static list_item *list_find(list_item *list, int16_t data)
+{
+    while (list && list->data != data)
+        list = list->next;
+    return list;
+}
+
+static list_item *list_reverse(list_item *list)
+{
+    list_item *reversed = 0;
+    while (list) {
+        list_item *next = list->next;
+        list->next = reversed;
+        reversed = list;
+        list = next;
+    }
+    return reversed;
+}
+
+/* Bottom-up mergesort of a singly linked list (Simon Tatham's), as in CoreMark */
+static list_item *list_mergesort(list_item *list, list_cmp cmp)
+{
+    int insize = 1;
+
+    for (;;) {
+        list_item *p = list, *tail = 0;
+        int merges = 0;
+        list = 0;
+
+        while (p) {
+            list_item *q = p;
+            int psize = 0, qsize;
+            merges++;
+            for (int i = 0; i < insize && q; i++) {
+                psize++;
+                q = q->next;
+            }
+            qsize = insize;
+
+            while (psize > 0 || (qsize > 0 && q)) {
+                list_item *e;
+                if (psize == 0) {
+                    e = q;
+                    q = q->next;
+                    qsize--;
+                } else if (qsize == 0 || !q || cmp(p, q) <= 0) {
+                    e = p;
+                    p = p->next;
+                    psize--;
+                } else {
+                    e = q;
+                    q = q->next;
+                    qsize--;
+                }
+                if (tail)
+                    tail->next = e;
+                else
+                    list = e;
+                tail = e;
+            }
+            p = q;
+        }
+        tail->next = 0;
+
+        if (merges <= 1)
+            return list;
+        insize *= 2;
+    }
+}
+
+static uint16_t bench_list(uint16_t seed, uint16_t crc)
+{
+    list_item *list = list_init(seed);
+
+    /* Look for values that are there and some that aren't */
+    for (int i = 0; i < 8; i++) {
+        list_item *found = list_find(list, items[(i * 5) % LIST_ITEMS].data + (i & 1));
+        crc = crcu16(found ? (uint16_t)found->idx : 0xffff, crc);
+        list = list_reverse(list);
+    }
+
+    list = list_mergesort(list, cmp_data);
+    for (list_item *item = list; item; item = item->next)
+        crc = crcu16((uint16_t)item->data, crc);
+
+    list = list_mergesort(list, cmp_idx);
+    for (list_item *item = list; item; item = item->next)
+        crc = crcu16((uint16_t)item->idx, crc);
+
+    return crc;
+}
+
+/* Matrices */
+
+#define N 8
+
+static int16_t matrix_a[N][N], matrix_b[N][N];
+static int32_t matrix_c[N][N];
+
+static void matrix_init(uint16_t seed)
+{
+    uint32_t state = seed;
+    for (int i = 0; i < N; i++) {
+        for (int j = 0; j < N; j++) {
+            matrix_a[i][j] = (int16_t)((bench_random(&state) >> 24) - 128);
+            matrix_b[i][j] = (int16_t)((bench_random(&state) >> 24) - 128);
+        }
+    }
+}
+
+static uint16_t matrix_sum(uint16_t crc)
+{
+    int32_t sum = 0;
+    for (int i = 0; i < N; i++)
+        for (int j = 0; j < N; j++)
+            sum += matrix_c[i][j];
+    return crcu32((uint32_t)sum, crc);
+}
+
+static uint16_t bench_matrix(uint16_t seed, uint16_t crc)
+{
+    int16_t value = (int16_t)(seed | 0xf);
+
+    matrix_init(seed);
+
+    /* A += value */
+    for (int i = 0; i < N; i++)
+        for (int j = 0; j < N; j++)
+            matrix_a[i][j] += value;
+
+    /* C = A * value */
+    for (int i = 0; i < N; i++)
+        for (int j = 0; j < N; j++)
+            matrix_c[i][j] = (int32_t)matrix_a[i][j] * value;
+    crc = matrix_sum(crc);
+
+    /* C = A * column 0 of B */
+    for (int i = 0; i < N; i++) {
+        int32_t sum = 0;
+        for (int j = 0; j < N; j++)
+            sum += (int32_t)matrix_a[i][j] * matrix_b[j][0];
+        matrix_c[i][0] = sum;
+    }
+    crc = matrix_sum(crc);
+
+    /* C = A * B */
+    for (int i = 0; i < N; i++) {
+        for (int j = 0; j < N; j++) {
+            int32_t sum = 0;
+            for (int k = 0; k < N; k++)
+                sum += (int32_t)matrix_a[i][k] * matrix_b[k][j];
+            matrix_c[i][j] = sum;
+        }
+    }
+    crc = matrix_sum(crc);
+
+    /* C = A * B, summing bit fields of the products */
+    for (int i = 0; i < N; i++) {
+        for (int j = 0; j < N; j++) {
+            int32_t sum = 0;
+            for (int k = 0; k < N; k++) {
+                int32_t product = (int32_t)matrix_a[i][k] * matrix_b[k][j];
+                sum += ((product >> 2) & 0xf) * ((product >> 5) & 0x7f);
+            }
+            matrix_c[i][j] = sum;
+        }
+    }
+    crc = matrix_sum(crc);
+
+    return crc;
+}
+
+/* State machine, classifying comma-separated numbers */
+
+enum state { START, INT, S1, FLOAT, S2, EXPONENT, SCIENTIFIC, INVALID, STATES };
+
+static const char *const tokens[] = {
+    "5012", "1.2", "-874", "-1.5e-3", "+122", "7.", "-.5", "6.4e-3", "12x", "+0e+1", "-", "3e",
+};
+
+#define INPUT_SIZE 256
+
+static char input[INPUT_SIZE];
+
+static void state_init(uint16_t seed)
+{
+    uint32_t state = seed;
+    int at = 0;
+    for (;;) {
+        const char *token = tokens[bench_random(&state) % (sizeof(tokens) / sizeof(tokens[0]))];
+        int length = 0;
+        while (token[length])
+            length++;
+        if (at + length + 1 >= INPUT_SIZE)
+            break;
+        for (int i = 0; i < length; i++)
+            input[at++] = token[i];
+        input[at++] = ',';
+    }
+    input[at] = 0;
+}
+
+static int is_digit(char c)
+{
+    return c >= '0' && c <= '9';
+}
+
+/* Runs to the next comma, counting the transitions into each state */
+static enum state next_state(const char **str, uint32_t *transitions)
+{
+    const char *p = *str;
+    enum state state = START;
+
+    for (; *p && state != INVALID; p++) {
+        char c = *p;
+        if (c == ',') {
+            p++;
+            break;
+        }
+        enum state next = state;
+        switch (state) {
+        case START:
+            if (is_digit(c))
+                next = INT;
+            else if (c == '+' || c == '-')
+                next = S1;
+            else if (c == '.')
+                next = FLOAT;
+            else
+                next = INVALID;
+            break;
+        case S1:
+            if (is_digit(c))
+                next = INT;
+            else if (c == '.')
+                next = FLOAT;
+            else
+                next = INVALID;
+            break;
+        case INT:
+            if (c == '.')
+                next = FLOAT;
+            else if (!is_digit(c))
+                next = INVALID;
+            break;
+        case FLOAT:
+            if (c == 'E' || c == 'e')
+                next = S2;
+            else if (!is_digit(c))
+                next = INVALID;
+            break;
+        case S2:
+            if (c == '+' || c == '-')
+                next = EXPONENT;
+            else
+                next = INVALID;
+            break;
+        case EXPONENT:
+            if (is_digit(c))
+                next = SCIENTIFIC;
+            else
+                next = INVALID;
+            break;
+        case SCIENTIFIC:
+            if (!is_digit(c))
+                next = INVALID;
+            break;
+        default:
+            break;
+        }
+        if (next != state)
+            transitions[next]++;
+        state = next;
+    }
+
+    /* Skip the rest of an invalid token */
+    while (*p && p[-1] != ',')
+        p++;
+    *str = p;
+    return state;
+}
+
+static uint16_t bench_state(uint16_t seed, uint16_t crc)
+{
+    uint32_t finals[STATES] = {0}, transitions[STATES] = {0};
+
+    state_init(seed);
+    for (const char *p = input; *p;)
+        finals[next_state(&p, transitions)]++;
+
+    for (int i = 0; i < STATES; i++) {
+        crc = crcu32(finals[i], crc);
+        crc = crcu32(transitions[i], crc);
+    }
+    return crc;
+}
+
+static uint16_t iterate(uint16_t seed)
+{
+    uint16_t crc = 0;
+    crc = bench_list(seed, crc);
+    crc = bench_matrix(seed, crc);
+    crc = bench_state(seed, crc);
+    return crc;
+}
+
+int main(void)
+{
+    int errors = 0;
+
+    bench_start();
+    for (int i = 0; i < ITERATIONS; i++)
+        errors += iterate(SEED) != EXPECTED_CRC;
+    bench_stop(ITERATIONS);
+
+    return errors;
+}
@@ -0,0 +1,46 @@
+/* Table-driven CRC-32 (IEEE 802.3) of a 1 KiB buffer */
+#include "bench.h"
+
+#define SIZE 1024
+
+static uint32_t table[256];
+static uint8_t buffer[SIZE];
+
+static void crc32_init(void)
+{
+    for (uint32_t i = 0; i < 256; i++) {
+        uint32_t crc = i;
+        for (int bit = 0; bit < 8; bit++)
+            crc = (crc >> 1) ^ (crc & 1 ? 0xedb88320 : 0);
+        table[i] = crc;
+    }
+}
+
+static uint32_t crc32(const uint8_t *data, size_t length)
+{
+    uint32_t crc = 0xffffffff;
+    while (length--)
+        crc = (crc >> 8) ^ table[(crc ^ *data++) & 0xff];
+    return ~crc;
+}
+
+int main(void)
+{
+    uint32_t state = 1;
+    uint32_t expected;
+    int errors = 0;
+
+    crc32_init();
+    errors += crc32((const uint8_t *)"123456789", 9) != 0xcbf43926;
+
+    for (int i = 0; i < SIZE; i++)
+        buffer[i] = (uint8_t)bench_random(&state);
+    expected = crc32(buffer, SIZE);
+
+    bench_start();
+    for (int i = 0; i < ITERATIONS; i++)
+        errors += crc32(buffer, SIZE) != expected;
+    bench_stop(ITERATIONS);
+
+    return errors;
+}
@@ -0,0 +1,67 @@
+#include "bench.h"
+
+uint32_t bench_cycles, bench_instret, bench_iterations;
+
+static uint32_t start_cycle, start_instret;
+
+void bench_start(void)
+{
+    start_instret = read_instret();
+    start_cycle = read_cycle();
+}
+
+void bench_stop(uint32_t iterations)
+{
+    uint32_t cycle = read_cycle();
+    uint32_t instret = read_instret();
+    bench_cycles = cycle - start_cycle;
+    bench_instret = instret - start_instret;
+    bench_iterations = iterations;
+}
+
+void *memcpy(void *dest, const void *src, size_t n)
+{
+    unsigned char *d = dest;
+    const unsigned char *s = src;
+
+    /* Words at a time if both line up */
+    if ((((uintptr_t)d | (uintptr_t)s) & 3) == 0) {
+        for (; n >= 4; n -= 4, d += 4, s += 4)
+            *(uint32_t *)d = *(const uint32_t *)s;
+    }
+    while (n--)
+        *d++ = *s++;
+    return dest;
+}
+
+void *memset(void *dest, int c, size_t n)
+{
+    unsigned char *d = dest;
+    while (n--)
+        *d++ = (unsigned char)c;
+    return dest;
+}
+
+int memcmp(const void *a, const void *b, size_t n)
+{
+    const unsigned char *x = a, *y = b;
+    for (; n; n--, x++, y++)
+        if (*x != *y)
+            return *x - *y;
+    return 0;
+}
+
+char *strcpy(char *dest, const char *src)
+{
+    char *d = dest;
+    while ((*d++ = *src++))
+        ;
+    return dest;
+}
+
+int strcmp(const char *a, const char *b)
+{
+    while (*a && *a == *b)
+        a++, b++;
+    return (unsigned char)*a - (unsigned char)*b;
+}
@@ -0,0 +1,26 @@
+/* Copies a 2 KiB buffer with lib.c's memcpy, word-aligned and then misaligned by a byte */
+#include "bench.h"
+
+#define SIZE 2048
+
+static uint8_t src[SIZE + 4], dest[SIZE + 4];
+
+int main(void)
+{
+    uint32_t state = 1;
+    int errors = 0;
+
+    for (int i = 0; i < SIZE + 4; i++)
+        src[i] = (uint8_t)bench_random(&state);
+
+    bench_start();
+    for (int i = 0; i < ITERATIONS; i++) {
+        memcpy(dest, src, SIZE);
+        errors += memcmp(dest, src, SIZE) != 0;
+        memcpy(dest + 1, src, SIZE);
+        errors += memcmp(dest + 1, src, SIZE) != 0;
+    }
+    bench_stop(ITERATIONS);
+
+    return errors;
+}
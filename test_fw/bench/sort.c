@@ -0,0 +1,60 @@
+/* Quicksort of 256 pseudo-random integers, refilled on every iteration */
+#include "bench.h"
+
+#define COUNT 256
+
+static int32_t values[COUNT];
+
+static void quicksort(int32_t *a, int n)
+{
+    while (n > 1) {
+        int32_t pivot = a[n / 2];
+        int i = 0, j = n - 1;
+        while (i <= j) {
+            while (a[i] < pivot)
+                i++;
+            while (a[j] > pivot)
+                j--;
+            if (i <= j) {
+                int32_t t = a[i];
+                a[i++] = a[j];
+                a[j--] = t;
+            }
+        }
+        /* Recurse into the smaller side, loop on the larger */
+        if (j + 1 < n - i) {
+            quicksort(a, j + 1);
+            a += i;
+            n -= i;
+        } else {
+            quicksort(a + i, n - i);
+            n = j + 1;
+        }
+    }
+}
+
+int main(void)
+{
+    int errors = 0;
+
+    bench_start();
+    for (int iteration = 0; iteration < ITERATIONS; iteration++) {
+        uint32_t state = 1;
+        uint32_t sum = 0, sorted_sum = 0;
+        for (int i = 0; i < COUNT; i++) {
+            values[i] = (int32_t)bench_random(&state);
+            sum += (uint32_t)values[i];
+        }
+
+        quicksort(values, COUNT);
+
+        for (int i = 0; i < COUNT; i++) {
+            errors += i > 0 && values[i - 1] > values[i];
+            sorted_sum += (uint32_t)values[i];
+        }
+        errors += sum != sorted_sum;
+    }
+    bench_stop(ITERATIONS);
+
+    return errors;
+}
@@ -1,8 +1,23 @@
 #!/usr/bin/env python
+import os
 from subprocess import run
 
 prefix = "riscv32-unknown-elf"
+here = os.path.dirname(os.path.abspath(__file__))
 
-run(f"{prefix}-as test.S -o test.o".split())
-run(f"{prefix}-ld -T test_link.ld test.o -o test.elf".split())
-run(f"{prefix}-objcopy -O binary test.elf test.bin".split())
\ No newline at end of file
+def build(source: str, output: str, linker_script: str = os.path.join(here, "test_link.ld"),
+          include_dirs: tuple = (), march: str = "rv32i", extra_sources: tuple = (),
+          cflags: tuple = ()) -> str:
+    """Build ``source`` into ``output``.elf and a flat ``output``.bin, returns the .bin path.
+
+    ``extra_sources`` are linked in too (startup code, support libraries). libgcc is always
+    linked, for the multiply/divide helpers C needs without RV32M.
+    """
+    includes = [f"-I{path}" for path in include_dirs]
+    run([f"{prefix}-gcc", f"-march={march}", "-mabi=ilp32", "-nostdlib", "-nostartfiles", *cflags,
+         "-T", linker_script, *includes, source, *extra_sources, "-o", f"{output}.elf", "-lgcc"], check=True)
+    run(f"{prefix}-objcopy -O binary {output}.elf {output}.bin".split(), check=True)
+    return f"{output}.bin"
+
+if __name__ == "__main__":
+    build("test.S", "test")
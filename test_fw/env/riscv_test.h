@@ -0,0 +1,45 @@
+// Minimal riscv-tests environment for runt: bare machine, no traps or CSRs, code at address 0.
+// Tests finish with an ECALL, a0 = 0 on pass, otherwise a0 = gp = (failing test number << 1) | 1
+#ifndef _ENV_RUNT_H
+#define _ENV_RUNT_H
+
+#define RVTEST_RV32U .macro init; .endm
+#define RVTEST_RV64U RVTEST_RV32U
+
+#define TESTNUM gp
+
+#define RVTEST_CODE_BEGIN                                               \
+        .section .text.init;                                            \
+        .align  2;                                                      \
+        .globl _start;                                                  \
+_start:                                                                 \
+        init;
+
+#define RVTEST_CODE_END                                                 \
+        unimp
+
+#define RVTEST_PASS                                                     \
+        fence;                                                          \
+        li TESTNUM, 1;                                                  \
+        li a7, 93;                                                      \
+        li a0, 0;                                                       \
+        ecall
+
+#define RVTEST_FAIL                                                     \
+        fence;                                                          \
+1:      beqz TESTNUM, 1b;                                               \
+        sll TESTNUM, TESTNUM, 1;                                        \
+        or TESTNUM, TESTNUM, 1;                                         \
+        li a7, 93;                                                      \
+        addi a0, TESTNUM, 0;                                            \
+        ecall
+
+#define EXTRA_DATA
+
+#define RVTEST_DATA_BEGIN                                               \
+        EXTRA_DATA                                                      \
+        .align 4; .global begin_signature; begin_signature:
+
+#define RVTEST_DATA_END .align 4; .global end_signature; end_signature:
+
+#endif
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pysim compiles each fragment to deeply nested Python
+sys.setrecursionlimit(max(sys.getrecursionlimit(), 100_000))
@@ -0,0 +1,51 @@
+"""Benchmark results from the registers crt0.S leaves behind, and the baseline comparison."""
+import bench
+import sim
+from bench import BENCHMARKS, parse_result
+
+DHRYSTONE, COREMARK = BENCHMARKS[:2]
+
+def run(regs: dict, halted: bool = True, cycles: int = 0) -> sim.SimResult:
+    values = [0] * 32
+    for reg, value in regs.items():
+        values[reg] = value
+    return sim.SimResult("pysim", cycles, 0, halted, 1.0, values)
+
+# A recorded pipelined Dhrystone run: a0 = errors, a1 = cycles, a2 = instret, a3 = iterations
+DHRYSTONE_RUN = {10: 0, 11: 11_224, 12: 8_980, 13: 20}
+
+def test_dhrystone():
+    assert parse_result(DHRYSTONE, run(DHRYSTONE_RUN, cycles=19_532)) == {
+        "name": "dhrystone",
+        "passed": True,
+        "timeout": False,
+        "iterations": 20,
+        "cycles": 11_224,
+        "instret": 8_980,
+        "cpi": 1.25,
+        # 20 iterations in 11224 cycles at 1 MHz, over 1757 per DMIPS
+        "score": 1.0142,
+        "score_unit": "DMIPS/MHz",
+        "total_cycles": 19_532,
+    }
+
+def test_failures():
+    # Errors reported by the benchmark itself
+    failed = parse_result(COREMARK, run({10: 3, 11: 50_000, 12: 40_000, 13: 2}))
+    assert not failed["passed"] and not failed["timeout"]
+    assert failed["score"] == 0.0 and failed["cpi"] == 1.25
+
+    # Out of cycles before the timed loop handed anything back
+    timeout = parse_result(COREMARK, run({}, halted=False, cycles=10_000_000))
+    assert not timeout["passed"] and timeout["timeout"]
+    assert timeout["cpi"] == timeout["score"] == 0.0
+
+def test_compare(capsys):
+    results = [parse_result(DHRYSTONE, run(DHRYSTONE_RUN)), parse_result(COREMARK, run({10: 1}))]
+    baseline = {"config": {"pipelined": False}, "benchmarks": [
+        dict(results[0], score=0.5), {"name": "coremark", "score": 2.0}]}
+    bench.compare(results, baseline)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == "against {'pipelined': False}"
+    # Failed runs have no score to compare
+    assert lines[3:] == ["dhrystone          0.5000       1.0142  +102.8%"]
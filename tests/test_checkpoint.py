@@ -0,0 +1,57 @@
+"""Fast-forwarding on the ISS, through a checkpoint file, and carrying on in the RTL in
+lockstep with an ISS restored from the same checkpoint."""
+import pytest
+
+import sim
+from checkpoint import Checkpoint, fast_forward, restore
+from iss import ISS, Lockstep
+from test_lockstep import CONFIGS, PROGRAMS, assemble
+
+# Partway through the fill and sum loops, with mtvec set, between traps (mepc/mcause set)
+# and inside the handler
+CASES = [("memory", 40), ("memory", 300), ("control", 30), ("control", 100), ("control", 65),
+         ("muldiv", 10)]
+
+@pytest.mark.parametrize("program, instructions", CASES)
+def test_save_load(program, instructions, tmp_path):
+    path = tmp_path / f"{program}.bin"
+    path.write_bytes(assemble(PROGRAMS[program]))
+    checkpoint = fast_forward(str(path), program == "muldiv", instructions)
+    assert checkpoint.instret == instructions
+
+    checkpoint.save(str(tmp_path / "ckpt.gz"))
+    loaded = Checkpoint.load(str(tmp_path / "ckpt.gz"))
+    assert (loaded.pc, loaded.regs, loaded.csrs, loaded.instret) == \
+        (checkpoint.pc, checkpoint.regs, checkpoint.csrs, checkpoint.instret)
+    assert loaded.memory.page_bits == checkpoint.memory.page_bits
+    assert loaded.memory.pages == checkpoint.memory.pages
+
+@pytest.mark.parametrize("name", ["fsm", "pipelined", "dcache-2way", "rv32m"])
+@pytest.mark.parametrize("program, instructions", CASES)
+def test_restore(name, program, instructions, tmp_path):
+    if program == "muldiv" and "muldiv" not in CONFIGS[name]:
+        pytest.skip("needs RV32M")
+    path = tmp_path / f"{program}.bin"
+    path.write_bytes(assemble(PROGRAMS[program]))
+    muldiv = "muldiv" in CONFIGS[name]
+    fast_forward(str(path), muldiv, instructions).save(str(tmp_path / "ckpt.gz"))
+    checkpoint = Checkpoint.load(str(tmp_path / "ckpt.gz"))
+
+    iss = ISS(muldiv=muldiv)
+    restore(iss, checkpoint)
+    lockstep = Lockstep(iss)
+    result = sim.Simulation(dict(CONFIGS[name], paged=True, trace=True)).run(
+        str(path), 20_000, trace=[lockstep], checkpoint=checkpoint)
+
+    assert result.halted
+    assert lockstep.divergence is None, lockstep.report()
+    assert lockstep.checked == result.instret
+    assert iss.step() is None
+    assert result.regs == iss.regs
+
+    # The same as running the whole program on the ISS
+    whole = ISS(muldiv=muldiv)
+    whole.load(str(path))
+    whole.run()
+    assert whole.regs == iss.regs
+    assert whole.instret == instructions + result.instret
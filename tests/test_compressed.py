@@ -0,0 +1,168 @@
+"""RV32C: every expansion class through ``CompressedExpander``, then a compressed program run
+end to end through ``RealignBuffer``.
+
+The ISS has no RV32C, so the program is checked against the ISS running its 32-bit
+expansion instead, apart from registers that hold code addresses.
+"""
+import struct
+
+import pytest
+from nmigen.sim import Simulator, Settle
+
+import sim
+from compressed import CompressedExpander
+from icache import ICacheConfig
+from iss import ISS
+from test_lockstep import assemble
+
+def expand(item):
+    """The 32-bit instruction a ``c.`` one stands for, in the assembler's syntax."""
+    op, *args = item
+    if op == "c.addi4spn":
+        return ("addi", args[0], 2, args[1])
+    if op in ("c.lw", "c.sw"):
+        return (op[2:], *args)
+    if op == "c.nop":
+        return ("addi", 0, 0, 0)
+    if op in ("c.addi", "c.srli", "c.srai", "c.andi", "c.slli"):
+        return (op[2:], args[0], args[0], args[1])
+    if op in ("c.jal", "c.j"):
+        return ("jal", 1 if op == "c.jal" else 0, args[0])
+    if op == "c.li":
+        return ("addi", args[0], 0, args[1])
+    if op == "c.addi16sp":
+        return ("addi", 2, 2, args[0])
+    if op == "c.lui":
+        return ("lui", args[0], args[1])
+    if op in ("c.sub", "c.xor", "c.or", "c.and", "c.add"):
+        return (op[2:], args[0], args[0], args[1])
+    if op in ("c.beqz", "c.bnez"):
+        return ("beq" if op == "c.beqz" else "bne", args[0], 0, args[1])
+    if op in ("c.lwsp", "c.swsp"):
+        return (op[2:4], args[0], args[1], 2)
+    if op in ("c.jr", "c.jalr"):
+        return ("jalr", 0 if op == "c.jr" else 1, 0, args[0])
+    if op == "c.mv":
+        return ("add", args[0], 0, args[1])
+    if op == "c.ebreak":
+        return ("word", 0x00100073)
+    return item
+
+#### Expander
+
+# One of each, with immediates that set the sign bit and every scattered field
+DIRECTED = [
+    ("c.addi4spn", 9, 0x3fc), ("c.addi4spn", 15, 4),
+    ("c.lw", 8, 0x7c, 15), ("c.sw", 15, 0x44, 8),
+    ("c.nop",), ("c.addi", 5, -32), ("c.addi", 31, 31),
+    ("c.jal", -2048), ("c.jal", 0x7fe), ("c.j", -2), ("c.j", 0x2aa),
+    ("c.li", 10, -1), ("c.li", 0, 5),
+    ("c.addi16sp", -512), ("c.addi16sp", 0x1f0),
+    ("c.lui", 3, 0xfffe0), ("c.lui", 31, 0x1f),
+    ("c.srli", 8, 31), ("c.srai", 15, 1), ("c.andi", 12, -32), ("c.andi", 9, 0x15),
+    ("c.sub", 8, 15), ("c.xor", 9, 14), ("c.or", 10, 13), ("c.and", 11, 12),
+    ("c.beqz", 8, -256), ("c.beqz", 15, 0xaa), ("c.bnez", 10, 0xfe), ("c.bnez", 11, -2),
+    ("c.slli", 7, 31), ("c.slli", 30, 1),
+    ("c.lwsp", 1, 0xfc), ("c.lwsp", 31, 0),
+    ("c.jr", 1), ("c.jalr", 17), ("c.mv", 10, 11), ("c.add", 2, 31), ("c.ebreak",),
+    ("c.swsp", 31, 0xfc), ("c.swsp", 1, 4),
+]
+
+# Reserved, or RV64/floating point only, expanded to all zeros
+RESERVED = {
+    "c.addi4spn zero": 0x0000, "c.fld": 0x2000, "c.addi16sp zero": 0x6101, "c.lui zero": 0x6181,
+    "c.srli shamt[5]": 0x9001, "c.subw": 0x9c01, "c.slli shamt[5]": 0x1006, "c.lwsp x0": 0x4002,
+    "c.jr x0": 0x8002, "c.fsdsp": 0xa002,
+}
+
+def expanded(words):
+    """Run ``words`` through the expander, return (out, compressed) for each."""
+    expander = CompressedExpander()
+    results = []
+
+    def process():
+        for word in words:
+            yield expander.instr.eq(word)
+            yield Settle()
+            results.append(((yield expander.out), (yield expander.compressed)))
+
+    simulator = Simulator(expander)
+    simulator.add_process(process)
+    simulator.run()
+    return results
+
+def test_expand():
+    halfwords = [struct.unpack("<H", assemble([item]))[0] for item in DIRECTED]
+    expected = [struct.unpack("<I", assemble([expand(item)]))[0] for item in DIRECTED]
+    for item, want, (out, compressed) in zip(DIRECTED, expected, expanded(halfwords)):
+        assert compressed
+        assert out == want, f"{item}: {out:#010x} != {want:#010x}"
+
+def test_reserved():
+    for name, (out, compressed) in zip(RESERVED, expanded(list(RESERVED.values()))):
+        assert compressed and out == 0, name
+
+def test_passthrough():
+    word = struct.unpack("<I", assemble([("lw", 5, -4, 9)]))[0]
+    # With the upper half of the fetched word a compressed instruction
+    assert expanded([word, word | 0x4515 << 16]) == [(word, 0), (word | 0x4515 << 16, 0)]
+
+#### End to end
+
+# 32-bit instructions land on both halves of a word, and straddle words and I-cache lines
+PROGRAM = [
+    ("li", 2, 0x1000),
+    ("c.li", 8, 5), ("c.li", 9, -3), ("c.addi", 8, 7), ("addi", 10, 0, 1),
+    ("c.mv", 10, 8), ("c.add", 10, 9), ("c.addi4spn", 11, 16),
+    ("c.sw", 10, 4, 11), ("c.lw", 12, 4, 11), ("lw", 13, 20, 2), ("c.swsp", 12, 8), ("c.lwsp", 14, 8),
+    ("c.addi16sp", -64), ("c.swsp", 10, 60), ("c.addi16sp", 64), ("lw", 15, -4, 2),
+    ("c.lui", 16, 0xfffff), ("c.srli", 12, 4), ("c.srai", 9, 1), ("c.slli", 16, 3), ("c.andi", 14, -6),
+    ("c.li", 13, 0x0f), ("c.mv", 15, 13), ("c.sub", 15, 8), ("c.xor", 13, 10), ("c.or", 14, 9),
+    ("c.and", 12, 13),
+    # A loop of compressed instructions, with a 32-bit one straddling the back edge
+    ("c.li", 8, 6), ("c.li", 9, 0),
+    "loop",
+    ("c.addi", 9, 3), ("addi", 17, 17, 2), ("c.addi", 8, -1), ("c.bnez", 8, "loop"),
+    ("c.beqz", 9, "wrong"), ("c.bnez", 8, "wrong"),
+    # Calls, to halfword-aligned code and back
+    ("c.jal", "leaf"), ("c.addi", 18, 1),
+    ("li", 15, "indirect"), ("c.jalr", 15), ("c.addi", 18, 1),
+    ("c.j", "done"),
+    "wrong",
+    ("c.li", 18, -1),
+    "done",
+    ("c.nop",), ("ecall",),
+    "leaf",
+    ("c.addi", 19, 5), ("c.jr", 1),
+    ("c.nop",),
+    "indirect",
+    ("addi", 19, 19, 7), ("c.jr", 1),
+]
+
+# Registers holding code addresses, which differ from the 32-bit program's
+ADDRESSES = {1, 15}
+
+CONFIGS = {
+    "fsm": {"compressed": True},
+    "pipelined": {"pipelined": True, "compressed": True},
+    "icache-prefetch": {"pipelined": True, "compressed": True, "icache": ICacheConfig(2, 4, 1), "prefetch": 2},
+}
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_program(name, tmp_path):
+    path = tmp_path / "rvc.bin"
+    path.write_bytes(assemble(PROGRAM))
+    result = sim.Simulation(dict(CONFIGS[name], paged=True)).run(str(path), 5_000)
+
+    reference = tmp_path / "rv32i.bin"
+    reference.write_bytes(assemble([item if isinstance(item, str) else expand(item) for item in PROGRAM]))
+    iss = ISS()
+    iss.load(str(reference))
+    iss.run()
+
+    assert result.halted
+    assert len(path.read_bytes()) < len(reference.read_bytes())
+    assert result.regs[18] == 2 and result.regs[19] == 12
+    for reg, (value, expected) in enumerate(zip(result.regs, iss.regs)):
+        if reg not in ADDRESSES:
+            assert value == expected, f"x{reg}"
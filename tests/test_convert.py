@@ -0,0 +1,23 @@
+"""Every configuration has to convert to RTLIL, not just simulate: pysim accepts some
+constructs the RTLIL backend can't lower, which would break Verilator runs, the RTL cache
+and sweeps."""
+import pytest
+
+from icache import ICacheConfig
+from dcache import DCacheConfig
+from rtlcache import RTLCache, generate
+
+CONFIGS = {
+    "icache-direct": {"pipelined": True, "icache": ICacheConfig(4, 8, 1)},
+    "icache-2way": {"pipelined": True, "icache": ICacheConfig(4, 8, 2)},
+    "dcache-direct": {"dcache": DCacheConfig(4, 2, 1)},
+    "dcache-2way": {"dcache": DCacheConfig(4, 2, 2), "store_buffer": 2},
+}
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_simtop(name, tmp_path):
+    assert "module" in generate(CONFIGS[name], "il", cache=RTLCache(str(tmp_path)))
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_core(name, tmp_path):
+    assert "module" in generate(CONFIGS[name], "il", cache=RTLCache(str(tmp_path)), core=True)
@@ -0,0 +1,149 @@
+"""Program images: PT_LOAD segments of a hand-built ELF, flat binaries, the paged memory they
+go into and a paged simulation of an ELF with far-apart segments."""
+import struct
+
+import pytest
+
+import sim
+from image import PagedMemory, image_size, load_segments, load_words, word_view
+from iss import ISS, Lockstep
+from test_lockstep import assemble
+
+PT_NOTE = 4
+
+def make_elf(segments: list, symbols: list = (), ident: bytes = b"\x7fELF\x01\x01\x01") -> bytes:
+    """A minimal RV32 ELF executable.
+
+    ``segments`` are (p_type, address, data, memsz), ``symbols`` (address, size, name, type)
+    go into a .symtab. Contents follow the headers in order.
+    """
+    ehsize, phentsize, shentsize = 52, 32, 40
+    offset = ehsize + phentsize * len(segments)
+    phdrs = b""
+    contents = b""
+    for p_type, address, data, memsz in segments:
+        phdrs += struct.pack("<IIIIIIII", p_type, offset + len(contents), address, address, len(data), memsz, 5, 4)
+        contents += data
+
+    shdrs = b""
+    shnum = 0
+    if symbols:
+        strtab = b"\0"
+        symtab = bytes(16)
+        for address, size, name, st_type in symbols:
+            symtab += struct.pack("<IIIBBH", len(strtab), address, size, st_type, 0, 1)
+            strtab += name.encode() + b"\0"
+        symtab_offset = offset + len(contents)
+        contents += symtab + strtab
+        shdrs = bytes(shentsize) + \
+            struct.pack("<IIIIIIIIII", 0, 2, 0, 0, symtab_offset, len(symtab), 2, 1, 4, 16) + \
+            struct.pack("<IIIIIIIIII", 0, 3, 0, 0, symtab_offset + len(symtab), len(strtab), 0, 0, 1, 0)
+        shnum = 3
+
+    header = ident.ljust(16, b"\0") + struct.pack(
+        "<HHIIIIIHHHHHH", 2, 243, 1, 0, ehsize, offset + len(contents) if shnum else 0, 0,
+        ehsize, phentsize, len(segments), shentsize, shnum, 0)
+    return header + phdrs + contents + shdrs
+
+#### Segments
+
+def test_elf_segments(tmp_path):
+    path = tmp_path / "image.elf"
+    path.write_bytes(make_elf([
+        (1, 0x0, b"\x13\x00\x00\x00" * 3, 12),
+        (PT_NOTE, 0x0, b"note", 4),
+        # .data followed by .bss
+        (1, 0x2000, b"\x01\x02\x03\x04\x05", 0x40),
+        (1, 0x3000, b"", 0),
+    ]))
+    segments = [(address, bytes(data), size) for address, data, size in load_segments(str(path))]
+    assert segments == [(0x0, b"\x13\x00\x00\x00" * 3, 12), (0x2000, b"\x01\x02\x03\x04\x05", 0x40)]
+    assert image_size(str(path)) == 0x2040
+
+    words = load_words(str(path))
+    assert len(words) == 0x2040 // 4
+    assert words[:4] == [0x13, 0x13, 0x13, 0]
+    assert words[0x800:0x803] == [0x04030201, 0x05, 0]
+    with pytest.raises(ValueError):
+        load_words(str(path), 0x800)
+
+def test_flat_binary(tmp_path):
+    path = tmp_path / "image.bin"
+    path.write_bytes(b"\x01\x02\x03\x04\x05\x06")
+    (address, data, size), = load_segments(str(path))
+    assert (address, bytes(data), size) == (0, b"\x01\x02\x03\x04\x05\x06", 6)
+    assert load_words(str(path), 4) == [0x04030201, 0x0605, 0, 0]
+
+    path.write_bytes(b"")
+    assert load_segments(str(path)) == [] and image_size(str(path)) == 0
+
+@pytest.mark.parametrize("ident", [b"\x7fELF\x02\x01\x01", b"\x7fELF\x01\x02\x01"])
+def test_not_rv32(ident, tmp_path):
+    path = tmp_path / "image.elf"
+    path.write_bytes(make_elf([(1, 0, b"\0" * 4, 4)], ident=ident))
+    with pytest.raises(ValueError):
+        load_segments(str(path))
+
+def test_word_view():
+    assert word_view(b"\x01\x02\x03\x04\x05").tolist() == [0x04030201, 0x05]
+    assert word_view(bytearray(8)).tolist() == [0, 0]
+
+#### Paged memory
+
+def test_paged_memory(tmp_path):
+    path = tmp_path / "image.elf"
+    # Over four 256-byte pages, with .bss running on into a fifth
+    data = bytes(range(256)) * 2 + bytes(range(0x20))
+    path.write_bytes(make_elf([(1, 0x1f0, data, 0x400)]))
+
+    memory = PagedMemory(page_bits=8)
+    memory.load(str(path))
+    assert sorted(memory.pages) == [1, 2, 3, 4]
+    assert memory.read(0x1f0) == 0x03020100
+    assert memory.read(0x1fc) == 0x0f0e0d0c
+    assert memory.read(0x200) == 0x13121110
+    assert memory.read(0x40c) == 0x1f1e1d1c
+    # .bss and never-written pages read zero, without being allocated
+    assert memory.read(0x410) == 0 and memory.read(0x5f0) == 0 and memory.read(0x10000) == 0
+    assert sorted(memory.pages) == [1, 2, 3, 4]
+
+    memory.write(0x10000, 0xaabbccdd, 0b0110)
+    assert memory.read(0x10000) == 0x00bbcc00
+    copy = PagedMemory(page_bits=8)
+    copy.copy_from(memory)
+    copy.write(0x10000, 0)
+    assert memory.read(0x10000) == 0x00bbcc00 and copy.read(0x1f0) == 0x03020100
+    with pytest.raises(ValueError):
+        PagedMemory(page_bits=12).copy_from(memory)
+
+    memory.load(str(path))
+    assert memory.read(0x10000) == 0
+
+#### Simulation
+
+# Code at 0, .data at 64KiB and .bss at 16MiB, far outside the default memory depth
+DATA = 0x10000
+BSS = 0x1000000
+PROGRAM = [
+    ("lui", 1, DATA >> 12), ("lui", 2, BSS >> 12),
+    ("lw", 3, 0, 1), ("lw", 4, 4, 1), ("lw", 5, 8, 1), ("add", 6, 3, 4),
+    ("lw", 7, 0x7fc, 2), ("sw", 6, 0x7fc, 2), ("lw", 8, 0x7fc, 2),
+    ("ecall",),
+]
+
+@pytest.mark.parametrize("config", [{}, {"pipelined": True}], ids=["fsm", "pipelined"])
+def test_paged_simulation(config, tmp_path):
+    path = tmp_path / "image.elf"
+    path.write_bytes(make_elf([
+        (1, 0, assemble(PROGRAM), 0x100),
+        (1, DATA, struct.pack("<II", 1234, 4321), 12),
+        (1, BSS, b"", 0x1000),
+    ]))
+    iss = ISS()
+    iss.load(str(path))
+    lockstep = Lockstep(iss)
+    result = sim.Simulation(dict(config, paged=True, trace=True)).run(str(path), 1_000, trace=[lockstep])
+
+    assert result.halted
+    assert lockstep.divergence is None, lockstep.report()
+    assert result.regs[3:9] == [1234, 4321, 0, 5555, 0, 5555]
@@ -0,0 +1,178 @@
+"""Interrupts in lockstep with the ISS, and a bound on how long the core takes to enter them.
+
+A hand-assembled loop of loads, stores, shifts, CSR reads and calls (and multiplies and
+divides with RV32M) runs with a vectored mtvec. The test raises meip at random points while
+interrupts are enabled, and the handler drops it again, like latency.py. The CLINT's timer
+interrupts it as well, its handler sets the next mtimecmp. Every cycle an interrupt is pending
+before the core takes it counts towards its entry latency.
+"""
+import random
+
+import pytest
+
+import sim
+from clint import CLINT_BASE, MTIME, MTIMECMP
+from dcache import DCacheConfig
+from icache import ICacheConfig
+from iss import ISS, Lockstep
+from muldiv import MulDivConfig, Multiplier
+from test_lockstep import assemble
+
+ITERATIONS = 60
+# Cycles between a timer interrupt and the next
+TIMER_PERIOD = 150
+
+def program(muldiv: bool) -> list:
+    return [
+        ("li", 1, "vectors"), ("ori", 1, 1, 1), ("csrrw", 0, 0x305, 1),     # Vectored
+        ("li", 1, (1 << 11) | (1 << 7)), ("csrrw", 0, 0x304, 1),           # MEIE, MTIE
+        ("li", 8, 0x800), ("li", 5, 1234), ("sw", 5, 0, 8), ("addi", 6, 0, 77), ("sw", 6, 4, 8),
+        ("li", 9, CLINT_BASE + MTIMECMP), ("li", 18, CLINT_BASE + MTIME),
+        ("sw", 0, 4, 9), ("lw", 11, 0, 18), ("addi", 11, 11, TIMER_PERIOD), ("sw", 11, 0, 9),
+        ("addi", 20, 0, 0), ("addi", 21, 0, 0), ("addi", 22, 0, 0), ("addi", 23, 0, ITERATIONS),
+        ("addi", 1, 0, 8), ("csrrs", 0, 0x300, 1),                          # MIE
+        "loop",
+        ("lw", 5, 0, 8), ("lw", 6, 4, 8), ("add", 7, 5, 6), ("sw", 7, 8, 8), ("lw", 28, 8, 8),
+        ("bne", 7, 28, "wrong"),
+        # Long operations an interrupt abandons part way, they start over afterwards
+        *([("mul", 28, 5, 6), ("divu", 29, 28, 6), ("bne", 29, 5, "wrong"),
+           ("remu", 29, 7, 5), ("bne", 29, 6, "wrong")] if muldiv else []),
+        ("slli", 28, 5, 7), ("srli", 28, 28, 7), ("bne", 28, 5, "wrong"),
+        ("csrrs", 30, 0xc00, 0), ("sb", 30, 12, 8), ("lbu", 13, 12, 8), ("andi", 30, 30, 0xff),
+        ("bne", 13, 30, "wrong"),
+        ("jal", 1, "leaf"),
+        ("addi", 22, 22, 1), ("bne", 22, 23, "loop"),
+        ("addi", 10, 0, 0), ("ecall",),
+        "wrong",
+        ("addi", 10, 0, 2), ("ecall",),
+        "exception",
+        ("addi", 10, 0, 1), ("ecall",),
+        "leaf",
+        ("jalr", 0, 0, 1),
+        # Handlers, by mcause
+        "vectors",
+        *([("jal", 0, "exception")] * 7),
+        ("jal", 0, "timer"),                # 7, MTI
+        *([("jal", 0, "exception")] * 3),
+        ("jal", 0, "external"),             # 11, MEI
+        # The test drops meip as the core gets here, like a real handler would ack the device
+        "external",
+        ("addi", 20, 20, 1), ("mret",),
+        "timer",
+        ("addi", 21, 21, 1), ("lw", 11, 0, 18), ("addi", 11, 11, TIMER_PERIOD), ("sw", 11, 0, 9), ("mret",),
+    ]
+
+CONFIGS = {
+    "fsm": {},
+    "pipelined": {"pipelined": True},
+    "caches": {"pipelined": True, "icache": ICacheConfig(4, 8, 1), "dcache": DCacheConfig(4, 8, 1),
+               "store_buffer": 2},
+    "rv32m-fsm": {"muldiv": MulDivConfig(Multiplier.ITERATIVE)},
+    "rv32m": {"pipelined": True, "muldiv": MulDivConfig(Multiplier.ITERATIVE)},
+}
+
+# Worst-case cycles from an interrupt becoming pending to entering its handler. Nothing but
+# a fetch or load already on the bus holds one up. The FSM core only takes one between a
+# fetch (3 cycles, from setting STB to decoding) and executing, so it can wait for a fetch
+# and a load that's out before it (2 more). The pipeline abandons everything but a load on
+# the bus, which takes 2 cycles from memory or up to a writeback and refill of a D-cache line.
+BOUNDS = {"fsm": 5, "pipelined": 2, "caches": 12, "rv32m-fsm": 5, "rv32m": 2}
+
+MAX_CYCLES = 40_000
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_interrupt_latency(name, tmp_path):
+    config = CONFIGS[name]
+    muldiv = "muldiv" in config
+    path = tmp_path / "irq.bin"
+    path.write_bytes(assemble(program(muldiv)))
+
+    simulation = sim.Simulation(dict(config, clint=True, paged=True, trace=True))
+    top = simulation.top
+    cpu = top.cpu
+    traps = cpu.csr.traps
+    rng = random.Random(name)
+    external = []
+    latencies = []
+
+    def drive_meip():
+        # Raises meip a random number of cycles after the last one was taken, once MIE is set.
+        # Like any sync process, it reads what the design had up to the clock edge it woke on.
+        cycles = 0
+
+        def tick():
+            # True once the run is over, pysim can't reset a process that's still waiting
+            nonlocal cycles
+            yield
+            cycles += 1
+            return cycles >= MAX_CYCLES or (yield top.halt)
+
+        while True:
+            for _ in range(rng.randrange(4, 64)):
+                if (yield from tick()):
+                    return
+            while not (yield traps.mstatus[3]) or (yield cpu.trap):
+                if (yield from tick()):
+                    return
+            yield top.meip.eq(1)
+            while not (yield cpu.interrupt):
+                if (yield from tick()):
+                    return
+            external.append(cycles)
+            yield top.meip.eq(0)
+
+    def measure():
+        # Cycles an interrupt has been pending, counted up to the one it's taken in
+        waiting = 0
+        for _ in range(MAX_CYCLES):
+            yield
+            if (yield top.halt):
+                return
+            if (yield cpu.interrupt):
+                latencies.append(waiting)
+                waiting = 0
+            elif (yield traps.pending):
+                waiting += 1
+
+    simulation.sim.add_sync_process(drive_meip)
+    simulation.sim.add_sync_process(measure)
+
+    iss = ISS(muldiv=muldiv)
+    iss.load(str(path))
+    lockstep = Lockstep(iss)
+    result = simulation.run(str(path), MAX_CYCLES, trace=[lockstep])
+
+    assert result.halted
+    assert lockstep.divergence is None, lockstep.report()
+    errors, taken_external, taken_timer = result.regs[10], result.regs[20], result.regs[21]
+    assert errors == 0
+    # Both kinds were taken, each MRET returned to the loop, and nothing was lost
+    assert result.regs[22] == ITERATIONS
+    assert taken_external == len(external) > 0
+    assert taken_timer > 0
+    assert len(latencies) == taken_external + taken_timer
+    assert max(latencies) <= BOUNDS[name]
+
+# Interrupts stay disabled in mstatus, so the timer interrupt pends and software polls mip for it
+POLL_MIP = [
+    ("li", 1, 1 << 7), ("csrrw", 0, 0x304, 1),                              # MTIE
+    ("li", 9, CLINT_BASE + MTIMECMP), ("li", 18, CLINT_BASE + MTIME),
+    ("sw", 0, 4, 9), ("lw", 11, 0, 18), ("addi", 11, 11, 20), ("sw", 11, 0, 9),
+    "wait",
+    ("csrrs", 5, 0x344, 0), ("andi", 6, 5, 1 << 7), ("beq", 6, 0, "wait"),
+    ("csrrs", 7, 0x344, 0), ("ecall",),
+]
+
+@pytest.mark.parametrize("name", ["fsm", "pipelined"])
+def test_mip_lockstep(name, tmp_path):
+    path = tmp_path / "mip.bin"
+    path.write_bytes(assemble(POLL_MIP))
+    iss = ISS()
+    iss.load(str(path))
+    lockstep = Lockstep(iss)
+    result = sim.Simulation(dict(CONFIGS[name], clint=True, paged=True, trace=True)).run(
+        str(path), 2_000, trace=[lockstep])
+
+    assert result.halted
+    assert lockstep.divergence is None, lockstep.report()
+    assert result.regs[7] == iss.regs[7] == 1 << 7
@@ -0,0 +1,39 @@
+"""Latency statistics and the printed report, from recorded runs of the workload."""
+from latency import report, summarize
+
+# Samples (latency, pc) recorded from two seeds of the pipelined core with a D-cache
+RUNS = [
+    {"seed": 0, "passed": True, "samples": [(0, 0x1a4), (1, 0x1b0), (0, 0x1a8), (9, 0x1c4), (1, 0x1b0)]},
+    {"seed": 1, "passed": True, "samples": [(2, 0x1b8), (9, 0x1cc), (0, 0x1a4)]},
+]
+
+SYMBOLS = [(0x100, 0, "_start"), (0x1a0, 0x40, "workload")]
+
+def test_summarize():
+    assert summarize(RUNS) == {
+        "interrupts": 8,
+        "min": 0,
+        "mean": 2.75,
+        "max": 9,
+        "histogram": {0: 3, 1: 2, 2: 1, 9: 2},
+        "worst_pcs": [0x1c4, 0x1cc],
+    }
+
+def test_report():
+    assert report(summarize(RUNS), SYMBOLS).splitlines() == [
+        "8 interrupts, latency min 0 mean 2.75 max 9 cycles",
+        "cycles    count",
+        "     0        3",
+        "     1        2",
+        "     2        1",
+        "     9        2",
+        "worst case at 0x000001c4 (workload+0x24)",
+        "worst case at 0x000001cc (workload+0x2c)",
+    ]
+    # Without symbols for the worst case
+    assert report(summarize(RUNS[1:])).splitlines()[-1] == "worst case at 0x000001cc"
+
+def test_none_taken():
+    summary = summarize([{"seed": 0, "passed": False, "samples": []}])
+    assert summary == {"interrupts": 0}
+    assert report(summary) == "0 interrupts"
@@ -0,0 +1,417 @@
+"""Small hand-assembled programs run on the RTL in lockstep with the ISS, across the main
+configurations, with every configuration also converted to RTLIL.
+
+The programs are assembled here rather than built with a toolchain, so the tests run
+anywhere nMigen does. Each one ends with ECALL.
+"""
+import struct
+
+import pytest
+
+import sim
+from alu import ALUConfig
+from dcache import DCacheConfig
+from icache import ICacheConfig
+from iss import ISS, Lockstep
+from muldiv import MulDivConfig, Multiplier
+from predictor import PredictorConfig
+from regfile import RegFileConfig
+from rtlcache import RTLCache, generate
+
+#### Assembler
+
+R_TYPE = {
+    "add": (0x00, 0), "sub": (0x20, 0), "sll": (0x00, 1), "slt": (0x00, 2), "sltu": (0x00, 3),
+    "xor": (0x00, 4), "srl": (0x00, 5), "sra": (0x20, 5), "or": (0x00, 6), "and": (0x00, 7),
+    "mul": (0x01, 0), "mulh": (0x01, 1), "mulhsu": (0x01, 2), "mulhu": (0x01, 3),
+    "div": (0x01, 4), "divu": (0x01, 5), "rem": (0x01, 6), "remu": (0x01, 7),
+}
+OP_IMM = {"addi": 0, "slti": 2, "sltiu": 3, "xori": 4, "ori": 6, "andi": 7}
+SHIFT_IMM = {"slli": (0x00, 1), "srli": (0x00, 5), "srai": (0x20, 5)}
+LOADS = {"lb": 0, "lh": 1, "lw": 2, "lbu": 4, "lhu": 5}
+STORES = {"sb": 0, "sh": 1, "sw": 2}
+BRANCHES = {"beq": 0, "bne": 1, "blt": 4, "bge": 5, "bltu": 6, "bgeu": 7}
+CSRS = {"csrrw": 1, "csrrs": 2, "csrrc": 3}
+WORDS = {"ecall": 0x00000073, "mret": 0x30200073, "fence.i": 0x0000100f, "illegal": 0x00000000}
+
+def _i(imm, rs1, funct3, rd, opcode):
+    return ((imm & 0xfff) << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+def _encode(op, args, pc, labels):
+    def target(label):
+        return labels[label] - pc if isinstance(label, str) else label
+
+    if op in R_TYPE:
+        funct7, funct3 = R_TYPE[op]
+        rd, rs1, rs2 = args
+        return [(funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | 0x33]
+    if op in OP_IMM:
+        rd, rs1, imm = args
+        return [_i(imm, rs1, OP_IMM[op], rd, 0x13)]
+    if op in SHIFT_IMM:
+        funct7, funct3 = SHIFT_IMM[op]
+        rd, rs1, shamt = args
+        return [_i((funct7 << 5) | shamt, rs1, funct3, rd, 0x13)]
+    if op in LOADS:
+        rd, offset, rs1 = args
+        return [_i(offset, rs1, LOADS[op], rd, 0x03)]
+    if op in STORES:
+        rs2, offset, rs1 = args
+        return [(((offset >> 5) & 0x7f) << 25) | (rs2 << 20) | (rs1 << 15) | (STORES[op] << 12) |
+                ((offset & 0x1f) << 7) | 0x23]
+    if op in BRANCHES:
+        rs1, rs2, label = args
+        offset = target(label)
+        return [(((offset >> 12) & 1) << 31) | (((offset >> 5) & 0x3f) << 25) | (rs2 << 20) | (rs1 << 15) |
+                (BRANCHES[op] << 12) | (((offset >> 1) & 0xf) << 8) | (((offset >> 11) & 1) << 7) | 0x63]
+    if op == "jal":
+        rd, label = args
+        offset = target(label)
+        return [(((offset >> 20) & 1) << 31) | (((offset >> 1) & 0x3ff) << 21) | (((offset >> 11) & 1) << 20) |
+                (((offset >> 12) & 0xff) << 12) | (rd << 7) | 0x6f]
+    if op == "jalr":
+        rd, offset, rs1 = args
+        return [_i(offset, rs1, 0, rd, 0x67)]
+    if op in ("lui", "auipc"):
+        rd, imm = args
+        return [((imm & 0xfffff) << 12) | (rd << 7) | (0x37 if op == "lui" else 0x17)]
+    if op in CSRS:
+        rd, csr, rs1 = args
+        return [_i(csr, rs1, CSRS[op], rd, 0x73)]
+    if op == "li":
+        # Always LUI + ADDI, so every instruction's size is known before labels are
+        rd, value = args
+        value = (labels[value] if isinstance(value, str) else value) & 0xffffffff
+        low = ((value & 0xfff) ^ 0x800) - 0x800
+        return [((((value - low) >> 12) & 0xfffff) << 12) | (rd << 7) | 0x37, _i(low, rd, 0, rd, 0x13)]
+    if op in WORDS:
+        return [WORDS[op]]
+    if op == "word":
+        return [args[0]]
+    raise ValueError(f"unknown instruction {op}")
+
+def _c(value, hi, lo):
+    # Bits hi..lo of an immediate, for scattering into a compressed instruction
+    return (value >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+def _c_reg(reg):
+    # rd'/rs1'/rs2', x8-x15
+    if not 8 <= reg < 16:
+        raise ValueError(f"x{reg} isn't a compressed register")
+    return reg - 8
+
+def _c_j(offset):
+    return ((_c(offset, 11, 11) << 12) | (_c(offset, 4, 4) << 11) | (_c(offset, 9, 8) << 9) |
+            (_c(offset, 10, 10) << 8) | (_c(offset, 6, 6) << 7) | (_c(offset, 7, 7) << 6) |
+            (_c(offset, 3, 1) << 3) | (_c(offset, 5, 5) << 2))
+
+def _c_b(offset):
+    return ((_c(offset, 8, 8) << 12) | (_c(offset, 4, 3) << 10) | (_c(offset, 7, 6) << 5) |
+            (_c(offset, 2, 1) << 3) | (_c(offset, 5, 5) << 2))
+
+def _c_ci(funct3, rd, imm, quadrant):
+    return (funct3 << 13) | (_c(imm, 5, 5) << 12) | (rd << 7) | (_c(imm, 4, 0) << 2) | quadrant
+
+C_ARITH = {"c.sub": 0, "c.xor": 1, "c.or": 2, "c.and": 3}
+
+def _encode_c(op, args, pc, labels):
+    """A 16-bit RV32C instruction, registers and operands in the order of the 32-bit one it
+    stands for with the repeated ones left out."""
+    def target(label):
+        return labels[label] - pc if isinstance(label, str) else label
+
+    # Quadrant 0
+    if op == "c.addi4spn":
+        rd, imm = args
+        return ((_c(imm, 5, 4) << 11) | (_c(imm, 9, 6) << 7) | (_c(imm, 2, 2) << 6) | (_c(imm, 3, 3) << 5) |
+                (_c_reg(rd) << 2))
+    if op in ("c.lw", "c.sw"):
+        reg, offset, rs1 = args
+        return (((2 if op == "c.lw" else 6) << 13) | (_c(offset, 5, 3) << 10) | (_c_reg(rs1) << 7) |
+                (_c(offset, 2, 2) << 6) | (_c(offset, 6, 6) << 5) | (_c_reg(reg) << 2))
+    # Quadrant 1
+    if op == "c.nop":
+        return _c_ci(0, 0, 0, 1)
+    if op in ("c.addi", "c.li"):
+        rd, imm = args
+        return _c_ci(0 if op == "c.addi" else 2, rd, imm, 1)
+    if op in ("c.jal", "c.j"):
+        return ((1 if op == "c.jal" else 5) << 13) | _c_j(target(args[0])) | 1
+    if op == "c.addi16sp":
+        imm, = args
+        return ((3 << 13) | (_c(imm, 9, 9) << 12) | (2 << 7) | (_c(imm, 4, 4) << 6) | (_c(imm, 6, 6) << 5) |
+                (_c(imm, 8, 7) << 3) | (_c(imm, 5, 5) << 2) | 1)
+    if op == "c.lui":
+        rd, imm = args
+        return _c_ci(3, rd, imm, 1)
+    if op in ("c.srli", "c.srai", "c.andi"):
+        rd, imm = args
+        return _c_ci(4, 0, imm, 1) | ({"c.srli": 0, "c.srai": 1, "c.andi": 2}[op] << 10) | (_c_reg(rd) << 7)
+    if op in C_ARITH:
+        rd, rs2 = args
+        return (4 << 13) | (3 << 10) | (_c_reg(rd) << 7) | (C_ARITH[op] << 5) | (_c_reg(rs2) << 2) | 1
+    if op in ("c.beqz", "c.bnez"):
+        rs1, label = args
+        return ((6 if op == "c.beqz" else 7) << 13) | _c_b(target(label)) | (_c_reg(rs1) << 7) | 1
+    # Quadrant 2
+    if op == "c.slli":
+        rd, shamt = args
+        return _c_ci(0, rd, shamt, 2)
+    if op == "c.lwsp":
+        rd, offset = args
+        return (2 << 13) | (_c(offset, 5, 5) << 12) | (rd << 7) | (_c(offset, 4, 2) << 4) | (_c(offset, 7, 6) << 2) | 2
+    if op in ("c.jr", "c.jalr"):
+        rs1, = args
+        return (4 << 13) | ((op == "c.jalr") << 12) | (rs1 << 7) | 2
+    if op in ("c.mv", "c.add"):
+        rd, rs2 = args
+        return (4 << 13) | ((op == "c.add") << 12) | (rd << 7) | (rs2 << 2) | 2
+    if op == "c.ebreak":
+        return (4 << 13) | (1 << 12) | 2
+    if op == "c.swsp":
+        rs2, offset = args
+        return (6 << 13) | (_c(offset, 5, 2) << 9) | (_c(offset, 7, 6) << 7) | (rs2 << 2) | 2
+    raise ValueError(f"unknown instruction {op}")
+
+def _assemble_one(item, pc, labels) -> bytes:
+    if item[0].startswith("c."):
+        return struct.pack("<H", _encode_c(item[0], item[1:], pc, labels))
+    return b"".join(struct.pack("<I", word & 0xffffffff) for word in _encode(item[0], item[1:], pc, labels))
+
+def assemble(program: list) -> bytes:
+    """Encode ``program``, a list of label strings and ``(mnemonic, *operands)`` tuples with
+    registers as numbers, branch and jump targets as labels and loads/stores as
+    ``(reg, offset, base)``, into a flat binary loaded at address 0. ``c.`` mnemonics are
+    16-bit RV32C instructions."""
+    labels = {}
+    pc = 0
+    for item in program:
+        if isinstance(item, str):
+            labels[item] = pc
+        else:
+            pc += len(_assemble_one(item, pc, _Anywhere()))
+
+    code = b""
+    for item in program:
+        if not isinstance(item, str):
+            code += _assemble_one(item, len(code), labels)
+    return code
+
+class _Anywhere(dict):
+    # Any label, for sizing instructions before forward labels are known
+    def __missing__(self, label):
+        return 0
+
+#### Programs
+
+ALU = [
+    ("li", 1, 0x12345678), ("li", 2, -0x1234),
+    ("add", 3, 1, 2), ("sub", 4, 1, 2), ("sll", 5, 1, 2), ("srl", 6, 2, 1), ("sra", 7, 2, 1),
+    ("slt", 8, 2, 1), ("sltu", 9, 2, 1), ("xor", 10, 1, 2), ("or", 11, 1, 2), ("and", 12, 1, 2),
+    ("addi", 13, 1, -1), ("slti", 14, 2, 5), ("sltiu", 15, 2, 5), ("xori", 16, 2, -1),
+    ("ori", 17, 1, 0x0f0), ("andi", 18, 2, 0x7ff),
+    ("slli", 19, 1, 7), ("srli", 20, 2, 3), ("srai", 21, 2, 3),
+    ("lui", 22, 0xabcde), ("auipc", 23, 1),
+    # Back-to-back dependencies, forwarded in the pipelined core
+    ("add", 24, 3, 4), ("add", 24, 24, 24), ("sub", 25, 24, 3), ("xor", 26, 25, 24),
+    ("ecall",),
+]
+
+# 32 words, bigger than the small data cache so lines get evicted and written back
+MEMORY = [
+    ("li", 1, 0x800), ("addi", 2, 0, 0), ("addi", 3, 0, 32),
+    "fill",
+    ("add", 4, 2, 2), ("addi", 4, 4, 3), ("addi", 1, 1, 4), ("addi", 2, 2, 1),
+    ("sw", 4, -4, 1), ("sw", 2, 124, 1), ("bne", 2, 3, "fill"),
+    ("li", 1, 0x800), ("sb", 3, 1, 1), ("sh", 3, 6, 1),
+    ("lb", 5, 1, 1), ("lbu", 6, 3, 1), ("lh", 7, 6, 1), ("lhu", 8, 4, 1),
+    ("addi", 11, 0, -1), ("sb", 11, 8, 1), ("lb", 12, 8, 1), ("lbu", 13, 8, 1), ("lh", 14, 8, 1),
+    ("addi", 2, 0, 0), ("addi", 9, 0, 0),
+    "sum",
+    ("lw", 4, 0, 1), ("add", 9, 9, 4), ("lw", 4, 128, 1), ("add", 9, 9, 4),
+    ("addi", 1, 1, 4), ("addi", 2, 2, 1), ("bne", 2, 3, "sum"),
+    # A load straight after a store to the same word
+    ("sw", 9, 0, 1), ("lw", 10, 0, 1),
+    ("ecall",),
+]
+
+# Reserved encodings of otherwise valid opcodes, each would change x5 (or jump) if it ran
+RESERVED = [
+    # BRANCH funct3 2/3
+    *((1 << 20) | (2 << 15) | (funct3 << 12) | (4 << 8) | 0x63 for funct3 in (2, 3)),
+    # LOAD funct3 3/6/7, STORE funct3 3-7
+    *(_i(0, 0, funct3, 5, 0x03) for funct3 in (3, 6, 7)),
+    *((5 << 20) | (funct3 << 12) | 0x23 for funct3 in range(3, 8)),
+    # JALR funct3 != 0
+    _i(0, 1, 1, 5, 0x67), _i(0, 1, 4, 5, 0x67),
+    # SLLI/SRLI/SRAI with shamt[5] or a bad funct7
+    _i((0x01 << 5) | 3, 1, 1, 5, 0x13), _i((0x20 << 5) | 3, 1, 1, 5, 0x13),
+    _i((0x01 << 5) | 3, 1, 5, 5, 0x13), _i((0x21 << 5) | 3, 1, 5, 5, 0x13), _i((0x10 << 5) | 3, 1, 5, 5, 0x13),
+    # OP funct7 0x20 on anything but ADD/SRL
+    *((0x20 << 25) | (2 << 20) | (1 << 15) | (funct3 << 12) | (5 << 7) | 0x33 for funct3 in (1, 4, 7)),
+]
+
+CONTROL = [
+    ("li", 1, "handler"), ("csrrw", 0, 0x305, 1),
+    ("addi", 10, 0, 0), ("addi", 5, 0, 6),
+    "loop",
+    ("jal", 1, "leaf"), ("addi", 5, 5, -1), ("bne", 5, 0, "loop"),
+    ("addi", 6, 0, -1), ("addi", 7, 0, 1),
+    ("blt", 6, 7, "t1"), ("addi", 10, 10, 100),
+    "t1",
+    ("bltu", 6, 7, "t2"), ("addi", 10, 10, 1),
+    "t2",
+    ("bge", 7, 6, "t3"), ("addi", 10, 10, 100),
+    "t3",
+    ("bgeu", 6, 7, "t4"), ("addi", 10, 10, 100),
+    "t4",
+    ("beq", 6, 7, "t5"), ("addi", 10, 10, 1),
+    "t5",
+    ("li", 8, "indirect"), ("jalr", 1, 0, 8), ("addi", 10, 10, 1),
+    # Illegal instructions, the handler skips them
+    ("illegal",), ("addi", 10, 10, 1),
+    *(item for word in RESERVED for item in (("word", word), ("addi", 10, 10, 1))),
+    ("ecall",),
+    "leaf",
+    ("addi", 10, 10, 1), ("jal", 0, "nested"),
+    "nested",
+    ("addi", 10, 10, 2), ("jalr", 0, 0, 1),
+    "indirect",
+    ("addi", 10, 10, 4), ("jalr", 0, 0, 1),
+    "handler",
+    ("csrrs", 11, 0x341, 0), ("addi", 11, 11, 4), ("csrrw", 0, 0x341, 11),
+    ("csrrs", 12, 0x342, 0), ("csrrs", 13, 0x343, 0), ("mret",),
+]
+
+MULDIV = [
+    ("li", 1, 0x12345678), ("addi", 2, 0, -7), ("addi", 3, 0, 0), ("li", 4, 0x80000000), ("addi", 5, 0, -1),
+    ("mul", 6, 1, 2), ("mulh", 7, 1, 2), ("mulhsu", 8, 2, 1), ("mulhu", 9, 1, 2),
+    ("div", 10, 1, 2), ("divu", 11, 1, 2), ("rem", 12, 1, 2), ("remu", 13, 1, 2),
+    # Division by zero and signed overflow
+    ("div", 14, 1, 3), ("rem", 15, 1, 3), ("divu", 16, 1, 3), ("remu", 17, 1, 3),
+    ("div", 18, 4, 5), ("rem", 19, 4, 5),
+    ("mul", 20, 6, 10), ("add", 21, 20, 7),
+    ("ecall",),
+]
+
+# Stores an instruction and runs it after FENCE.I. First over fresh code, a line-aligned
+# ADDI x10, x10, 1 becomes ADDI x10, x10, 16 while fetch may already be reading it. Then in a
+# loop that bumps the immediate every pass, with the last pass's copy cached or prefetched.
+FENCE_I = [
+    ("li", 2, 0x00050513 | (16 << 20)), ("addi", 10, 0, 0), ("addi", 0, 0, 0),
+    *(item for i in range(4) for item in (
+        ("li", 1, f"patch{i}"), ("sw", 2, 0, 1), ("fence.i",),
+        f"patch{i}",
+        ("addi", 10, 10, 1), *[("addi", 0, 0, 0)] * 3)),
+    ("li", 1, "patch"), ("lw", 2, 0, 1), ("addi", 5, 0, 8),
+    "loop",
+    ("li", 3, 1 << 20), ("add", 2, 2, 3), ("sw", 2, 0, 1),
+    ("fence.i",),
+    "patch",
+    ("addi", 10, 10, 1), ("addi", 5, 5, -1), ("bne", 5, 0, "loop"),
+    ("ecall",),
+]
+
+PROGRAMS = {"alu": ALU, "memory": MEMORY, "control": CONTROL, "muldiv": MULDIV, "fence_i": FENCE_I}
+
+#### Configurations
+
+CONFIGS = {
+    "fsm": {},
+    "pipelined": {"pipelined": True},
+    "icache-2way": {"pipelined": True, "icache": ICacheConfig(2, 2, 2)},
+    # FENCE.I waits for D-cache write-backs while fetch refills the long line behind it
+    "icache-dcache": {"pipelined": True, "icache": ICacheConfig(8, 2, 2), "dcache": DCacheConfig(2, 2, 2)},
+    "dcache-2way": {"pipelined": True, "dcache": DCacheConfig(2, 2, 2), "store_buffer": 2},
+    # A store draining through the arbiter stalls fetch while a branch redirects it
+    "store-buffer": {"pipelined": True, "store_buffer": 2},
+    "predictor": {"pipelined": True, "prefetch": 2, "predictor": PredictorConfig(16, 8, 2)},
+    # Stores draining ahead of prefetches stall the prefetch buffer's reads too
+    "prefetch": {"pipelined": True, "prefetch": 4, "store_buffer": 2, "memory_latency": 3},
+    "prefetch-fsm": {"prefetch": 2, "store_buffer": 2, "memory_latency": 2},
+    "rv32m-fsm": {"muldiv": MulDivConfig()},
+    "rv32m": {"pipelined": True, "muldiv": MulDivConfig(Multiplier.ITERATIVE, divider_radix=4)},
+    "lutram": {"pipelined": True, "regfile": RegFileConfig(memory=True)},
+    "bram": {"pipelined": True, "regfile": RegFileConfig(memory=True, sync_read=True)},
+    "bram-fsm": {"regfile": RegFileConfig(memory=True, sync_read=True)},
+    "serial-shifter": {"pipelined": True, "alu": ALUConfig(serial_shifter=True)},
+    "serial-shifter-fsm": {"alu": ALUConfig(serial_shifter=True)},
+    "alu-register": {"pipelined": True, "alu": ALUConfig(output_register=True)},
+    "alu-register-fsm": {"alu": ALUConfig(output_register=True)},
+    # Fetch and data accesses on their own ports, or taking turns on a shared one
+    "harvard": {"pipelined": True, "dcache": DCacheConfig(2, 2, 2), "prefetch": 2, "harvard": True},
+    "harvard-fsm": {"harvard": True},
+    "round-robin": {"pipelined": True, "store_buffer": 2, "prefetch": 2, "round_robin": True},
+}
+
+def _programs(name):
+    return [program for program in PROGRAMS if program != "muldiv" or "muldiv" in CONFIGS[name]]
+
+MAX_CYCLES = 20_000
+
+CASES = [(config, program) for config in CONFIGS for program in _programs(config)]
+
+def fetch_buses(cpu):
+    """The Wishbone buses instruction fetch drives: the core's fetch port, and the prefetch
+    buffer's master port if there is one."""
+    if cpu.prefetch is not None:
+        return [cpu.prefetch.bus, cpu.prefetch.mem]
+    if cpu.icache is not None:
+        return [cpu.icache.bus]
+    return [cpu.ibus]
+
+@pytest.fixture(scope="module")
+def simulations():
+    # Elaborating is the slow part, keep one simulation per configuration
+    cache = {}
+
+    def get(name):
+        if name not in cache:
+            simulation = sim.Simulation(dict(CONFIGS[name], paged=True, trace=True))
+            violations = []
+
+            def check_stall(bus):
+                # A stalled request has to stay on the bus unchanged until it's accepted. Ends
+                # with the run, pysim can't reset a process that's still waiting
+                def process():
+                    held = None
+                    for _ in range(MAX_CYCLES):
+                        yield
+                        if (yield simulation.top.halt):
+                            return
+                        stb, adr = (yield bus.stb), (yield bus.adr)
+                        if held is not None and (not stb or adr != held):
+                            violations.append((bus.name, held))
+                        held = adr if stb and (yield bus.stall) else None
+                return process
+
+            for bus in fetch_buses(simulation.top.cpu):
+                simulation.sim.add_sync_process(check_stall(bus))
+            cache[name] = simulation, violations
+        return cache[name]
+
+    return get
+
+@pytest.mark.parametrize("name, program", CASES)
+def test_lockstep(name, program, simulations, tmp_path):
+    path = tmp_path / f"{program}.bin"
+    path.write_bytes(assemble(PROGRAMS[program]))
+
+    simulation, violations = simulations(name)
+    del violations[:]
+    iss = ISS(muldiv="muldiv" in CONFIGS[name])
+    iss.load(str(path))
+    lockstep = Lockstep(iss)
+    result = simulation.run(str(path), MAX_CYCLES, trace=[lockstep])
+
+    assert result.halted
+    assert lockstep.divergence is None, lockstep.report()
+    assert lockstep.checked == result.instret
+    # ... and the ISS halts on the same ECALL
+    assert iss.step() is None
+    assert result.regs == iss.regs
+    assert not violations, "fetch request on {} changed while stalled at {:#010x}".format(*violations[0])
+
+@pytest.mark.parametrize("name", CONFIGS)
+def test_convert(name, tmp_path):
+    assert "module" in generate(CONFIGS[name], "il", cache=RTLCache(str(tmp_path)))
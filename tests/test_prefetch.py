@@ -0,0 +1,45 @@
+"""The prefetch buffer against memories of different latencies: it mustn't cost a cycle
+anywhere, and has to pay for itself once memory is slower than a cycle."""
+import pytest
+
+import sim
+from predictor import PredictorConfig
+from test_lockstep import assemble
+
+LOOP = [
+    ("addi", 1, 0, 100),
+    "loop",
+    ("addi", 2, 2, 1), ("addi", 3, 3, 2), ("addi", 1, 1, -1), ("bne", 1, 0, "loop"),
+    ("ecall",),
+]
+
+STRAIGHT = [("addi", 2, 2, 1)] * 100 + [("ecall",)]
+
+PROGRAMS = {"loop": LOOP, "straight": STRAIGHT}
+
+CONFIGS = {
+    "fsm": {},
+    "pipelined": {"pipelined": True},
+    "predictor": {"pipelined": True, "predictor": PredictorConfig(16, 8, 2)},
+}
+
+def cycles(config: dict, program: str, path) -> int:
+    path.write_bytes(assemble(PROGRAMS[program]))
+    result = sim.Simulation(dict(config, paged=True)).run(str(path), 10_000)
+    assert result.halted and result.regs[2] == 100
+    return result.cycles
+
+@pytest.mark.parametrize("program", PROGRAMS)
+@pytest.mark.parametrize("name", CONFIGS)
+def test_no_slower(name, program, tmp_path):
+    path = tmp_path / f"{program}.bin"
+    assert cycles(dict(CONFIGS[name], prefetch=4), program, path) <= cycles(CONFIGS[name], program, path)
+
+@pytest.mark.parametrize("program", PROGRAMS)
+@pytest.mark.parametrize("name", CONFIGS)
+def test_slow_memory(name, program, tmp_path):
+    path = tmp_path / f"{program}.bin"
+    config = dict(CONFIGS[name], memory_latency=3)
+    without = cycles(config, program, path)
+    with_prefetch = cycles(dict(config, prefetch=4), program, path)
+    assert with_prefetch < 0.8 * without
@@ -0,0 +1,41 @@
+"""Keys of the RTL cache: they have to change with anything the generated RTL depends on."""
+from importlib import metadata
+
+import pytest
+
+import rtlcache
+from rtlcache import RTLCache, source_hash
+
+@pytest.mark.parametrize("package", rtlcache.TOOLCHAIN)
+def test_toolchain_version(package, monkeypatch, tmp_path):
+    before = source_hash()
+    key = RTLCache(str(tmp_path)).key("rtl-il", {"config": {}})
+
+    version = metadata.version
+
+    def upgraded(name):
+        if name == package:
+            return "99.0"
+        return version(name)
+
+    monkeypatch.setattr(metadata, "version", upgraded)
+    assert source_hash() != before
+    assert RTLCache(str(tmp_path)).key("rtl-il", {"config": {}}) != key
+
+def test_missing_package(monkeypatch):
+    version = metadata.version
+
+    def missing(name):
+        if name == "nmigen":
+            raise metadata.PackageNotFoundError(name)
+        return version(name)
+
+    monkeypatch.setattr(metadata, "version", missing)
+    assert rtlcache.toolchain_versions()["nmigen"] is None
+    assert len(source_hash()) == 64
+
+def test_params(tmp_path):
+    cache = RTLCache(str(tmp_path))
+    assert cache.key("rtl-il", {"config": {}}) == cache.key("rtl-il", {"config": {}})
+    assert cache.key("rtl-il", {"config": {}}) != cache.key("rtl-v", {"config": {}})
+    assert cache.key("rtl-il", {"config": {}}) != cache.key("rtl-il", {"config": {"pipelined": True}})
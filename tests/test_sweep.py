@@ -0,0 +1,71 @@
+"""Sweep points from the command line, and synthesis results from recorded Yosys output."""
+import argparse
+
+from dcache import DCacheConfig
+from icache import ICacheConfig
+from sweep import configurations, parse_synthesis
+
+# Recorded from Yosys 0.33, trimmed: synth_xilinx of the pipelined core with a BRAM register file
+XILINX_STAT = {
+    "creator": "Yosys 0.33 (git sha1 2584903a060)",
+    "invocation": "stat -json ",
+    "modules": {
+        "\\top": {
+            "num_wires": 1843, "num_wire_bits": 5120, "num_pub_wires": 402, "num_pub_wire_bits": 3311,
+            "num_memories": 0, "num_memory_bits": 0, "num_processes": 0,
+            "num_cells": 2082,
+            "num_cells_by_type": {
+                "BUFG": 1, "CARRY4": 34, "DSP48E1": 4, "FDRE": 1102, "FDSE": 6, "IBUF": 40, "LUT2": 120,
+                "LUT3": 200, "LUT6": 400, "MUXF7": 90, "OBUF": 70, "RAM32M": 12, "RAMB18E1": 2, "RAMB36E1": 1,
+            },
+        },
+    },
+}
+
+XILINX_LTP = """
+Longest topological path in top (length=17):
+    0 \\\\cpu.decode.insn [14]
+    1 $abc$18231$auto$blifparse.cc:396:parse_blif$18232
+   17 \\\\cpu.execute.result [31]
+"""
+
+# Generic synth, where newer Yosys also adds a "design" total
+GENERIC_STAT = {
+    "creator": "Yosys 0.38 (git sha1 543faed9c8c)",
+    "modules": {"\\top": {"num_cells": 1}},
+    "design": {
+        "num_cells": 5190,
+        "num_cells_by_type": {"$_AND_": 900, "$_DFFE_PP_": 620, "$_DFF_P_": 310, "$_MUX_": 2380, "$_OR_": 600,
+                              "$_SDFF_PP0_": 40, "$_XOR_": 340},
+    },
+}
+
+GENERIC_LTP = "\nLongest topological path in top (length=48):\n    0 \\\\cpu.pc [0]\n"
+
+def test_xilinx():
+    assert parse_synthesis(XILINX_STAT, XILINX_LTP, "xilinx") == {
+        "cells": 2082, "depth": 17, "ffs": 1108, "luts": 720, "lutram": 12, "carry": 34, "bram": 2.0, "dsp": 4,
+        # 1000 / (0.6 + 17 * 0.6) ns
+        "fmax_mhz": 92.6,
+    }
+
+def test_generic():
+    assert parse_synthesis(GENERIC_STAT, GENERIC_LTP, "generic") == {
+        "cells": 5190, "depth": 48, "ffs": 970, "luts": 0, "lutram": 0, "carry": 0, "bram": 0, "dsp": 0,
+    }
+
+def test_no_path():
+    # ltp prints nothing for a design without combinational logic
+    result = parse_synthesis(XILINX_STAT, "", "xilinx")
+    assert result["depth"] is None and "fmax_mhz" not in result
+
+def test_configurations():
+    args = argparse.Namespace(pipeline=["fsm", "pipelined"], regfile=["flops"], icache=["none", "4:64:1"],
+                              prefetch=[0, 2], dcache=["none", "4:32:2"], ext=["im"])
+    points = dict(configurations(args))
+    assert len(points) == 16
+    config = points["pipelined-flops-ic4x64x1-pf2-dc4x32x2-im"]
+    assert config["icache"] == ICacheConfig(line_words=4, sets=64, ways=1)
+    assert config["prefetch"] == 2
+    assert config["dcache"] == DCacheConfig(line_words=4, sets=32, ways=2)
+    assert "prefetch" not in points["fsm-flops-im"] and "dcache" not in points["fsm-flops-im"]
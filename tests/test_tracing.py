@@ -0,0 +1,96 @@
+"""Trace files written and read back, and profiles symbolised from an ELF's symbol table."""
+import gzip
+
+import pytest
+
+import sim
+from image import load_symbols
+from test_image import make_elf
+from test_lockstep import PROGRAMS, assemble
+from tracing import STALL_EVENTS, TRACE_MAGIC, Profile, TraceEntry, TraceWriter, read_trace
+
+STT_OBJECT = 1
+
+def entry(pc, cycles=1, stalls=None, **fields):
+    return TraceEntry(pc, fields.get("insn", 0x13), fields.get("rd_addr", 0), fields.get("rd_wdata", 0),
+                      fields.get("mem_addr", 0), fields.get("mem_rmask", 0), fields.get("mem_wmask", 0),
+                      cycles, stalls or (0,) * len(STALL_EVENTS))
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "run.trace")
+    entries = [
+        entry(0x0, insn=0x12345678, rd_addr=31, rd_wdata=0xffffffff),
+        entry(0xfffffffc, cycles=3, stalls=(2, 0, 0, 1), mem_addr=0x80000002, mem_rmask=0b1100),
+        entry(0x10, cycles=0xffff, mem_addr=0x1000, mem_wmask=0b1111),
+        # Saturate at 16 bits
+        entry(0x14, cycles=70_000, stalls=(0x10000, 5, 65_535, 1 << 20)),
+    ] + [entry(4 * i, cycles=i % 7) for i in range(10)]
+    # A small buffer, so records go out over several flushes
+    with TraceWriter(path, buffer=3) as writer:
+        for e in entries:
+            writer.add(e)
+
+    expected = entries[:3] + [entry(0x14, cycles=0xffff, stalls=(0xffff, 5, 0xffff, 0xffff))] + entries[4:]
+    assert list(read_trace(path)) == expected
+
+def test_bad_files(tmp_path):
+    path = str(tmp_path / "run.trace")
+    with gzip.open(path, "wb") as f:
+        f.write(b"NOTATRACE")
+    with pytest.raises(ValueError):
+        list(read_trace(path))
+
+    # Stalls for a different set of events
+    with gzip.open(path, "wb") as f:
+        f.write(TRACE_MAGIC + bytes([1, STALL_EVENTS[0].value]))
+    with pytest.raises(ValueError):
+        list(read_trace(path))
+
+def test_functions(tmp_path):
+    path = tmp_path / "image.elf"
+    path.write_bytes(make_elf([(1, 0, bytes(0x100), 0x100)], [
+        (0x00, 0, "_start", 0),
+        (0x10, 0x10, "main", 2),
+        (0x18, 0, ".L1", 0),
+        (0x20, 0, "$x", 0),
+        (0x40, 8, "helper", 2),
+        (0x80, 4, "table", STT_OBJECT),
+    ]))
+    symbols = load_symbols(str(path))
+    assert symbols == [(0x00, 0, "_start"), (0x10, 0x10, "main"), (0x40, 8, "helper")]
+
+    profile = Profile(symbols)
+    for pc, cycles, stalls in [(0x0, 1, (0, 0, 0, 0)), (0x10, 4, (3, 0, 0, 0)), (0x1c, 2, (0, 1, 0, 0)),
+                               (0x10, 4, (3, 0, 0, 0)), (0x44, 12, (0, 0, 0, 9)), (0x48, 1, (0, 0, 0, 0)),
+                               (0x84, 2, (1, 0, 0, 0))]:
+        profile.add(entry(pc, cycles, stalls))
+
+    assert profile.symbolize(0x1c) == ("main", 0xc)
+    # Past the end of a sized symbol, back to the last one without a size
+    assert profile.symbolize(0x20) == ("_start", 0x20)
+    assert Profile([(0x10, 4, "f")]).symbolize(0x4) is None
+    assert profile.functions() == [
+        ("helper", 1, 12, (0, 0, 0, 9)),
+        ("main", 3, 10, (6, 1, 0, 0)),
+        ("_start", 3, 4, (1, 0, 0, 0)),
+    ]
+    assert (profile.instret, profile.cycles, profile.stalls) == (7, 26, [7, 1, 0, 9])
+    assert "helper" in profile.report()
+
+@pytest.mark.parametrize("config", [{}, {"pipelined": True}], ids=["fsm", "pipelined"])
+def test_simulation(config, tmp_path):
+    # A profile taken during the run and one from its trace file agree
+    image = tmp_path / "memory.bin"
+    image.write_bytes(assemble(PROGRAMS["memory"]))
+    path = str(tmp_path / "run.trace")
+    live = Profile()
+    with TraceWriter(path) as writer:
+        result = sim.Simulation(dict(config, paged=True, trace=True)).run(str(image), 20_000, trace=[writer, live])
+    assert result.halted
+
+    replayed = Profile()
+    for e in read_trace(path):
+        replayed.add(e)
+    assert replayed.instret == live.instret == result.instret
+    assert replayed.cycles == live.cycles
+    assert replayed.pcs == live.pcs
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""Retired-instruction trace, and a profile of where the cycles went.
+
+    python tracing.py run.trace --elf test_fw/test.elf --top 20
+
+``TracePort`` is the core's trace output, one record per retired instruction in the style of
+RVFI. In simulation each record becomes a ``TraceEntry``, along with the cycles it took and
+what the core was waiting on for them. ``TraceWriter`` streams them to a compressed file and
+``Profile`` builds a PC histogram, a per-function breakdown and stall attribution, either
+straight from a simulation or from a trace file read back with ``read_trace``.
+"""
+import argparse
+import bisect
+import gzip
+import struct
+from dataclasses import dataclass
+
+from nmigen import *
+from nmigen.hdl.rec import Layout, Record
+
+from counters import HPMEvent
+
+# One retired instruction, valid the cycle after it retires, when its register write happens
+TRACE_LAYOUT = Layout([
+    ("valid",       1),
+    ("pc",          32),
+    ("insn",        32),    # As executed, RV32C instructions come out expanded
+    ("rd_addr",     5),     # Zero if nothing was written
+    ("rd_wdata",    32),
+    ("mem_addr",    32),
+    ("mem_rmask",   4),     # Byte lanes of a load
+    ("mem_wmask",   4),     # ... or store
+])
+
+# Counter events cycles between retirements are put down to, the rest is execution
+STALL_EVENTS = (HPMEvent.FETCH_STALL, HPMEvent.LOAD_STALL, HPMEvent.STORE_STALL, HPMEvent.MULDIV_STALL)
+
+class TracePort(Elaboratable):
+    """Registers what a core knows about an instruction as it retires into ``out``.
+
+    The core pulses ``retire`` with ``pc``, ``insn`` and its ``LoadStoreUnit`` request as they
+    are in that cycle. The register write (``rd_wen``, ``rd_addr``, ``rd_wdata``) is taken the
+    cycle after, which is when both cores write the register file.
+    """
+    def __init__(self):
+        #### Retiring instruction
+        self.retire = Signal()
+        self.pc = Signal(unsigned(32))
+        self.insn = Signal(unsigned(32))
+        self.mem_valid = Signal()
+        self.mem_store = Signal()
+        self.mem_addr = Signal(unsigned(32))
+        self.mem_sel = Signal(4)
+
+        #### Its register write, a cycle later
+        self.rd_wen = Signal()
+        self.rd_addr = Signal(unsigned(5))
+        self.rd_wdata = Signal(unsigned(32))
+
+        self.out = Record(TRACE_LAYOUT, name="trace")
+
+    def elaborate(self, platform):
+        m = Module()
+
+        out = self.out
+        m.d.sync += out.valid.eq(self.retire)
+        with m.If(self.retire):
+            m.d.sync += [
+                out.pc.eq(self.pc),
+                out.insn.eq(self.insn),
+                out.mem_addr.eq(Mux(self.mem_valid, self.mem_addr, 0)),
+                out.mem_rmask.eq(Mux(self.mem_valid & ~self.mem_store, self.mem_sel, 0)),
+                out.mem_wmask.eq(Mux(self.mem_valid & self.mem_store, self.mem_sel, 0)),
+            ]
+
+        written = self.rd_wen & (self.rd_addr != 0)
+        m.d.comb += out.rd_addr.eq(Mux(written, self.rd_addr, 0))
+        m.d.comb += out.rd_wdata.eq(Mux(written, self.rd_wdata, 0))
+
+        return m
+
+#### Simulation side
+
+@dataclass
+class TraceEntry:
+    pc: int
+    insn: int
+    rd_addr: int
+    rd_wdata: int
+    mem_addr: int
+    mem_rmask: int
+    mem_wmask: int
+    cycles: int     # Since the previous instruction retired, including the one it retired in
+    stalls: tuple   # Of those, cycles spent on each of STALL_EVENTS
+
+TRACE_MAGIC = b"RUNTTRC\x01"
+_RECORD = struct.Struct("<IIIIBBH" + "H" * len(STALL_EVENTS))
+
+class TraceWriter:
+    """Streams ``TraceEntry``s to a gzip-compressed file of fixed-size binary records.
+
+    Cycle counts saturate at 65535 per instruction. Use it as a context manager, or ``close``
+    it, to flush the end of the file.
+    """
+    def __init__(self, path: str, buffer: int = 4096):
+        self.file = gzip.open(path, "wb", compresslevel=6)
+        self.file.write(TRACE_MAGIC)
+        self.file.write(bytes([len(STALL_EVENTS)] + [event.value for event in STALL_EVENTS]))
+        self.buffer = buffer
+        self.pending = []
+
+    def add(self, entry: TraceEntry):
+        self.pending.append(_RECORD.pack(entry.pc, entry.insn, entry.rd_wdata, entry.mem_addr, entry.rd_addr,
+                                         entry.mem_rmask | (entry.mem_wmask << 4), min(entry.cycles, 0xffff),
+                                         *(min(stall, 0xffff) for stall in entry.stalls)))
+        if len(self.pending) >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        self.file.write(b"".join(self.pending))
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_trace(path: str):
+    """Yield the ``TraceEntry``s of a file written by ``TraceWriter``."""
+    with gzip.open(path, "rb") as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        events = tuple(HPMEvent(value) for value in f.read(f.read(1)[0]))
+        if events != STALL_EVENTS:
+            raise ValueError(f"{path} has stalls for {', '.join(event.name.lower() for event in events)}")
+
+        while True:
+            data = f.read(_RECORD.size * 4096)
+            if not data:
+                break
+            for pc, insn, rd_wdata, mem_addr, rd_addr, masks, cycles, *stalls in _RECORD.iter_unpack(data):
+                yield TraceEntry(pc, insn, rd_addr, rd_wdata, mem_addr, masks & 0xf, masks >> 4, cycles,
+                                 tuple(stalls))
+
+class Profile:
+    """PC histogram of a trace, with cycles and stalls per PC and per function.
+
+    ``symbols`` is a sorted list of (address, size, name), as from ``image.load_symbols``. A PC
+    belongs to the closest symbol at or below it that either has no size or covers it.
+    """
+    def __init__(self, symbols: list = ()):
+        self.symbols = list(symbols)
+        self._addresses = [address for address, _, _ in self.symbols]
+        self.instret = 0
+        self.cycles = 0
+        self.stalls = [0] * len(STALL_EVENTS)
+        # pc -> [retired, cycles, stalls..., insn]
+        self.pcs = {}
+
+    def add(self, entry: TraceEntry):
+        self.instret += 1
+        self.cycles += entry.cycles
+        stats = self.pcs.get(entry.pc)
+        if stats is None:
+            stats = self.pcs[entry.pc] = [0, 0] + [0] * len(STALL_EVENTS) + [entry.insn]
+        stats[0] += 1
+        stats[1] += entry.cycles
+        for i, stall in enumerate(entry.stalls):
+            stats[2 + i] += stall
+            self.stalls[i] += stall
+
+    def symbolize(self, pc: int) -> tuple:
+        """(name, offset) of the symbol ``pc`` is in, or None."""
+        for i in range(bisect.bisect_right(self._addresses, pc) - 1, -1, -1):
+            address, size, name = self.symbols[i]
+            if not size or pc < address + size:
+                return name, pc - address
+        return None
+
+    def functions(self) -> list:
+        """(name, retired, cycles, stalls) per symbol, most cycles first."""
+        functions = {}
+        for pc, stats in self.pcs.items():
+            symbol = self.symbolize(pc)
+            name = symbol[0] if symbol else "?"
+            total = functions.setdefault(name, [0] * (2 + len(STALL_EVENTS)))
+            for i in range(len(total)):
+                total[i] += stats[i]
+        return sorted(((name, total[0], total[1], tuple(total[2:])) for name, total in functions.items()),
+                      key=lambda function: -function[2])
+
+    def report(self, top: int = 20) -> str:
+        names = [event.name.lower() for event in STALL_EVENTS]
+        cpi = self.cycles / self.instret if self.instret else 0.0
+        lines = [f"{self.instret} instructions in {self.cycles} cycles (CPI {cpi:.2f})"]
+        for name, stall in zip(names, self.stalls):
+            lines.append(f"  {name:<14} {stall:>12} {self._percent(stall)}")
+
+        lines += ["", f"{'function':<24} {'retired':>10} {'cycles':>10} {'':>6} {'CPI':>6}" +
+                  "".join(f" {name:>13}" for name in names)]
+        for name, retired, cycles, stalls in self.functions()[:top]:
+            lines.append(f"{name[:24]:<24} {retired:>10} {cycles:>10} {self._percent(cycles)} "
+                         f"{cycles / retired:>6.2f}" + "".join(f" {stall:>13}" for stall in stalls))
+
+        lines += ["", f"{'pc':<10} {'where':<32} {'retired':>10} {'cycles':>10} {'':>6} {'insn':>8}"]
+        hot = sorted(self.pcs.items(), key=lambda item: -item[1][1])[:top]
+        for pc, stats in hot:
+            symbol = self.symbolize(pc)
+            where = f"{symbol[0]}+{symbol[1]:#x}" if symbol else ""
+            lines.append(f"{pc:08x}   {where[:32]:<32} {stats[0]:>10} {stats[1]:>10} {self._percent(stats[1])} "
+                         f"{stats[-1]:08x}")
+
+        return "\n".join(lines)
+
+    def _percent(self, cycles: int) -> str:
+        return f"{100 * cycles / self.cycles:5.1f}%" if self.cycles else "     -"
+
+if __name__ == "__main__":
+    from image import load_symbols
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="trace file written by sim.py --trace")
+    parser.add_argument("--elf", help="image the trace was taken from, for function names")
+    parser.add_argument("--top", type=int, default=20, help="functions and PCs to list")
+    args = parser.parse_args()
+
+    profile = Profile(load_symbols(args.elf) if args.elf else ())
+    for entry in read_trace(args.trace):
+        profile.add(entry)
+    print(profile.report(args.top))
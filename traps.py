@@ -1,4 +1,158 @@
-# Not sure how to implement - what is required, what is not
-# Only need M-mode.
+from enum import Enum
 
-# Do I need nested interrupts?
\ No newline at end of file
+from nmigen import *
+
+# Only M-mode, and no nested interrupts: a handler runs with MIE clear until MRET, and can
+# set it again itself after saving mepc/mcause if it wants to be interrupted.
+
+class Cause(Enum):
+    # Exception codes in mcause
+    INSN_MISALIGNED = 0
+    INSN_ACCESS_FAULT = 1
+    ILLEGAL_INSN = 2
+    BREAKPOINT = 3
+    LOAD_MISALIGNED = 4
+    LOAD_ACCESS_FAULT = 5
+    STORE_MISALIGNED = 6
+    STORE_ACCESS_FAULT = 7
+    ECALL_M = 11
+
+class Interrupt(Enum):
+    # Interrupt codes in mcause, and their bits in mie/mip
+    MSI = 3     # Software, CLINT msip
+    MTI = 7     # Timer, CLINT mtimecmp
+    MEI = 11    # External
+
+# Highest priority first, as the privileged spec orders them
+INTERRUPT_PRIORITY = (Interrupt.MEI, Interrupt.MSI, Interrupt.MTI)
+
+# mstatus fields
+MSTATUS_MIE = 1 << 3
+MSTATUS_MPIE = 1 << 7
+MSTATUS_MPP = 0b11 << 11
+
+# Interrupt bits of mie/mip
+MIP_MSIP = 1 << Interrupt.MSI.value
+MIP_MTIP = 1 << Interrupt.MTI.value
+MIP_MEIP = 1 << Interrupt.MEI.value
+
+# mtvec MODE
+MTVEC_VECTORED = 1
+
+# funct12 of the PRIV instructions that aren't ECALL/EBREAK
+MRET = 0x302
+WFI = 0x105
+
+class TrapUnit(Elaboratable):
+    """Machine-mode trap CSRs, and trap entry and return.
+
+    Holds mstatus, mie, mtvec, mepc, mcause, mtval and mip, listed by ``csrs`` for the CSR
+    file to decode like ``PerfCounters``; CSR writes come in on ``we``/``waddr``/``wdata``.
+
+    The interrupt lines ``msip``/``mtip``/``meip`` are level sensitive and show up in mip.
+    ``pending`` is high whenever one of them is enabled in mie while mstatus.MIE is set. It's
+    a few gates from the lines and CSRs, so the core can act on it the same cycle. To take it,
+    the core pulses ``interrupt`` instead of carrying on with the instruction it was about to
+    execute, passing that instruction's address on ``epc``. Synchronous exceptions pulse
+    ``exception`` instead, with ``cause`` and ``tval``. Either way ``vector`` has the handler
+    address that cycle: the mtvec base, or base + 4 * cause for an interrupt with mtvec in
+    vectored mode. The entry itself (mepc, mcause, mtval and stacking MIE into MPIE) happens
+    on the clock edge, taking priority over a CSR write.
+
+    Pulse ``mret`` when MRET executes, it jumps to ``mepc`` and restores MIE.
+    """
+    def __init__(self, compressed: bool = False):
+        #### Interrupt lines
+        self.msip = Signal()
+        self.mtip = Signal()
+        self.meip = Signal()
+
+        #### Trap entry and return
+        self.pending = Signal()
+        self.interrupt = Signal()
+        self.exception = Signal()
+        self.cause = Signal(Cause)
+        self.tval = Signal(unsigned(32))
+        self.epc = Signal(unsigned(32))
+        self.vector = Signal(unsigned(32))
+        self.mret = Signal()
+
+        #### CSR writes
+        self.we = Signal()
+        self.waddr = Signal(unsigned(12))
+        self.wdata = Signal(unsigned(32))
+
+        #### CSRs
+        # M-mode only, so MPP always reads as M
+        self.mstatus = Signal(unsigned(32), reset=MSTATUS_MPP)
+        self.mie = Signal(unsigned(32))
+        self.mtvec = Signal(unsigned(32))
+        self.mepc = Signal(unsigned(32))
+        self.mcause = Signal(unsigned(32))
+        self.mtval = Signal(unsigned(32))
+        self.mip = Signal(unsigned(32))
+
+        # Bits CSR instructions can write, the rest keep their reset value
+        self.masks = {
+            0x300: MSTATUS_MIE | MSTATUS_MPIE,
+            0x304: MIP_MSIP | MIP_MTIP | MIP_MEIP,
+            # Direct or vectored mode, the base is 4-byte aligned
+            0x305: ~0b10 & 0xFFFF_FFFF,
+            # Instructions are 2-byte aligned with RV32C
+            0x341: ~(0b1 if compressed else 0b11) & 0xFFFF_FFFF,
+            0x342: 0xFFFF_FFFF,
+            0x343: 0xFFFF_FFFF,
+        }
+
+    def csrs(self) -> list:
+        """(address, value) for every trap CSR. mip is read-only, writes to it are ignored."""
+        return [
+            (0x300, self.mstatus), (0x304, self.mie), (0x305, self.mtvec),
+            (0x341, self.mepc), (0x342, self.mcause), (0x343, self.mtval), (0x344, self.mip),
+        ]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.d.comb += self.mip.eq(Cat(Const(0, 3), self.msip, Const(0, 3), self.mtip,
+                                    Const(0, 3), self.meip, Const(0, 20)))
+
+        #### Interrupt selection
+        enabled = Signal(unsigned(32))
+        m.d.comb += enabled.eq(self.mip & self.mie)
+        m.d.comb += self.pending.eq(enabled.any() & (self.mstatus & MSTATUS_MIE).any())
+
+        # The highest priority enabled interrupt, the last assignment wins
+        irq_code = Signal(unsigned(4))
+        for irq in reversed(INTERRUPT_PRIORITY):
+            with m.If(enabled[irq.value]):
+                m.d.comb += irq_code.eq(irq.value)
+
+        base = Cat(Const(0, 2), self.mtvec[2:])
+        vectored = self.mtvec[0:2] == MTVEC_VECTORED
+        m.d.comb += self.vector.eq(Mux(self.interrupt & vectored, base + (irq_code << 2), base))
+
+        #### CSR writes
+        for address, csr in self.csrs():
+            mask = self.masks.get(address)
+            if mask is None:
+                continue
+            with m.If(self.we & (self.waddr == address)):
+                m.d.sync += csr.eq((self.wdata & mask) | (csr & (~mask & 0xFFFF_FFFF)))
+
+        #### Trap entry and return, over any CSR write
+        mie = self.mstatus[3]
+        mpie = self.mstatus[7]
+        with m.If(self.interrupt | self.exception):
+            m.d.sync += [
+                self.mepc.eq(self.epc),
+                self.mcause.eq(Mux(self.interrupt, Cat(irq_code, Const(0, 27), Const(1, 1)), self.cause)),
+                self.mtval.eq(Mux(self.interrupt, 0, self.tval)),
+                mpie.eq(mie),
+                mie.eq(0),
+            ]
+        with m.Elif(self.mret):
+            m.d.sync += mie.eq(mpie)
+            m.d.sync += mpie.eq(1)
+
+        return m